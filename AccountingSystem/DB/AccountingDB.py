@@ -2,6 +2,7 @@
 __RCSID__ = "$Id$"
 
 import datetime, time
+import re
 import types
 import threading
 import random
@@ -11,9 +12,13 @@ from DIRAC.Core.Utilities import List, ThreadSafe, Time, DEncode
 from DIRAC.AccountingSystem.private.ObjectLoader import loadObjects
 from DIRAC.AccountingSystem.Client.Types.BaseAccountingType import BaseAccountingType
 from DIRAC.Core.Utilities.ThreadPool import ThreadPool
+from DIRAC.Core.Utilities.DictCache import DictCache
 
 gSynchro = ThreadSafe.Synchronizer()
 
+#Key ids never change, they are only expired to bound the memory of unused values
+KEYS_CACHE_LIFETIME = 86400
+
 class AccountingDB( DB ):
 
   def __init__( self, name = 'Accounting/AccountingDB', maxQueueSize = 10, readOnly = False ):
@@ -29,7 +34,29 @@ class AccountingDB( DB ):
     self.__queuedRecordsToInsert = []
     self.dbCatalog = {}
     self.dbBucketsLength = {}
+    #( typeName, keyName ) -> DictCache of value -> id
     self.__keysCache = {}
+    self.__keysCacheSize = self.getCSOption( "KeysCacheSize", 10000 )
+    #Records taken from the IN tables waiting to be written with their buckets aggregated
+    self.__aggregateBuckets = False
+    self.__bucketsBufferLock = threading.Lock()
+    self.__bucketsFlushLock = threading.Lock()
+    self.__bucketsBuffer = {}
+    self.__bufferedRecords = 0
+    self.__maxBufferedRecords = 10000
+    #Lengths of the buckets of the rollup tables, each one a bucket table re-binned to that length.
+    #A rollup only answers plots with a granularity multiple of its length: 4 hours for plots of
+    #8 to 35 days (as in the Job type), 1 day and 1 week for longer ones
+    self.__rollupLengths = sorted( [ int( length ) for length in self.getCSOption( "RollupLengths", [ 14400, 86400, 604800 ] ) ] )
+    self.__readyRollupsCache = DictCache()
+    self.__rollupsBackfillLock = threading.Lock()
+    self.__rollupsToBackfill = []
+    self.__doingRollupsBackfill = False
+    #Types are compacted in parallel in slices of CompactionSliceLength seconds
+    self.__compactionPool = False
+    self.__compactionSliceLength = self.getCSOption( "CompactionSliceLength", 86400 )
+    self.__compactionStatus = {}
+    self.__compactionStatusLock = threading.Lock()
     maxParallelInsertions = self.getCSOption( "ParallelRecordInsertions", 10 )
     self.__threadPool = ThreadPool( 1, maxParallelInsertions )
     self.__threadPool.daemonize()
@@ -43,6 +70,25 @@ class AccountingDB( DB ):
                                            }
                         }
                       )
+    #Rollups in here have been completely filled
+    self.rollupsTableName = _getTableName( "catalog", "Rollups" )
+    self._createTables( { self.rollupsTableName : { 'Fields' : { 'name' : "VARCHAR(64) NOT NULL",
+                                                                 'bucketLength' : "INT UNSIGNED NOT NULL"
+                                                               },
+                                                    'UniqueIndexes' : { 'rollupIndex' : [ 'name', 'bucketLength' ] }
+                                                  }
+                        }
+                      )
+    #Buckets of each length older than the watermark have been compacted
+    self.compactionTableName = _getTableName( "catalog", "Compaction" )
+    self._createTables( { self.compactionTableName : { 'Fields' : { 'name' : "VARCHAR(64) NOT NULL",
+                                                                    'bucketLength' : "INT UNSIGNED NOT NULL",
+                                                                    'watermark' : "INT UNSIGNED NOT NULL"
+                                                                  },
+                                                       'UniqueIndexes' : { 'watermarkIndex' : [ 'name', 'bucketLength' ] }
+                                                     }
+                        }
+                      )
     self.__loadCatalogFromDB()
     gMonitor.registerActivity( "registeradded",
                                "Register added",
@@ -59,6 +105,21 @@ class AccountingDB( DB ):
                                "Accounting",
                                "seconds",
                                gMonitor.OP_MEAN )
+    gMonitor.registerActivity( "bucketswritten",
+                               "Buckets written",
+                               "Accounting",
+                               "buckets",
+                               gMonitor.OP_ACUM )
+    gMonitor.registerActivity( "compactedbuckets",
+                               "Buckets compacted",
+                               "Accounting",
+                               "buckets",
+                               gMonitor.OP_ACUM )
+    gMonitor.registerActivity( "compactiontime",
+                               "Compaction time per slice",
+                               "Accounting",
+                               "seconds",
+                               gMonitor.OP_MEAN )
 
     self.__compactTime = datetime.time( hour = 2,
                                         minute = random.randint( 0, 59 ),
@@ -70,6 +131,8 @@ class AccountingDB( DB ):
     self.__lastCompactionEpoch = Time.toEpoch( lcd )
 
     self.__registerTypes()
+    if not self.__readOnly:
+      self.__preloadKeysCache()
 
   def __loadTablesCreated( self ):
     result = self._query( "show tables" )
@@ -96,6 +159,26 @@ class AccountingDB( DB ):
       time.sleep( sleepTime )
       self.compactBuckets()
 
+  def enableBucketsAggregation( self, flushPeriod = 10 ):
+    """
+    Aggregate the buckets of the records coming from the IN tables in memory and write
+    them every flushPeriod seconds, or when MaxAggregatedRecords records are waiting.
+    Records stay in the IN tables until their buckets are written
+    """
+    self.__maxBufferedRecords = self.getCSOption( "MaxAggregatedRecords", 10000 )
+    self.__aggregateBuckets = True
+    th = threading.Thread( target = self.__periodicFlushBuckets, args = ( flushPeriod, ) )
+    th.setDaemon( 1 )
+    th.start()
+
+  def __periodicFlushBuckets( self, flushPeriod ):
+    while self.__aggregateBuckets:
+      time.sleep( flushPeriod )
+      try:
+        self.flushBuckets()
+      except Exception, e:
+        self.log.exception( "Exception while flushing buckets", str( e ) )
+
   def __registerTypes( self ):
     """
     Register all types
@@ -244,7 +327,8 @@ class AccountingDB( DB ):
     """
     self.log.verbose( "Adding to catalog type %s" % typeName, "with length %s" % str( bucketsLength ) )
     self.dbCatalog[ typeName ] = { 'keys' : keyFields , 'values' : valueFields,
-                                   'typeFields' : [], 'bucketFields' : [], 'dataTimespan' : 0 }
+                                   'typeFields' : [], 'bucketFields' : [], 'dataTimespan' : 0,
+                                   'rollups' : [] }
     self.dbCatalog[ typeName ][ 'typeFields' ].extend( keyFields )
     self.dbCatalog[ typeName ][ 'typeFields' ].extend( valueFields )
     self.dbCatalog[ typeName ][ 'bucketFields' ] = list( self.dbCatalog[ typeName ][ 'typeFields' ] )
@@ -350,6 +434,14 @@ class AccountingDB( DB ):
                                       'Indexes' : bucketIndexes,
                                       'UniqueIndexes' : { 'UniqueConstraint' : uniqueIndexFields }
                                     }
+    rollupTables = {}
+    for rollupLength in self.__rollupLengths:
+      rollupTableName = _getRollupTableName( name, rollupLength )
+      if rollupTableName not in tablesInThere:
+        rollupTables[ rollupTableName ] = { 'Fields' : bucketFieldsDict,
+                                            'Indexes' : bucketIndexes,
+                                            'UniqueIndexes' : { 'UniqueConstraint' : uniqueIndexFields }
+                                          }
     typeTableName = _getTableName( "type", name )
     if typeTableName not in tablesInThere:
       tables[ typeTableName ] = { 'Fields' : fieldsDict }
@@ -360,6 +452,10 @@ class AccountingDB( DB ):
                                     'PrimaryKey' : 'id'
                                   }
     if self.__readOnly:
+      #Missing rollups are just not used
+      if name in self.dbCatalog:
+        self.dbCatalog[ name ][ 'rollups' ] = [ rollupLength for rollupLength in self.__rollupLengths
+                                                if _getRollupTableName( name, rollupLength ) in tablesInThere ]
       if tables:
         self.log.notice( "ReadOnly mode: Skipping create of tables for %s. Removing from memory catalog" % name )
         self.log.verbose( "Skipping creation of tables %s" % ", ".join( [ tn for tn in tables ] ) )
@@ -371,6 +467,7 @@ class AccountingDB( DB ):
         self.log.notice( "ReadOnly mode: %s is OK" % name )
       return S_OK( not updateDBCatalog )
 
+    tables.update( rollupTables )
     if tables:
       retVal = self._createTables( tables )
       if not retVal[ 'OK' ]:
@@ -383,6 +480,8 @@ class AccountingDB( DB ):
                          [ 'name', 'keyFields', 'valueFields', 'bucketsLength' ],
                          [ name, ",".join( keyFieldsList ), ",".join( valueFieldsList ), bucketsEncoding ] )
       self.__addToCatalog( name, keyFieldsList, valueFieldsList, bucketsLength )
+    self.dbCatalog[ name ][ 'rollups' ] = list( self.__rollupLengths )
+    self.__requestRollupsBackfill( name )
     self.log.info( "Registered type %s" % name )
     return S_OK( True )
 
@@ -456,69 +555,143 @@ class AccountingDB( DB ):
     tablesToDelete.insert( 0, "`%s`" % _getTableName( "type", typeName ) )
     tablesToDelete.insert( 0, "`%s`" % _getTableName( "bucket", typeName ) )
     tablesToDelete.insert( 0, "`%s`" % _getTableName( "in", typeName ) )
+    for rollupLength in self.dbCatalog[ typeName ][ 'rollups' ]:
+      tablesToDelete.append( "`%s`" % _getRollupTableName( typeName, rollupLength ) )
     retVal = self._query( "DROP TABLE %s" % ", ".join( tablesToDelete ) )
     if not retVal[ 'OK' ]:
       return retVal
     retVal = self._update( "DELETE FROM `%s` WHERE name='%s'" % ( _getTableName( "catalog", "Types" ), typeName ) )
+    self._update( "DELETE FROM `%s` WHERE name='%s'" % ( self.rollupsTableName, typeName ) )
+    self.__resetCompactionWatermarks( typeName )
+    self.__readyRollupsCache.delete( typeName )
+    for keyField in self.dbCatalog[ typeName ][ 'keys' ]:
+      self.__keysCache.pop( ( typeName, keyField ), None )
     del( self.dbCatalog[ typeName ] )
     return S_OK()
 
-  def __getIdForKeyValue( self, typeName, keyName, keyValue, conn = False ):
+  def __getKeysCache( self, typeName, keyName ):
     """
-      Finds id number for value in a key table
+      Get the cache of ids for the values of a key
     """
-    retVal = self._escapeString( keyValue )
+    cacheKey = ( typeName, keyName )
+    if cacheKey not in self.__keysCache:
+      self.__keysCache.setdefault( cacheKey, DictCache( maxSize = self.__keysCacheSize ) )
+    return self.__keysCache[ cacheKey ]
+
+  def __preloadKeysCache( self ):
+    """
+      Cache the ids of the last values added to each key table
+    """
+    for typeName in self.dbCatalog:
+      for keyName in self.dbCatalog[ typeName ][ 'keys' ]:
+        retVal = self._query( "SELECT `id`, `value` FROM `%s` ORDER BY `id` DESC LIMIT %d" % ( _getTableName( "key", typeName, keyName ),
+                                                                                              self.__keysCacheSize ) )
+        if not retVal[ 'OK' ]:
+          self.log.error( "Can't preload key ids", "for %s %s: %s" % ( typeName, keyName, retVal[ 'Message' ] ) )
+          continue
+        keysCache = self.__getKeysCache( typeName, keyName )
+        #Oldest first so the newest ones are the last to be evicted
+        for keyId, keyValue in reversed( retVal[ 'Value' ] ):
+          keysCache.add( keyValue, KEYS_CACHE_LIFETIME, keyId )
+
+  def __loadKeyIds( self, typeName, keyName, keyValues ):
+    """
+      Cache the ids of the key values found in the key table.
+      Returns S_OK( ( { value : id } for the found values, list of values not found ) )
+    """
+    keysCache = self.__getKeysCache( typeName, keyName )
+    keyValues = list( keyValues )
+    keyIds = {}
+    notFound = []
+    for iPos in range( 0, len( keyValues ), 500 ):
+      chunk = keyValues[ iPos : iPos + 500 ]
+      retVal = self._escapeValues( chunk )
+      if not retVal[ 'OK' ]:
+        return retVal
+      retVal = self._query( "SELECT `id`, `value` FROM `%s` WHERE `value` in ( %s )" % ( _getTableName( "key", typeName, keyName ),
+                                                                                          ", ".join( retVal[ 'Value' ] ) ) )
+      if not retVal[ 'OK' ]:
+        return retVal
+      #The comparison in the DB may ignore case and trailing spaces
+      idsFound = {}
+      for keyId, dbValue in retVal[ 'Value' ]:
+        idsFound[ dbValue ] = keyId
+        idsFound.setdefault( dbValue.lower().rstrip( " " ), keyId )
+      for keyValue in chunk:
+        keyId = idsFound.get( keyValue, idsFound.get( keyValue.lower().rstrip( " " ) ) )
+        if keyId is None:
+          notFound.append( keyValue )
+        else:
+          keyIds[ keyValue ] = keyId
+          keysCache.add( keyValue, KEYS_CACHE_LIFETIME, keyId )
+    return S_OK( ( keyIds, notFound ) )
+
+  def __cacheKeyIds( self, typeName, keyName, keyValues ):
+    """
+      Make sure the ids of the key values are cached. Unknown values are looked up and
+      inserted in bulk. The value column is unique so values inserted at the same time
+      by other DataStores get the same id.
+      Returns S_OK( { value : id } ) for the values that were not cached
+    """
+    keysCache = self.__getKeysCache( typeName, keyName )
+    missing = set()
+    for keyValue in keyValues:
+      keyValue = _normalizeKeyValue( keyValue )
+      if not keysCache.get( keyValue ):
+        missing.add( keyValue )
+    if not missing:
+      return S_OK( {} )
+    retVal = self.__loadKeyIds( typeName, keyName, missing )
     if not retVal[ 'OK' ]:
       return retVal
-    keyValue = retVal[ 'Value' ]
-    retVal = self._query( "SELECT `id` FROM `%s` WHERE `value`=%s" % ( _getTableName( "key", typeName, keyName ),
-                                                                         keyValue ), conn = conn )
+    keyIds, missing = retVal[ 'Value' ]
+    if not missing:
+      return S_OK( keyIds )
+    self.log.info( "Values for key %s didn't exist, inserting" % keyName, ", ".join( missing ) )
+    retVal = self.insertMany( _getTableName( "key", typeName, keyName ), [ 'value' ],
+                              [ [ keyValue ] for keyValue in missing ], ignore = True )
     if not retVal[ 'OK' ]:
       return retVal
-    if len( retVal[ 'Value' ] ) > 0:
-      return S_OK( retVal[ 'Value' ][0][0] )
-    return S_ERROR( "Key id %s for value %s does not exist although it shoud" % ( keyName, keyValue ) )
+    retVal = self.__loadKeyIds( typeName, keyName, missing )
+    if not retVal[ 'OK' ]:
+      return retVal
+    if retVal[ 'Value' ][1]:
+      return S_ERROR( "Key ids %s for values %s do not exist although they should" % ( keyName,
+                                                                                       ", ".join( retVal[ 'Value' ][1] ) ) )
+    keyIds.update( retVal[ 'Value' ][0] )
+    return S_OK( keyIds )
+
+  def __cacheKeyIdsForRecords( self, recordTuples ):
+    """
+      Look up in bulk the ids of all the key values in a bundle of records
+    """
+    keyValuesToCache = {}
+    for record in recordTuples:
+      typeName, valuesList = record[1], record[4]
+      keyNames = self.dbCatalog[ typeName ][ 'keys' ]
+      for keyPos in range( len( keyNames ) ):
+        keyValuesToCache.setdefault( ( typeName, keyNames[ keyPos ] ), set() ).add( valuesList[ keyPos ] )
+    for typeName, keyName in keyValuesToCache:
+      retVal = self.__cacheKeyIds( typeName, keyName, keyValuesToCache[ ( typeName, keyName ) ] )
+      if not retVal[ 'OK' ]:
+        self.log.error( "Can't cache key ids", retVal[ 'Message' ] )
 
   def __addKeyValue( self, typeName, keyName, keyValue ):
     """
       Adds a key value to a key table if not existant
     """
-    #Cast to string just in case
-    if type( keyValue ) != types.StringType:
-      keyValue = str( keyValue )
-    #No more than 64 chars for keys
-    if len( keyValue ) > 64:
-      keyValue = keyValue[:64]
-
-    #Look into the cache
-    if typeName not in self.__keysCache:
-      self.__keysCache[ typeName ] = {}
-    typeCache = self.__keysCache[ typeName ]
-    if keyName not in typeCache:
-      typeCache[ keyName ] = {}
-    keyCache = typeCache[ keyName ]
-    if keyValue in keyCache:
-      return S_OK( keyCache[ keyValue ] )
-    #Retrieve key
-    keyTable = _getTableName( "key", typeName, keyName )
-    retVal = self.__getIdForKeyValue( typeName, keyName, keyValue )
-    if retVal[ 'OK' ]:
-      keyCache[ keyValue ] = retVal[ 'Value' ]
-      return retVal
-    #Key is not in there
-    retVal = self._getConnection()
+    keyValue = _normalizeKeyValue( keyValue )
+    keysCache = self.__getKeysCache( typeName, keyName )
+    keyId = keysCache.get( keyValue )
+    if keyId:
+      return S_OK( keyId )
+    retVal = self.__cacheKeyIds( typeName, keyName, [ keyValue ] )
     if not retVal[ 'OK' ]:
       return retVal
-    connection = retVal[ 'Value' ]
-    self.log.info( "Value %s for key %s didn't exist, inserting" % ( keyValue, keyName ) )
-    retVal = self.insertFields( keyTable, [ 'id', 'value' ], [ 0, keyValue ], connection )
-    if not retVal[ 'OK' ] and retVal[ 'Message' ].find( "Duplicate key" ) == -1:
-      return retVal
-    result = self.__getIdForKeyValue( typeName, keyName, keyValue, connection )
-    if not result[ 'OK' ]:
-      return result
-    keyCache[ keyValue ] = result[ 'Value' ]
-    return result
+    if keyValue in retVal[ 'Value' ]:
+      return S_OK( retVal[ 'Value' ][ keyValue ] )
+    #Cached by another thread in the meantime
+    return self.__addKeyValue( typeName, keyName, keyValue )
 
   def calculateBucketLengthForTime( self, typeName, now, when ):
     """
@@ -557,18 +730,24 @@ class AccountingDB( DB ):
       bucketTimeLength = self.calculateBucketLengthForTime( typeName, nowEpoch, currentBucketStart )
     return buckets
 
-  def __insertInQueueTable( self, typeName, startTime, endTime, valuesList ):
-    sqlFields = [ 'id', 'taken', 'takenSince' ] + self.dbCatalog[ typeName ][ 'typeFields' ]
-    sqlValues = [ '0', '0', 'UTC_TIMESTAMP()' ] + valuesList + [ startTime, endTime ]
-    if len( sqlFields ) != len( sqlValues ):
+  def __getQueueRowValues( self, typeName, startTime, endTime, valuesList ):
+    sqlValues = [ '0', '0', 'UTC_TIMESTAMP()' ] + list( valuesList ) + [ startTime, endTime ]
+    numExp = len( self.dbCatalog[ typeName ][ 'typeFields' ] )
+    if len( sqlValues ) != numExp + 3:
       numRcv = len( valuesList ) + 2
-      numExp = len( self.dbCatalog[ typeName ][ 'typeFields' ] )
       return S_ERROR( "Fields mismatch for record %s. %s fields and %s expected" % ( typeName,
                                                                                      numRcv,
                                                                                      numExp ) )
+    return S_OK( sqlValues )
+
+  def __insertInQueueTable( self, typeName, startTime, endTime, valuesList ):
+    retVal = self.__getQueueRowValues( typeName, startTime, endTime, valuesList )
+    if not retVal[ 'OK' ]:
+      return retVal
+    sqlFields = [ 'id', 'taken', 'takenSince' ] + self.dbCatalog[ typeName ][ 'typeFields' ]
     retVal = self.insertFields( _getTableName( "in", typeName ),
                            sqlFields,
-                           sqlValues )
+                           retVal[ 'Value' ] )
     if not retVal[ 'OK' ]:
       return retVal
     return S_OK( retVal[ 'lastRowId' ] )
@@ -576,16 +755,22 @@ class AccountingDB( DB ):
   def insertRecordBundleThroughQueue( self, recordsToQueue ) :
     if self.__readOnly:
       return S_ERROR( "ReadOnly mode enabled. No modification allowed" )
-    recordsToProcess = []
-    now = Time.toEpoch()
+    #Group the records per type to insert them in bulk
+    rowsPerType = {}
     for record in recordsToQueue:
       typeName, startTime, endTime, valuesList = record
-      result = self.__insertInQueueTable( typeName, startTime, endTime, valuesList )
+      if not typeName in self.dbCatalog:
+        return S_ERROR( "Type %s has not been defined in the db" % typeName )
+      result = self.__getQueueRowValues( typeName, startTime, endTime, valuesList )
       if not result[ 'OK' ]:
         return result
-      iD = result[ 'Value' ]
-      recordsToProcess.append( ( iD, typeName, startTime, endTime, valuesList, now ) )
+      rowsPerType.setdefault( typeName, [] ).append( result[ 'Value' ] )
 
+    for typeName in rowsPerType:
+      sqlFields = [ 'id', 'taken', 'takenSince' ] + self.dbCatalog[ typeName ][ 'typeFields' ]
+      result = self.insertMany( _getTableName( "in", typeName ), sqlFields, rowsPerType[ typeName ] )
+      if not result[ 'OK' ]:
+        return result
     return S_OK()
 
   def insertRecordThroughQueue( self, typeName, startTime, endTime, valuesList ):
@@ -608,6 +793,9 @@ class AccountingDB( DB ):
     Do the real insert and delete from the in buffer table
     """
     self.log.verbose( "Received bundle to process", "of %s elements" % len( recordTuples ) )
+    self.__cacheKeyIdsForRecords( recordTuples )
+    if self.__aggregateBuckets:
+      return self.__aggregateFromINTable( recordTuples )
     for record in recordTuples:
       iD, typeName, startTime, endTime, valuesList, insertionEpoch = record
       result = self.insertRecordDirectly( typeName, startTime, endTime, valuesList )
@@ -621,6 +809,401 @@ class AccountingDB( DB ):
       gMonitor.addMark( "insertiontime", Time.toEpoch() - insertionEpoch )
 
 
+  def __aggregateFromINTable( self, recordTuples ):
+    """
+    Add the records to the buffer of records and aggregated buckets to write
+    """
+    for record in recordTuples:
+      iD, typeName, startTime, endTime, valuesList, insertionEpoch = record
+      #Discover key indexes
+      for keyPos in range( len( self.dbCatalog[ typeName ][ 'keys' ] ) ):
+        keyName = self.dbCatalog[ typeName ][ 'keys' ][ keyPos ]
+        retVal = self.__addKeyValue( typeName, keyName, valuesList[ keyPos ] )
+        if not retVal[ 'OK' ]:
+          break
+        valuesList[ keyPos ] = retVal[ 'Value' ]
+      if not retVal[ 'OK' ]:
+        self._update( "UPDATE `%s` SET taken=0 WHERE id=%s" % ( _getTableName( "in", typeName ), iD ) )
+        self.log.error( "Can't insert row", retVal[ 'Message' ] )
+        continue
+      numKeys = len( self.dbCatalog[ typeName ][ 'keys' ] )
+      keyValues = tuple( valuesList[ :numKeys ] )
+      #HACK: One more value to be able to count total entries
+      bucketValues = valuesList[ numKeys: ] + [ 1 ]
+      buckets = self.calculateBuckets( typeName, startTime, endTime )
+      gMonitor.addMark( "registeradded", 1 )
+      gMonitor.addMark( "registeradded:%s" % typeName, 1 )
+      self.__bucketsBufferLock.acquire()
+      try:
+        if typeName not in self.__bucketsBuffer:
+          self.__bucketsBuffer[ typeName ] = { 'records' : [], 'buckets' : {} }
+        typeBuffer = self.__bucketsBuffer[ typeName ]
+        typeBuffer[ 'records' ].append( ( iD, valuesList + [ startTime, endTime ], insertionEpoch ) )
+        for bucketStartTime, proportion, bucketLength in buckets:
+          bucketKey = ( bucketStartTime, bucketLength, keyValues )
+          if proportion == 1:
+            proportionalValues = bucketValues
+          else:
+            proportionalValues = [ float( value ) * proportion for value in bucketValues ]
+          if bucketKey in typeBuffer[ 'buckets' ]:
+            summedValues = typeBuffer[ 'buckets' ][ bucketKey ]
+            for pos in range( len( summedValues ) ):
+              summedValues[ pos ] += proportionalValues[ pos ]
+          else:
+            typeBuffer[ 'buckets' ][ bucketKey ] = list( proportionalValues )
+        self.__bufferedRecords += 1
+        bufferFull = self.__bufferedRecords >= self.__maxBufferedRecords
+      finally:
+        self.__bucketsBufferLock.release()
+      #Don't wait for a running flush, it will be flushed later
+      if bufferFull and self.__bucketsFlushLock.acquire( False ):
+        try:
+          self.__flushBuckets()
+        finally:
+          self.__bucketsFlushLock.release()
+    return S_OK()
+
+  def flushBuckets( self ):
+    """
+    Write the buffered records and their aggregated buckets
+    """
+    self.__bucketsFlushLock.acquire()
+    try:
+      return self.__flushBuckets()
+    finally:
+      self.__bucketsFlushLock.release()
+
+  def __flushBuckets( self ):
+    self.__bucketsBufferLock.acquire()
+    try:
+      bucketsBuffer = self.__bucketsBuffer
+      self.__bucketsBuffer = {}
+      self.__bufferedRecords = 0
+    finally:
+      self.__bucketsBufferLock.release()
+    for typeName in bucketsBuffer:
+      typeBuffer = bucketsBuffer[ typeName ]
+      idList = [ str( record[0] ) for record in typeBuffer[ 'records' ] ]
+      for i in range( max( 1, self.__deadLockRetries ) ):
+        result = self.__writeAggregatedBuckets( typeName, typeBuffer[ 'records' ], typeBuffer[ 'buckets' ], idList )
+        if result[ 'OK' ] or result[ 'Message' ].find( "try restarting transaction" ) == -1:
+          break
+      if not result[ 'OK' ]:
+        self.log.error( "Can't write aggregated buckets", "for %s: %s" % ( typeName, result[ 'Message' ] ) )
+        #Leave them to be retried. Records are deleted from the IN table in the same transaction
+        #as their buckets, so the ones already written are not there any more
+        for iPos in range( 0, len( idList ), 1000 ):
+          self._update( "UPDATE `%s` SET taken=0 WHERE id in (%s)" % ( _getTableName( "in", typeName ),
+                                                                      ", ".join( idList[ iPos : iPos + 1000 ] ) ) )
+        continue
+      now = Time.toEpoch()
+      for record in typeBuffer[ 'records' ]:
+        gMonitor.addMark( "insertiontime", now - record[2] )
+      gMonitor.addMark( "bucketswritten", len( typeBuffer[ 'buckets' ] ) )
+      self.log.info( "Flushed %s records" % len( idList ),
+                     "of %s in %s buckets" % ( typeName, len( typeBuffer[ 'buckets' ] ) ) )
+    return S_OK()
+
+  def __writeAggregatedBuckets( self, typeName, records, aggregatedBuckets, idList ):
+    """
+    Insert the raw records, add the aggregated values to the buckets and rollups with
+    multi-row INSERT ... ON DUPLICATE KEY UPDATE and delete the records from the IN table,
+    all in one transaction
+    """
+    retVal = self._getConnection()
+    if not retVal[ 'OK' ]:
+      return retVal
+    connObj = retVal[ 'Value' ]
+    try:
+      retVal = self.__startTransaction( connObj )
+      if not retVal[ 'OK' ]:
+        return retVal
+      retVal = self.__writeAggregatedBucketsInTransaction( typeName, records, aggregatedBuckets, idList, connObj )
+      if retVal[ 'OK' ]:
+        retVal = self.__commitTransaction( connObj )
+        if retVal[ 'OK' ]:
+          return retVal
+      self.__rollbackTransaction( connObj )
+      return retVal
+    finally:
+      connObj.close()
+
+  def __writeAggregatedBucketsInTransaction( self, typeName, records, aggregatedBuckets, idList, connObj ):
+    retVal = self.insertMany( _getTableName( "type", typeName ), self.dbCatalog[ typeName ][ 'typeFields' ],
+                              [ record[1] for record in records ], conn = connObj, commit = False )
+    if not retVal[ 'OK' ]:
+      return retVal
+    retVal = self.__addToBucketTable( _getTableName( "bucket", typeName ), typeName, aggregatedBuckets, connObj,
+                                      commit = False )
+    if not retVal[ 'OK' ]:
+      return retVal
+    bucketsData = [ ( bucketKey[0], bucketKey[1], bucketKey[2], aggregatedBuckets[ bucketKey ] )
+                    for bucketKey in aggregatedBuckets ]
+    retVal = self.__addToRollups( typeName, bucketsData, connObj = connObj, commit = False )
+    if not retVal[ 'OK' ]:
+      return retVal
+    for iPos in range( 0, len( idList ), 1000 ):
+      retVal = self._update( "DELETE FROM `%s` WHERE id in (%s)" % ( _getTableName( "in", typeName ),
+                                                                      ", ".join( idList[ iPos : iPos + 1000 ] ) ),
+                             conn = connObj, commit = False )
+      if not retVal[ 'OK' ]:
+        return retVal
+    return S_OK()
+
+  def __addToBucketTable( self, tableName, typeName, bucketsDict, connObj = False, commit = True ):
+    """
+    Add values to the buckets of a bucket or rollup table
+      - bucketsDict : { ( startTime, bucketLength, keyValues ) : values + [ entriesInBucket ] }
+      - commit : False to leave the changes in the transaction opened on connObj
+    """
+    keyFields = self.dbCatalog[ typeName ][ 'keys' ]
+    valueFields = self.dbCatalog[ typeName ][ 'values' ] + [ 'entriesInBucket' ]
+    bucketFields = [ 'startTime', 'bucketLength' ] + keyFields + valueFields
+    bucketRows = []
+    #Sorted to always lock the rows in the same order
+    for bucketKey in sorted( bucketsDict ):
+      bucketStartTime, bucketLength, keyValues = bucketKey
+      bucketRows.append( [ bucketStartTime, bucketLength ] + list( keyValues ) + list( bucketsDict[ bucketKey ] ) )
+    #Small enough chunks to be written in one statement each, so a chunk that failed
+    #because of a dead lock can be retried without adding its values twice. A dead lock
+    #rolls back the whole transaction, so the chunks in one are not retried
+    for iPos in range( 0, len( bucketRows ), 500 ):
+      for i in range( self.__getStatementRetries( commit ) ):
+        retVal = self.upsertMany( tableName, bucketFields, bucketRows[ iPos : iPos + 500 ],
+                                  updateFields = [], conn = connObj, incrementFields = valueFields,
+                                  commit = commit )
+        if retVal[ 'OK' ] or retVal[ 'Message' ].find( "try restarting transaction" ) == -1:
+          break
+      if not retVal[ 'OK' ]:
+        return retVal
+    return S_OK()
+
+  def __getStatementRetries( self, commit ):
+    """
+    Times a statement is tried when it fails because of a dead lock. A dead lock rolls back
+    the transaction, so statements in one are not retried alone
+    """
+    if not commit:
+      return 1
+    return max( 1, self.__deadLockRetries )
+
+  def __splitInRollup( self, bucketsData, rollupLength, factor = 1 ):
+    """
+    Re-bin buckets into buckets of rollupLength. Buckets are split proportionally as the
+    reports do when they convert the buckets to the plot granularity
+      - bucketsData : list of ( startTime, bucketLength, keyValues, values + [ entriesInBucket ] )
+      - factor : multiply the values by it
+    """
+    rollupData = {}
+    for bucketStartTime, bucketLength, keyValues, bucketValues in bucketsData:
+      bucketEndTime = bucketStartTime + max( 1, bucketLength )
+      rollupStartTime = bucketStartTime - bucketStartTime % rollupLength
+      while rollupStartTime < bucketEndTime:
+        start = max( rollupStartTime, bucketStartTime )
+        end = min( rollupStartTime + rollupLength, bucketEndTime )
+        proportion = factor * float( end - start ) / ( bucketEndTime - bucketStartTime )
+        rollupKey = ( rollupStartTime, rollupLength, tuple( keyValues ) )
+        if rollupKey in rollupData:
+          summedValues = rollupData[ rollupKey ]
+          for pos in range( len( summedValues ) ):
+            summedValues[ pos ] += float( bucketValues[ pos ] ) * proportion
+        else:
+          rollupData[ rollupKey ] = [ float( value ) * proportion for value in bucketValues ]
+        rollupStartTime += rollupLength
+    return rollupData
+
+  def __addToRollups( self, typeName, bucketsData, factor = 1, connObj = False, commit = True ):
+    """
+    Add the contents of buckets to the rollups of a type
+      - bucketsData : list of ( startTime, bucketLength, keyValues, values + [ entriesInBucket ] )
+      - factor : multiply the values by it, -1 to remove them
+    """
+    for rollupLength in self.dbCatalog[ typeName ][ 'rollups' ]:
+      retVal = self.__addToBucketTable( _getRollupTableName( typeName, rollupLength ), typeName,
+                                        self.__splitInRollup( bucketsData, rollupLength, factor ), connObj,
+                                        commit = commit )
+      if not retVal[ 'OK' ]:
+        return retVal
+    return S_OK()
+
+  def __getMaxBucketLength( self, typeName ):
+    return max( [ self.maxBucketTime ] + [ bucketDef[1] for bucketDef in self.dbBucketsLength[ typeName ] ] )
+
+  def __rebuildRollups( self, typeName, startTime, endTime, rollupLengths = None ):
+    """
+    Regenerate the rollups of a type between two times from the bucket table
+    """
+    if rollupLengths is None:
+      rollupLengths = self.dbCatalog[ typeName ][ 'rollups' ]
+    for rollupLength in rollupLengths:
+      rollupTableName = _getRollupTableName( typeName, rollupLength )
+      rangeStart = startTime - startTime % rollupLength
+      rangeEnd = endTime - endTime % rollupLength + rollupLength
+      self.log.info( "[ROLLUP] Rebuilding %s" % rollupTableName, "from %s to %s" % ( Time.fromEpoch( rangeStart ),
+                                                                                      Time.fromEpoch( rangeEnd ) ) )
+      #Windows of about a week
+      windowLength = rollupLength * max( 1, 604800 / rollupLength )
+      for windowStart in range( rangeStart, rangeEnd, windowLength ):
+        windowEnd = min( windowStart + windowLength, rangeEnd )
+        for i in range( max( 1, self.__deadLockRetries ) ):
+          retVal = self.__rebuildRollupWindow( typeName, rollupLength, windowStart, windowEnd )
+          if retVal[ 'OK' ] or retVal[ 'Message' ].find( "try restarting transaction" ) == -1:
+            break
+        if not retVal[ 'OK' ]:
+          return retVal
+    return S_OK()
+
+  def __rebuildRollupWindow( self, typeName, rollupLength, windowStart, windowEnd ):
+    """
+    Regenerate a window of a rollup in one transaction. The buckets it is made of are read
+    with FOR UPDATE, so records being added to them wait until the rollup is rebuilt and then
+    add themselves to it. Writers lock buckets before rollups, as this does
+    """
+    tableName = _getTableName( "bucket", typeName )
+    rollupTableName = _getRollupTableName( typeName, rollupLength )
+    maxBucketLength = self.__getMaxBucketLength( typeName )
+    bucketFields = self.dbCatalog[ typeName ][ 'keys' ] + self.dbCatalog[ typeName ][ 'values' ] + \
+                   [ 'entriesInBucket', 'startTime', 'bucketLength' ]
+    numKeys = len( self.dbCatalog[ typeName ][ 'keys' ] )
+    retVal = self._getConnection()
+    if not retVal[ 'OK' ]:
+      return retVal
+    connObj = retVal[ 'Value' ]
+    try:
+      retVal = self.__startTransaction( connObj )
+      if not retVal[ 'OK' ]:
+        return retVal
+      #Buckets starting in the window and the ones started before that reach it
+      sqlCmd = "SELECT %s FROM `%s` WHERE ( `startTime` >= %d AND `startTime` < %d )" % ( ", ".join( [ "`%s`" % f for f in bucketFields ] ),
+                                                                                         tableName, windowStart, windowEnd )
+      sqlCmd += " OR ( `startTime` >= %d AND `startTime` < %d AND `startTime` + `bucketLength` > %d )" % ( windowStart - maxBucketLength,
+                                                                                                          windowStart, windowStart )
+      retVal = self._query( "%s FOR UPDATE" % sqlCmd, conn = connObj )
+      if retVal[ 'OK' ]:
+        bucketsData = [ ( row[-2], row[-1], row[ :numKeys ], row[ numKeys:-2 ] ) for row in retVal[ 'Value' ] ]
+        retVal = self._update( "DELETE FROM `%s` WHERE `startTime` >= %d AND `startTime` < %d" % ( rollupTableName,
+                                                                                                 windowStart,
+                                                                                                 windowEnd ),
+                               conn = connObj, commit = False )
+      if retVal[ 'OK' ]:
+        rollupData = self.__splitInRollup( bucketsData, rollupLength )
+        for rollupKey in rollupData.keys():
+          if rollupKey[0] < windowStart or rollupKey[0] >= windowEnd:
+            del( rollupData[ rollupKey ] )
+        retVal = self.__addToBucketTable( rollupTableName, typeName, rollupData, connObj, commit = False )
+      if retVal[ 'OK' ]:
+        retVal = self.__commitTransaction( connObj )
+        if retVal[ 'OK' ]:
+          return retVal
+      self.__rollbackTransaction( connObj )
+      return retVal
+    finally:
+      connObj.close()
+
+  def __rebuildAllRollups( self, typeName, rollupLengths ):
+    """
+    Regenerate the rollups of a type for all the data in the bucket table
+    """
+    for rollupLength in rollupLengths:
+      retVal = self._update( "DELETE FROM `%s`" % _getRollupTableName( typeName, rollupLength ) )
+      if not retVal[ 'OK' ]:
+        return retVal
+    retVal = self._query( "SELECT MIN( `startTime` ), MAX( `startTime` ) FROM `%s`" % _getTableName( "bucket", typeName ) )
+    if not retVal[ 'OK' ]:
+      return retVal
+    minTime, maxTime = retVal[ 'Value' ][0]
+    if minTime is None:
+      return S_OK()
+    return self.__rebuildRollups( typeName, int( minTime ), int( maxTime ) + self.__getMaxBucketLength( typeName ),
+                                  rollupLengths )
+
+  def __getReadyRollups( self, typeName ):
+    """
+    Get the lengths of the rollups of a type that have been completely filled
+    """
+    readyRollups = self.__readyRollupsCache.get( typeName )
+    if readyRollups is False:
+      retVal = self._query( "SELECT `bucketLength` FROM `%s` WHERE `name`='%s'" % ( self.rollupsTableName, typeName ) )
+      if not retVal[ 'OK' ]:
+        self.log.error( "Can't get the ready rollups", retVal[ 'Message' ] )
+        return []
+      readyRollups = [ row[0] for row in retVal[ 'Value' ] ]
+      self.__readyRollupsCache.add( typeName, 300, readyRollups )
+    return [ rollupLength for rollupLength in self.dbCatalog[ typeName ][ 'rollups' ] if rollupLength in readyRollups ]
+
+  def __requestRollupsBackfill( self, typeName ):
+    """
+    Fill the new rollups of a type in the background
+    """
+    self.__rollupsBackfillLock.acquire()
+    try:
+      if typeName not in self.__rollupsToBackfill:
+        self.__rollupsToBackfill.append( typeName )
+      if self.__doingRollupsBackfill:
+        return
+      self.__doingRollupsBackfill = True
+    finally:
+      self.__rollupsBackfillLock.release()
+    th = threading.Thread( target = self.__backfillRollups )
+    th.setDaemon( 1 )
+    th.start()
+
+  def __backfillRollups( self ):
+    while True:
+      self.__rollupsBackfillLock.acquire()
+      try:
+        if not self.__rollupsToBackfill:
+          self.__doingRollupsBackfill = False
+          return
+        typeName = self.__rollupsToBackfill.pop( 0 )
+      finally:
+        self.__rollupsBackfillLock.release()
+      try:
+        retVal = self.__backfillRollupsForType( typeName )
+        if not retVal[ 'OK' ]:
+          self.log.error( "[ROLLUP] Can't fill rollups", "for %s: %s" % ( typeName, retVal[ 'Message' ] ) )
+      except Exception, e:
+        self.log.exception( "[ROLLUP] Exception while filling rollups", "for %s: %s" % ( typeName, str( e ) ) )
+
+  def __backfillRollupsForType( self, typeName ):
+    """
+    Fill the rollups of a type that are not ready yet from the bucket table. Only one
+    DataStore does it, the others skip it
+    """
+    retVal = self._getConnection()
+    if not retVal[ 'OK' ]:
+      return retVal
+    connObj = retVal[ 'Value' ]
+    lockName = "AccountingDB.Rollups.%s" % typeName
+    try:
+      retVal = self._query( "SELECT GET_LOCK( '%s', 0 )" % lockName, conn = connObj )
+      if not retVal[ 'OK' ]:
+        return retVal
+      if retVal[ 'Value' ][0][0] != 1:
+        self.log.info( "[ROLLUP] Rollups for %s are being filled somewhere else" % typeName )
+        return S_OK()
+      try:
+        self.__readyRollupsCache.delete( typeName )
+        readyRollups = self.__getReadyRollups( typeName )
+        rollupLengths = [ rollupLength for rollupLength in self.dbCatalog[ typeName ][ 'rollups' ]
+                          if rollupLength not in readyRollups ]
+        if not rollupLengths:
+          return S_OK()
+        retVal = self.__rebuildAllRollups( typeName, rollupLengths )
+        if not retVal[ 'OK' ]:
+          return retVal
+        retVal = self.insertMany( self.rollupsTableName, [ 'name', 'bucketLength' ],
+                                  [ [ typeName, rollupLength ] for rollupLength in rollupLengths ], ignore = True )
+        if not retVal[ 'OK' ]:
+          return retVal
+        self.__readyRollupsCache.delete( typeName )
+        self.log.info( "[ROLLUP] Rollups %s ready for %s" % ( rollupLengths, typeName ) )
+        return S_OK()
+      finally:
+        self._query( "SELECT RELEASE_LOCK( '%s' )" % lockName, conn = connObj )
+    finally:
+      connObj.close()
+
   def insertRecordDirectly( self, typeName, startTime, endTime, valuesList ):
     """
     Add an entry to the type contents
@@ -660,7 +1243,13 @@ class AccountingDB( DB ):
       retVal = self.__startTransaction( connObj )
       if not retVal[ 'OK' ]:
         return retVal
-      retVal = self.__splitInBuckets( typeName, startTime, endTime, valuesList, connObj = connObj )
+      #Buckets and rollups change together, rollups being rebuilt from the buckets rely on it
+      retVal = self.__splitInBuckets( typeName, startTime, endTime, valuesList, connObj = connObj, commit = False )
+      if not retVal[ 'OK' ]:
+        self.__rollbackTransaction( connObj )
+        return retVal
+      retVal = self.__addToRollups( typeName, self.__getRecordBuckets( typeName, startTime, endTime, valuesList ),
+                                    connObj = connObj, commit = False )
       if not retVal[ 'OK' ]:
         self.__rollbackTransaction( connObj )
         return retVal
@@ -728,13 +1317,21 @@ class AccountingDB( DB ):
       return S_OK( 0 )
     #Delete from type
     retVal = self._update( "DELETE FROM `%s` WHERE %s" % ( mainTable, " AND ".join( sqlCond ) ),
-                           conn = connObj )
+                           conn = connObj, commit = False )
     if not retVal[ 'OK' ]:
+      self.__rollbackTransaction( connObj )
       return retVal
     #Deleted from type, now the buckets
     #HACK: One more record to split in the buckets to be able to count total entries
     sqlValues.append( 1 )
-    retVal = self.__deleteFromBuckets( typeName, startTime, endTime, sqlValues, numInsertions, connObj = connObj )
+    retVal = self.__deleteFromBuckets( typeName, startTime, endTime, sqlValues, numInsertions, connObj = connObj,
+                                       commit = False )
+    if not retVal[ 'OK' ]:
+      self.__rollbackTransaction( connObj )
+      return retVal
+    retVal = self.__addToRollups( typeName, self.__getRecordBuckets( typeName, startTime, endTime, sqlValues,
+                                                                     self.__lastCompactionEpoch ),
+                                  factor = -numInsertions, connObj = connObj, commit = False )
     if not retVal[ 'OK' ]:
       self.__rollbackTransaction( connObj )
       return retVal
@@ -744,9 +1341,21 @@ class AccountingDB( DB ):
       return retVal
     return S_OK( numInsertions )
 
-  def __splitInBuckets( self, typeName, startTime, endTime, valuesList, connObj = False ):
+  def __getRecordBuckets( self, typeName, startTime, endTime, valuesList, nowEpoch = False ):
+    """
+    Get the contents of the buckets a record is split in as ( startTime, bucketLength, keyValues, values )
+    """
+    numKeys = len( self.dbCatalog[ typeName ][ 'keys' ] )
+    keyValues = tuple( valuesList[ :numKeys ] )
+    recordBuckets = []
+    for bucketStartTime, bucketProportion, bucketLength in self.calculateBuckets( typeName, startTime, endTime, nowEpoch ):
+      recordBuckets.append( ( bucketStartTime, bucketLength, keyValues,
+                              [ float( value ) * bucketProportion for value in valuesList[ numKeys: ] ] ) )
+    return recordBuckets
+
+  def __splitInBuckets( self, typeName, startTime, endTime, valuesList, connObj = False, commit = True ):
     """
-    Bucketize a record
+    Bucketize a record. With commit False the buckets are left in the transaction opened on connObj
     """
     #Calculate amount of buckets
     buckets = self.calculateBuckets( typeName, startTime, endTime )
@@ -761,7 +1370,7 @@ class AccountingDB( DB ):
       bucketLength = bucketInfo[2]
       if not self.__oldBucketMethod:
         result = self.__writeBucket( typeName, bucketStartTime, bucketLength, keyValues,
-                                     valuesList, bucketProportion, connObj = connObj )
+                                     valuesList, bucketProportion, connObj = connObj, commit = commit )
         if not result[ 'OK' ]:
           return result
       else:
@@ -770,7 +1379,7 @@ class AccountingDB( DB ):
                                       bucketStartTime,
                                       bucketLength,
                                       keyValues,
-                                      valuesList, bucketProportion, connObj = connObj )
+                                      valuesList, bucketProportion, connObj = connObj, commit = commit )
         #If OK insert is successful
         if retVal[ 'OK' ]:
           continue
@@ -779,12 +1388,12 @@ class AccountingDB( DB ):
           return retVal
         #Duplicate keys!!. If that's the case..
         #Update!
-        for i in range( max( 1, self.__deadLockRetries ) ):
+        for i in range( self.__getStatementRetries( commit ) ):
           retVal = self.__updateBucket( typeName,
                                         bucketStartTime,
                                         bucketLength,
                                         keyValues,
-                                        valuesList, bucketProportion, connObj = connObj )
+                                        valuesList, bucketProportion, connObj = connObj, commit = commit )
           if not retVal[ 'OK' ]:
             #If failed because of dead lock try restarting
             if retVal[ 'Message' ].find( "try restarting transaction" ):
@@ -795,7 +1404,7 @@ class AccountingDB( DB ):
             break
     return S_OK()
 
-  def __deleteFromBuckets( self, typeName, startTime, endTime, valuesList, numInsertions, connObj = False ):
+  def __deleteFromBuckets( self, typeName, startTime, endTime, valuesList, numInsertions, connObj = False, commit = True ):
     """
     DeBucketize a record
     """
@@ -810,12 +1419,13 @@ class AccountingDB( DB ):
       bucketStartTime = bucketInfo[0]
       bucketProportion = bucketInfo[1]
       bucketLength = bucketInfo[2]
-      for i in range( max( 1, self.__deadLockRetries ) ):
+      for i in range( self.__getStatementRetries( commit ) ):
         retVal = self.__extractFromBucket( typeName,
                                            bucketStartTime,
                                            bucketLength,
                                            keyValues,
-                                           valuesList, bucketProportion * numInsertions, connObj = connObj )
+                                           valuesList, bucketProportion * numInsertions, connObj = connObj,
+                                           commit = commit )
         if not retVal[ 'OK' ]:
           #If failed because of dead lock try restarting
           if retVal[ 'Message' ].find( "try restarting transaction" ):
@@ -862,7 +1472,8 @@ class AccountingDB( DB ):
     cmd += self.__generateSQLConditionForKeys( typeName, keyValues )
     return self._query( cmd, conn = connObj )
 
-  def __extractFromBucket( self, typeName, startTime, bucketLength, keyValues, bucketValues, proportion, connObj = False ):
+  def __extractFromBucket( self, typeName, startTime, bucketLength, keyValues, bucketValues, proportion, connObj = False,
+                           commit = True ):
     """
     Update a bucket when coming from the raw insert
     """
@@ -885,10 +1496,11 @@ class AccountingDB( DB ):
                                                                             tableName,
                                                                             bucketLength )
     cmd += self.__generateSQLConditionForKeys( typeName, keyValues )
-    return self._update( cmd, conn = connObj )
+    return self._update( cmd, conn = connObj, commit = commit )
 
 
-  def __writeBucket( self, typeName, startTime, bucketLength, keyValues, bucketValues, proportion, connObj = False ):
+  def __writeBucket( self, typeName, startTime, bucketLength, keyValues, bucketValues, proportion, connObj = False,
+                     commit = True ):
     """ Insert or update a bucket
     """
     tableName = _getTableName( "bucket", typeName )
@@ -910,8 +1522,8 @@ class AccountingDB( DB ):
     cmd += "VALUES ( %s ) " % ", ".join( [ str( val ) for val in sqlValues ] )
     cmd += "ON DUPLICATE KEY UPDATE %s" % ", ".join( sqlUpData )
 
-    for i in range( max( 1, self.__deadLockRetries ) ):
-      result = self._update( cmd, conn = connObj )
+    for i in range( self.__getStatementRetries( commit ) ):
+      result = self._update( cmd, conn = connObj, commit = commit )
       if not result[ 'OK' ]:
         #If failed because of dead lock try restarting
         if result[ 'Message' ].find( "try restarting transaction" ):
@@ -924,7 +1536,8 @@ class AccountingDB( DB ):
     return S_ERROR( "Cannot update bucket: %s" % result[ 'Message' ] )
 
 
-  def __updateBucket( self, typeName, startTime, bucketLength, keyValues, bucketValues, proportion, connObj = False ):
+  def __updateBucket( self, typeName, startTime, bucketLength, keyValues, bucketValues, proportion, connObj = False,
+                      commit = True ):
     """
     Update a bucket when coming from the raw insert
     """
@@ -947,9 +1560,10 @@ class AccountingDB( DB ):
                                                                             tableName,
                                                                             bucketLength )
     cmd += self.__generateSQLConditionForKeys( typeName, keyValues )
-    return self._update( cmd, conn = connObj )
+    return self._update( cmd, conn = connObj, commit = commit )
 
-  def __insertBucket( self, typeName, startTime, bucketLength, keyValues, bucketValues, proportion, connObj = False ):
+  def __insertBucket( self, typeName, startTime, bucketLength, keyValues, bucketValues, proportion, connObj = False,
+                      commit = True ):
     """
     Insert a bucket when coming from the raw insert
     """
@@ -963,7 +1577,7 @@ class AccountingDB( DB ):
       sqlValues.append( "(%s*%s)" % ( bucketValues[ valPos ], proportion ) )
     cmd = "INSERT INTO `%s` ( %s ) " % ( _getTableName( "bucket", typeName ), ", ".join( sqlFields ) )
     cmd += "VALUES ( %s )" % ", ".join( [ str( val ) for val in sqlValues ] )
-    return self._update( cmd, conn = connObj )
+    return self._update( cmd, conn = connObj, commit = commit )
 
   def __checkFieldsExistsInType( self, typeName, fields, tableType ):
     """
@@ -1008,7 +1622,8 @@ class AccountingDB( DB ):
     return self.__queryType( typeName, startTime, endTime, selectFields,
                              condDict, False, orderFields, "type" )
 
-  def retrieveBucketedData( self, typeName, startTime, endTime, selectFields, condDict, groupFields, orderFields, connObj = False ):
+  def retrieveBucketedData( self, typeName, startTime, endTime, selectFields, condDict, groupFields, orderFields,
+                            connObj = False, granularity = 0 ):
     """
     Get data from the DB
     Parameters:
@@ -1023,6 +1638,8 @@ class AccountingDB( DB ):
                   ( "%s, %s, %s", ( "field1name", "field2name", "field3name" ) )
      - orderFields -> list of fields to order by
                   ( "%s, %s, %s", ( "field1name", "field2name", "field3name" ) )
+     - granularity -> the data will be summed in bins of this length. If set, additive
+                      time series can be read from the rollups
     """
     if typeName not in self.dbCatalog:
       return S_ERROR( "Type %s is not defined" % typeName )
@@ -1035,18 +1652,58 @@ class AccountingDB( DB ):
     nowEpoch = Time.toEpoch( Time.dateTime () )
     bucketTimeLength = self.calculateBucketLengthForTime( typeName, nowEpoch , startTime )
     startTime = startTime - startTime % bucketTimeLength
-    result = self.__queryType( typeName,
-                             startTime,
-                             endTime,
-                             selectFields,
-                             condDict,
-                             groupFields,
-                             orderFields,
-                             "bucket",
-                             connObj = connObj )
+    rollupLength = 0
+    if granularity:
+      rollupLength = self.__getRollupForQuery( typeName, startTime, endTime, selectFields, groupFields,
+                                               orderFields, granularity, nowEpoch )
+    if not rollupLength:
+      result = self.__queryType( typeName,
+                               startTime,
+                               endTime,
+                               selectFields,
+                               condDict,
+                               groupFields,
+                               orderFields,
+                               "bucket",
+                               connObj = connObj )
+    else:
+      #Whole rollups up to the last one finished before endTime and the buckets after it
+      rollupEnd = ( endTime + 1 ) - ( endTime + 1 ) % rollupLength
+      self.log.verbose( "Using %s rollup for %s up to %s" % ( rollupLength, typeName, Time.fromEpoch( rollupEnd ) ) )
+      result = self.__queryType( typeName, startTime, rollupEnd - 1, selectFields, condDict,
+                                 _copyFieldsDef( groupFields ), _copyFieldsDef( orderFields ),
+                                 "rollup%s" % rollupLength, connObj = connObj )
+      if result[ 'OK' ] and rollupEnd <= endTime:
+        rollupData = result[ 'Value' ]
+        result = self.__queryType( typeName, rollupEnd, endTime, selectFields, condDict,
+                                   groupFields, orderFields, "bucket", connObj = connObj )
+        if result[ 'OK' ]:
+          result = S_OK( tuple( rollupData ) + tuple( result[ 'Value' ] ) )
     gMonitor.addMark( "querytime", Time.toEpoch() - startQueryEpoch )
     return result
 
+  def __getRollupForQuery( self, typeName, startTime, endTime, selectFields, groupFields, orderFields,
+                           granularity, nowEpoch ):
+    """
+    Get the length of the rollup that can answer a query, 0 if none. Rollups only keep sums
+    per bin, so they can only be used for additive time series summed in bins made of whole rollups
+    """
+    if not groupFields or 'startTime' not in groupFields[1]:
+      return 0
+    if orderFields and orderFields[1][:1] != [ 'startTime' ]:
+      return 0
+    if not _isAdditiveSelection( selectFields, self.dbCatalog[ typeName ][ 'values' ] + [ 'entriesInBucket' ] ):
+      return 0
+    #Buckets at the seam with the rollups have to end at a rollup boundary
+    seamBucketLength = self.calculateBucketLengthForTime( typeName, nowEpoch, endTime )
+    for rollupLength in sorted( self.__getReadyRollups( typeName ), reverse = True ):
+      if granularity % rollupLength or startTime % rollupLength or rollupLength % seamBucketLength:
+        continue
+      if ( endTime + 1 ) - ( endTime + 1 ) % rollupLength - startTime < rollupLength:
+        continue
+      return rollupLength
+    return 0
+
   def __queryType( self, typeName, startTime, endTime, selectFields, condDict, groupFields, orderFields, tableType, connObj = False ):
     """
     Execute a query over a main table
@@ -1093,10 +1750,10 @@ class AccountingDB( DB ):
     if startTime:
       sqlTimeCond.append( "`%s`.`startTime` >= %s" % ( tableName, startTime ) )
     if endTime:
-      if tableType == "bucket":
-        endTimeSQLVar = "startTime"
-      else:
+      if tableType == "type":
         endTimeSQLVar = "endTime"
+      else:
+        endTimeSQLVar = "startTime"
       sqlTimeCond.append( "`%s`.`%s` <= %s" % ( tableName, endTimeSQLVar, endTime ) )
     cmd += " WHERE %s" % " AND ".join( sqlTimeCond )
     #Calculate conditions
@@ -1146,7 +1803,8 @@ class AccountingDB( DB ):
 
   def compactBuckets( self, typeFilter = False ):
     """
-    Compact buckets for all defined types
+    Compact buckets for all defined types. Types are compacted in parallel, each one
+    in slices of time starting where the previous compaction stopped
     """
     if self.__readOnly:
       return S_ERROR( "ReadOnly mode enabled. No modification allowed" )
@@ -1155,223 +1813,272 @@ class AccountingDB( DB ):
       if self.__doingCompaction:
         return S_OK()
       self.__doingCompaction = True
+      if not self.__compactionPool:
+        self.__compactionPool = ThreadPool( 1, self.getCSOption( "CompactionThreads", 4 ) )
     finally:
       gSynchro.unlock()
-    slow = True
-    for typeName in self.dbCatalog:
-      if typeFilter and typeName.find( typeFilter ) == -1:
-        self.log.info( "[COMPACT] Skipping %s" % typeName )
-        continue
-      if self.dbCatalog[ typeName ][ 'dataTimespan' ] > 0:
-        self.log.info( "[COMPACT] Deleting records older that timespan for type %s" % typeName )
-        self.__deleteRecordsOlderThanDataTimespan( typeName )
-      self.log.info( "[COMPACT] Compacting %s" % typeName )
-      if slow:
-        self.__slowCompactBucketsForType( typeName )
-      else:
-        self.__compactBucketsForType( typeName )
-    self.log.info( "[COMPACT] Compaction finished" )
-    self.__lastCompactionEpoch = int( Time.toEpoch() )
-    gSynchro.lock()
     try:
-      if self.__doingCompaction:
-        self.__doingCompaction = False
+      nowEpoch = int( Time.toEpoch() )
+      for typeName in self.dbCatalog.keys():
+        if typeFilter and typeName.find( typeFilter ) == -1:
+          self.log.info( "[COMPACT] Skipping %s" % typeName )
+          continue
+        self.__setCompactionStatus( typeName, { 'state' : 'queued', 'lastRun' : nowEpoch, 'slicesDone' : 0,
+                                                'slicesTotal' : 0, 'bucketsCompacted' : 0, 'bucketsWritten' : 0,
+                                                'elapsed' : 0.0 } )
+        self.__compactionPool.generateJobAndQueueIt( self.__compactType, args = ( typeName, nowEpoch ) )
+      self.__compactionPool.processAllResults()
+      self.log.info( "[COMPACT] Compaction finished" )
+      self.__lastCompactionEpoch = int( Time.toEpoch() )
     finally:
-      gSynchro.unlock()
+      gSynchro.lock()
+      try:
+        self.__doingCompaction = False
+      finally:
+        gSynchro.unlock()
     return S_OK()
 
-  def __selectForCompactBuckets( self, typeName, timeLimit, bucketLength, nextBucketLength, connObj = False ):
+  def getCompactionStatus( self ):
     """
-    Nasty SQL query to get ideal buckets using grouping by date calculations and adding value contents
+    Get the progress and timing of the last compaction of each type
     """
-    tableName = _getTableName( "bucket", typeName )
-    selectSQL = "SELECT "
-    sqlSelectList = []
-    for field in self.dbCatalog[ typeName ][ 'keys' ]:
-      sqlSelectList.append( "`%s`.`%s`" % ( tableName, field ) )
-    for field in self.dbCatalog[ typeName ][ 'values' ]:
-      sqlSelectList.append( "SUM( `%s`.`%s` )" % ( tableName, field ) )
-    sqlSelectList.append( "SUM( `%s`.`entriesInBucket` )" % ( tableName ) )
-    sqlSelectList.append( "MIN( `%s`.`startTime` )" % tableName )
-    sqlSelectList.append( "MAX( `%s`.`startTime` )" % tableName )
-    selectSQL += ", ".join( sqlSelectList )
-    selectSQL += " FROM `%s`" % tableName
-    selectSQL += " WHERE `%s`.`startTime` < '%s' AND" % ( tableName, timeLimit )
-    selectSQL += " `%s`.`bucketLength` = %s" % ( tableName, bucketLength )
-    #MAGIC bucketing
-    sqlGroupList = [ _bucketizeDataField( "`%s`.`startTime`" % tableName, nextBucketLength ) ]
-    for field in self.dbCatalog[ typeName ][ 'keys' ]:
-      sqlGroupList.append( "`%s`.`%s`" % ( tableName, field ) )
-    selectSQL += " GROUP BY %s" % ", ".join( sqlGroupList )
-    return self._query( selectSQL, conn = connObj )
+    self.__compactionStatusLock.acquire()
+    try:
+      return S_OK( dict( [ ( typeName, dict( self.__compactionStatus[ typeName ] ) )
+                           for typeName in self.__compactionStatus ] ) )
+    finally:
+      self.__compactionStatusLock.release()
 
-  def __deleteForCompactBuckets( self, typeName, timeLimit, bucketLength, connObj = False ):
-    """
-    Delete compacted buckets
-    """
-    tableName = _getTableName( "bucket", typeName )
-    deleteSQL = "DELETE FROM `%s` WHERE " % tableName
-    deleteSQL += "`%s`.`startTime` < '%s' AND " % ( tableName, timeLimit )
-    deleteSQL += "`%s`.`bucketLength` = %s" % ( tableName, bucketLength )
-    return self._update( deleteSQL, conn = connObj )
+  def __setCompactionStatus( self, typeName, statusDict, increment = False ):
+    self.__compactionStatusLock.acquire()
+    try:
+      if typeName not in self.__compactionStatus:
+        self.__compactionStatus[ typeName ] = {}
+      typeStatus = self.__compactionStatus[ typeName ]
+      for key in statusDict:
+        if increment:
+          typeStatus[ key ] = typeStatus.get( key, 0 ) + statusDict[ key ]
+        else:
+          typeStatus[ key ] = statusDict[ key ]
+    finally:
+      self.__compactionStatusLock.release()
 
-  def __compactBucketsForType( self, typeName ):
+  def __compactType( self, typeName, nowEpoch ):
     """
-    Compact all buckets for a given type
+    Delete the old records and compact the buckets of a type. Only one DataStore does it,
+    the others skip it
     """
-    nowEpoch = Time.toEpoch()
+    startTime = time.time()
+    self.__setCompactionStatus( typeName, { 'state' : 'running' } )
     retVal = self._getConnection()
     if not retVal[ 'OK' ]:
+      self.__setCompactionStatus( typeName, { 'state' : 'failed', 'error' : retVal[ 'Message' ] } )
       return retVal
     connObj = retVal[ 'Value' ]
-    #retVal = self.__startTransaction( connObj )
-    #if not retVal[ 'OK' ]:
-    #  return retVal
-    for bPos in range( len( self.dbBucketsLength[ typeName ] ) - 1 ):
-      self.log.info( "[COMPACT] Query %d of %d" % ( bPos + 1, len( self.dbBucketsLength[ typeName ] ) - 1 ) )
-      secondsLimit = self.dbBucketsLength[ typeName ][ bPos ][0]
-      bucketLength = self.dbBucketsLength[ typeName ][ bPos ][1]
-      timeLimit = ( nowEpoch - nowEpoch % bucketLength ) - secondsLimit
-      nextBucketLength = self.dbBucketsLength[ typeName ][ bPos + 1 ][1]
-      self.log.info( "[COMPACT] Compacting data newer that %s with bucket size %s" % ( Time.fromEpoch( timeLimit ), bucketLength ) )
-      #Retrieve the data
-      retVal = self.__selectForCompactBuckets( typeName, timeLimit, bucketLength, nextBucketLength, connObj )
-      if not retVal[ 'OK' ]:
-        #self.__rollbackTransaction( connObj )
-        return retVal
-      bucketsData = retVal[ 'Value' ]
-      self.log.info( "[COMPACT] Got %d records to compact" % len( bucketsData ) )
-      if len( bucketsData ) == 0:
-        continue
-      retVal = self.__deleteForCompactBuckets( typeName, timeLimit, bucketLength, connObj )
-      if not retVal[ 'OK' ]:
-        #self.__rollbackTransaction( connObj )
-        return retVal
-      self.log.info( "[COMPACT] Compacting %s records %s seconds size for %s" % ( len( bucketsData ), bucketLength, typeName ) )
-      #Add data
-      for record in bucketsData:
-        startTime = record[-2]
-        endTime = record[-1]
-        valuesList = record[:-2]
-        retVal = self.__splitInBuckets( typeName, startTime, endTime, valuesList, connObj )
+    lockName = "AccountingDB.Compaction.%s" % typeName
+    try:
+      try:
+        retVal = self._query( "SELECT GET_LOCK( '%s', 0 )" % lockName, conn = connObj )
         if not retVal[ 'OK' ]:
-          #self.__rollbackTransaction( connObj )
-          self.log.error( "[COMPACT] Error while compacting data for record in %s: %s" % ( typeName, retVal[ 'Value' ] ) )
-      self.log.info( "[COMPACT] Finished compaction %d of %d" % ( bPos, len( self.dbBucketsLength[ typeName ] ) - 1 ) )
-    #return self.__commitTransaction( connObj )
-    connObj.close()
-    return S_OK()
+          return retVal
+        if retVal[ 'Value' ][0][0] != 1:
+          self.log.info( "[COMPACT] %s is being compacted somewhere else" % typeName )
+          self.__setCompactionStatus( typeName, { 'state' : 'skipped' } )
+          return retVal
+        try:
+          if self.dbCatalog[ typeName ][ 'dataTimespan' ] > 0:
+            self.log.info( "[COMPACT] Deleting records older that timespan for type %s" % typeName )
+            self.__deleteRecordsOlderThanDataTimespan( typeName )
+          self.log.info( "[COMPACT] Compacting %s" % typeName )
+          retVal = self.__compactBucketsForType( typeName, nowEpoch )
+        finally:
+          self._query( "SELECT RELEASE_LOCK( '%s' )" % lockName, conn = connObj )
+      except Exception, e:
+        self.log.exception( "[COMPACT] Exception while compacting", "%s: %s" % ( typeName, str( e ) ) )
+        retVal = S_ERROR( "Exception while compacting %s: %s" % ( typeName, str( e ) ) )
+      return retVal
+    finally:
+      connObj.close()
+      elapsed = time.time() - startTime
+      if retVal[ 'OK' ]:
+        statusDict = { 'elapsed' : elapsed }
+        if self.getCompactionStatus()[ 'Value' ][ typeName ][ 'state' ] == 'running':
+          statusDict[ 'state' ] = 'done'
+      else:
+        statusDict = { 'state' : 'failed', 'error' : retVal[ 'Message' ], 'elapsed' : elapsed }
+        self.log.error( "[COMPACT] Can't compact", "%s: %s" % ( typeName, retVal[ 'Message' ] ) )
+      self.__setCompactionStatus( typeName, statusDict )
 
-  def __slowCompactBucketsForType( self, typeName ):
+  def __getCompactionWatermarks( self, typeName ):
     """
-    Compact all buckets for a given type
+    Get up to when the buckets of each length of a type have been compacted
     """
-    nowEpoch = Time.toEpoch()
-    retVal = self._getConnection()
+    retVal = self._query( "SELECT `bucketLength`, `watermark` FROM `%s` WHERE `name`='%s'" % ( self.compactionTableName,
+                                                                                             typeName ) )
     if not retVal[ 'OK' ]:
       return retVal
-    connObj = retVal[ 'Value' ]
-    for bPos in range( len( self.dbBucketsLength[ typeName ] ) - 1 ):
-      self.log.info( "[COMPACT] Query %d of %d" % ( bPos, len( self.dbBucketsLength[ typeName ] ) - 1 ) )
-      secondsLimit = self.dbBucketsLength[ typeName ][ bPos ][0]
-      bucketLength = self.dbBucketsLength[ typeName ][ bPos ][1]
-      timeLimit = ( nowEpoch - nowEpoch % bucketLength ) - secondsLimit
-      nextBucketLength = self.dbBucketsLength[ typeName ][ bPos + 1 ][1]
-      self.log.info( "[COMPACT] Compacting data newer that %s with bucket size %s for %s" % ( Time.fromEpoch( timeLimit ), bucketLength, typeName ) )
-      querySize = 10000
-      previousRecordsSelected = querySize
-      totalCompacted = 0
-      while previousRecordsSelected == querySize:
-        #Retrieve the data
-        self.log.info( "[COMPACT] Retrieving buckets to compact newer that %s with size %s" % ( Time.fromEpoch( timeLimit ),
-                                                                                                       bucketLength ) )
-        roundStartTime = time.time()
-        result = self.__selectIndividualForCompactBuckets( typeName, timeLimit, bucketLength,
-                                                           nextBucketLength, querySize, connObj )
-        if not result[ 'OK' ]:
-          #self.__rollbackTransaction( connObj )
-          return result
-        bucketsData = result[ 'Value' ]
-        previousRecordsSelected = len( bucketsData )
-        selectEndTime = time.time()
-        self.log.info( "[COMPACT] Got %d buckets (%d done) (took %.2f secs)" % ( previousRecordsSelected,
-                                                                                 totalCompacted,
-                                                                                 selectEndTime - roundStartTime ) )
-        if len( bucketsData ) == 0:
-          break
+    return S_OK( dict( [ ( int( row[0] ), int( row[1] ) ) for row in retVal[ 'Value' ] ] ) )
 
-        result = self.__deleteIndividualForCompactBuckets( typeName, bucketsData, connObj )
-        if not result[ 'OK' ]:
-          #self.__rollbackTransaction( connObj )
-          return result
-        bucketsData = result[ 'Value' ]
-        deleteEndTime = time.time()
-        self.log.info( "[COMPACT] Deleted %s out-of-bounds buckets (took %.2f secs)" % ( len( bucketsData ),
-                                                                                         deleteEndTime - selectEndTime ) )
-        #Add data
-        for record in bucketsData:
-          startTime = record[-2]
-          endTime = record[-2] + record[-1]
-          valuesList = record[:-2]
-          retVal = self.__splitInBuckets( typeName, startTime, endTime, valuesList, connObj )
-          if not retVal[ 'OK' ]:
-            self.log.error( "[COMPACT] Error while compacting data for buckets in %s: %s" % ( typeName, retVal[ 'Value' ] ) )
-        totalCompacted += len( bucketsData )
-        insertElapsedTime = time.time() - deleteEndTime
-        self.log.info( "[COMPACT] Records compacted (took %.2f secs, %.2f secs/bucket)" % ( insertElapsedTime,
-                                                                                            insertElapsedTime / len( bucketsData ) ) )
-      self.log.info( "[COMPACT] Finised compaction %d of %d" % ( bPos, len( self.dbBucketsLength[ typeName ] ) - 1 ) )
-    #return self.__commitTransaction( connObj )
-    connObj.close()
-    return S_OK()
+  def __setCompactionWatermark( self, typeName, bucketLength, watermark ):
+    return self.upsertMany( self.compactionTableName, [ 'name', 'bucketLength', 'watermark' ],
+                            [ [ typeName, bucketLength, watermark ] ], updateFields = [ 'watermark' ] )
 
-  def __selectIndividualForCompactBuckets( self, typeName, timeLimit, bucketLength, nextBucketLength, querySize, connObj = False ):
+  def __resetCompactionWatermarks( self, typeName ):
+    return self._update( "DELETE FROM `%s` WHERE `name`='%s'" % ( self.compactionTableName, typeName ) )
+
+  def __compactBucketsForType( self, typeName, nowEpoch ):
     """
-    Nasty SQL query to get ideal buckets using grouping by date calculations and adding value contents
+    Compact the buckets of a type in slices of time. Each slice is compacted with its own
+    queries, so no query holds the bucket table for long
     """
     tableName = _getTableName( "bucket", typeName )
-    selectSQL = "SELECT "
-    sqlSelectList = []
-    for field in self.dbCatalog[ typeName ][ 'keys' ]:
-      sqlSelectList.append( "`%s`.`%s`" % ( tableName, field ) )
-    for field in self.dbCatalog[ typeName ][ 'values' ]:
-      sqlSelectList.append( "`%s`.`%s`" % ( tableName, field ) )
-    sqlSelectList.append( "`%s`.`entriesInBucket`" % ( tableName ) )
-    sqlSelectList.append( "`%s`.`startTime`" % tableName )
-    sqlSelectList.append( "`%s`.bucketLength" % ( tableName ) )
-    selectSQL += ", ".join( sqlSelectList )
-    selectSQL += " FROM `%s`" % tableName
-    selectSQL += " WHERE `%s`.`startTime` < '%s' AND" % ( tableName, timeLimit )
-    selectSQL += " `%s`.`bucketLength` = %s" % ( tableName, bucketLength )
-    #MAGIC bucketing
-    selectSQL += " LIMIT %d" % querySize
-    return self._query( selectSQL, conn = connObj )
-
-  def __deleteIndividualForCompactBuckets( self, typeName, bucketsData, connObj = False ):
-    """
-    Delete compacted buckets
+    compactedRange = False
+    retVal = self.__getCompactionWatermarks( typeName )
+    if not retVal[ 'OK' ]:
+      return retVal
+    watermarks = retVal[ 'Value' ]
+    bucketsLength = self.dbBucketsLength[ typeName ]
+    for bPos in range( len( bucketsLength ) - 1 ):
+      secondsLimit = bucketsLength[ bPos ][0]
+      bucketLength = bucketsLength[ bPos ][1]
+      timeLimit = ( nowEpoch - nowEpoch % bucketLength ) - secondsLimit
+      nextBucketLength = bucketsLength[ bPos + 1 ][1]
+      #Buckets of this length older than the watermark have already been compacted
+      if bucketLength in watermarks:
+        firstTime = watermarks[ bucketLength ]
+      else:
+        retVal = self._query( "SELECT MIN( `startTime` ) FROM `%s` WHERE `bucketLength` = %d AND `startTime` < %d" % ( tableName,
+                                                                                                                      bucketLength,
+                                                                                                                      timeLimit ) )
+        if not retVal[ 'OK' ]:
+          return retVal
+        firstTime = retVal[ 'Value' ][0][0]
+        if firstTime is None:
+          firstTime = timeLimit
+      firstTime = int( firstTime )
+      #Slices are aligned to the next bucket length, so the buckets merged into one stay in the same slice
+      sliceLength = max( nextBucketLength, self.__compactionSliceLength - self.__compactionSliceLength % nextBucketLength )
+      sliceStarts = range( firstTime - firstTime % nextBucketLength, timeLimit, sliceLength )
+      self.__setCompactionStatus( typeName, { 'slicesTotal' : len( sliceStarts ) }, increment = True )
+      self.log.info( "[COMPACT] Compacting buckets of %s seconds for %s" % ( bucketLength, typeName ),
+                     "from %s to %s in %d slices" % ( Time.fromEpoch( firstTime ), Time.fromEpoch( timeLimit ),
+                                                      len( sliceStarts ) ) )
+      for sliceStart in sliceStarts:
+        sliceEnd = min( sliceStart + sliceLength, timeLimit )
+        sliceStartTime = time.time()
+        for i in range( max( 1, self.__deadLockRetries ) ):
+          retVal = self.__compactSlice( typeName, bucketLength, nextBucketLength, sliceStart, sliceEnd, nowEpoch )
+          if retVal[ 'OK' ] or retVal[ 'Message' ].find( "try restarting transaction" ) == -1:
+            break
+        if not retVal[ 'OK' ]:
+          self.__rebuildRollupsForRange( typeName, compactedRange )
+          return retVal
+        numCompacted, numWritten, sliceRange = retVal[ 'Value' ]
+        retVal = self.__setCompactionWatermark( typeName, bucketLength, sliceEnd )
+        if not retVal[ 'OK' ]:
+          self.log.error( "[COMPACT] Can't save the compaction watermark", retVal[ 'Message' ] )
+        sliceElapsed = time.time() - sliceStartTime
+        if sliceRange:
+          compactedRange = self.__extendRange( compactedRange, sliceRange[0], sliceRange[1] )
+        gMonitor.addMark( "compactedbuckets", numCompacted )
+        gMonitor.addMark( "compactiontime", sliceElapsed )
+        self.__setCompactionStatus( typeName, { 'slicesDone' : 1, 'bucketsCompacted' : numCompacted,
+                                                'bucketsWritten' : numWritten }, increment = True )
+        if numCompacted:
+          self.log.verbose( "[COMPACT] Compacted %d buckets of %s into %d" % ( numCompacted, typeName, numWritten ),
+                            "from %s to %s (took %.2f secs)" % ( Time.fromEpoch( sliceStart ), Time.fromEpoch( sliceEnd ),
+                                                                 sliceElapsed ) )
+      self.log.info( "[COMPACT] Finished compaction %d of %d for %s" % ( bPos + 1, len( bucketsLength ) - 1, typeName ) )
+    return self.__rebuildRollupsForRange( typeName, compactedRange )
+
+  def __compactSlice( self, typeName, bucketLength, nextBucketLength, sliceStart, sliceEnd, nowEpoch ):
+    """
+    Merge the buckets of bucketLength starting between sliceStart and sliceEnd into buckets of the next length.
+    The buckets are read with FOR UPDATE, deleted and written again merged in one transaction
+    Returns ( buckets compacted, buckets written, time range affected )
     """
     tableName = _getTableName( "bucket", typeName )
     keyFields = self.dbCatalog[ typeName ][ 'keys' ]
-    deleteQueryLimit = 50
-    deletedBuckets = []
-    for bLimit in range( 0, len( bucketsData ) , deleteQueryLimit ):
-      delCondsSQL = []
-      for record in bucketsData[ bLimit : bLimit + deleteQueryLimit ]:
-        condSQL = []
-        for iPos in range( len( keyFields ) ):
-          field = keyFields[ iPos ]
-          condSQL.append( "`%s`.`%s` = %s" % ( tableName, field, record[ iPos ] ) )
-        condSQL.append( "`%s`.`startTime` = %d" % ( tableName, record[-2] ) )
-        condSQL.append( "`%s`.`bucketLength` = %d" % ( tableName, record[-1] ) )
-        delCondsSQL.append( "(%s)" % " AND ".join( condSQL ) )
-      delSQL = "DELETE FROM `%s` WHERE %s" % ( tableName, " OR ".join( delCondsSQL ) )
-      result = self._update( delSQL, conn = connObj )
-      if not result[ 'OK' ]:
-        self.log.error( "Cannot delete individual records for compaction", result[ 'Message' ] )
-      else:
-        deletedBuckets.extend( bucketsData[ bLimit : bLimit + deleteQueryLimit ] )
-    return S_OK( deletedBuckets )
+    sqlSelectList = [ "`%s`" % field for field in keyFields ]
+    for field in self.dbCatalog[ typeName ][ 'values' ] + [ 'entriesInBucket' ]:
+      sqlSelectList.append( "SUM( `%s` )" % field )
+    sqlSelectList.extend( [ "MIN( `startTime` )", "MAX( `startTime` )", "COUNT(*)" ] )
+    sqlCond = "`startTime` >= %d AND `startTime` < %d AND `bucketLength` = %d" % ( sliceStart, sliceEnd, bucketLength )
+    sqlGroupList = [ _bucketizeDataField( "`startTime`", nextBucketLength ) ] + [ "`%s`" % field for field in keyFields ]
+    selectSQL = "SELECT %s FROM `%s` WHERE %s GROUP BY %s FOR UPDATE" % ( ", ".join( sqlSelectList ), tableName, sqlCond,
+                                                                         ", ".join( sqlGroupList ) )
+    retVal = self._getConnection()
+    if not retVal[ 'OK' ]:
+      return retVal
+    connObj = retVal[ 'Value' ]
+    try:
+      retVal = self.__startTransaction( connObj )
+      if not retVal[ 'OK' ]:
+        return retVal
+      retVal = self._query( selectSQL, conn = connObj )
+      if retVal[ 'OK' ]:
+        retVal = self.__mergeSliceBuckets( typeName, bucketLength, retVal[ 'Value' ], sqlCond, nowEpoch, connObj )
+      if retVal[ 'OK' ]:
+        result = self.__commitTransaction( connObj )
+        if result[ 'OK' ]:
+          return retVal
+        retVal = result
+      self.__rollbackTransaction( connObj )
+      return retVal
+    finally:
+      connObj.close()
+
+  def __mergeSliceBuckets( self, typeName, bucketLength, bucketsData, sqlCond, nowEpoch, connObj ):
+    """
+    Replace the buckets of a slice with the merged ones in the transaction opened on connObj
+    """
+    if not bucketsData:
+      return S_OK( ( 0, 0, False ) )
+    tableName = _getTableName( "bucket", typeName )
+    retVal = self._update( "DELETE FROM `%s` WHERE %s" % ( tableName, sqlCond ), conn = connObj, commit = False )
+    if not retVal[ 'OK' ]:
+      return retVal
+    numCompacted = 0
+    sliceRange = False
+    compactedBuckets = {}
+    for record in bucketsData:
+      numCompacted += int( record[-1] )
+      startTime = int( record[-3] )
+      endTime = int( record[-2] ) + bucketLength
+      sliceRange = self.__extendRange( sliceRange, startTime, endTime )
+      for bucketStartTime, bucketLen, keyValues, bucketValues in self.__getRecordBuckets( typeName, startTime, endTime,
+                                                                                          record[:-3], nowEpoch ):
+        bucketKey = ( bucketStartTime, bucketLen, keyValues )
+        if bucketKey in compactedBuckets:
+          summedValues = compactedBuckets[ bucketKey ]
+          for pos in range( len( summedValues ) ):
+            summedValues[ pos ] += bucketValues[ pos ]
+        else:
+          compactedBuckets[ bucketKey ] = bucketValues
+    retVal = self.__addToBucketTable( tableName, typeName, compactedBuckets, connObj, commit = False )
+    if not retVal[ 'OK' ]:
+      self.log.error( "[COMPACT] Error while writing compacted buckets", "for %s: %s" % ( typeName, retVal[ 'Message' ] ) )
+      return retVal
+    return S_OK( ( numCompacted, len( compactedBuckets ), sliceRange ) )
+
+  def __extendRange( self, timeRange, startTime, endTime ):
+    if not timeRange:
+      return ( startTime, endTime )
+    return ( min( timeRange[0], startTime ), max( timeRange[1], endTime ) )
+
+  def __rebuildRollupsForRange( self, typeName, compactedRange ):
+    """
+    Compaction moves data between buckets, so the rollups around the compacted buckets
+    have to be regenerated
+    """
+    if not compactedRange or not self.dbCatalog[ typeName ][ 'rollups' ]:
+      return S_OK()
+    maxBucketLength = self.__getMaxBucketLength( typeName )
+    retVal = self.__rebuildRollups( typeName, int( compactedRange[0] ) - maxBucketLength,
+                                    int( compactedRange[1] ) + maxBucketLength )
+    if not retVal[ 'OK' ]:
+      self.log.error( "[COMPACT] Can't rebuild the rollups", "for %s: %s" % ( typeName, retVal[ 'Message' ] ) )
+    return retVal
 
   def __deleteRecordsOlderThanDataTimespan( self, typeName ):
     """
@@ -1381,8 +2088,11 @@ class AccountingDB( DB ):
     dataTimespan = self.dbCatalog[ typeName ][ 'dataTimespan' ]
     if dataTimespan < 86400 * 30:
       return
-    for table, field in ( ( _getTableName( "type", typeName ), 'endTime' ),
-                          ( _getTableName( "bucket", typeName ), 'startTime + bucketLength' ) ):
+    tablesToPurge = [ ( _getTableName( "type", typeName ), 'endTime' ),
+                      ( _getTableName( "bucket", typeName ), 'startTime + bucketLength' ) ]
+    for rollupLength in self.dbCatalog[ typeName ][ 'rollups' ]:
+      tablesToPurge.append( ( _getRollupTableName( typeName, rollupLength ), 'startTime + bucketLength' ) )
+    for table, field in tablesToPurge:
       self.log.info( "[COMPACT] Deleting old records for table %s" % table )
       deleteLimit = 10000
       deleted = deleteLimit
@@ -1410,6 +2120,8 @@ class AccountingDB( DB ):
       self.log.info( "[REBUCKET] Deleting records older that timespan for type %s" % typeName )
       self.__deleteRecordsOlderThanDataTimespan( typeName )
       self.log.info( "[REBUCKET] Done deleting old records" )
+    #Buckets are written again with the current lengths
+    self.__resetCompactionWatermarks( typeName )
     rawTableName = _getTableName( "type", typeName )
     #retVal = self.__startTransaction( connObj )
     #if not retVal[ 'OK' ]:
@@ -1529,7 +2241,8 @@ class AccountingDB( DB ):
                                                                                                             expectedEnd ) )
     #return self.__commitTransaction( connObj )
     connObj.close()
-    return S_OK()
+    self.log.info( "[REBUCKET] Rebuilding rollups for type %s" % typeName )
+    return self.__rebuildAllRollups( typeName, self.dbCatalog[ typeName ][ 'rollups' ] )
 
 
   def __startTransaction( self, connObj ):
@@ -1544,6 +2257,48 @@ class AccountingDB( DB ):
 def _bucketizeDataField( dataField, bucketLength ):
   return "%s - ( %s %% %s )" % ( dataField, dataField, bucketLength )
 
+def _normalizeKeyValue( keyValue ):
+  """
+  Key values are stored as strings of up to 64 chars
+  """
+  if type( keyValue ) != types.StringType:
+    keyValue = str( keyValue )
+  return keyValue[:64]
+
+def _copyFieldsDef( fieldsDef ):
+  """
+  Copy a ( "%s, %s", [ "field1name", "field2name" ] ) definition. Queries modify the field list
+  """
+  if not fieldsDef:
+    return fieldsDef
+  return ( fieldsDef[0], list( fieldsDef[1] ) )
+
+def _isAdditiveSelection( selectFields, valueFields ):
+  """
+  Check if the values selected are sums of value fields that can be added across buckets,
+  as in "%s, %s, SUM(%s), SUM(%s)-SUM(%s)"
+  """
+  selectParts = selectFields[0].split( "%s" )
+  if len( selectParts ) != len( selectFields[1] ) + 1:
+    return False
+  for iPos in range( len( selectFields[1] ) ):
+    if selectFields[1][ iPos ] not in valueFields:
+      continue
+    if not re.search( r"SUM\(\s*$", selectParts[ iPos ], re.I ) or not re.match( r"^\s*\)", selectParts[ iPos + 1 ] ):
+      return False
+  #No products or ratios between values, only constants
+  selectString = re.sub( r"'[^']*'", "", selectFields[0] )
+  selectString = re.sub( r"(?i)SUM\(\s*%s\s*\)", "X", selectString )
+  if selectString.find( "(" ) > -1 or re.search( r"[*/]\s*[X%]", selectString ):
+    return False
+  return True
+
+def _getRollupTableName( typeName, rollupLength ):
+  """
+  Generate the name of the table of a rollup
+  """
+  return _getTableName( "rollup%s" % rollupLength, typeName )
+
 def _getTableName( tableType, typeName, keyName = None ):
   """
   Generate table name
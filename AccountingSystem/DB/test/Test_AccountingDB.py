@@ -0,0 +1,432 @@
+""" Unit tests of the writes of buckets and rollups and of the key ids cache of the AccountingDB
+
+    The MySQL methods it uses are replaced by in memory tables. One lock stands
+    for the InnoDB row locks: statements in a transaction keep it until COMMIT or
+    ROLLBACK, the rest take it just for the statement.
+"""
+import copy
+import re
+import threading
+import time
+import unittest
+
+from DIRAC import S_OK, S_ERROR, gLogger
+from DIRAC.AccountingSystem.DB.AccountingDB import AccountingDB
+
+DAY = 86400
+HOUR = 3600
+
+class FakeTables:
+  """ Bucket and rollup tables as { table : { ( startTime, bucketLength, keyValues ) : values } } """
+
+  def __init__( self ):
+    self.lock = threading.Lock()
+    self.rows = {}
+    #Name of the table whose next write fails
+    self.failOn = None
+    #Called with each statement once it has been executed
+    self.afterStatement = None
+
+  def getTable( self, tableName ):
+    if tableName not in self.rows:
+      self.rows[ tableName ] = {}
+    return self.rows[ tableName ]
+
+class FakeConnection:
+
+  def __init__( self, tables ):
+    self.tables = tables
+    self.inTransaction = False
+    self.snapshot = None
+
+  def lock( self ):
+    if self.snapshot is None:
+      self.tables.lock.acquire()
+      self.snapshot = copy.deepcopy( self.tables.rows )
+
+  def commit( self ):
+    if self.snapshot is not None:
+      self.snapshot = None
+      self.tables.lock.release()
+
+  def rollback( self ):
+    if self.snapshot is not None:
+      self.tables.rows = self.snapshot
+      self.snapshot = None
+      self.tables.lock.release()
+
+  def close( self ):
+    self.rollback()
+
+class FakeAccountingDB( AccountingDB ):
+  """ AccountingDB for a type with a key, a value, hour buckets and day rollups """
+
+  def __init__( self, tables ):
+    self.log = gLogger.getSubLogger( "FakeAccountingDB" )
+    self.tables = tables
+    self.maxBucketTime = 604800
+    self.dbCatalog = { 'Test' : { 'keys' : [ 'Site' ], 'values' : [ 'CPUTime' ],
+                                  'typeFields' : [ 'Site', 'CPUTime', 'startTime', 'endTime' ],
+                                  'rollups' : [ DAY ] } }
+    self.dbBucketsLength = { 'Test' : [ ( 30 * DAY, HOUR ) ] }
+    self._AccountingDB__deadLockRetries = 2
+    self._AccountingDB__bucketsBufferLock = threading.Lock()
+    self._AccountingDB__bucketsFlushLock = threading.Lock()
+    self._AccountingDB__bucketsBuffer = {}
+    self._AccountingDB__bufferedRecords = 0
+    self.compactionTableName = "ac_catalog_Compaction"
+    self._AccountingDB__compactionSliceLength = DAY
+    self._AccountingDB__compactionStatus = {}
+    self._AccountingDB__compactionStatusLock = threading.Lock()
+
+  def bufferRecord( self, iD, site, cpuTime, startTime ):
+    """ Add a one hour record as __aggregateFromINTable does """
+    self.tables.getTable( "ac_in_Test" )[ iD ] = 1
+    typeBuffer = self._AccountingDB__bucketsBuffer.setdefault( 'Test', { 'records' : [], 'buckets' : {} } )
+    typeBuffer[ 'records' ].append( ( iD, [ site, cpuTime, startTime, startTime + HOUR ], time.time() ) )
+    bucketKey = ( startTime, HOUR, ( site, ) )
+    summedValues = typeBuffer[ 'buckets' ].setdefault( bucketKey, [ 0, 0 ] )
+    summedValues[0] += cpuTime
+    summedValues[1] += 1
+
+  def _getConnection( self ):
+    return S_OK( FakeConnection( self.tables ) )
+
+  def __execute( self, cmd, conn, commit, function ):
+    if conn and conn.inTransaction:
+      conn.lock()
+      try:
+        result = function()
+      finally:
+        if commit:
+          conn.commit()
+    else:
+      self.tables.lock.acquire()
+      try:
+        result = function()
+      finally:
+        self.tables.lock.release()
+    if self.tables.afterStatement:
+      self.tables.afterStatement( cmd )
+    return result
+
+  def _query( self, cmd, conn = None, debug = False ):
+    if cmd == "START TRANSACTION":
+      conn.inTransaction = True
+      return S_OK( () )
+    if cmd in ( "COMMIT", "ROLLBACK" ):
+      if cmd == "COMMIT":
+        conn.commit()
+      else:
+        conn.rollback()
+      conn.inTransaction = False
+      return S_OK( () )
+    if cmd.find( "GET_LOCK" ) > -1 or cmd.find( "RELEASE_LOCK" ) > -1:
+      return S_OK( ( ( 1, ), ) )
+    if cmd.find( self.compactionTableName ) > -1:
+      watermarks = self.tables.getTable( self.compactionTableName )
+      return S_OK( tuple( [ ( bucketLength, watermarks[ ( typeName, bucketLength ) ] ) for typeName, bucketLength in watermarks ] ) )
+    match = re.match( "SELECT MIN\( `startTime` \) FROM `ac_bucket_Test` WHERE `bucketLength` = (\d+) AND `startTime` < (\d+)$", cmd )
+    if match:
+      startTimes = [ bucketKey[0] for bucketKey in self.tables.getTable( "ac_bucket_Test" )
+                     if bucketKey[1] == int( match.group( 1 ) ) and bucketKey[0] < int( match.group( 2 ) ) ]
+      return S_OK( ( ( startTimes and min( startTimes ) or None, ), ) )
+    if cmd.find( "GROUP BY" ) > -1:
+      return self.__execute( cmd, conn, False, lambda: self.__selectSliceBuckets( cmd ) )
+    if cmd.find( "FOR UPDATE" ) > -1:
+      return self.__execute( cmd, conn, False, lambda: self.__selectBuckets( cmd ) )
+    return self.__selectBuckets( cmd )
+
+  def __selectBuckets( self, cmd ):
+    ranges = [ ( int( start ), int( end ) ) for start, end in re.findall( "`startTime` >= (\d+) AND `startTime` < (\d+)", cmd ) ]
+    windowStart, windowEnd = ranges[0]
+    rows = []
+    for bucketKey, bucketValues in self.tables.getTable( "ac_bucket_Test" ).items():
+      startTime, bucketLength, keyValues = bucketKey
+      if windowStart <= startTime < windowEnd or \
+         ( ranges[1][0] <= startTime < ranges[1][1] and startTime + bucketLength > windowStart ):
+        rows.append( tuple( keyValues ) + tuple( bucketValues ) + ( startTime, bucketLength ) )
+    return S_OK( tuple( rows ) )
+
+  def __selectSliceBuckets( self, cmd ):
+    match = re.search( "`startTime` >= (\d+) AND `startTime` < (\d+) AND `bucketLength` = (\d+) GROUP BY `startTime` - \( `startTime` % (\d+) \)", cmd )
+    sliceStart, sliceEnd, bucketLength, nextBucketLength = [ int( value ) for value in match.groups() ]
+    groups = {}
+    for bucketKey, bucketValues in self.tables.getTable( "ac_bucket_Test" ).items():
+      startTime, bLength, keyValues = bucketKey
+      if bLength != bucketLength or not sliceStart <= startTime < sliceEnd:
+        continue
+      group = groups.setdefault( ( startTime - startTime % nextBucketLength, keyValues ), [ 0, 0, startTime, startTime, 0 ] )
+      group[0] += bucketValues[0]
+      group[1] += bucketValues[1]
+      group[2] = min( group[2], startTime )
+      group[3] = max( group[3], startTime )
+      group[4] += 1
+    return S_OK( tuple( [ groupKey[1] + tuple( groups[ groupKey ] ) for groupKey in sorted( groups ) ] ) )
+
+  def _update( self, cmd, conn = None, debug = False, commit = True ):
+    return self.__execute( cmd, conn, commit, lambda: self.__update( cmd ) )
+
+  def __update( self, cmd ):
+    match = re.match( "DELETE FROM `(\w+)` WHERE `startTime` >= (\d+) AND `startTime` < (\d+)( AND `bucketLength` = (\d+))?$", cmd )
+    if match:
+      table = self.tables.getTable( match.group( 1 ) )
+      for bucketKey in table.keys():
+        if match.group( 5 ) and bucketKey[1] != int( match.group( 5 ) ):
+          continue
+        if int( match.group( 2 ) ) <= bucketKey[0] < int( match.group( 3 ) ):
+          del( table[ bucketKey ] )
+      return S_OK( 0 )
+    match = re.match( "(DELETE FROM|UPDATE) `ac_in_Test`.* WHERE id in \((.*)\)$", cmd )
+    if match:
+      table = self.tables.getTable( "ac_in_Test" )
+      for iD in match.group( 2 ).split( ", " ):
+        if match.group( 1 ) == "UPDATE":
+          table[ int( iD ) ] = 0
+        else:
+          del( table[ int( iD ) ] )
+      return S_OK( 0 )
+    return S_ERROR( "Unexpected statement %s" % cmd )
+
+  def insertMany( self, tableName, inFields, valuesList, conn = None, ignore = False, commit = True ):
+    def insert():
+      self.tables.rows.setdefault( tableName, [] ).extend( valuesList )
+      return S_OK( len( valuesList ) )
+    return self.__execute( "INSERT INTO %s" % tableName, conn, commit, insert )
+
+  def upsertMany( self, tableName, inFields, valuesList, updateFields = None, conn = None,
+                  incrementFields = None, commit = True ):
+    def upsert():
+      if self.tables.failOn == tableName:
+        self.tables.failOn = None
+        return S_ERROR( "Lost connection to MySQL server during query" )
+      table = self.tables.getTable( tableName )
+      if tableName == self.compactionTableName:
+        for typeName, bucketLength, watermark in valuesList:
+          table[ ( typeName, bucketLength ) ] = watermark
+        return S_OK( len( valuesList ) )
+      for row in valuesList:
+        bucketKey = ( row[0], row[1], tuple( row[ 2 : 3 ] ) )
+        summedValues = table.setdefault( bucketKey, [ 0, 0 ] )
+        for pos in range( 2 ):
+          summedValues[ pos ] += row[ 3 + pos ]
+      return S_OK( len( valuesList ) )
+    return self.__execute( "INSERT INTO %s" % tableName, conn, commit, upsert )
+
+class FakeKeysAccountingDB( FakeAccountingDB ):
+  """ AccountingDB with a key table where values equal ignoring case and trailing spaces share the id """
+
+  def __init__( self, tables, keysCacheSize = 10 ):
+    FakeAccountingDB.__init__( self, tables )
+    self._AccountingDB__keysCache = {}
+    self._AccountingDB__keysCacheSize = keysCacheSize
+    self.keyQueries = []
+
+  def __getKeyTable( self ):
+    return self.tables.getTable( "ac_key_Test_Site" )
+
+  def _escapeValues( self, inValues = None ):
+    return S_OK( [ "'%s'" % value for value in inValues ] )
+
+  def _query( self, cmd, conn = None, debug = False ):
+    if cmd.find( "ac_key_Test_Site" ) == -1:
+      return FakeAccountingDB._query( self, cmd, conn, debug )
+    self.keyQueries.append( cmd )
+    keyTable = self.__getKeyTable()
+    match = re.search( "ORDER BY `id` DESC LIMIT (\d+)", cmd )
+    if match:
+      rows = sorted( keyTable.values(), reverse = True )
+      return S_OK( tuple( rows[ :int( match.group( 1 ) ) ] ) )
+    values = re.search( "in \( (.*) \)", cmd ).group( 1 )[ 1:-1 ].split( "', '" )
+    rows = [ keyTable[ value.lower().rstrip( " " ) ] for value in values if value.lower().rstrip( " " ) in keyTable ]
+    return S_OK( tuple( rows ) )
+
+  def insertMany( self, tableName, inFields, valuesList, conn = None, ignore = False, commit = True ):
+    if tableName != "ac_key_Test_Site":
+      return FakeAccountingDB.insertMany( self, tableName, inFields, valuesList, conn, ignore, commit )
+    self.keyQueries.append( "INSERT" )
+    keyTable = self.__getKeyTable()
+    for row in valuesList:
+      if row[0].lower().rstrip( " " ) not in keyTable:
+        keyTable[ row[0].lower().rstrip( " " ) ] = ( len( keyTable ) + 1, row[0] )
+    return S_OK( len( valuesList ) )
+
+  def addKeyValue( self, keyValue ):
+    return self._AccountingDB__addKeyValue( 'Test', 'Site', keyValue )
+
+class KeysCacheTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.tables = FakeTables()
+    self.db = FakeKeysAccountingDB( self.tables )
+
+  def test_bulkLookup( self ):
+    self.db.addKeyValue( "CERN" )
+    self.db.keyQueries = []
+    records = [ ( iD, 'Test', 0, 0, [ site, 1 ], 0 ) for iD, site in enumerate( [ "CERN", "PIC", "RAL", "ral ", "PIC" ] ) ]
+    self.db._AccountingDB__cacheKeyIdsForRecords( records )
+    #Lookup, insertion and lookup of the new values
+    self.assertEqual( len( self.db.keyQueries ), 3 )
+    self.assertEqual( self.db.keyQueries[1], "INSERT" )
+    self.db.keyQueries = []
+    ids = [ self.db.addKeyValue( site )[ 'Value' ] for site in [ "CERN", "PIC", "RAL", "ral " ] ]
+    self.assertEqual( self.db.keyQueries, [] )
+    self.assertEqual( ids[0], 1 )
+    self.assertEqual( ids[2], ids[3] )
+    self.assertEqual( sorted( set( ids ) ), [ 1, 2, 3 ] )
+
+  def test_sharedKeyTable( self ):
+    #Two DataStores adding the same value get the same id
+    otherDB = FakeKeysAccountingDB( self.tables )
+    self.assertEqual( self.db.addKeyValue( "CERN" )[ 'Value' ], 1 )
+    self.assertEqual( otherDB.addKeyValue( "cern" )[ 'Value' ], 1 )
+    self.assertEqual( otherDB.keyQueries[0].find( "SELECT" ), 0 )
+    self.assertEqual( len( otherDB.keyQueries ), 1 )
+
+  def test_bounded( self ):
+    self.db = FakeKeysAccountingDB( self.tables, keysCacheSize = 2 )
+    for site in [ "CERN", "PIC", "RAL" ]:
+      self.db.addKeyValue( site )
+    self.db.keyQueries = []
+    self.assertEqual( self.db.addKeyValue( "RAL" )[ 'Value' ], 3 )
+    self.assertEqual( self.db.keyQueries, [] )
+    #Evicted, looked up again
+    self.assertEqual( self.db.addKeyValue( "CERN" )[ 'Value' ], 1 )
+    self.assertEqual( len( self.db.keyQueries ), 1 )
+
+  def test_preload( self ):
+    for site in [ "CERN", "PIC", "RAL" ]:
+      self.db.addKeyValue( site )
+    otherDB = FakeKeysAccountingDB( self.tables, keysCacheSize = 2 )
+    otherDB._AccountingDB__preloadKeysCache()
+    otherDB.keyQueries = []
+    self.assertEqual( [ otherDB.addKeyValue( site )[ 'Value' ] for site in [ "PIC", "RAL" ] ], [ 2, 3 ] )
+    self.assertEqual( otherDB.keyQueries, [] )
+
+class AccountingDBTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.tables = FakeTables()
+    self.db = FakeAccountingDB( self.tables )
+    self.dayStart = 100 * DAY
+
+  def getTotals( self, tableName ):
+    totals = {}
+    for bucketKey, bucketValues in self.tables.getTable( tableName ).items():
+      dayStart = bucketKey[0] - bucketKey[0] % DAY
+      if dayStart in totals:
+        totals[ dayStart ] = [ totals[ dayStart ][ pos ] + bucketValues[ pos ] for pos in range( 2 ) ]
+      else:
+        totals[ dayStart ] = list( bucketValues )
+    return totals
+
+  def test_failedFlushRolledBack( self ):
+    self.db.bufferRecord( 1, 1, 10, self.dayStart )
+    self.db.bufferRecord( 2, 1, 20, self.dayStart + HOUR )
+    #Fails after the buckets have been written
+    self.tables.failOn = "ac_rollup86400_Test"
+    self.db.flushBuckets()
+    self.assertEqual( self.tables.getTable( "ac_bucket_Test" ), {} )
+    self.failIf( self.tables.rows.get( "ac_type_Test" ) )
+    self.assertEqual( self.tables.getTable( "ac_in_Test" ), { 1 : 0, 2 : 0 } )
+    #Picked up again from the IN table
+    self.db.bufferRecord( 1, 1, 10, self.dayStart )
+    self.db.bufferRecord( 2, 1, 20, self.dayStart + HOUR )
+    self.assert_( self.db.flushBuckets()[ 'OK' ] )
+    self.assertEqual( self.getTotals( "ac_bucket_Test" ), { self.dayStart : [ 30, 2 ] } )
+    self.assertEqual( self.getTotals( "ac_rollup86400_Test" ), { self.dayStart : [ 30, 2 ] } )
+    self.assertEqual( len( self.tables.rows[ "ac_type_Test" ] ), 2 )
+    self.assertEqual( self.tables.getTable( "ac_in_Test" ), {} )
+
+  def test_insertDuringRebuild( self ):
+    self.db.bufferRecord( 1, 1, 10, self.dayStart )
+    self.db.flushBuckets()
+    #Stop the rebuild after its first statement and add a record to the same day meanwhile
+    paused = threading.Event()
+    resume = threading.Event()
+    rebuildThread = threading.Thread( target = self.db._AccountingDB__rebuildRollups,
+                                      args = ( 'Test', self.dayStart, self.dayStart + HOUR ) )
+    def pause( cmd ):
+      if threading.currentThread() is rebuildThread and not paused.isSet():
+        paused.set()
+        resume.wait()
+    self.tables.afterStatement = pause
+    rebuildThread.start()
+    paused.wait()
+    self.db.bufferRecord( 2, 1, 20, self.dayStart + HOUR )
+    flushThread = threading.Thread( target = self.db.flushBuckets )
+    flushThread.start()
+    flushThread.join( 0.2 )
+    resume.set()
+    rebuildThread.join()
+    flushThread.join()
+    self.assertEqual( self.getTotals( "ac_bucket_Test" ), { self.dayStart : [ 30, 2 ] } )
+    self.assertEqual( self.getTotals( "ac_rollup86400_Test" ), { self.dayStart : [ 30, 2 ] } )
+
+  def test_rebuild( self ):
+    self.db.bufferRecord( 1, 1, 10, self.dayStart )
+    self.db.bufferRecord( 2, 2, 20, self.dayStart + DAY - HOUR )
+    self.db.flushBuckets()
+    rollups = copy.deepcopy( self.tables.getTable( "ac_rollup86400_Test" ) )
+    self.tables.getTable( "ac_rollup86400_Test" )[ ( self.dayStart, DAY, ( 1, ) ) ] = [ 1000, 5 ]
+    self.assert_( self.db._AccountingDB__rebuildRollups( 'Test', self.dayStart, self.dayStart + DAY )[ 'OK' ] )
+    self.assertEqual( self.tables.getTable( "ac_rollup86400_Test" ), rollups )
+
+  def __bufferForCompaction( self ):
+    #Buckets of an hour become day buckets 2 days after
+    self.db.dbBucketsLength[ 'Test' ] = [ ( 2 * DAY, HOUR ), ( 3650 * DAY, DAY ) ]
+    self.db.bufferRecord( 1, 1, 10, self.dayStart )
+    self.db.bufferRecord( 2, 1, 20, self.dayStart + HOUR )
+    self.db.bufferRecord( 3, 1, 30, self.dayStart + 5 * HOUR )
+    self.db.bufferRecord( 4, 2, 5, self.dayStart + DAY )
+    self.db.bufferRecord( 5, 2, 7, self.dayStart + 9 * DAY + 3 * HOUR )
+    self.db.flushBuckets()
+    return self.dayStart + 10 * DAY
+
+  def test_compaction( self ):
+    nowEpoch = self.__bufferForCompaction()
+    rollups = copy.deepcopy( self.tables.getTable( "ac_rollup86400_Test" ) )
+    self.assert_( self.db._AccountingDB__compactBucketsForType( 'Test', nowEpoch )[ 'OK' ] )
+    self.assertEqual( self.tables.getTable( "ac_bucket_Test" ),
+                      { ( self.dayStart, DAY, ( 1, ) ) : [ 60, 3 ],
+                        ( self.dayStart + DAY, DAY, ( 2, ) ) : [ 5, 1 ],
+                        ( self.dayStart + 9 * DAY + 3 * HOUR, HOUR, ( 2, ) ) : [ 7, 1 ] } )
+    self.assertEqual( self.tables.getTable( "ac_rollup86400_Test" ), rollups )
+    self.assertEqual( self.tables.getTable( "ac_catalog_Compaction" ), { ( 'Test', HOUR ) : nowEpoch - 2 * DAY } )
+    status = self.db.getCompactionStatus()[ 'Value' ][ 'Test' ]
+    self.assertEqual( ( status[ 'bucketsCompacted' ], status[ 'bucketsWritten' ] ), ( 4, 2 ) )
+    #Starts from the watermark
+    self.assert_( self.db._AccountingDB__compactBucketsForType( 'Test', nowEpoch + DAY )[ 'OK' ] )
+    self.assertEqual( self.tables.getTable( "ac_catalog_Compaction" ), { ( 'Test', HOUR ) : nowEpoch - DAY } )
+    self.assertEqual( len( self.tables.getTable( "ac_bucket_Test" ) ), 3 )
+
+  def test_failedCompactionRolledBack( self ):
+    nowEpoch = self.__bufferForCompaction()
+    buckets = copy.deepcopy( self.tables.getTable( "ac_bucket_Test" ) )
+    #Fails after the buckets of the slice have been deleted
+    self.tables.failOn = "ac_bucket_Test"
+    self.failIf( self.db._AccountingDB__compactBucketsForType( 'Test', nowEpoch )[ 'OK' ] )
+    self.assertEqual( self.tables.getTable( "ac_bucket_Test" ), buckets )
+    self.assertEqual( self.tables.getTable( "ac_catalog_Compaction" ), {} )
+    self.assert_( self.db._AccountingDB__compactBucketsForType( 'Test', nowEpoch )[ 'OK' ] )
+    self.assertEqual( self.getTotals( "ac_bucket_Test" ), { self.dayStart : [ 60, 3 ], self.dayStart + DAY : [ 5, 1 ],
+                                                           self.dayStart + 9 * DAY : [ 7, 1 ] } )
+
+  def test_monthPlotRollup( self ):
+    #Bucket lengths of the Job type, month long plots have a granularity of 4 hours
+    self.db.dbBucketsLength[ 'Test' ] = [ ( 8 * DAY, HOUR ), ( 35 * DAY, 4 * HOUR ), ( 180 * DAY, DAY ) ]
+    self.db._AccountingDB__getReadyRollups = lambda typeName: self.db.dbCatalog[ typeName ][ 'rollups' ]
+    nowEpoch = 1000 * DAY + 5 * HOUR
+    startTime = nowEpoch - 30 * DAY
+    startTime -= startTime % ( 4 * HOUR )
+    query = ( 'Test', startTime, nowEpoch, ( "%s, %s, SUM(%s)", [ 'Site', 'startTime', 'CPUTime' ] ),
+              ( "%s, %s", [ 'startTime', 'Site' ] ), ( "%s", [ 'startTime' ] ), 4 * HOUR, nowEpoch )
+    self.db.dbCatalog[ 'Test' ][ 'rollups' ] = [ DAY, 7 * DAY ]
+    self.assertEqual( self.db._AccountingDB__getRollupForQuery( *query ), 0 )
+    self.db.dbCatalog[ 'Test' ][ 'rollups' ] = [ 4 * HOUR, DAY, 7 * DAY ]
+    self.assertEqual( self.db._AccountingDB__getRollupForQuery( *query ), 4 * HOUR )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( AccountingDBTestCase )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( KeysCacheTestCase ) )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -13,6 +13,8 @@ def initializeDataStoreHandler( serviceInfo ):
   global gAccountingDB
   gAccountingDB = AccountingDB()
   gAccountingDB.autoCompactDB()
+  if gConfig.getValue( "%s/AggregateBuckets" % serviceInfo[ 'serviceSectionPath' ], True ):
+    gAccountingDB.enableBucketsAggregation( gConfig.getValue( "%s/BucketsAggregationPeriod" % serviceInfo[ 'serviceSectionPath' ], 10 ) )
   result = gAccountingDB.markAllPendingRecordsAsNotTaken()
   if not result[ 'OK' ]:
     return result
@@ -145,6 +147,13 @@ class DataStoreHandler( RequestHandler ):
     """
     return gAccountingDB.compactBuckets()
 
+  types_getCompactionStatus = []
+  def export_getCompactionStatus( self ):
+    """
+    Get the progress and timing of the last compaction of each type
+    """
+    return gAccountingDB.getCompactionStatus()
+
   types_remove = [ types.StringType, Time._dateTimeType, Time._dateTimeType, types.ListType ]
   def export_remove( self, typeName, startTime, endTime, valuesList ):
     """
@@ -1,5 +1,13 @@
 import types
 from DIRAC.Core.Utilities import Time
+#NumPy is only needed for speed. Without it the data is transformed with plain loops
+try:
+  from DIRAC.AccountingSystem.private import TimeSeries
+except ImportError:
+  TimeSeries = False
+
+#Below this number of values the loops are faster than converting to arrays
+MIN_VALUES_FOR_ARRAYS = 64
 
 class DBUtils:
 
@@ -14,7 +22,8 @@ class DBUtils:
                              selectFields,
                              condDict = None,
                              groupFields = None,
-                             orderFields = None ):
+                             orderFields = None,
+                             granularity = 0 ):
     """
     Get data from the DB
     Parameters:
@@ -29,6 +38,7 @@ class DBUtils:
                        ( "%s, %s", ( "field1name", "field2name", "field3name" ) )
       - orderFields -> list of fields to order by, can be in form
                        ( "%s, %s", ( "field1name", "field2name", "field3name" )
+      - granularity -> length of the bins the data will be summed in, if any
     """
     typeName = "%s_%s" % ( self._setup, typeName )
     validCondDict = {}
@@ -40,7 +50,8 @@ class DBUtils:
     if not retVal[ 'OK' ]:
       return retVal
     connObj = retVal[ 'Value' ]
-    return self._acDB.retrieveBucketedData( typeName, startTime, endTime, selectFields, condDict, groupFields, orderFields, connObj = connObj )
+    return self._acDB.retrieveBucketedData( typeName, startTime, endTime, selectFields, condDict, groupFields, orderFields,
+                                            connObj = connObj, granularity = granularity )
 
   def _getUniqueValues( self, typeName, startTime, endTime, condDict, fieldList ):
     stringList = [ "%s" for field in fieldList ]
@@ -78,6 +89,19 @@ class DBUtils:
     typeName = "%s_%s" % ( self._setup, typeName )
     return self._acDB.calculateBucketLengthForTime( typeName, nowEpoch, momentEpoch )
 
+  def _getTimeSeriesArray( self, dataDict ):
+    """
+    Get the data as a TimeSeriesArray if it's worth it, False otherwise
+      - dataDict = { 'key' : { time1 : value,  time2 : value... }, 'key2'.. }
+    """
+    if not TimeSeries or sum( [ len( dataDict[ key ] ) for key in dataDict ] ) < MIN_VALUES_FOR_ARRAYS:
+      return False
+    try:
+      return TimeSeries.TimeSeriesArray( dataDict )
+    except ( TypeError, ValueError ):
+      #Non numerical values
+      return False
+
   def _spanToGranularity( self, granularity, bucketsData ):
     """
     bucketsData must be a list of lists where each list contains
@@ -85,6 +109,8 @@ class DBUtils:
       - field 1: bucketLength
       - fields 2-n: numericalFields
     """
+    if TimeSeries and len( bucketsData ) >= MIN_VALUES_FOR_ARRAYS:
+      return TimeSeries.spanToGranularity( granularity, { 0 : bucketsData } )[ 0 ]
     normData = {}
 
     def addToNormData( bucketDate, data, proportion = 1.0 ):
@@ -145,6 +171,22 @@ class DBUtils:
       del( normData[ bDate ][-1] )
     return normData
 
+  def _convertToGranularity( self, granularity, dataDict, conversion ):
+    """
+    Sum or average in place the buckets of all the keys in bins of granularity seconds
+      - dataDict = { 'key' : bucketsData, 'key2'.. } where bucketsData is as in _sumToGranularity
+      - conversion : "sum" or "average"
+    """
+    if TimeSeries and sum( [ len( dataDict[ key ] ) for key in dataDict ] ) >= MIN_VALUES_FOR_ARRAYS:
+      dataDict.update( TimeSeries.convertToGranularity( granularity, dataDict, conversion ) )
+      return dataDict
+    for key in dataDict:
+      if conversion == "average":
+        dataDict[ key ] = self._averageToGranularity( granularity, dataDict[ key ] )
+      else:
+        dataDict[ key ] = self._sumToGranularity( granularity, dataDict[ key ] )
+    return dataDict
+
   def _convertNoneToZero( self, bucketsData ):
     """
     Convert None to 0
@@ -1,74 +1,401 @@
 # $HeadURL$
+""" Cache of report data and plots for the ReportGenerator
+
+    Reports are kept in bounded LRU caches in memory and in a ReportStore on disk
+    that survives restarts. Their lifetime depends on how old the end of the report
+    is: reports ending now change with every new record, old ones rarely do.
+"""
 __RCSID__ = "$Id$"
 
 import os
 import os.path
 import time
 import threading
+try:
+  import hashlib as md5
+except:
+  import md5
 
 from DIRAC import S_OK, S_ERROR, gLogger, rootPath, gConfig
-from DIRAC.Core.Utilities import DictCache
+from DIRAC.Core.Utilities import DictCache, DEncode
+from DIRAC.ConfigurationSystem.Client.PathFinder import getServiceSection
+
+#Reports are kept for this fraction of the time since their end time
+AGE_LIFETIME_FACTOR = 0.25
+
+class ReportStore:
+  """
+  Report data and plots on disk indexed by report hash. Report data files are named after
+  the hash of their contents so identical data is stored only once. Files are deleted
+  when no report uses them. The index is written periodically and loaded at start
+  """
+
+  def __init__( self, location, maxSize, removeCallback = False ):
+    self.__location = location
+    self.__dataLocation = os.path.join( location, "reportData" )
+    self.__indexFile = os.path.join( location, "reports.index" )
+    self.__maxSize = maxSize
+    self.__lock = threading.Lock()
+    #( kind, reportHash ) -> [ reference, expiration, last access ]
+    self.__index = {}
+    #File path -> [ number of entries using it, size ]
+    self.__files = {}
+    self.__totalSize = 0
+    self.__dirty = False
+    #Called with ( kind, reportHash ) for each entry removed, out of the lock
+    self.__removeCallback = removeCallback
+    self.__removedKeys = []
+    self.log = gLogger.getSubLogger( "ReportStore" )
+
+  def load( self ):
+    """
+    Load the index and delete the files not in it
+    """
+    try:
+      os.makedirs( self.__dataLocation )
+    except OSError:
+      pass
+    index = {}
+    if os.path.isfile( self.__indexFile ):
+      try:
+        fd = file( self.__indexFile, "rb" )
+        try:
+          indexData = DEncode.decode( fd.read() )[0]
+        finally:
+          fd.close()
+        if indexData.get( 'version' ) == 1:
+          index = indexData[ 'entries' ]
+      except Exception, e:
+        self.log.error( "Can't load the index of cached reports", str( e ) )
+    now = time.time()
+    self.__lock.acquire()
+    try:
+      for indexKey in index:
+        entry = index[ indexKey ]
+        filePaths = self.__getEntryFiles( indexKey[0], entry[0] )
+        if entry[1] <= now or [ filePath for filePath in filePaths if not os.path.isfile( filePath ) ]:
+          continue
+        self.__index[ indexKey ] = entry
+        self.__addFileRefs( filePaths )
+      self.log.info( "Loaded %d cached reports using %.1f MB" % ( len( self.__index ), self.__totalSize / 1048576.0 ) )
+      #Files of reports not in the index are orphans
+      for directory, isCached in ( ( self.__location, lambda fileName: fileName.find( ".png" ) > 0 ),
+                                   ( self.__dataLocation, lambda fileName: True ) ):
+        for fileName in os.listdir( directory ):
+          filePath = os.path.join( directory, fileName )
+          if isCached( fileName ) and filePath not in self.__files and os.path.isfile( filePath ):
+            self.log.verbose( "Purging %s" % filePath )
+            os.unlink( filePath )
+      self.__dirty = True
+    finally:
+      self.__lock.release()
+    return self.flush()
+
+  def flush( self ):
+    """
+    Write the index if it has changed
+    """
+    self.__lock.acquire()
+    try:
+      if not self.__dirty:
+        return S_OK()
+      indexData = DEncode.encode( { 'version' : 1, 'entries' : self.__index } )
+      self.__dirty = False
+    finally:
+      self.__lock.release()
+    try:
+      self.__writeFile( self.__indexFile, indexData )
+    except Exception, e:
+      self.__dirty = True
+      return S_ERROR( "Can't write the index of cached reports: %s" % str( e ) )
+    return S_OK()
+
+  def __writeFile( self, filePath, data ):
+    #Write and rename so readers never see partial files
+    tmpPath = "%s.%s.tmp" % ( filePath, threading.currentThread().getName() )
+    fd = file( tmpPath, "wb" )
+    try:
+      fd.write( data )
+    finally:
+      fd.close()
+    os.rename( tmpPath, filePath )
+
+  def __notifyRemoved( self ):
+    self.__lock.acquire()
+    try:
+      removedKeys = self.__removedKeys
+      self.__removedKeys = []
+    finally:
+      self.__lock.release()
+    if not self.__removeCallback:
+      return
+    for kind, reportHash in removedKeys:
+      try:
+        self.__removeCallback( kind, reportHash )
+      except Exception, e:
+        self.log.exception( "Exception while forgetting removed report %s" % reportHash, lException = e )
+
+  def __getEntryFiles( self, kind, reference ):
+    if kind == "data":
+      return [ os.path.join( self.__dataLocation, "%s.data" % reference ) ]
+    return [ os.path.join( self.__location, str( fileName ) ) for fileName in reference.values() if fileName ]
+
+  #Lock has to be held
+
+  def __addFileRefs( self, filePaths ):
+    for filePath in filePaths:
+      if filePath in self.__files:
+        self.__files[ filePath ][0] += 1
+      else:
+        try:
+          fileSize = os.path.getsize( filePath )
+        except OSError:
+          fileSize = 0
+        self.__files[ filePath ] = [ 1, fileSize ]
+        self.__totalSize += fileSize
+
+  def __removeEntry( self, indexKey ):
+    entry = self.__index.pop( indexKey )
+    self.__dirty = True
+    if self.__removeCallback:
+      self.__removedKeys.append( indexKey )
+    for filePath in self.__getEntryFiles( indexKey[0], entry[0] ):
+      fileInfo = self.__files.get( filePath )
+      if not fileInfo:
+        continue
+      fileInfo[0] -= 1
+      if fileInfo[0] > 0:
+        continue
+      self.__files.pop( filePath, None )
+      self.__totalSize -= fileInfo[1]
+      try:
+        os.unlink( filePath )
+      except OSError:
+        pass
+
+  def __evict( self ):
+    if self.__totalSize <= self.__maxSize:
+      return
+    #Least recently used first, down to 90% of the maximum to evict in batches
+    lruKeys = sorted( self.__index, key = lambda indexKey: self.__index[ indexKey ][2] )
+    for indexKey in lruKeys:
+      if self.__totalSize <= self.__maxSize * 0.9:
+        break
+      self.__removeEntry( indexKey )
+
+  def put( self, kind, reportHash, value, expiration ):
+    """
+    Store report data or a plot dict whose files are already in the store location
+      - kind : "data" or "plot"
+    """
+    if kind == "data":
+      try:
+        data = DEncode.encode( value )
+      except Exception, e:
+        return S_ERROR( "Can't encode report data: %s" % str( e ) )
+      reference = md5.md5( data ).hexdigest()
+      dataPath = self.__getEntryFiles( kind, reference )[0]
+      try:
+        if not os.path.isfile( dataPath ):
+          self.__writeFile( dataPath, data )
+      except Exception, e:
+        return S_ERROR( "Can't write report data: %s" % str( e ) )
+    else:
+      #Only the file names, callers keep using and changing their plot dicts
+      reference = dict( [ ( key, value.get( key ) ) for key in ( 'plot', 'thumbnail' ) ] )
+    indexKey = ( kind, reportHash )
+    self.__lock.acquire()
+    try:
+      #Files of the new entry are referenced before releasing the old one, they can be the same
+      self.__addFileRefs( self.__getEntryFiles( kind, reference ) )
+      if indexKey in self.__index:
+        self.__removeEntry( indexKey )
+      self.__index[ indexKey ] = [ reference, expiration, time.time() ]
+      self.__dirty = True
+      self.__evict()
+    finally:
+      self.__lock.release()
+    self.__notifyRemoved()
+    return S_OK()
+
+  def get( self, kind, reportHash ):
+    """
+    Get a stored report as ( expiration, value ). False if it's not there
+    """
+    indexKey = ( kind, reportHash )
+    self.__lock.acquire()
+    try:
+      entry = self.__index.get( indexKey )
+      if entry and entry[1] <= time.time():
+        self.__removeEntry( indexKey )
+        entry = None
+      if entry:
+        entry[2] = time.time()
+        self.__dirty = True
+        reference, expiration = entry[0], entry[1]
+    finally:
+      self.__lock.release()
+    if not entry:
+      self.__notifyRemoved()
+      return S_OK( False )
+    if kind != "data":
+      return S_OK( ( expiration, dict( reference ) ) )
+    try:
+      fd = file( self.__getEntryFiles( kind, reference )[0], "rb" )
+      try:
+        value = DEncode.decode( fd.read() )[0]
+      finally:
+        fd.close()
+    except Exception, e:
+      self.log.error( "Can't read cached report data", "%s: %s" % ( reportHash, str( e ) ) )
+      self.__lock.acquire()
+      try:
+        if indexKey in self.__index:
+          self.__removeEntry( indexKey )
+      finally:
+        self.__lock.release()
+      self.__notifyRemoved()
+      return S_OK( False )
+    return S_OK( ( expiration, value ) )
 
+  def purgeExpired( self ):
+    self.__lock.acquire()
+    try:
+      now = time.time()
+      for indexKey in [ indexKey for indexKey in self.__index if self.__index[ indexKey ][1] <= now ]:
+        self.__removeEntry( indexKey )
+    finally:
+      self.__lock.release()
+    self.__notifyRemoved()
+
+  def getStats( self ):
+    self.__lock.acquire()
+    try:
+      return { 'entries' : len( self.__index ), 'files' : len( self.__files ),
+               'size' : self.__totalSize, 'maxSize' : self.__maxSize }
+    finally:
+      self.__lock.release()
 
 class DataCache:
 
   def __init__( self ):
     self.graphsLocation = os.path.join( gConfig.getValue( '/LocalSite/InstancePath', rootPath ), 'data', 'accountingPlots' )
-    self.cachedGraphs = {}
     self.alive = True
     self.purgeThread = threading.Thread( target = self.purgeExpired )
     self.purgeThread.setDaemon( 1 )
     self.purgeThread.start()
-    self.__dataCache = DictCache()
-    self.__graphCache = DictCache( deleteFunction = self._deleteGraph )
-    self.__dataLifeTime = 600
-    self.__graphLifeTime = 3600
+    self.__dataCache = DictCache( maxSize = 2000 )
+    self.__graphCache = DictCache( maxSize = 5000 )
+    self.__store = False
+    self.__minLifeTime = 300
+    self.__maxLifeTime = 86400
 
   def setGraphsLocation( self, graphsDir ):
+    """
+    Set where plots are written and load the reports cached there
+    """
     self.graphsLocation = graphsDir
-    for graphName in os.listdir( self.graphsLocation ):
-      if graphName.find( ".png" ) > 0:
-        graphLocation = "%s/%s" % ( self.graphsLocation, graphName )
-        gLogger.verbose( "Purging %s" % graphLocation )
-        os.unlink( graphLocation )
+    csSection = getServiceSection( "Accounting/ReportGenerator" )
+    self.__minLifeTime = gConfig.getValue( "%s/MinCacheLifeTime" % csSection, self.__minLifeTime )
+    self.__maxLifeTime = gConfig.getValue( "%s/MaxCacheLifeTime" % csSection, self.__maxLifeTime )
+    self.__dataCache = DictCache( maxSize = gConfig.getValue( "%s/MaxCachedReports" % csSection, 2000 ) )
+    self.__graphCache = DictCache( maxSize = gConfig.getValue( "%s/MaxCachedPlots" % csSection, 5000 ) )
+    maxDiskSize = gConfig.getValue( "%s/MaxCacheDiskSize" % csSection, 1024 ) * 1048576
+    self.__store = ReportStore( self.graphsLocation, maxDiskSize, self.__forgetReport )
+    retVal = self.__store.load()
+    if not retVal[ 'OK' ]:
+      gLogger.error( "Can't initialize the cache of reports", retVal[ 'Message' ] )
+    return retVal
 
   def purgeExpired( self ):
     while self.alive:
-      time.sleep( 600 )
-      self.__graphCache.purgeExpired()
-      self.__dataCache.purgeExpired()
+      time.sleep( 60 )
+      try:
+        self.__graphCache.purgeExpired()
+        self.__dataCache.purgeExpired()
+        if self.__store:
+          self.__store.purgeExpired()
+          retVal = self.__store.flush()
+          if not retVal[ 'OK' ]:
+            gLogger.error( retVal[ 'Message' ] )
+      except Exception, e:
+        #Keep purging in the next iterations
+        gLogger.exception( "Exception while purging the cache of reports", lException = e )
+
+  def __forgetReport( self, kind, reportHash ):
+    #Plots in memory point to files the store has just deleted
+    if kind == "plot":
+      self.__graphCache.delete( reportHash )
+
+  def getReportLifeTime( self, reportRequest ):
+    """
+    Get how long a report can be cached. The older its end time the longer
+    """
+    age = time.time() - reportRequest[ 'endTime' ]
+    return int( min( self.__maxLifeTime, max( self.__minLifeTime, age * AGE_LIFETIME_FACTOR ) ) )
 
   def getReportData( self, reportRequest, reportHash, dataFunc ):
     """
     Get report data from cache if exists, else generate it
     """
-    reportData = self.__dataCache.get( reportHash )
-    if reportData == False:
-      retVal = dataFunc( reportRequest )
-      if not retVal[ 'OK' ]:
-        return retVal
-      reportData = retVal[ 'Value' ]
-      self.__dataCache.add( reportHash, self.__dataLifeTime, reportData )
-    return S_OK( reportData )
+    return self.__getCached( self.__dataCache, "data", reportHash, self.getReportLifeTime( reportRequest ),
+                             dataFunc, reportRequest )
 
   def getReportPlot( self, reportRequest, reportHash, reportData, plotFunc ):
     """
     Get report data from cache if exists, else generate it
     """
-    plotDict = self.__graphCache.get( reportHash )
-    if plotDict == False:
-      basePlotFileName = "%s/%s" % ( self.graphsLocation, reportHash )
-      retVal = plotFunc( reportRequest, reportData, basePlotFileName )
+    return self.__getCached( self.__graphCache, "plot", reportHash, self.getReportLifeTime( reportRequest ),
+                             self.__generatePlot, reportRequest, reportHash, reportData, plotFunc )
+
+  def __getCached( self, memCache, kind, reportHash, lifeTime, generateFunc, *args ):
+    #Identical requests arriving at the same time generate the report only once
+    for i in range( 2 ):
+      retVal = memCache.getOrLoad( reportHash, lifeTime, self.__loadReport, kind, reportHash, lifeTime,
+                                   generateFunc, *args )
       if not retVal[ 'OK' ]:
         return retVal
-      plotDict = retVal[ 'Value' ]
-      if plotDict[ 'plot' ]:
-        plotDict[ 'plot' ] = "%s.png" % reportHash
-      if plotDict[ 'thumbnail' ]:
-        plotDict[ 'thumbnail' ] = "%s.thb.png" % reportHash
-      self.__graphCache.add( reportHash, self.__graphLifeTime, plotDict )
+      expiration, value = retVal[ 'Value' ]
+      #Reports loaded from disk can expire before the life time of the memory cache
+      if expiration > time.time() and ( kind != "plot" or self.__plotFilesExist( value ) ):
+        break
+      memCache.delete( reportHash )
+    return S_OK( value )
+
+  def __loadReport( self, kind, reportHash, lifeTime, generateFunc, *args ):
+    if self.__store:
+      retVal = self.__store.get( kind, reportHash )
+      if retVal[ 'OK' ] and retVal[ 'Value' ]:
+        if kind != "plot" or self.__plotFilesExist( retVal[ 'Value' ][1] ):
+          return retVal
+    retVal = generateFunc( *args )
+    if not retVal[ 'OK' ]:
+      return retVal
+    expiration = time.time() + lifeTime
+    if self.__store:
+      result = self.__store.put( kind, reportHash, retVal[ 'Value' ], expiration )
+      if not result[ 'OK' ]:
+        gLogger.error( "Can't store report on disk", result[ 'Message' ] )
+    return S_OK( ( expiration, retVal[ 'Value' ] ) )
+
+  def __generatePlot( self, reportRequest, reportHash, reportData, plotFunc ):
+    basePlotFileName = "%s/%s" % ( self.graphsLocation, reportHash )
+    retVal = plotFunc( reportRequest, reportData, basePlotFileName )
+    if not retVal[ 'OK' ]:
+      return retVal
+    plotDict = retVal[ 'Value' ]
+    if plotDict[ 'plot' ]:
+      plotDict[ 'plot' ] = "%s.png" % reportHash
+    if plotDict[ 'thumbnail' ]:
+      plotDict[ 'thumbnail' ] = "%s.thb.png" % reportHash
     return S_OK( plotDict )
 
+  def __plotFilesExist( self, plotDict ):
+    for key in ( 'plot', 'thumbnail' ):
+      if plotDict.get( key ) and not os.path.isfile( os.path.join( self.graphsLocation, plotDict[ key ] ) ):
+        return False
+    return True
+
   def getPlotData( self, plotFileName ):
     filename = "%s/%s" % ( self.graphsLocation, plotFileName )
     try:
@@ -79,19 +406,14 @@ class DataCache:
       return S_ERROR( "Can't open file %s: %s" % ( plotFileName, str( e ) ) )
     return S_OK( data )
 
-  def _deleteGraph( self, plotDict ):
-    try:
-      for key in plotDict:
-        value = plotDict[ key ]
-        if value:
-          fPath = os.path.join( self.graphsLocation, str( value ) )
-          if os.path.isfile( fPath ):
-            gLogger.info( "Deleting plot from cache", value )
-            os.unlink( fPath )
-          else:
-            gLogger.info( "Plot has already been deleted", value )
-    except:
-      pass
+  def getStats( self ):
+    """
+    Get usage statistics of the caches
+    """
+    stats = { 'data' : self.__dataCache.getStats(), 'plots' : self.__graphCache.getStats() }
+    if self.__store:
+      stats[ 'disk' ] = self.__store.getStats()
+    return S_OK( stats )
 
 
 
@@ -144,6 +144,12 @@ class BaseReporter( DBUtils ):
     for keyword in self._typeKeyFields:
       if keyword in preCondDict:
         condDict[ keyword ] = preCondDict[ keyword ]
+    coarsestGranularity = self._getBucketLengthForTime( self._typeName, startTime )
+    #Sums can be read from the rollups
+    if metadataDict[ self._PARAM_CONVERT_TO_GRANULARITY ] == "sum":
+      queryGranularity = coarsestGranularity
+    else:
+      queryGranularity = 0
     #Query!
     timeGrouping = ( "%%s, %s" % groupingFields[0], [ 'startTime' ] + groupingFields[1] )
     retVal = self._retrieveBucketedData( self._typeName,
@@ -152,20 +158,18 @@ class BaseReporter( DBUtils ):
                                           selectFields,
                                           condDict,
                                           timeGrouping,
-                                          ( '%s', [ 'startTime' ] )
+                                          ( '%s', [ 'startTime' ] ),
+                                          granularity = queryGranularity
                                           )
     if not retVal[ 'OK' ]:
       return retVal
     dataDict = self._groupByField( 0, retVal[ 'Value' ] )
-    coarsestGranularity = self._getBucketLengthForTime( self._typeName, startTime )
     #Transform!
-    for keyField in dataDict:
-      if metadataDict[ self._PARAM_CHECK_FOR_NONE ]:
+    if metadataDict[ self._PARAM_CHECK_FOR_NONE ]:
+      for keyField in dataDict:
         dataDict[ keyField ] = self._convertNoneToZero( dataDict[ keyField ] )
-      if metadataDict[ self._PARAM_CONVERT_TO_GRANULARITY ] == "average":
-        dataDict[ keyField ] = self._averageToGranularity( coarsestGranularity, dataDict[ keyField ] )
-      if metadataDict[ self._PARAM_CONVERT_TO_GRANULARITY ] == "sum":
-        dataDict[ keyField ] = self._sumToGranularity( coarsestGranularity, dataDict[ keyField ] )
+    self._convertToGranularity( coarsestGranularity, dataDict, metadataDict[ self._PARAM_CONVERT_TO_GRANULARITY ] )
+    for keyField in dataDict:
       if self._PARAM_CONSOLIDATION_FUNCTION in metadataDict:
         dataDict[ keyField ] = self._executeConsolidation( metadataDict[ self._PARAM_CONSOLIDATION_FUNCTION ], dataDict[ keyField ] )
     if metadataDict[ self._PARAM_CALCULATE_PROPORTIONAL_GAUGES ]:
@@ -235,6 +239,16 @@ class BaseReporter( DBUtils ):
           break
       unitData = selectedUnits[ unit ][ unitIndex ]
     #Apply divFactor to all units
+    timeSeries = self._getTimeSeriesArray( reportDataDict )
+    if timeSeries:
+      #Scale the arrays instead of copying the dicts
+      graphSeries, maxValue = timeSeries.divideByFactor( unitData[1] )
+      graphDataDict = graphSeries.toDataDict()
+      if unitData == baseUnitData:
+        reportDataDict = graphDataDict
+      else:
+        reportDataDict = timeSeries.divideByFactor( baseUnitData[1] )[0].toDataDict( reportDataDict )
+      return reportDataDict, graphDataDict, maxValue, unitData[0]
     graphDataDict, maxValue = self._divideByFactor( copy.deepcopy( reportDataDict ), unitData[1] )
     if unitData == baseUnitData:
       reportDataDict = graphDataDict
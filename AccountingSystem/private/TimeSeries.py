@@ -0,0 +1,139 @@
+# $HeadURL$
+""" NumPy versions of the time series transformations done by DBUtils on report data
+
+    spanToGranularity splits the buckets of all the keys in bins at once.
+    TimeSeriesArray holds a { key : { epoch : value } } dict as a key x epoch array
+    with a mask of the cells that exist in the dict, so whole reports can be scaled
+    without copying the dicts value by value.
+"""
+__RCSID__ = "$Id$"
+
+import itertools
+import numpy
+
+def spanToGranularity( granularity, keyedBucketsData, withProportion = True ):
+  """
+  Split the buckets of each key in bins of granularity seconds
+    - keyedBucketsData : { key : [ [ startTime, bucketLength, value1, value2, .. ], .. ] }
+    - withProportion : append the sum of the proportions of the buckets in each bin
+  Returns { key : { binEpoch : [ value1, value2, .., proportion ] } } as DBUtils._spanToGranularity
+  """
+  keys = []
+  numRows = []
+  rows = []
+  for key in keyedBucketsData:
+    keys.append( key )
+    numRows.append( len( keyedBucketsData[ key ] ) )
+    rows.extend( keyedBucketsData[ key ] )
+  normData = dict( [ ( key, {} ) for key in keys ] )
+  if not rows:
+    return normData
+  rows = numpy.array( rows, dtype = numpy.float64 )
+  keyPos = numpy.repeat( numpy.arange( len( keys ) ), numRows )
+  bucketDates = rows[ :, 0 ].astype( numpy.int64 )
+  bucketLengths = rows[ :, 1 ].astype( numpy.int64 )
+  bucketValues = rows[ :, 2: ]
+  #Buckets of the granularity stay where they are, the rest start at the bin containing them
+  sameLength = bucketLengths == granularity
+  firstBins = numpy.where( sameLength, bucketDates, bucketDates - bucketDates % granularity )
+  bucketEnds = bucketDates + bucketLengths
+  numBins = numpy.where( sameLength | ( bucketLengths == 0 ), 1,
+                         ( bucketEnds - firstBins + granularity - 1 ) // granularity )
+  #One entry per bin touched by a bucket
+  bucketIndex = numpy.repeat( numpy.arange( len( rows ) ), numBins )
+  binOffsets = numpy.arange( len( bucketIndex ) ) - numpy.repeat( numpy.cumsum( numBins ) - numBins, numBins )
+  binEpochs = firstBins[ bucketIndex ] + binOffsets * granularity
+  binStarts = numpy.maximum( binEpochs, bucketDates[ bucketIndex ] )
+  binEnds = numpy.minimum( binEpochs + granularity, bucketEnds[ bucketIndex ] )
+  lengths = bucketLengths[ bucketIndex ]
+  proportions = numpy.where( lengths == 0, 1.0,
+                             ( binEnds - binStarts ) / numpy.maximum( lengths, 1 ).astype( numpy.float64 ) )
+  #Add up the bins of each key. bincount adds in the order of the buckets, as DBUtils does
+  minEpoch = binEpochs.min()
+  epochRange = binEpochs.max() - minEpoch + 1
+  binIds, binPos = numpy.unique( keyPos[ bucketIndex ] * epochRange + ( binEpochs - minEpoch ),
+                                 return_inverse = True )
+  columns = [ numpy.bincount( binPos, weights = bucketValues[ bucketIndex, column ] * proportions )
+              for column in range( bucketValues.shape[1] ) ]
+  if withProportion:
+    columns.append( numpy.bincount( binPos, weights = proportions ) )
+  binValues = numpy.column_stack( columns ).tolist()
+  binEpochs = ( binIds % epochRange + minEpoch ).tolist()
+  #Bins are sorted by key
+  keyLimits = numpy.searchsorted( binIds // epochRange, numpy.arange( len( keys ) + 1 ) ).tolist()
+  for iKey in range( len( keys ) ):
+    start, end = keyLimits[ iKey ], keyLimits[ iKey + 1 ]
+    normData[ keys[ iKey ] ] = dict( itertools.izip( binEpochs[ start:end ], binValues[ start:end ] ) )
+  return normData
+
+def convertToGranularity( granularity, keyedBucketsData, conversion ):
+  """
+  Sum or average the buckets of each key in bins of granularity seconds
+    - conversion : "sum" or "average"
+  """
+  if conversion != "average":
+    return spanToGranularity( granularity, keyedBucketsData, withProportion = False )
+  normData = spanToGranularity( granularity, keyedBucketsData )
+  for key in normData:
+    keyData = normData[ key ]
+    for epoch in keyData:
+      values = keyData[ epoch ]
+      proportion = values.pop()
+      keyData[ epoch ] = [ value / proportion for value in values ]
+  return normData
+
+class TimeSeriesArray:
+  """
+  { key : { epoch : value } } as arrays
+    - keys : list of keys, one per row
+    - epochs : sorted array of all the epochs, one per column
+    - values : keys x epochs array
+    - present : keys x epochs array, True where the dict has the epoch for the key
+  """
+
+  def __init__( self, dataDict ):
+    self.keys = list( dataDict )
+    keyEpochs = []
+    for key in self.keys:
+      keyEpochs.append( numpy.fromiter( dataDict[ key ].iterkeys(), dtype = numpy.int64,
+                                        count = len( dataDict[ key ] ) ) )
+    if keyEpochs:
+      self.epochs = numpy.unique( numpy.concatenate( keyEpochs ) )
+    else:
+      self.epochs = numpy.zeros( 0, dtype = numpy.int64 )
+    self.values = numpy.zeros( ( len( self.keys ), len( self.epochs ) ) )
+    self.present = numpy.zeros( self.values.shape, dtype = bool )
+    for row in range( len( self.keys ) ):
+      columns = numpy.searchsorted( self.epochs, keyEpochs[ row ] )
+      self.values[ row, columns ] = numpy.fromiter( dataDict[ self.keys[ row ] ].itervalues(), dtype = numpy.float64,
+                                                    count = len( columns ) )
+      self.present[ row, columns ] = True
+
+  def toDataDict( self, dataDict = None ):
+    """
+    Write the values in a { key : { epoch : value } } dict. A new one if none is given
+    """
+    if dataDict is None:
+      dataDict = dict( [ ( key, {} ) for key in self.keys ] )
+    epochList = self.epochs.tolist()
+    for row in range( len( self.keys ) ):
+      present = self.present[ row ]
+      if present.all():
+        dataDict[ self.keys[ row ] ].update( itertools.izip( epochList, self.values[ row ].tolist() ) )
+      else:
+        dataDict[ self.keys[ row ] ].update( itertools.izip( self.epochs[ present ].tolist(),
+                                                             self.values[ row, present ].tolist() ) )
+    return dataDict
+
+  def divideByFactor( self, factor ):
+    """
+    Get a copy with all the values divided by factor and the maximum of the present ones
+    """
+    divided = TimeSeriesArray( {} )
+    divided.keys = self.keys
+    divided.epochs = self.epochs
+    divided.present = self.present
+    divided.values = self.values / float( factor )
+    if not self.present.any():
+      return divided, 0.0
+    return divided, max( 0.0, float( divided.values[ self.present ].max() ) )
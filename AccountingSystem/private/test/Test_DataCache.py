@@ -0,0 +1,71 @@
+""" Unit tests of the ReportStore keeping the cached reports on disk
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from DIRAC.AccountingSystem.private.DataCache import ReportStore
+
+class ReportStoreTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.location = tempfile.mkdtemp()
+    self.removed = []
+    self.store = ReportStore( self.location, 1000, lambda kind, reportHash: self.removed.append( ( kind, reportHash ) ) )
+    self.assert_( self.store.load()[ 'OK' ] )
+
+  def tearDown( self ):
+    shutil.rmtree( self.location )
+
+  def __writePlot( self, reportHash, size ):
+    plotDict = {}
+    for key, fileName in ( ( 'plot', "%s.png" % reportHash ), ( 'thumbnail', "%s.thb.png" % reportHash ) ):
+      fd = file( os.path.join( self.location, fileName ), "wb" )
+      fd.write( "x" * size )
+      fd.close()
+      plotDict[ key ] = fileName
+    return plotDict
+
+  def test_plotDictCopied( self ):
+    plotDict = self.__writePlot( "report1", 10 )
+    self.assert_( self.store.put( "plot", "report1", plotDict, time.time() + 1 )[ 'OK' ] )
+    #The reporters add their data to the plot dict they got
+    plotDict[ 'reportData' ] = { 'key' : { 0 : 1 } }
+    plotDict[ 'thumbnail' ] = False
+    expiration, storedDict = self.store.get( "plot", "report1" )[ 'Value' ]
+    self.assertEqual( storedDict, { 'plot' : "report1.png", 'thumbnail' : "report1.thb.png" } )
+    storedDict[ 'plot' ] = False
+    self.assertEqual( self.store.get( "plot", "report1" )[ 'Value' ][1][ 'plot' ], "report1.png" )
+
+  def test_expiredPlotRemoved( self ):
+    plotDict = self.__writePlot( "report1", 10 )
+    self.store.put( "plot", "report1", plotDict, time.time() + 0.1 )
+    plotDict[ 'plot' ] = "other.png"
+    time.sleep( 0.2 )
+    self.store.purgeExpired()
+    self.assertEqual( self.store.getStats()[ 'entries' ], 0 )
+    self.assertEqual( self.store.getStats()[ 'size' ], 0 )
+    self.failIf( os.path.isfile( os.path.join( self.location, "report1.png" ) ) )
+    self.assertEqual( self.removed, [ ( "plot", "report1" ) ] )
+
+  def test_evictionNotified( self ):
+    for i in range( 3 ):
+      self.store.put( "plot", "report%d" % i, self.__writePlot( "report%d" % i, 200 ), time.time() + 60 )
+    self.assertEqual( self.removed, [ ( "plot", "report0" ) ] )
+    self.failIf( self.store.get( "plot", "report0" )[ 'Value' ] )
+    self.failIf( os.path.isfile( os.path.join( self.location, "report0.png" ) ) )
+    self.assert_( self.store.get( "plot", "report2" )[ 'Value' ] )
+
+  def test_data( self ):
+    reportData = { 'data' : { 'key' : { 0 : 1.5 } }, 'granularity' : 3600 }
+    self.store.put( "data", "report1", reportData, time.time() + 60 )
+    self.store.put( "data", "report2", reportData, time.time() + 60 )
+    #Same contents, same file
+    self.assertEqual( self.store.getStats()[ 'files' ], 1 )
+    self.assertEqual( self.store.get( "data", "report2" )[ 'Value' ][1], reportData )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( ReportStoreTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
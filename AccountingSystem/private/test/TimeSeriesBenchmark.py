@@ -0,0 +1,98 @@
+########################################################################
+# $HeadURL $
+# File: TimeSeriesBenchmark.py
+########################################################################
+
+""".. module:: TimeSeriesBenchmark
+
+Compare the dict loops and the NumPy arrays used by DBUtils to sum buckets
+in bins and to scale reports to their units, on data shaped like a month
+of hourly buckets per site.
+Both paths have to give the same results.
+
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import sys
+import time
+import copy
+import random
+from DIRAC.AccountingSystem.private import DBUtils
+
+GRANULARITY = 3600
+NUM_BINS = 24 * 30
+START_EPOCH = 1300000000 - 1300000000 % 86400
+
+def bucketsPayload( numKeys ):
+  """ { site : [ [ startTime, bucketLength, value1, value2 ], .. ] } as returned by the buckets query """
+  random.seed( numKeys )
+  keyedBuckets = {}
+  for iKey in range( numKeys ):
+    buckets = []
+    for iBin in range( NUM_BINS ):
+      if random.random() < 0.2:
+        continue
+      #Some buckets are not aligned with the granularity
+      bucketLength = random.choice( ( 900, 3600, 3600, 3600, 86400 ) )
+      startTime = START_EPOCH + iBin * GRANULARITY
+      buckets.append( [ startTime - startTime % bucketLength, bucketLength,
+                        random.random() * 1000, random.randint( 1, 100 ) ] )
+    keyedBuckets[ "LCG.Site%04d.ch" % iKey ] = buckets
+  return keyedBuckets
+
+def transform( dbUtils, keyedBuckets ):
+  """ what _getTimedData and _findUnitMagic do with the data of a sum report """
+  results = []
+  timings = []
+  start = time.time()
+  dataDict = dbUtils._convertToGranularity( GRANULARITY, keyedBuckets, "sum" )
+  timings.append( time.time() - start )
+  dbUtils.stripDataField( dataDict, 0 )
+  start = time.time()
+  timeSeries = dbUtils._getTimeSeriesArray( dataDict )
+  if timeSeries:
+    graphSeries, maxValue = timeSeries.divideByFactor( 1000 )
+    graphDataDict = graphSeries.toDataDict()
+  else:
+    graphDataDict, maxValue = dbUtils._divideByFactor( copy.deepcopy( dataDict ), 1000 )
+  timings.append( time.time() - start )
+  results.extend( [ dataDict, graphDataDict, maxValue ] )
+  return results, timings
+
+def assertClose( first, second ):
+  if isinstance( first, dict ):
+    assert sorted( first ) == sorted( second )
+    for key in first:
+      assertClose( first[ key ], second[ key ] )
+  elif isinstance( first, list ):
+    assert len( first ) == len( second )
+    for iPos in range( len( first ) ):
+      assertClose( first[ iPos ], second[ iPos ] )
+  else:
+    assert abs( first - second ) <= 1e-9 * max( 1, abs( first ) ), ( first, second )
+
+def runBenchmark():
+  if not DBUtils.TimeSeries:
+    print "NumPy is not available"
+    return
+  timeSeries = DBUtils.TimeSeries
+  dbUtils = DBUtils.DBUtils( None, "Benchmark" )
+  stepNames = ( "sum", "scale" )
+  for numKeys in ( 10, 100, 500 ):
+    payload = bucketsPayload( numKeys )
+    print "%d keys x %d bins:" % ( numKeys, NUM_BINS )
+    DBUtils.TimeSeries = False
+    dictResults, dictTimings = transform( dbUtils, copy.deepcopy( payload ) )
+    DBUtils.TimeSeries = timeSeries
+    arrayResults, arrayTimings = transform( dbUtils, copy.deepcopy( payload ) )
+    assertClose( dictResults, arrayResults )
+    for iStep in range( len( stepNames ) ):
+      print "  %-10s dicts %.3f s  arrays %.3f s  (x%.1f)" % ( stepNames[ iStep ], dictTimings[ iStep ],
+                                                             arrayTimings[ iStep ],
+                                                             dictTimings[ iStep ] / max( arrayTimings[ iStep ], 1e-6 ) )
+    sys.stdout.flush()
+
+if __name__ == "__main__":
+  runBenchmark()
@@ -1,15 +1,13 @@
-import threading, thread
-import types
 from DIRAC import S_OK, S_ERROR
-from DIRAC.Core.Utilities import CFG, LockRing
+from DIRAC.Core.Utilities import CFG
 from DIRAC.ConfigurationSystem.Client.Helpers import Registry, CSGlobals
 from DIRAC.ConfigurationSystem.Client.ConfigurationData import gConfigurationData
+from DIRAC.ConfigurationSystem.private.ConfigurationData import CFGSnapshot
 
 class Operations( object ):
 
-  __cache = {}
-  __cacheVersion = 0
-  __cacheLock = LockRing.LockRing().getLock()
+  #( configuration snapshot, { ( vo, setup ) : snapshot of the merged Operations sections } )
+  __cache = ( None, {} )
 
   def __init__( self, vo = False, group = False, setup = False ):
     self.__uVO = vo
@@ -38,32 +36,29 @@ class Operations( object ):
       self.__setup = CSGlobals.getSetup()
 
   def __getCache( self ):
-    Operations.__cacheLock.acquire()
+    #No locks. At worst two threads merge the same sections at the same time
+    snapshot = gConfigurationData.getSnapshot()
+    cacheSnapshot, cacheDict = Operations.__cache
+    if cacheSnapshot is not snapshot:
+      cacheDict = {}
+      Operations.__cache = ( snapshot, cacheDict )
+
+    cacheKey = ( self.__vo, self.__setup )
     try:
-      currentVersion = gConfigurationData.getVersion()
-      if currentVersion != Operations.__cacheVersion:
-        Operations.__cache = {}
-        Operations.__cacheVersion = currentVersion
+      return cacheDict[ cacheKey ]
+    except KeyError:
+      pass
 
-      cacheKey = ( self.__vo, self.__setup )
-      if cacheKey in Operations.__cache:
-        return Operations.__cache[ cacheKey ]
+    mergedCFG = CFG.CFG()
 
-      mergedCFG = CFG.CFG()
+    for path in self.__getSearchPaths():
+      pathCFG = snapshot.getSectionCFG( path )
+      if pathCFG:
+        mergedCFG = mergedCFG.mergeWith( pathCFG, shareSections = True )
 
-      for path in self.__getSearchPaths():
-        pathCFG = gConfigurationData.mergedCFG[ path ]
-        if pathCFG:
-          mergedCFG = mergedCFG.mergeWith( pathCFG )
+    cacheDict[ cacheKey ] = CFGSnapshot( mergedCFG )
 
-      Operations.__cache[ cacheKey ] = mergedCFG
-
-      return Operations.__cache[ cacheKey ]
-    finally:
-      try:
-        Operations.__cacheLock.release()
-      except thread.error:
-        pass
+    return cacheDict[ cacheKey ]
 
   def setVO( self, vo ):
     """ False to auto detect VO
@@ -95,41 +90,33 @@ class Operations( object ):
     return paths
 
   def getValue( self, optionPath, defaultValue = None ):
-    return self.__getCache().getOption( optionPath, defaultValue )
+    return self.__getCache().cfg.getOption( optionPath, defaultValue )
 
-  def __getCFG( self, sectionPath ):
-    cacheCFG = self.__getCache()
-    section = cacheCFG.getRecursive( sectionPath )
-    if not section:
+  def __sectionError( self, cacheSnapshot, sectionPath ):
+    if cacheSnapshot.getOption( sectionPath ) is None:
       return S_ERROR( "%s in Operations does not exist" % sectionPath )
-    sectionCFG = section[ 'value' ]
-    if type( sectionCFG ) in ( types.StringType, types.UnicodeType ):
-      return S_ERROR( "%s in Operations is not a section" % sectionPath )
-    return S_OK( sectionCFG )
+    return S_ERROR( "%s in Operations is not a section" % sectionPath )
 
   def getSections( self, sectionPath, listOrdered = False ):
-    result = self.__getCFG( sectionPath )
-    if not result[ 'OK' ]:
-      return result
-    sectionCFG = result[ 'Value' ]
-    return S_OK( sectionCFG.listSections( listOrdered ) )
+    cacheSnapshot = self.__getCache()
+    sectionsList = cacheSnapshot.getSections( sectionPath )
+    if sectionsList is None:
+      return self.__sectionError( cacheSnapshot, sectionPath )
+    return S_OK( sectionsList )
 
   def getOptions( self, sectionPath, listOrdered = False ):
-    result = self.__getCFG( sectionPath )
-    if not result[ 'OK' ]:
-      return result
-    sectionCFG = result[ 'Value' ]
-    return S_OK( sectionCFG.listOptions( listOrdered ) )
+    cacheSnapshot = self.__getCache()
+    optionsList = cacheSnapshot.getOptions( sectionPath )
+    if optionsList is None:
+      return self.__sectionError( cacheSnapshot, sectionPath )
+    return S_OK( optionsList )
 
   def getOptionsDict( self, sectionPath ):
-    result = self.__getCFG( sectionPath )
-    if not result[ 'OK' ]:
-      return result
-    sectionCFG = result[ 'Value' ]
-    data = {}
-    for opName in sectionCFG.listOptions():
-      data[ opName ] = sectionCFG[ opName ]
-    return S_OK( data )
+    cacheSnapshot = self.__getCache()
+    optionsDict = cacheSnapshot.getOptionsDict( sectionPath )
+    if optionsDict is None:
+      return self.__sectionError( cacheSnapshot, sectionPath )
+    return S_OK( optionsDict )
 
   def generatePath( self, option, vo = False, setup = False ):
     """
@@ -25,11 +25,15 @@ class ConfigurationHandler( RequestHandler ):
 
   types_getCompressedDataIfNewer = [ types.StringType ]
   def export_getCompressedDataIfNewer( self, sClientVersion ):
-    sVersion = gServiceInterface.getVersion()
-    retDict = { 'newestVersion' : sVersion }
-    if sClientVersion < sVersion:
-      retDict[ 'data' ] = gServiceInterface.getCompressedConfigurationData()
-    return S_OK( retDict )
+    return S_OK( gServiceInterface.getDataIfNewer( sClientVersion ) )
+
+  types_getModificationsIfNewer = [ types.StringType ]
+  def export_getModificationsIfNewer( self, sClientVersion ):
+    """
+    Get the modifications since the client version if they are still in the history,
+    the whole compressed configuration if not
+    """
+    return S_OK( gServiceInterface.getDataIfNewer( sClientVersion, withModifications = True ) )
 
   types_publishSlaveServer = [ types.StringType ]
   def export_publishSlaveServer( self, sURL ):
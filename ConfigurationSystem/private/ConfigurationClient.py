@@ -147,12 +147,8 @@ class ConfigurationClient:
 
   def getOptionsDict( self, sectionPath ):
     gRefresher.refreshConfigurationIfNeeded()
-    optionsDict = {}
-    optionList = gConfigurationData.getOptionsFromCFG( sectionPath )
-    if type( optionList ) == types.ListType:
-      for option in optionList:
-        optionsDict[ option ] = gConfigurationData.extractOptionFromCFG( "%s/%s" %
-                                                              ( sectionPath, option ) )
+    optionsDict = gConfigurationData.getSnapshot().getOptionsDict( sectionPath )
+    if type( optionsDict ) == types.DictType:
       return S_OK( optionsDict )
     else:
       return S_ERROR( "Path %s does not exist or it's not a section" % sectionPath )
@@ -2,17 +2,104 @@
 __RCSID__ = "$Id$"
 
 import os.path
+import types
 import zlib
 import zipfile
 import threading, thread
 import time
 import DIRAC
-from DIRAC.Core.Utilities import List, Time
+from DIRAC.Core.Utilities import List, Time, DEncode
 from DIRAC.Core.Utilities.ReturnValues import S_OK, S_ERROR
 from DIRAC.Core.Utilities.CFG import CFG
 from DIRAC.Core.Utilities.LockRing import LockRing
 from DIRAC.FrameworkSystem.Client.Logger import gLogger
 
+def _normalizePath( path ):
+  return "/".join( [ level.strip() for level in path.split( "/" ) if level.strip() != "" ] )
+
+class CFGSnapshot:
+  """
+  Read only view of a CFG with all the options, sections and comments indexed by path.
+  It is never modified once built, so it can be read without locks. The CFG it is built
+  from must not be modified afterwards either
+  """
+
+  def __init__( self, cfg, sequence = 0 ):
+    self.cfg = cfg
+    self.sequence = sequence
+    self.__options = {}
+    #path -> ( section CFG, subsection names, option names )
+    self.__sections = {}
+    self.__comments = {}
+    self.__indexSection( cfg, "" )
+
+  def __indexSection( self, cfg, path ):
+    sectionsList = []
+    optionsList = []
+    for key in cfg.listAll():
+      value = cfg[ key ]
+      if path:
+        keyPath = "%s/%s" % ( path, key )
+      else:
+        keyPath = key
+      self.__comments[ keyPath ] = cfg.getComment( key )
+      if type( value ) == types.StringType:
+        optionsList.append( key )
+        self.__options[ keyPath ] = value
+      else:
+        sectionsList.append( key )
+        self.__indexSection( value, keyPath )
+    self.__sections[ path ] = ( cfg, sectionsList, optionsList )
+
+  def getOption( self, path ):
+    """
+    Get the value of an option, None if it's not defined
+    """
+    return self.__options.get( _normalizePath( path ) )
+
+  def getSections( self, path ):
+    """
+    Get the ordered list of subsections of a section, None if it's not defined
+    """
+    try:
+      return list( self.__sections[ _normalizePath( path ) ][1] )
+    except KeyError:
+      return None
+
+  def getOptions( self, path ):
+    """
+    Get the ordered list of options of a section, None if it's not defined
+    """
+    try:
+      return list( self.__sections[ _normalizePath( path ) ][2] )
+    except KeyError:
+      return None
+
+  def getOptionsDict( self, path ):
+    """
+    Get the options of a section and their values, None if it's not defined
+    """
+    path = _normalizePath( path )
+    try:
+      optionsList = self.__sections[ path ][2]
+    except KeyError:
+      return None
+    if not path:
+      return dict( [ ( option, self.__options[ option ] ) for option in optionsList ] )
+    return dict( [ ( option, self.__options[ "%s/%s" % ( path, option ) ] ) for option in optionsList ] )
+
+  def getComment( self, path ):
+    return self.__comments.get( _normalizePath( path ) )
+
+  def getSectionCFG( self, path ):
+    """
+    Get the CFG of a section, False if it's not defined. It must not be modified
+    """
+    try:
+      return self.__sections[ _normalizePath( path ) ][0]
+    except KeyError:
+      return False
+
 class ConfigurationData:
 
   def __init__( self, loadDefaultCFG = True ):
@@ -20,8 +107,15 @@ class ConfigurationData:
     self.threadingEvent = lr.getEvent()
     self.threadingEvent.set()
     self.threadingLock = lr.getLock()
+    self.__syncLock = lr.getLock()
+    self.__snapshot = CFGSnapshot( CFG() )
     self.runningThreadsNumber = 0
-    self.compressedConfigurationData = ""
+    #( snapshot sequence, compressed remote CFG )
+    self.compressedConfigurationData = ( -1, "" )
+    #Versions of the remote CFG served to clients as [ ( version, CFG ) ], the last one is the current one
+    self.__remoteHistory = []
+    #( version, { client version : compressed modifications } )
+    self.__modificationsCache = ( None, {} )
     self.configurationPath = "/DIRAC/Configuration"
     self.backupsDir = os.path.join( DIRAC.rootPath, "etc", "csbackup" )
     self._isService = False
@@ -42,7 +136,19 @@ class ConfigurationData:
 
   def sync( self ):
     gLogger.debug( "Updating configuration internals" )
-    self.mergedCFG = self.remoteCFG.mergeWith( self.localCFG )
+    self.__syncLock.acquire()
+    try:
+      self.__sync()
+    finally:
+      self.__syncLock.release()
+
+  def __sync( self ):
+    #The merged cfg shares its sections with the local and remote ones. Those are not modified in place
+    #but replaced by modified copies (see __getWritableCFG) so the snapshot does not change
+    mergedCFG = self.remoteCFG.mergeWith( self.localCFG, shareSections = True )
+    #Readers keep using the previous snapshot until the new one is swapped in
+    self.__snapshot = CFGSnapshot( mergedCFG, self.__snapshot.sequence + 1 )
+    self.mergedCFG = mergedCFG
     self.remoteServerList = []
     localServers = self.extractOptionFromCFG( "%s/Servers" % self.configurationPath,
                                         self.localCFG,
@@ -55,7 +161,17 @@ class ConfigurationData:
     if remoteServers:
       self.remoteServerList.extend( List.fromChar( remoteServers, "," ) )
     self.remoteServerList = List.uniqueElements( self.remoteServerList )
-    self.compressedConfigurationData = zlib.compress( str( self.remoteCFG ), 9 )
+    if self._isService:
+      self.__addToRemoteHistory()
+
+  def __addToRemoteHistory( self ):
+    version = self.getVersion()
+    history = self.__remoteHistory
+    #Changes are made before generating the new version, keep the contents the version was published with
+    if history and history[-1][0] == version:
+      return
+    history = history + [ ( version, self.remoteCFG.clone() ) ]
+    self.__remoteHistory = history[ -self.getHistoryLength(): ]
 
   def loadFile( self, fileName ):
     try:
@@ -103,9 +219,15 @@ class ConfigurationData:
     self.unlock()
     self.sync()
 
+  def getSnapshot( self ):
+    """
+    Get the current read only snapshot of the merged configuration
+    """
+    return self.__snapshot
+
   def getCommentFromCFG( self, path, cfg = False ):
-    if not cfg:
-      cfg = self.mergedCFG
+    if not cfg or cfg is self.mergedCFG:
+      return self.__snapshot.getComment( path )
     self.dangerZoneStart()
     try:
       levelList = [ level.strip() for level in path.split( "/" ) if level.strip() != "" ]
@@ -117,8 +239,8 @@ class ConfigurationData:
     return self.dangerZoneEnd( None )
 
   def getSectionsFromCFG( self, path, cfg = False, ordered = False ):
-    if not cfg:
-      cfg = self.mergedCFG
+    if not cfg or cfg is self.mergedCFG:
+      return self.__snapshot.getSections( path )
     self.dangerZoneStart()
     try:
       levelList = [ level.strip() for level in path.split( "/" ) if level.strip() != "" ]
@@ -130,8 +252,8 @@ class ConfigurationData:
     return self.dangerZoneEnd( None )
 
   def getOptionsFromCFG( self, path, cfg = False, ordered = False ):
-    if not cfg:
-      cfg = self.mergedCFG
+    if not cfg or cfg is self.mergedCFG:
+      return self.__snapshot.getOptions( path )
     self.dangerZoneStart()
     try:
       levelList = [ level.strip() for level in path.split( "/" ) if level.strip() != "" ]
@@ -143,20 +265,34 @@ class ConfigurationData:
     return self.dangerZoneEnd( None )
 
   def extractOptionFromCFG( self, path, cfg = False, disableDangerZones = False ):
-    if not cfg:
-      cfg = self.mergedCFG
+    if not cfg or cfg is self.mergedCFG:
+      return self.__snapshot.getOption( path )
     if not disableDangerZones:
       self.dangerZoneStart()
+    value = None
     try:
       levelList = [ level.strip() for level in path.split( "/" ) if level.strip() != "" ]
       for section in levelList[:-1]:
         cfg = cfg[ section ]
       if levelList[-1] in cfg.listOptions():
-        return self.dangerZoneEnd( cfg[ levelList[ -1 ] ] )
+        value = cfg[ levelList[ -1 ] ]
     except Exception:
       pass
     if not disableDangerZones:
       self.dangerZoneEnd()
+    return value
+
+  def __getWritableCFG( self, cfg ):
+    """
+    Get a copy of the local or remote cfg to modify instead of the one used by the current snapshot
+    """
+    if cfg is self.localCFG:
+      self.localCFG = cfg.clone()
+      return self.localCFG
+    if cfg is self.remoteCFG:
+      self.remoteCFG = cfg.clone()
+      return self.remoteCFG
+    return cfg
 
   def setOptionInCFG( self, path, value, cfg = False, disableDangerZones = False ):
     if not cfg:
@@ -164,6 +300,7 @@ class ConfigurationData:
     if not disableDangerZones:
       self.dangerZoneStart()
     try:
+      cfg = self.__getWritableCFG( cfg )
       levelList = [ level.strip() for level in path.split( "/" ) if level.strip() != "" ]
       for section in levelList[:-1]:
         if section not in cfg.listSections():
@@ -180,6 +317,7 @@ class ConfigurationData:
       cfg = self.localCFG
     self.dangerZoneStart()
     try:
+      cfg = self.__getWritableCFG( cfg )
       levelList = [ level.strip() for level in path.split( "/" ) if level.strip() != "" ]
       for section in levelList[:-1]:
         if section not in cfg.listSections():
@@ -284,7 +422,84 @@ class ConfigurationData:
     self.sync()
 
   def getCompressedData( self ):
-    return self.compressedConfigurationData
+    #Compressed when it's requested, only servers need it
+    sequence = self.__snapshot.sequence
+    dataSequence, compressedData = self.compressedConfigurationData
+    if dataSequence != sequence:
+      compressedData = zlib.compress( str( self.remoteCFG ), 9 )
+      self.compressedConfigurationData = ( sequence, compressedData )
+    return compressedData
+
+  def getHistoryLength( self ):
+    try:
+      return max( 1, int( self.extractOptionFromCFG( "%s/HistoryLength" % self.configurationPath,
+                                                     self.mergedCFG ) ) )
+    except:
+      return 10
+
+  def getCompressedModifications( self, fromVersion ):
+    """
+    Get the modifications from a version of the remote CFG to the current one,
+    zlib compressed and DEncoded. False if the version is not in the history
+    """
+    history = self.__remoteHistory
+    if not history:
+      return False
+    currentVersion, currentCFG = history[-1]
+    cacheVersion, cacheDict = self.__modificationsCache
+    if cacheVersion != currentVersion:
+      cacheDict = {}
+      self.__modificationsCache = ( currentVersion, cacheDict )
+    if fromVersion in cacheDict:
+      return cacheDict[ fromVersion ]
+    for version, versionCFG in history[:-1]:
+      if version == fromVersion:
+        modList = versionCFG.getModifications( currentCFG )
+        cacheDict[ fromVersion ] = zlib.compress( DEncode.encode( modList ), 9 )
+        return cacheDict[ fromVersion ]
+    return False
+
+  def getDataIfNewer( self, clientVersion, withModifications = False ):
+    """
+    Get what a client with clientVersion needs to update. The modifications if
+    they are requested and the history has them, else the whole compressed data
+    """
+    serviceVersion = self.getVersion()
+    retDict = { 'newestVersion' : serviceVersion }
+    if clientVersion < serviceVersion:
+      modData = False
+      if withModifications:
+        modData = self.getCompressedModifications( clientVersion )
+      compressedData = self.getCompressedData()
+      if modData and len( modData ) < len( compressedData ):
+        retDict[ 'modifications' ] = modData
+      else:
+        retDict[ 'data' ] = compressedData
+    return retDict
+
+  def applyRemoteModifications( self, data, newVersion ):
+    """
+    Update the remote CFG with compressed modifications from getCompressedModifications
+    """
+    try:
+      modList = DEncode.decode( zlib.decompress( data ) )[0]
+    except Exception, e:
+      return S_ERROR( "Can't decode configuration modifications: %s" % str( e ) )
+    remoteCFG = self.remoteCFG.clone()
+    try:
+      retVal = remoteCFG.applyModifications( modList )
+    except Exception, e:
+      retVal = S_ERROR( str( e ) )
+    if not retVal[ 'OK' ]:
+      return S_ERROR( "Can't apply configuration modifications: %s" % retVal[ 'Message' ] )
+    if self.getVersion( remoteCFG ) != newVersion:
+      return S_ERROR( "Configuration modifications lead to version %s instead of %s" % ( self.getVersion( remoteCFG ),
+                                                                                          newVersion ) )
+    self.lock()
+    self.remoteCFG = remoteCFG
+    self.unlock()
+    self.sync()
+    return S_OK()
 
   def isMaster( self ):
     value = self.extractOptionFromCFG( "%s/Master" % self.configurationPath,
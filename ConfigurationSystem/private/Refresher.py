@@ -15,14 +15,29 @@ from DIRAC.Core.Utilities.ReturnValues import S_OK, S_ERROR
 def _updateFromRemoteLocation( serviceClient ):
   gLogger.debug( "", "Trying to refresh from %s" % serviceClient.serviceURL )
   localVersion = gConfigurationData.getVersion()
-  retVal = serviceClient.getCompressedDataIfNewer( localVersion )
+  retVal = serviceClient.getModificationsIfNewer( localVersion )
+  if not retVal[ 'OK' ]:
+    #Servers that only send the whole configuration
+    retVal = serviceClient.getCompressedDataIfNewer( localVersion )
   if retVal[ 'OK' ]:
     dataDict = retVal[ 'Value' ]
-    if localVersion < dataDict[ 'newestVersion' ] :
-      gLogger.debug( "New version available", "Updating to version %s..." % dataDict[ 'newestVersion' ] )
-      gConfigurationData.loadRemoteCFGFromCompressedMem( dataDict[ 'data' ] )
+    newestVersion = dataDict[ 'newestVersion' ]
+    if localVersion < newestVersion :
+      gLogger.debug( "New version available", "Updating to version %s..." % newestVersion )
+      if 'modifications' in dataDict:
+        result = gConfigurationData.applyRemoteModifications( dataDict[ 'modifications' ], newestVersion )
+        if result[ 'OK' ]:
+          dataDict = False
+        else:
+          gLogger.warn( "Can't update with the modifications, getting the whole configuration", result[ 'Message' ] )
+          result = serviceClient.getCompressedDataIfNewer( localVersion )
+          if not result[ 'OK' ]:
+            return result
+          dataDict = result[ 'Value' ]
+      if dataDict:
+        gConfigurationData.loadRemoteCFGFromCompressedMem( dataDict[ 'data' ] )
       gLogger.debug( "Updated to version %s" % gConfigurationData.getVersion() )
-      gEventDispatcher.triggerEvent( "CSNewVersion", dataDict[ 'newestVersion' ], threaded = True )
+      gEventDispatcher.triggerEvent( "CSNewVersion", newestVersion, threaded = True )
     return S_OK()
   return retVal
 
@@ -66,6 +81,9 @@ class Refresher( threading.Thread ):
   def refreshConfigurationIfNeeded( self ):
     if not self.__refreshEnabled or self.__automaticUpdate or not gConfigurationData.getServers():
       return
+    #Checked first without the lock, this is called for every read of the configuration
+    if not self.__lastRefreshExpired():
+      return
     self.__triggeredRefreshLock.acquire()
     try:
       if not self.__lastRefreshExpired():
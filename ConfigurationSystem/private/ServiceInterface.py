@@ -162,6 +162,9 @@ class ServiceInterface( threading.Thread ):
   def getVersion( self ):
     return gConfigurationData.getVersion()
 
+  def getDataIfNewer( self, sClientVersion, withModifications = False ):
+    return gConfigurationData.getDataIfNewer( sClientVersion, withModifications )
+
   def getCommitHistory( self ):
     files = self.__getCfgBackups( gConfigurationData.getBackupDir() )
     backups = [ ".".join( fileName.split( "." )[1:3] ).split( "@" ) for fileName in files ]
@@ -72,9 +72,15 @@ class DB( MySQL ):
     result = gConfig.getOption( self.cs_path + '/MaxQueueSize' )
     if result['OK']:
       self.maxQueueSize = int( result['Value'] )
+    # Connection pool tuning
+    self.minPoolSize = gConfig.getValue( self.cs_path + '/MinPoolSize', 1 )
+    self.pingIdleTime = gConfig.getValue( self.cs_path + '/PingIdleTime', 60 )
+    self.connectionWaitTime = gConfig.getValue( self.cs_path + '/ConnectionWaitTime', 30 )
 
     MySQL.__init__( self, self.dbHost, self.dbUser, self.dbPass,
-                   self.dbName, self.dbPort, maxQueueSize = maxQueueSize, debug = debug )
+                   self.dbName, self.dbPort, maxQueueSize = self.maxQueueSize, debug = debug,
+                   minPoolSize = self.minPoolSize, pingIdleTime = self.pingIdleTime,
+                   connectionWaitTime = self.connectionWaitTime )
 
     if not self._connected:
       raise RuntimeError( 'Can not connect to DB %s, exiting...' % self.dbName )
@@ -88,6 +94,7 @@ class DB( MySQL ):
     #self.log.info("Password:       "+self.dbPass)
     self.log.info( "DBName:         " + self.dbName )
     self.log.info( "MaxQueue:       " + str( self.maxQueueSize ) )
+    self.log.info( "MinPoolSize:    " + str( self.minPoolSize ) )
     self.log.info( "==================================================" )
 
 #############################################################################
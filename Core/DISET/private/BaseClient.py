@@ -3,10 +3,14 @@ __RCSID__ = "$Id$"
 
 import types
 import thread
+try:
+  from hashlib import md5
+except:
+  from md5 import md5
 import DIRAC
 from DIRAC.Core.DISET.private.Protocols import gProtocolDict
 from DIRAC.FrameworkSystem.Client.Logger import gLogger
-from DIRAC.Core.Utilities import List, Network
+from DIRAC.Core.Utilities import List, Network, BinEncode
 from DIRAC.Core.Utilities.ReturnValues import S_OK, S_ERROR
 from DIRAC.ConfigurationSystem.Client.Config import gConfig
 from DIRAC.ConfigurationSystem.Client.PathFinder import getServiceURL
@@ -31,6 +35,8 @@ class BaseClient:
   KW_PROXY_CHAIN = "proxyChain"
   KW_SKIP_CA_CHECK = "skipCACheck"
   KW_KEEP_ALIVE_LAPSE = "keepAliveLapse"
+  KW_CONNECTION_POOLING = "connectionPooling"
+  KW_BINARY_CODEC = "binaryCodec"
 
   __threadConfig = ThreadConfig()
 
@@ -48,7 +54,9 @@ class BaseClient:
     for initFunc in ( self.__discoverSetup, self.__discoverVO, self.__discoverTimeout,
                       self.__discoverURL, self.__discoverCredentialsToUse,
                       self.__checkTransportSanity,
-                      self.__setKeepAliveLapse ):
+                      self.__setKeepAliveLapse,
+                      self.__discoverConnectionPooling,
+                      self.__discoverCodecs ):
       result = initFunc()
       if not result[ 'OK' ] and self.__initStatus[ 'OK' ]:
         self.__initStatus = result
@@ -213,12 +221,54 @@ and this is thread %s
       #raise Exception( msgTxt )
 
 
-  def _connect( self ):
+  def __discoverConnectionPooling( self ):
+    if self.KW_CONNECTION_POOLING in self.kwargs:
+      self.__connectionPooling = self.kwargs[ self.KW_CONNECTION_POOLING ]
+    else:
+      self.__connectionPooling = gConfig.getValue( "/DIRAC/ConnectionPooling", True )
+    return S_OK()
+
+  def __discoverCodecs( self ):
+    if self.KW_BINARY_CODEC in self.kwargs:
+      useBinaryCodec = self.kwargs[ self.KW_BINARY_CODEC ]
+    else:
+      useBinaryCodec = gConfig.getValue( "/DIRAC/BinaryCodec", True )
+    if useBinaryCodec:
+      self.__codecs = [ BinEncode.CODEC_NAME ]
+    else:
+      self.__codecs = []
+    return S_OK()
+
+  def __getConnectionKey( self ):
+    """
+    Connections can only be reused by clients connecting to the same URL with the same identity
+    """
+    proxyString = self.kwargs.get( self.KW_PROXY_STRING, "" )
+    if proxyString:
+      proxyString = md5( proxyString ).hexdigest()
+    return ( self.serviceURL,
+             self.useCertificates,
+             self.kwargs.get( self.KW_PROXY_LOCATION, "" ),
+             proxyString,
+             self.kwargs.get( self.KW_SKIP_CA_CHECK, False ),
+             self.timeout,
+             str( self.__extraCredentials ) )
+
+  def _connect( self, reuse = False ):
     self.__discoverExtraCredentials()
     if not self.__initStatus[ 'OK' ]:
       return self.__initStatus
     if self.__enableThreadCheck:
       self.__checkThreadID()
+    reuse = reuse and self.__connectionPooling
+    if reuse:
+      connKey = self.__getConnectionKey()
+      trid = getGlobalTransportPool().getIdleConnection( connKey )
+      if trid:
+        gLogger.debug( "Reusing connection to: %s" % self.serviceURL )
+        retVal = S_OK( ( trid, getGlobalTransportPool().get( trid ) ) )
+        retVal[ 'reused' ] = True
+        return retVal
     gLogger.debug( "Connecting to: %s" % self.serviceURL )
     try:
       transport = gProtocolDict[ self.__URLTuple[0] ][ 'transport' ]( self.__URLTuple[1:3], **self.kwargs )
@@ -227,18 +277,55 @@ and this is thread %s
         return S_ERROR( "Can't connect to %s: %s" % ( self.serviceURL, retVal ) )
     except Exception, e:
       return S_ERROR( "Can't connect to %s: %s" % ( self.serviceURL, e ) )
-    trid = getGlobalTransportPool().add( transport )
+    if reuse:
+      trid = getGlobalTransportPool().addClientTransport( transport, connKey )
+    else:
+      trid = getGlobalTransportPool().add( transport )
     return S_OK( ( trid, transport ) )
 
-  def _disconnect( self, trid ):
-    getGlobalTransportPool().close( trid )
-
-  def _proposeAction( self, transport, action ):
+  def _disconnect( self, trid, reuse = False ):
+    if reuse:
+      getGlobalTransportPool().releaseConnection( trid )
+    else:
+      getGlobalTransportPool().close( trid )
+
+  def _connectAndPropose( self, action ):
+    """
+    Get a connection, reusing an idle one if possible, and propose the action.
+    If a reused connection has been dropped by the server, a new one is tried.
+    The result has 'persistentConnection' set if the server will keep the connection open
+    """
+    reuse = True
+    while True:
+      retVal = self._connect( reuse = reuse )
+      if not retVal[ 'OK' ]:
+        return retVal
+      trid, transport = retVal[ 'Value' ]
+      reused = retVal.get( 'reused', False )
+      retVal = self._proposeAction( transport, action, persistent = self.__connectionPooling )
+      if retVal[ 'OK' ]:
+        result = S_OK( ( trid, transport ) )
+        result[ 'persistentConnection' ] = retVal.get( 'persistentConnection', False )
+        return result
+      self._disconnect( trid )
+      if not reused:
+        return retVal
+      gLogger.debug( "Reused connection to %s failed, connecting again" % self.serviceURL )
+      reuse = False
+
+  def _proposeAction( self, transport, action, persistent = False ):
     if not self.__initStatus[ 'OK' ]:
       return self.__initStatus
     stConnectionInfo = ( ( self.__URLTuple[3], self.setup, self.vo ),
                          action,
                          self.__extraCredentials )
+    proposalExtra = {}
+    if persistent:
+      proposalExtra[ 'persistentConnection' ] = True
+    if self.__codecs:
+      proposalExtra[ 'codecs' ] = self.__codecs
+    if proposalExtra:
+      stConnectionInfo += ( proposalExtra, )
     retVal = transport.sendData( S_OK( stConnectionInfo ) )
     if not retVal[ 'OK' ]:
       return retVal
@@ -250,6 +337,9 @@ and this is thread %s
       if 'delegate' in serverRequirements:
         gLogger.debug( "A delegation is requested" )
         serverReturn = self.__delegateCredentials( transport, serverRequirements[ 'delegate' ] )
+    #Switch to the codec the server has agreed to use for this connection
+    if serverReturn[ 'OK' ] and 'codec' in serverReturn:
+      transport.setCodec( serverReturn[ 'codec' ] )
     return serverReturn
 
   def __delegateCredentials( self, transport, delegationRequest ):
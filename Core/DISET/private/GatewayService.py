@@ -79,6 +79,10 @@ class GatewayService( Service ):
       self._transportPool.close( trid )
     return result
 
+  def _acceptPersistentConnection( self, proposalTuple ):
+    #Forwarded connections are not kept open
+    return False
+
   def _receiveAndCheckProposal( self, trid ):
     clientTransport = self._transportPool.get( trid )
     #Get the peer credentials
@@ -92,6 +96,8 @@ class GatewayService( Service ):
       return S_ERROR( "Invalid action proposal" )
     proposalTuple = retVal[ 'Value' ]
     gLogger.debug( "Received action from client", "/".join( list( proposalTuple[1] ) ) )
+    if proposalTuple[1][0] == "MultiplexedRPC":
+      return S_ERROR( "Multiplexed RPC cannot be forwarded through a gateway" )
     #Check if there are extra credentials
     if proposalTuple[2]:
       clientTransport.setExtraCredentials( proposalTuple[2] )
@@ -204,12 +210,9 @@ class GatewayService( Service ):
     if targetService == "Configuration/Server":
       if method == "getCompressedDataIfNewer":
         #Relay CS data directly
-        serviceVersion = gConfigurationData.getVersion()
-        retDict = { 'newestVersion' : serviceVersion }
-        clientVersion = params[0]
-        if clientVersion < serviceVersion:
-          retDict[ 'data' ] = gConfigurationData.getCompressedData()
-        return S_OK( retDict )
+        return S_OK( gConfigurationData.getDataIfNewer( params[0] ) )
+      if method == "getModificationsIfNewer":
+        return S_OK( gConfigurationData.getDataIfNewer( params[0], withModifications = True ) )
     #Default
     rpcClient = RPCClient( targetService, **clientInitArgs )
     methodObj = getattr( rpcClient, method )
@@ -8,25 +8,77 @@ from DIRAC.Core.Utilities.ReturnValues import S_OK, S_ERROR
 
 class InnerRPCClient( BaseClient ):
 
+  #Proposal errors of the services that can't multiplex RPCs: older ones and gateways
+  __multiplexingUnsupported = ( "MultiplexedRPC is not a known action type",
+                                "Multiplexed RPC cannot be forwarded" )
+
   def executeRPC( self, functionName, args ):
     stub = ( self._getBaseStub(), functionName, args )
-    retVal = self._connect()
+    retVal = self._connectAndPropose( ( "RPC", functionName ) )
     if not retVal[ 'OK' ]:
       retVal[ 'rpcStub' ] = stub
       return retVal
     trid, transport = retVal[ 'Value' ]
+    keepConnection = retVal[ 'persistentConnection' ]
     try:
-      retVal = self._proposeAction( transport, ( "RPC", functionName ) )
-      if not retVal[ 'OK' ]:
-        retVal[ 'rpcStub' ] = stub
-        return retVal
       retVal = transport.sendData( S_OK( args ) )
       if not retVal[ 'OK' ]:
+        keepConnection = False
         return retVal
       receivedData = transport.receiveData()
       if type( receivedData ) == types.DictType:
+        #Transport errors can't be told apart from remote ones. Only reuse after success
+        keepConnection = keepConnection and receivedData.get( 'OK', False )
         receivedData[ 'rpcStub' ] = stub
+      else:
+        keepConnection = False
       return receivedData
     finally:
+      self._disconnect( trid, reuse = keepConnection )
+
+
+  def executeRPCList( self, rpcList ):
+    """
+    Execute a list of ( functionName, args ) calls over a single multiplexed connection.
+    Requests are sent without waiting for each response. Returns S_OK with the list of
+    results in the same order. Falls back to sequential calls if the service does not
+    support multiplexing
+    """
+    if not rpcList:
+      return S_OK( [] )
+    retVal = self._connect()
+    if not retVal[ 'OK' ]:
+      return retVal
+    trid, transport = retVal[ 'Value' ]
+    retVal = self._proposeAction( transport, ( "MultiplexedRPC", "new" ) )
+    if not retVal[ 'OK' ]:
       self._disconnect( trid )
+      if not self.__isMultiplexingUnsupported( retVal[ 'Message' ] ):
+        return retVal
+      return S_OK( [ self.executeRPC( functionName, args ) for functionName, args in rpcList ] )
+    #Imported here to avoid a circular import through gMonitor
+    from DIRAC.Core.DISET.private.MessageBroker import getGlobalMessageBroker
+    msgBroker = getGlobalMessageBroker()
+    retVal = msgBroker.addTransportId( trid, self._serviceName )
+    if not retVal[ 'OK' ]:
+      self._disconnect( trid )
+      return retVal
+    try:
+      retVal = msgBroker.sendRPCs( trid, [ ( functionName, tuple( args ) ) for functionName, args in rpcList ],
+                                   timeout = self.timeout )
+    finally:
+      msgBroker.removeTransport( trid )
+    if not retVal[ 'OK' ]:
+      return retVal
+    baseStub = self._getBaseStub()
+    for iPos in range( len( rpcList ) ):
+      result = retVal[ 'Value' ][ iPos ]
+      if type( result ) == types.DictType:
+        result[ 'rpcStub' ] = ( baseStub, rpcList[ iPos ][0], rpcList[ iPos ][1] )
+    return retVal
 
+  def __isMultiplexingUnsupported( self, message ):
+    for unsupported in self.__multiplexingUnsupported:
+      if str( message ).find( unsupported ) > -1:
+        return True
+    return False
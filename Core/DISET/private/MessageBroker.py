@@ -74,7 +74,7 @@ class MessageBroker:
 
   def addTransportId( self, trid, svcName,
                       receiveMessageCallback = None, disconnectCallback = None,
-                      idleRead = False, listenToConnection = True ):
+                      idleRead = False, listenToConnection = True, receiveRPCCallback = None ):
     self.__trInOutLock.acquire()
     try:
       if trid in self.__messageTransports:
@@ -85,9 +85,11 @@ class MessageBroker:
       self.__messageTransports[ trid ] = { 'transport' : tr,
                                            'svcName' : svcName,
                                            'cbReceiveMessage': receiveMessageCallback,
+                                           'cbReceiveRPC' : receiveRPCCallback,
                                            'cbDisconnect' : disconnectCallback,
                                            'listen' : listenToConnection,
-                                           'idleRead' : idleRead }
+                                           'idleRead' : idleRead,
+                                           'sendLock' : threading.Lock() }
       self.__startListeningThread()
       return S_OK()
     finally:
@@ -156,20 +158,24 @@ class MessageBroker:
   #Process received data functions
 
   def __receiveMsgDataAndQueue( self, trid ):
-    #Receive
-    result = self.__trPool.receive( trid,
-                                    blockAfterKeepAlive = False,
-                                    idleReceive = self.__messageTransports[ trid ][ 'idleRead' ] )
-    self.__log.debug( "[trid %s] Received data: %s" % ( trid, str( result ) ) )
-    #If error close transport and exit
-    if not result[ 'OK' ]:
-      self.__log.debug( "[trid %s] ERROR RCV DATA %s" % ( trid, result[ 'Message' ] ) )
-      gLogger.warn( "Error while receiving message", "from %s : %s" % ( self.__trPool.get( trid ).getFormattedCredentials(),
-                                                                        result[ 'Message' ] ) )
-      return self.removeTransport( trid )
-    self.__threadPool.generateJobAndQueueIt( self.__processIncomingData,
-                                             args = ( trid, result ) )
-    return S_OK()
+    while True:
+      #Receive
+      result = self.__trPool.receive( trid,
+                                      blockAfterKeepAlive = False,
+                                      idleReceive = self.__messageTransports[ trid ][ 'idleRead' ] )
+      self.__log.debug( "[trid %s] Received data: %s" % ( trid, str( result ) ) )
+      #If error close transport and exit
+      if not result[ 'OK' ]:
+        self.__log.debug( "[trid %s] ERROR RCV DATA %s" % ( trid, result[ 'Message' ] ) )
+        gLogger.warn( "Error while receiving message", "from %s : %s" % ( self.__trPool.get( trid ).getFormattedCredentials(),
+                                                                          result[ 'Message' ] ) )
+        return self.removeTransport( trid )
+      self.__threadPool.generateJobAndQueueIt( self.__processIncomingData,
+                                               args = ( trid, result ) )
+      #Pipelined messages may already be buffered in the transport and select won't see them
+      transport = self.__trPool.get( trid )
+      if not transport or not transport.hasBufferedMessage():
+        return S_OK()
 
   def __processIncomingData( self, trid, receivedResult ):
     #If keep alive, return OK
@@ -197,7 +203,10 @@ class MessageBroker:
       gLogger.warn( "Received data does not seem to be a message !!!!" )
       return self.removeTransport( trid )
     #Decide if it's a response or a request
-    if msg[ 'request' ]:
+    if msg[ 'request' ] and 'rpc' in msg:
+      #RPC requests are answered with the result of the call
+      result = self.__processIncomingRPC( trid, msg )
+    elif msg[ 'request' ]:
       #If message has Id return ACK to received
       if 'id' in msg:
         self.__sendResponse( trid, msg[ 'id' ], S_OK() )
@@ -256,6 +265,34 @@ class MessageBroker:
       gLogger.exception( "Exception while processing message %s" % msg[ 'name' ] )
       return S_ERROR( "Exception while processing message %s: %s" % ( msg[ 'name' ], str( e ) ) )
 
+  def __processIncomingRPC( self, trid, msg ):
+    for requiredField in ( 'id', 'args' ):
+      if requiredField not in msg:
+        gLogger.error( "RPC message does not have %s" % requiredField )
+        return S_ERROR( "RPC message does not have %s" % requiredField )
+    self.__trInOutLock.acquire()
+    try:
+      rpcCB = self.__messageTransports[ trid ][ 'cbReceiveRPC' ]
+    except KeyError:
+      return S_ERROR( "Transport %s unknown" % trid )
+    finally:
+      self.__trInOutLock.release()
+    args = msg[ 'args' ]
+    if not rpcCB:
+      result = S_ERROR( "No RPC was expected for this transport" )
+    elif type( args ) not in ( types.TupleType, types.ListType ):
+      result = S_ERROR( "RPC args has to be a tuple or a list, not %s" % type( args ) )
+    else:
+      try:
+        result = rpcCB( trid, msg[ 'rpc' ], args )
+        if not isReturnStructure( result ):
+          result = S_ERROR( "RPC function does not return a result structure" )
+      except Exception, e:
+        gLogger.exception( "Exception while processing RPC %s" % msg[ 'rpc' ] )
+        result = S_ERROR( "Exception while processing RPC %s: %s" % ( msg[ 'rpc' ], str( e ) ) )
+    #An RPC failing is not a reason to drop the connection, only not being able to answer
+    return self.__sendResponse( trid, msg[ 'id' ], result )
+
   def __processIncomingResponse( self, trid, msg ):
     #This is a message response
     for requiredField in ( 'id', 'result' ):
@@ -268,9 +305,49 @@ class MessageBroker:
 
   #Sending functions
 
+  def __send( self, trid, data ):
+    #Several threads may be sending through the same transport
+    try:
+      sendLock = self.__messageTransports[ trid ][ 'sendLock' ]
+    except KeyError:
+      return self.__trPool.send( trid, data )
+    sendLock.acquire()
+    try:
+      return self.__trPool.send( trid, data )
+    finally:
+      sendLock.release()
+
   def __sendResponse( self, trid, msgId, msgResult ):
     msgResponse = { 'request' : False, 'id' : msgId, 'result' : msgResult }
-    result = self.__trPool.send( trid, S_OK( msgResponse ) )
+    return self.__send( trid, S_OK( msgResponse ) )
+
+  def sendRPCs( self, trid, rpcList, timeout = 600 ):
+    """
+    Send a list of ( method, args ) RPC requests through a transport without waiting
+    for each response. Returns the list of results in the same order
+    """
+    if not self.__trPool.exists( trid ):
+      return S_ERROR( "Not transport with id %s defined for messaging" % trid )
+    msgIds = []
+    for method, args in rpcList:
+      msgId = self.__generateMsgId()
+      self.__generateMessageResponse( trid, msgId )
+      msgIds.append( msgId )
+      result = self.__send( trid, S_OK( { 'request' : True, 'rpc' : method, 'args' : args, 'id' : msgId } ) )
+      if not result[ 'OK' ]:
+        self.__callbacksLock.acquire()
+        try:
+          for msgId in msgIds:
+            self.__clearCallback( msgId )
+        finally:
+          self.__callbacksLock.release()
+        self.removeTransport( trid )
+        return result
+    self.__callbacksLock.acquire()
+    try:
+      return S_OK( [ self.__waitForMessageResponse( msgId, timeout ) for msgId in msgIds ] )
+    finally:
+      self.__callbacksLock.release()
 
   def sendMessage( self, trid, msgObj ):
     if not msgObj.isOK():
@@ -290,13 +367,13 @@ class MessageBroker:
     waitForAck = msgObj.getWaitForAck()
 
     if not waitForAck:
-      return self.__trPool.send( trid, S_OK( msg ) )
+      return self.__send( trid, S_OK( msg ) )
 
     msgId = self.__generateMsgId()
     msg[ 'id' ] = msgId
 
     self.__generateMessageResponse( trid, msgId )
-    result = self.__trPool.send( trid, S_OK( msg ) )
+    result = self.__send( trid, S_OK( msg ) )
 
     #Lock and generate and wait
     self.__callbacksLock.acquire()
@@ -329,12 +406,12 @@ class MessageBroker:
       self.__callbacksLock.release()
 
   #Lock need to have been aquired prior to func
-  def __waitForMessageResponse( self, msgId ):
+  def __waitForMessageResponse( self, msgId, timeout = 30 ):
     if msgId not in self.__responseCallbacks:
       return S_ERROR( "Invalid msg id" )
     respCallback = self.__responseCallbacks[ msgId ]
-    while 'result' not in respCallback and time.time() - respCallback[ 'creationTime' ] < 30 :
-      self.__callbacksLock.wait( 30 )
+    while 'result' not in respCallback and time.time() - respCallback[ 'creationTime' ] < timeout :
+      self.__callbacksLock.wait( timeout )
     self.__clearCallback( msgId )
     if 'result' in respCallback:
       return respCallback[ 'result' ]
@@ -1,10 +1,13 @@
 
 import os
 import time
+import types
+import select
+import socket
 import DIRAC
 import threading
 from DIRAC import gConfig, gLogger, S_OK, S_ERROR, gMonitor
-from DIRAC.Core.Utilities import List, Time, MemStat
+from DIRAC.Core.Utilities import List, Time, MemStat, BinEncode
 from DIRAC.Core.DISET.private.LockManager import LockManager
 from DIRAC.FrameworkSystem.Client.MonitoringClient import MonitoringClient
 from DIRAC.Core.DISET.private.ServiceConfiguration import ServiceConfiguration
@@ -24,7 +27,8 @@ class Service:
   SVC_VALID_ACTIONS = { 'RPC' : 'export',
                         'FileTransfer': 'transfer',
                         'Message' : 'msg',
-                        'Connection' : 'Message' }
+                        'Connection' : 'Message',
+                        'MultiplexedRPC' : 'RPC' }
   SVC_SECLOG_CLIENT = SecurityLogClient()
 
   def __init__( self, serviceData ):
@@ -45,6 +49,17 @@ class Service:
     self._transportPool = getGlobalTransportPool()
     self.__cloneId = 0
     self.__maxFD = 0
+    self.__initIdleConnections()
+
+  def __initIdleConnections( self ):
+    #Persistent connections waiting for their next proposal: trid -> idle since
+    self.__idleConnections = {}
+    self.__idleConnectionsLock = threading.Lock()
+    self.__listeningIdleConnections = False
+    #Written to wake up the listener when a connection is added to the idle ones
+    self.__idleWakeUp = socket.socketpair()
+    for sock in self.__idleWakeUp:
+      sock.setblocking( 0 )
 
   def setCloneProcessId( self, cloneId ):
     self.__cloneId = cloneId
@@ -282,7 +297,7 @@ class Service:
                                              args = ( clientTransport, ) )
 
   #Threaded process function
-  def _processInThread( self, clientTransport ):
+  def _processInThread( self, clientTransport, trid = False ):
     self.__maxFD = max( self.__maxFD, clientTransport.oSocket.fileno() )
     self._lockManager.lockGlobal()
     try:
@@ -290,18 +305,28 @@ class Service:
     except Exception, e:
       monReport = False
     try:
-      #Handshake
-      try:
-        result = clientTransport.handshake()
+      if trid:
+        #Persistent connection woken up. It may just be a keep alive
+        result = self._transportPool.receive( trid, 1024, blockAfterKeepAlive = False, idleReceive = True )
         if not result[ 'OK' ]:
-          clientTransport.close()
+          self._transportPool.close( trid )
+          return
+        if 'keepAlive' in result and result[ 'keepAlive' ]:
+          self.__keepIdleConnection( trid )
+          return
+      else:
+        #Handshake
+        try:
+          result = clientTransport.handshake()
+          if not result[ 'OK' ]:
+            clientTransport.close()
+            return
+        except:
+          return
+        #Add to the transport pool
+        trid = self._transportPool.add( clientTransport )
+        if not trid:
           return
-      except:
-        return
-      #Add to the transport pool
-      trid = self._transportPool.add( clientTransport )
-      if not trid:
-        return
       #Receive and check proposal
       result = self._receiveAndCheckProposal( trid )
       if not result[ 'OK' ]:
@@ -321,12 +346,109 @@ class Service:
         if not result[ 'OK' ]:
           gLogger.error( "Error processing proposal: %s" % result[ 'Message' ] )
         self._transportPool.close( trid )
+      elif result[ 'persistentConnection' ]:
+        self.__keepIdleConnection( trid )
       return result
     finally:
       self._lockManager.unlockGlobal()
       if monReport:
         self.__endReportToMonitoring( *monReport )
 
+  #Persistent connections
+
+  def _acceptPersistentConnection( self, proposalTuple ):
+    """
+    Only RPC clients asking for it get their connection kept open after the action
+    """
+    if proposalTuple[1][0] != 'RPC' or len( proposalTuple ) < 4:
+      return False
+    if type( proposalTuple[3] ) != types.DictType or not proposalTuple[3].get( 'persistentConnection', False ):
+      return False
+    return len( self.__idleConnections ) < self._cfg.getMaxPersistentConnections()
+
+  def _negotiateCodec( self, proposalTuple ):
+    """
+    Pick the codec to use for an RPC among the ones offered by the client
+    """
+    if proposalTuple[1][0] not in ( 'RPC', 'MultiplexedRPC' ):
+      return False
+    if len( proposalTuple ) < 4 or type( proposalTuple[3] ) != types.DictType:
+      return False
+    if BinEncode.CODEC_NAME in proposalTuple[3].get( 'codecs', [] ):
+      return BinEncode.CODEC_NAME
+    return False
+
+  def __keepIdleConnection( self, trid ):
+    self.__idleConnectionsLock.acquire()
+    try:
+      self.__idleConnections[ trid ] = time.time()
+      threadDead = self.__listeningIdleConnections and not self.__idleListenerThread.isAlive()
+      if not self.__listeningIdleConnections or threadDead:
+        self.__listeningIdleConnections = True
+        self.__idleListenerThread = threading.Thread( target = self.__listenIdleConnections )
+        self.__idleListenerThread.setDaemon( True )
+        self.__idleListenerThread.start()
+        return
+    finally:
+      self.__idleConnectionsLock.release()
+    #The listener has to select on this connection too
+    try:
+      self.__idleWakeUp[1].send( "W" )
+    except socket.error:
+      #Buffer full, there are wake ups pending already
+      pass
+
+  def __listenIdleConnections( self ):
+    while True:
+      now = time.time()
+      maxIdleTime = self._cfg.getMaxIdleConnectionTime()
+      sIdList = []
+      expired = []
+      self.__idleConnectionsLock.acquire()
+      try:
+        for trid in list( self.__idleConnections ):
+          tr = self._transportPool.get( trid )
+          if not tr or now - self.__idleConnections[ trid ] > maxIdleTime:
+            del( self.__idleConnections[ trid ] )
+            expired.append( trid )
+            continue
+          sIdList.append( ( trid, tr.getSocket() ) )
+        if not sIdList and not expired:
+          self.__listeningIdleConnections = False
+          return
+      finally:
+        self.__idleConnectionsLock.release()
+      for trid in expired:
+        gLogger.debug( "Closing idle persistent connection %s" % trid )
+        self._transportPool.close( trid )
+      if not sIdList:
+        continue
+      try:
+        inList, outList, exList = select.select( [ self.__idleWakeUp[0] ] + [ pos[1] for pos in sIdList ], [], [], 1 )
+      except ( socket.error, select.error ):
+        time.sleep( 0.001 )
+        continue
+      if self.__idleWakeUp[0] in inList:
+        try:
+          while self.__idleWakeUp[0].recv( 1024 ):
+            pass
+        except socket.error:
+          pass
+      for sock in inList:
+        for trid, trSock in sIdList:
+          if sock != trSock:
+            continue
+          self.__idleConnectionsLock.acquire()
+          try:
+            if trid not in self.__idleConnections:
+              break
+            del( self.__idleConnections[ trid ] )
+          finally:
+            self.__idleConnectionsLock.release()
+          self._threadPool.generateJobAndQueueIt( self._processInThread,
+                                                   args = ( self._transportPool.get( trid ), trid ) )
+          break
+
 
   def _createIdentityString( self, credDict, clientTransport = False ):
     if 'username' in credDict:
@@ -450,9 +572,21 @@ class Service:
 
   def _processProposal( self, trid, proposalTuple, handlerObj ):
     #Notify the client we're ready to execute the action
-    retVal = self._transportPool.send( trid, S_OK() )
+    persistentConnection = self._acceptPersistentConnection( proposalTuple )
+    proposalAck = S_OK()
+    if persistentConnection:
+      proposalAck[ 'persistentConnection' ] = True
+    codec = self._negotiateCodec( proposalTuple )
+    if codec:
+      proposalAck[ 'codec' ] = codec
+    retVal = self._transportPool.send( trid, proposalAck )
     if not retVal[ 'OK' ]:
       return retVal
+    if codec:
+      self._transportPool.get( trid ).setCodec( codec )
+
+    if proposalTuple[1][0] == 'MultiplexedRPC':
+      return self.__startMultiplexedRPC( trid, proposalTuple )
 
     messageConnection = False
     if proposalTuple[1] == ( 'Connection', 'new' ):
@@ -478,9 +612,45 @@ class Service:
       if not result[ 'OK' ]:
         self._msgBroker.removeTransport( trid )
 
-    result[ 'closeTransport' ] = not messageConnection or not result[ 'OK' ]
+    result[ 'persistentConnection' ] = persistentConnection and result[ 'OK' ]
+    result[ 'closeTransport' ] = not ( messageConnection or result[ 'persistentConnection' ] ) or not result[ 'OK' ]
     return result
 
+  def __startMultiplexedRPC( self, trid, proposalTuple ):
+    """
+    Hand the connection to the message broker. From now on RPC requests arrive as
+    messages and are answered with their results in any order
+    """
+    if self._msgBroker.getNumConnections() > self._cfg.getMaxMessagingConnections():
+      result = S_ERROR( "Maximum number of connections reached. Try later" )
+      result[ 'closeTransport' ] = True
+      return result
+    #Keep the proposal to know the client setup and VO for each call
+    self._transportPool.associateData( trid, 'proposalTuple', proposalTuple )
+    result = self._msgBroker.addTransportId( trid, self._name,
+                                             receiveRPCCallback = self._mbReceivedRPC )
+    result[ 'closeTransport' ] = not result[ 'OK' ]
+    result[ 'persistentConnection' ] = False
+    return result
+
+  def _mbReceivedRPC( self, trid, method, args ):
+    #Each call counts against the maximum number of concurrent queries as any other RPC
+    self._lockManager.lockGlobal()
+    try:
+      tr = self._transportPool.get( trid )
+      if not tr:
+        return S_ERROR( "Client disconnected" )
+      result = self._authorizeProposal( ( 'RPC', method ), trid, tr.getConnectingCredentials() )
+      if not result[ 'OK' ]:
+        return result
+      result = self._instantiateHandler( trid, self._transportPool.getAssociatedData( trid, 'proposalTuple' ) )
+      if not result[ 'OK' ]:
+        return result
+      self._monitor.addMark( "Queries" )
+      return result[ 'Value' ]._rh_executeMultiplexedRPC( method, args )
+    finally:
+      self._lockManager.unlockGlobal()
+
   def _mbConnect( self, trid, handlerObj = False ):
     if not handlerObj:
       result = self._instantiateHandler( trid )
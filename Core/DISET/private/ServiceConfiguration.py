@@ -68,6 +68,18 @@ class ServiceConfiguration:
     except:
       return 20
 
+  def getMaxPersistentConnections( self ):
+    try:
+      return int( self.getOption( "MaxPersistentConnections" ) )
+    except:
+      return 100
+
+  def getMaxIdleConnectionTime( self ):
+    try:
+      return int( self.getOption( "MaxIdleConnectionTime" ) )
+    except:
+      return 300
+
   def getMaxThreadsForMethod( self, actionType, method ):
     try:
       return int( self.getOption( "ThreadLimit/%s/%s" % ( actionType, method ) ) )
@@ -1,12 +1,13 @@
 
 import time
+import select
 import threading
 from DIRAC import gLogger, S_OK, S_ERROR
 from DIRAC.Core.Utilities.ThreadScheduler import gThreadScheduler
 
 class TransportPool:
 
-  def __init__( self, logger = False ):
+  def __init__( self, logger = False, maxIdleTime = 60, maxConnectionLifeTime = 600, maxIdlePerKey = 10 ):
     if logger:
       self.log = logger
     else:
@@ -15,10 +16,20 @@ class TransportPool:
     self.__transports = {}
     self.__listenPersistConn = False
     self.__msgCounter = 0
+    #Idle client connections kept for reuse: connKey -> [ ( trid, idleSince ) ]
+    self.__idleConnections = {}
+    self.__maxIdleTime = maxIdleTime
+    self.__maxConnectionLifeTime = maxConnectionLifeTime
+    self.__maxIdlePerKey = maxIdlePerKey
+    self.__clientStats = { 'hits' : 0, 'misses' : 0, 'handshakes' : 0, 'evictions' : 0 }
     result = gThreadScheduler.addPeriodicTask( 5, self.__sendKeepAlives )
     if not result[ 'OK' ]:
       self.log.fatal( "Cannot add task to thread scheduler", result[ 'Message' ] )
     self.__keepAlivesTask = result[ 'Value' ]
+    result = gThreadScheduler.addPeriodicTask( 5, self.__purgeIdleConnections )
+    if not result[ 'OK' ]:
+      self.log.fatal( "Cannot add task to thread scheduler", result[ 'Message' ] )
+    self.__purgeIdleTask = result[ 'Value' ]
 
   #
   # Send keep alives
@@ -155,6 +166,121 @@ class TransportPool:
     finally:
       self.__modLock.release()
 
+  #
+  # Reusable client connections
+  #
+
+  def addClientTransport( self, transport, connKey ):
+    """
+    Add a freshly connected client transport that can be reused for connKey
+    """
+    trid = self.add( transport )
+    self.associateData( trid, 'connKey', connKey )
+    self.associateData( trid, 'creationTime', time.time() )
+    self.__modLock.acquire()
+    try:
+      self.__clientStats[ 'handshakes' ] += 1
+    finally:
+      self.__modLock.release()
+    return trid
+
+  def getIdleConnection( self, connKey ):
+    """
+    Get a healthy idle connection for connKey. Returns the trid or False if there's none
+    """
+    while True:
+      self.__modLock.acquire()
+      try:
+        try:
+          trid, idleSince = self.__idleConnections[ connKey ].pop()
+        except ( KeyError, IndexError ):
+          self.__clientStats[ 'misses' ] += 1
+          return False
+        if not self.__idleConnections[ connKey ]:
+          del( self.__idleConnections[ connKey ] )
+      finally:
+        self.__modLock.release()
+      if time.time() - idleSince < self.__maxIdleTime and self.__isIdleConnectionAlive( trid ):
+        self.__modLock.acquire()
+        try:
+          self.__clientStats[ 'hits' ] += 1
+        finally:
+          self.__modLock.release()
+        return trid
+      self.__evict( trid )
+
+  def releaseConnection( self, trid, reuse = True ):
+    """
+    Give back a client connection. If it can be reused it's kept idle, otherwise it's closed
+    """
+    connKey = self.getAssociatedData( trid, 'connKey' )
+    creationTime = self.getAssociatedData( trid, 'creationTime' )
+    if not reuse or connKey is None or time.time() - creationTime > self.__maxConnectionLifeTime:
+      self.close( trid )
+      return S_OK()
+    self.__modLock.acquire()
+    try:
+      idleList = self.__idleConnections.setdefault( connKey, [] )
+      if len( idleList ) < self.__maxIdlePerKey:
+        idleList.append( ( trid, time.time() ) )
+        return S_OK()
+    finally:
+      self.__modLock.release()
+    self.close( trid )
+    return S_OK()
+
+  def __isIdleConnectionAlive( self, trid ):
+    transport = self.get( trid )
+    if not transport:
+      return False
+    try:
+      inList, dummy, dummy = select.select( [ transport.getSocket() ], [], [], 0 )
+    except Exception:
+      return False
+    if not inList:
+      return True
+    #Idle connections only receive keep alives. Anything else means the peer has gone
+    result = transport.receiveData( blockAfterKeepAlive = False )
+    return result[ 'OK' ] and result.get( 'keepAlive', False )
+
+  def __evict( self, trid ):
+    self.__modLock.acquire()
+    try:
+      self.__clientStats[ 'evictions' ] += 1
+    finally:
+      self.__modLock.release()
+    self.log.debug( "Evicting idle connection %s" % trid )
+    self.close( trid )
+
+  def __purgeIdleConnections( self ):
+    now = time.time()
+    toEvict = []
+    self.__modLock.acquire()
+    try:
+      for connKey in list( self.__idleConnections ):
+        idleList = self.__idleConnections[ connKey ]
+        toEvict.extend( [ trid for trid, idleSince in idleList if now - idleSince >= self.__maxIdleTime ] )
+        idleList = [ ( trid, idleSince ) for trid, idleSince in idleList if now - idleSince < self.__maxIdleTime ]
+        if idleList:
+          self.__idleConnections[ connKey ] = idleList
+        else:
+          del( self.__idleConnections[ connKey ] )
+    finally:
+      self.__modLock.release()
+    for trid in toEvict:
+      self.__evict( trid )
+
+  def getClientStats( self ):
+    """
+    Get the counters for reusable client connections
+    """
+    self.__modLock.acquire()
+    try:
+      stats = dict( self.__clientStats )
+      stats[ 'idle' ] = sum( [ len( idleList ) for idleList in self.__idleConnections.values() ] )
+    finally:
+      self.__modLock.release()
+    return stats
 
 gTransportPool = False
 
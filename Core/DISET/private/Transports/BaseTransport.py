@@ -9,7 +9,7 @@ except:
   from md5 import md5
 
 from DIRAC.Core.Utilities.ReturnValues import S_ERROR, S_OK
-from DIRAC.Core.Utilities import DEncode
+from DIRAC.Core.Utilities import DEncode, BinEncode
 from DIRAC.FrameworkSystem.Client.Logger import gLogger
 
 class BaseTransport:
@@ -41,6 +41,7 @@ class BaseTransport:
         pass
     self.__lastActionTimestamp = time.time()
     self.__lastServerRenewTimestamp = self.__lastActionTimestamp
+    self.__binaryCodec = False
 
   def __updateLastActionTimestamp( self ):
     self.__lastActionTimestamp = time.time()
@@ -51,6 +52,27 @@ class BaseTransport:
   def getKeepAliveLapse( self ):
     return self.__keepAliveLapse
 
+  def setCodec( self, codecName ):
+    """
+    Set the codec used to send data. Received data is decoded with whatever codec it was sent
+    """
+    self.__binaryCodec = codecName == BinEncode.CODEC_NAME
+
+  def getCodec( self ):
+    if self.__binaryCodec:
+      return BinEncode.CODEC_NAME
+    return "DEncode"
+
+  def _encode( self, uData ):
+    if self.__binaryCodec:
+      return BinEncode.encode( uData )
+    return DEncode.encode( uData )
+
+  def _decode( self, data ):
+    if BinEncode.isEncoded( data ):
+      return BinEncode.decode( data )[0]
+    return DEncode.decode( data )[0]
+
   def handshake( self ):
     return S_OK()
 
@@ -115,33 +137,61 @@ class BaseTransport:
     except Exception, e:
       return S_ERROR( "Exception while reading from peer: %s" % str( e ) )
 
-  def _write( self, buffer ):
-    return S_OK( self.oSocket.send( buffer ) )
+  def _readInto( self, memView ):
+    """
+    Read into a writable memoryview and return the number of bytes read.
+    Transports able to receive straight into the buffer should overwrite it
+    """
+    retVal = self._read( len( memView ), skipReadyCheck = True )
+    if not retVal[ 'OK' ]:
+      return retVal
+    data = retVal[ 'Value' ]
+    memView[ :len( data ) ] = data
+    return S_OK( len( data ) )
+
+  def _write( self, sBuffer ):
+    return S_OK( self.oSocket.send( sBuffer ) )
 
   def sendData( self, uData, prefix = False ):
     self.__updateLastActionTimestamp()
-    sCodedData = DEncode.encode( uData )
+    sCodedData = self._encode( uData )
     if prefix:
       dataToSend = "%s%s:%s" % ( prefix, len( sCodedData ), sCodedData )
     else:
       dataToSend = "%s:%s" % ( len( sCodedData ), sCodedData )
-    for index in range( 0, len( dataToSend ), self.packetSize ):
-      bytesToSend = len( dataToSend[ index : index + self.packetSize ] )
-      packSentBytes = 0
-      while packSentBytes < bytesToSend:
-        try:
-          result = self._write( dataToSend[ index + packSentBytes : index + bytesToSend ] )
-          if not result[ 'OK' ]:
-            return result
-          sentBytes = result[ 'Value' ]
-        except Exception, e:
-          return S_ERROR( "Exception while sending data: %s" % e )
-        if sentBytes == 0:
-          return S_ERROR( "Connection closed by peer" )
-        packSentBytes += sentBytes
+    #Send packets as buffers pointing into dataToSend to avoid copying it
+    dataLen = len( dataToSend )
+    index = 0
+    while index < dataLen:
+      try:
+        result = self._write( buffer( dataToSend, index, self.packetSize ) )
+        if not result[ 'OK' ]:
+          return result
+        sentBytes = result[ 'Value' ]
+      except Exception, e:
+        return S_ERROR( "Exception while sending data: %s" % e )
+      if sentBytes == 0:
+        return S_ERROR( "Connection closed by peer" )
+      index += sentBytes
     return S_OK()
 
 
+  def hasBufferedMessage( self ):
+    """
+    Check if a whole message has already been read from the socket. Selecting on the
+    socket will not report it, so the receiver has to drain it explicitly
+    """
+    if self.receivedMessages:
+      return True
+    iSeparatorPosition = self.byteStream.find( ":", 0, 10 )
+    if iSeparatorPosition == -1:
+      return False
+    try:
+      size = int( self.byteStream[ :iSeparatorPosition ] )
+    except ValueError:
+      return False
+    return len( self.byteStream ) - iSeparatorPosition - 1 >= size
+
   def receiveData( self, maxBufferSize = 0, blockAfterKeepAlive = True, idleReceive = False ):
     self.__updateLastActionTimestamp()
     if self.receivedMessages:
@@ -179,22 +229,30 @@ class BaseTransport:
       #From here it must be a real message!
       #Process the size and remove the msg length from the bytestream
       size = int( self.byteStream[ :iSeparatorPosition ] )
-      self.byteStream = self.byteStream[ iSeparatorPosition + 1: ]
-      #Receive while there's still data to be received
-      while len( self.byteStream ) < size:
-        retVal = self._read( min( self.packetSize, size - len( self.byteStream ) ), skipReadyCheck = True )
-        if not retVal[ 'OK' ]:
-          return retVal
-        if not retVal[ 'Value' ]:
-          return S_ERROR( "Peer closed connection" )
-        self.byteStream += retVal[ 'Value' ]
-        if maxBufferSize and len( self.byteStream ) > maxBufferSize:
+      received = len( self.byteStream ) - iSeparatorPosition - 1
+      if received >= size:
+        #Whole message already in the bytestream
+        data = self.byteStream[ iSeparatorPosition + 1 : iSeparatorPosition + 1 + size ]
+        self.byteStream = self.byteStream[ iSeparatorPosition + 1 + size: ]
+      else:
+        if maxBufferSize and size > maxBufferSize:
           return S_ERROR( "Read limit exceeded (%s chars)" % maxBufferSize )
-      #Data is here! take it out from the bytestream, dencode and return
-      data = self.byteStream[ :size ]
-      self.byteStream = self.byteStream[ size: ]
+        #Receive the rest of the message straight into a buffer of the final size
+        msgBuffer = bytearray( size )
+        msgView = memoryview( msgBuffer )
+        msgView[ :received ] = self.byteStream[ iSeparatorPosition + 1: ]
+        self.byteStream = ""
+        while received < size:
+          retVal = self._readInto( msgView[ received : min( size, received + self.packetSize ) ] )
+          if not retVal[ 'OK' ]:
+            return retVal
+          if not retVal[ 'Value' ]:
+            return S_ERROR( "Peer closed connection" )
+          received += retVal[ 'Value' ]
+        data = str( msgBuffer )
+      #Data is here! dencode and return
       try:
-        data = DEncode.decode( data )[0]
+        data = self._decode( data )
       except Exception, e:
         return S_ERROR( "Could not decode received data: %s" % str( e ) )
       if idleReceive:
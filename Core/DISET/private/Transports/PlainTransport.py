@@ -84,19 +84,38 @@ class PlainTransport( BaseTransport ):
       except Exception, e:
         return S_ERROR( "Exception while reading from peer: %s" % str( e ) )
 
-  def _write( self, buffer ):
+  def _readInto( self, memView ):
+    start = time.time()
+    timeout = False
+    if 'timeout' in self.extraArgsDict:
+      timeout = self.extraArgsDict[ 'timeout' ]
+    while True:
+      if timeout:
+        if time.time() - start > timeout:
+          return S_ERROR( "Socket read timeout exceeded" )
+      try:
+        return S_OK( self.oSocket.recv_into( memView ) )
+      except socket.error, e:
+        if e[0] == 11:
+          time.sleep( 0.001 )
+        else:
+          return S_ERROR( "Exception while reading from peer: %s" % str( e ) )
+      except Exception, e:
+        return S_ERROR( "Exception while reading from peer: %s" % str( e ) )
+
+  def _write( self, sBuffer ):
     sentBytes = 0
     timeout = False
     if 'timeout' in self.extraArgsDict:
       timeout = self.extraArgsDict[ 'timeout' ]
     if timeout:
       start = time.time()
-    while sentBytes < len( buffer ):
+    while sentBytes < len( sBuffer ):
       try:
         if timeout:
           if time.time() - start > timeout:
             return S_ERROR( "Socket write timeout exceeded" )
-        sent = self.oSocket.send( buffer[ sentBytes: ] )
+        sent = self.oSocket.send( buffer( sBuffer, sentBytes ) )
         if sent == 0:
           return S_ERROR( "Connection closed by peer" )
         if sent > 0:
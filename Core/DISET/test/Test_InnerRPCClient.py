@@ -0,0 +1,51 @@
+""" Unit tests of the fall back of multiplexed RPC calls to sequential ones
+"""
+import unittest
+
+from DIRAC import S_OK, S_ERROR
+from DIRAC.Core.DISET.private.InnerRPCClient import InnerRPCClient
+
+class FakeRPCClient( InnerRPCClient ):
+  """ Client whose proposals get the given answer from the service """
+
+  def __init__( self, proposalResult ):
+    self.proposalResult = proposalResult
+    self.calls = []
+
+  def _connect( self, reuse = False ):
+    return S_OK( ( 1, None ) )
+
+  def _disconnect( self, trid, reuse = False ):
+    pass
+
+  def _proposeAction( self, transport, action, persistent = False ):
+    return self.proposalResult
+
+  def executeRPC( self, functionName, args ):
+    self.calls.append( ( functionName, args ) )
+    return S_OK( args )
+
+class ExecuteRPCListTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.rpcList = [ ( "echo", ( 1, ) ), ( "echo", ( 2, ) ) ]
+
+  def test_unknownActionFallback( self ):
+    for message in ( "MultiplexedRPC is not a known action type",
+                     "Multiplexed RPC cannot be forwarded through a gateway" ):
+      client = FakeRPCClient( S_ERROR( message ) )
+      result = client.executeRPCList( self.rpcList )
+      self.assertEqual( [ rpcResult[ 'Value' ] for rpcResult in result[ 'Value' ] ], [ ( 1, ), ( 2, ) ] )
+      self.assertEqual( client.calls, self.rpcList )
+
+  def test_errorPropagated( self ):
+    for message in ( "Unautorized query", "Maximum number of connections reached. Try later" ):
+      client = FakeRPCClient( S_ERROR( message ) )
+      result = client.executeRPCList( self.rpcList )
+      self.failIf( result[ 'OK' ] )
+      self.assertEqual( result[ 'Message' ], message )
+      self.assertEqual( client.calls, [] )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( ExecuteRPCListTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
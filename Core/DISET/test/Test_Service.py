@@ -0,0 +1,133 @@
+""" Unit tests of the persistent connections kept by the DISET Service
+"""
+import socket
+import threading
+import time
+import unittest
+
+from DIRAC import S_OK
+from DIRAC.Core.DISET.private.LockManager import LockManager
+from DIRAC.Core.DISET.private.Service import Service
+
+class FakeTransport:
+
+  def __init__( self, sock ):
+    self.sock = sock
+
+  def getSocket( self ):
+    return self.sock
+
+  def getConnectingCredentials( self ):
+    return {}
+
+class FakeTransportPool:
+
+  def __init__( self ):
+    self.transports = {}
+
+  def get( self, trid ):
+    return self.transports.get( trid )
+
+  def close( self, trid ):
+    self.transports.pop( trid, None )
+
+  def getAssociatedData( self, trid, key ):
+    return ( ( "Test/Service", "Setup", "vo" ), ( "MultiplexedRPC", "new" ), False )
+
+class FakeConfiguration:
+
+  def getMaxIdleConnectionTime( self ):
+    return 60
+
+class FakeThreadPool:
+
+  def __init__( self ):
+    self.dispatched = {}
+
+  def generateJobAndQueueIt( self, function, args ):
+    self.dispatched[ args[1] ] = time.time()
+
+class IdleService( Service ):
+  """ Service with just what the idle connections need """
+
+  def __init__( self ):
+    self._transportPool = FakeTransportPool()
+    self._cfg = FakeConfiguration()
+    self._threadPool = FakeThreadPool()
+    self._Service__initIdleConnections()
+
+  def keepIdle( self, trid, sock ):
+    self._transportPool.transports[ trid ] = FakeTransport( sock )
+    self._Service__keepIdleConnection( trid )
+
+class FakeMonitor:
+
+  def addMark( self, name, value = 1 ):
+    pass
+
+class FakeHandler:
+  """ Records if the global lock was free while executing """
+
+  def __init__( self, lockManager ):
+    self.lockManager = lockManager
+    self.globalLockFree = []
+
+  def _rh_executeMultiplexedRPC( self, method, args ):
+    free = self.lockManager.oGlobalLock.acquire( False )
+    if free:
+      self.lockManager.oGlobalLock.release()
+    self.globalLockFree.append( free )
+    return S_OK( args )
+
+class MultiplexedService( Service ):
+  """ Service allowing a single query at a time """
+
+  def __init__( self ):
+    self._transportPool = FakeTransportPool()
+    self._transportPool.transports[ 1 ] = FakeTransport( None )
+    self._lockManager = LockManager( 1 )
+    self._monitor = FakeMonitor()
+    self.handler = FakeHandler( self._lockManager )
+
+  def _authorizeProposal( self, actionTuple, trid, credDict ):
+    return S_OK()
+
+  def _instantiateHandler( self, trid, proposalTuple = False ):
+    return S_OK( self.handler )
+
+class IdleConnectionsTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.service = IdleService()
+    self.pairs = [ socket.socketpair() for i in range( 2 ) ]
+
+  def tearDown( self ):
+    for pair in self.pairs:
+      for sock in pair:
+        sock.close()
+
+  def test_newIdleConnectionWatched( self ):
+    self.service.keepIdle( 1, self.pairs[0][0] )
+    #The listener is waiting in select for the first connection only
+    time.sleep( 0.1 )
+    self.service.keepIdle( 2, self.pairs[1][0] )
+    start = time.time()
+    self.pairs[1][1].send( "proposal" )
+    while 2 not in self.service._threadPool.dispatched and time.time() - start < 2:
+      time.sleep( 0.01 )
+    self.assert_( self.service._threadPool.dispatched[ 2 ] - start < 0.5 )
+    self.failIf( 1 in self.service._threadPool.dispatched )
+
+class MultiplexedRPCTestCase( unittest.TestCase ):
+
+  def test_globalLock( self ):
+    service = MultiplexedService()
+    self.assertEqual( service._mbReceivedRPC( 1, "echo", ( 1, ) )[ 'Value' ], ( 1, ) )
+    self.assertEqual( service.handler.globalLockFree, [ False ] )
+    #Released after the call
+    self.assert_( service._lockManager.oGlobalLock.acquire( False ) )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( IdleConnectionsTestCase )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( MultiplexedRPCTestCase ) )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -0,0 +1,63 @@
+########################################################################
+# $HeadURL $
+# File: TransportBenchmark.py
+########################################################################
+
+""".. module:: TransportBenchmark
+
+Throughput of BaseTransport sendData/receiveData over a local socketpair
+for several message sizes.
+
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import sys
+import time
+import socket
+import threading
+from DIRAC import S_OK
+from DIRAC.Core.DISET.private.Transports.PlainTransport import PlainTransport
+
+def transportPair():
+  """ two connected plain transports """
+  sockA, sockB = socket.socketpair()
+  trA = PlainTransport( ( "", 0 ) )
+  trA.setClientSocket( sockA )
+  trB = PlainTransport( ( "", 0 ) )
+  trB.setClientSocket( sockB )
+  return trA, trB
+
+def measure( msgSize, numMessages ):
+  sender, receiver = transportPair()
+  payload = S_OK( "x" * msgSize )
+
+  def sendAll():
+    for i in xrange( numMessages ):
+      sender.sendData( payload )
+
+  sendThread = threading.Thread( target = sendAll )
+  start = time.time()
+  sendThread.start()
+  for i in xrange( numMessages ):
+    result = receiver.receiveData()
+    assert result[ 'OK' ] and len( result[ 'Value' ] ) == msgSize
+  sendThread.join()
+  elapsed = time.time() - start
+  sender.close()
+  receiver.close()
+  return elapsed
+
+def runBenchmark():
+  for msgSize, numMessages in ( ( 1024, 5000 ),
+                                ( 1024 * 1024, 100 ),
+                                ( 16 * 1024 * 1024, 10 ),
+                                ( 64 * 1024 * 1024, 3 ) ):
+    elapsed = measure( msgSize, numMessages )
+    mbytes = msgSize * numMessages / 1048576.0
+    print "%10d bytes x %5d msgs: %.3f s, %.1f MB/s" % ( msgSize, numMessages, elapsed, mbytes / elapsed )
+    sys.stdout.flush()
+
+if __name__ == "__main__":
+  runBenchmark()
@@ -0,0 +1,311 @@
+# $HeadURL$
+"""
+Compact binary encoding for dirac. It encodes the same types as DEncode but
+uses fixed size fields and length prefixes instead of text. Encoded data always
+starts with MAGIC, so it can be told apart from DEncoded data. Ids:
+ i -> int (8 bytes)
+ I -> long (length prefixed decimal)
+ f -> float (8 bytes)
+ b -> bool
+ s -> string
+ u -> unicode
+ z -> datetime
+ n -> none
+ l -> list
+ t -> tuple
+ d -> dictionary
+Fast paths:
+ A -> list of ints
+ S -> list of strings
+ M -> dictionary of strings to strings
+ K -> dictionary with string keys (e.g. dictionaries of dictionaries)
+"""
+__RCSID__ = "$Id$"
+
+import types
+import struct
+import datetime
+
+MAGIC = "\x00"
+CODEC_NAME = "bin"
+
+_dateTimeObject = datetime.datetime.utcnow()
+_dateTimeType = type( _dateTimeObject )
+_dateType = type( _dateTimeObject.date() )
+_timeType = type( _dateTimeObject.time() )
+
+_stringTypeSet = set( ( types.StringType, ) )
+_int64 = struct.Struct( "<q" )
+_uint32 = struct.Struct( "<I" )
+_double = struct.Struct( "<d" )
+
+g_dEncodeFunctions = {}
+g_dDecodeFunctions = {}
+
+def _encodeLength( length ):
+  return _uint32.pack( length )
+
+def _decodeLength( data, i ):
+  return _uint32.unpack_from( data, i )[0]
+
+def _decodeStringBlock( data, i, num ):
+  """
+  Decode num strings stored as a block of lengths followed by the joined strings
+  """
+  lengths = struct.unpack_from( "<%dI" % num, data, i )
+  i += 4 * num
+  strList = []
+  for length in lengths:
+    end = i + length
+    strList.append( data[ i : end ] )
+    i = end
+  return ( strList, i )
+
+def _encodeStringBlock( strList, eList ):
+  eList.append( struct.pack( "<%dI" % len( strList ), *[ len( sValue ) for sValue in strList ] ) )
+  eList.append( "".join( strList ) )
+
+#Encoding and decoding ints
+def encodeInt( iValue, eList ):
+  eList.extend( ( "i", _int64.pack( iValue ) ) )
+
+def decodeInt( data, i ):
+  return ( _int64.unpack_from( data, i + 1 )[0], i + 9 )
+
+g_dEncodeFunctions[ types.IntType ] = encodeInt
+g_dDecodeFunctions[ "i" ] = decodeInt
+
+#Encoding and decoding longs
+def encodeLong( iValue, eList ):
+  sValue = str( iValue )
+  eList.extend( ( "I", _encodeLength( len( sValue ) ), sValue ) )
+
+def decodeLong( data, i ):
+  end = i + 5 + _decodeLength( data, i + 1 )
+  return ( long( data[ i + 5 : end ] ), end )
+
+g_dEncodeFunctions[ types.LongType ] = encodeLong
+g_dDecodeFunctions[ "I" ] = decodeLong
+
+#Encoding and decoding floats
+def encodeFloat( fValue, eList ):
+  eList.extend( ( "f", _double.pack( fValue ) ) )
+
+def decodeFloat( data, i ):
+  return ( _double.unpack_from( data, i + 1 )[0], i + 9 )
+
+g_dEncodeFunctions[ types.FloatType ] = encodeFloat
+g_dDecodeFunctions[ "f" ] = decodeFloat
+
+#Encoding and decoding booleans
+def encodeBool( bValue, eList ):
+  if bValue:
+    eList.append( "b\x01" )
+  else:
+    eList.append( "b\x00" )
+
+def decodeBool( data, i ):
+  return ( data[ i + 1 ] != "\x00", i + 2 )
+
+g_dEncodeFunctions[ types.BooleanType ] = encodeBool
+g_dDecodeFunctions[ "b" ] = decodeBool
+
+#Encoding and decoding strings
+def encodeString( sValue, eList ):
+  eList.extend( ( "s", _encodeLength( len( sValue ) ), sValue ) )
+
+def decodeString( data, i ):
+  end = i + 5 + _decodeLength( data, i + 1 )
+  return ( data[ i + 5 : end ], end )
+
+g_dEncodeFunctions[ types.StringType ] = encodeString
+g_dDecodeFunctions[ "s" ] = decodeString
+
+#Encoding and decoding unicode strings
+def encodeUnicode( sValue, eList ):
+  valueStr = sValue.encode( 'utf-8' )
+  eList.extend( ( "u", _encodeLength( len( valueStr ) ), valueStr ) )
+
+def decodeUnicode( data, i ):
+  end = i + 5 + _decodeLength( data, i + 1 )
+  return ( unicode( data[ i + 5 : end ], 'utf-8' ), end )
+
+g_dEncodeFunctions[ types.UnicodeType ] = encodeUnicode
+g_dDecodeFunctions[ "u" ] = decodeUnicode
+
+#Encoding and decoding datetime
+def encodeDateTime( oValue, eList ):
+  if type( oValue ) == _dateTimeType:
+    tDateTime = ( oValue.year, oValue.month, oValue.day, \
+                      oValue.hour, oValue.minute, oValue.second, \
+                      oValue.microsecond, oValue.tzinfo )
+    eList.append( "za" )
+    encodeTuple( tDateTime, eList )
+  elif type( oValue ) == _dateType:
+    tData = ( oValue.year, oValue.month, oValue. day )
+    eList.append( "zd" )
+    encodeTuple( tData, eList )
+  elif type( oValue ) == _timeType:
+    tTime = ( oValue.hour, oValue.minute, oValue.second, oValue.microsecond, oValue.tzinfo )
+    eList.append( "zt" )
+    encodeTuple( tTime, eList )
+  else:
+    raise Exception( "Unexpected type %s while encoding a datetime object" % str( type( oValue ) ) )
+
+def decodeDateTime( data, i ):
+  dataType = data[ i + 1 ]
+  tupleObject, i = decodeTuple( data, i + 2 )
+  if dataType == 'a':
+    dtObject = datetime.datetime( *tupleObject )
+  elif dataType == 'd':
+    dtObject = datetime.date( *tupleObject )
+  elif dataType == 't':
+    dtObject = datetime.time( *tupleObject )
+  else:
+    raise Exception( "Unexpected type %s while decoding a datetime object" % dataType )
+  return ( dtObject, i )
+
+g_dEncodeFunctions[ _dateTimeType ] = encodeDateTime
+g_dEncodeFunctions[ _dateType ] = encodeDateTime
+g_dEncodeFunctions[ _timeType ] = encodeDateTime
+g_dDecodeFunctions[ 'z' ] = decodeDateTime
+
+#Encoding and decoding None
+def encodeNone( oValue, eList ):
+  eList.append( "n" )
+
+def decodeNone( data, i ):
+  return ( None, i + 1 )
+
+g_dEncodeFunctions[ types.NoneType ] = encodeNone
+g_dDecodeFunctions[ 'n' ] = decodeNone
+
+#Encode and decode a list
+def encodeList( lValue, eList ):
+  numItems = len( lValue )
+  if numItems > 1:
+    itemTypes = set( map( type, lValue ) )
+    if len( itemTypes ) == 1:
+      itemType = itemTypes.pop()
+      if itemType == types.IntType:
+        eList.extend( ( "A", _encodeLength( numItems ), struct.pack( "<%dq" % numItems, *lValue ) ) )
+        return
+      if itemType == types.StringType:
+        eList.extend( ( "S", _encodeLength( numItems ) ) )
+        _encodeStringBlock( lValue, eList )
+        return
+  eList.extend( ( "l", _encodeLength( numItems ) ) )
+  for uObject in lValue:
+    g_dEncodeFunctions[ type( uObject ) ]( uObject, eList )
+
+def decodeList( data, i ):
+  numItems = _decodeLength( data, i + 1 )
+  i += 5
+  oL = []
+  for iItem in xrange( numItems ):
+    ob, i = g_dDecodeFunctions[ data[ i ] ]( data, i )
+    oL.append( ob )
+  return ( oL, i )
+
+def decodeIntList( data, i ):
+  numItems = _decodeLength( data, i + 1 )
+  i += 5
+  return ( list( struct.unpack_from( "<%dq" % numItems, data, i ) ), i + 8 * numItems )
+
+def decodeStringList( data, i ):
+  return _decodeStringBlock( data, i + 5, _decodeLength( data, i + 1 ) )
+
+g_dEncodeFunctions[ types.ListType ] = encodeList
+g_dDecodeFunctions[ "l" ] = decodeList
+g_dDecodeFunctions[ "A" ] = decodeIntList
+g_dDecodeFunctions[ "S" ] = decodeStringList
+
+#Encode and decode a tuple
+def encodeTuple( lValue, eList ):
+  eList.extend( ( "t", _encodeLength( len( lValue ) ) ) )
+  for uObject in lValue:
+    g_dEncodeFunctions[ type( uObject ) ]( uObject, eList )
+
+def decodeTuple( data, i ):
+  oL, i = decodeList( data, i )
+  return ( tuple( oL ), i )
+
+g_dEncodeFunctions[ types.TupleType ] = encodeTuple
+g_dDecodeFunctions[ "t" ] = decodeTuple
+
+#Encode and decode a dictionary
+def encodeDict( dValue, eList ):
+  numItems = len( dValue )
+  if numItems > 1:
+    keys = dValue.keys()
+    if set( map( type, keys ) ) == _stringTypeSet:
+      values = [ dValue[ key ] for key in keys ]
+      if set( map( type, values ) ) == _stringTypeSet:
+        eList.extend( ( "M", _encodeLength( numItems ) ) )
+        _encodeStringBlock( keys + values, eList )
+        return
+      eList.extend( ( "K", _encodeLength( numItems ) ) )
+      _encodeStringBlock( keys, eList )
+      for uObject in values:
+        g_dEncodeFunctions[ type( uObject ) ]( uObject, eList )
+      return
+  eList.extend( ( "d", _encodeLength( numItems ) ) )
+  for key in dValue:
+    g_dEncodeFunctions[ type( key ) ]( key, eList )
+    g_dEncodeFunctions[ type( dValue[key] ) ]( dValue[key], eList )
+
+def decodeDict( data, i ):
+  numItems = _decodeLength( data, i + 1 )
+  i += 5
+  oD = {}
+  for iItem in xrange( numItems ):
+    k, i = g_dDecodeFunctions[ data[ i ] ]( data, i )
+    oD[ k ], i = g_dDecodeFunctions[ data[ i ] ]( data, i )
+  return ( oD, i )
+
+def decodeStringDict( data, i ):
+  numItems = _decodeLength( data, i + 1 )
+  strList, i = _decodeStringBlock( data, i + 5, 2 * numItems )
+  return ( dict( zip( strList[ :numItems ], strList[ numItems: ] ) ), i )
+
+def decodeStringKeyDict( data, i ):
+  keys, i = _decodeStringBlock( data, i + 5, _decodeLength( data, i + 1 ) )
+  values = []
+  for key in keys:
+    ob, i = g_dDecodeFunctions[ data[ i ] ]( data, i )
+    values.append( ob )
+  return ( dict( zip( keys, values ) ), i )
+
+g_dEncodeFunctions[ types.DictType ] = encodeDict
+g_dDecodeFunctions[ "d" ] = decodeDict
+g_dDecodeFunctions[ "M" ] = decodeStringDict
+g_dDecodeFunctions[ "K" ] = decodeStringKeyDict
+
+
+def isEncoded( data ):
+  """
+  Check if data has been encoded with this codec
+  """
+  return data[ :1 ] == MAGIC
+
+#Encode function
+def encode( uObject ):
+  eList = [ MAGIC ]
+  g_dEncodeFunctions[ type( uObject ) ]( uObject, eList )
+  return "".join( eList )
+
+def decode( data ):
+  if not data:
+    return data
+  if not isEncoded( data ):
+    raise ValueError( "Data is not binary encoded" )
+  return g_dDecodeFunctions[ data[ 1 ] ]( data, 1 )
+
+
+if __name__ == "__main__":
+  gObject = { 2 : "3", True : ( 3, None ), 2.0 * 10 ** 20 : 2.0 * 10 ** -10, 'ids' : range( 5 ),
+              'replicas' : { '/lfn/a' : { 'SE1' : 'pfn1', 'SE2' : 'pfn2' } } }
+  print "Initial: %s" % gObject
+  gData = encode( gObject )
+  print "Encoded: %s" % repr( gData )
+  print "Decoded: %s, [%s]" % decode( gData )
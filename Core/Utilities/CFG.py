@@ -2,8 +2,8 @@
 __RCSID__ = "$Id$"
 
 import types
-import copy
 import os
+import re
 try:
   import zipfile
   gZipEnabled = True
@@ -67,6 +67,9 @@ except Exception:
 
 #START OF CFG MODULE
 
+#Characters with a meaning for the parser
+gParserTokens = re.compile( r"[{}=]|\+=" )
+
 class CFG( object ):
 
   def __init__( self ):
@@ -647,27 +650,36 @@ class CFG( object ):
     @param tabLevelString: Tab string to apply to entries before representing them
     @return: String with the contents of the CFG
     """
+    lines = []
+    self.__serializeLines( tabLevelString, lines )
+    return "".join( lines )
+
+  def __serializeLines( self, tabLevelString, lines ):
+    """
+    Append the lines of the serialization to a list
+    """
     indentation = "  "
-    cfgString = ""
     for entryName in self.__orderedList:
       if entryName in self.__commentDict:
-        for commentLine in List.fromChar( self.__commentDict[ entryName ], "\n" ):
-          cfgString += "%s#%s\n" % ( tabLevelString, commentLine )
-      if entryName in self.listSections():
-        cfgString += "%s%s\n%s{\n" % ( tabLevelString, entryName, tabLevelString )
-        cfgString += self.__dataDict[ entryName ].serialize( "%s%s" % ( tabLevelString, indentation ) )
-        cfgString += "%s}\n" % tabLevelString
-      elif entryName in self.listOptions():
-        valueList = List.fromChar( self.__dataDict[ entryName ] )
+        for commentLine in self.__commentDict[ entryName ].split( "\n" ):
+          commentLine = commentLine.strip()
+          if commentLine:
+            lines.append( "%s#%s\n" % ( tabLevelString, commentLine ) )
+      if entryName not in self.__dataDict:
+        raise ValueError( "Oops. There is an entry in the order which is not a section nor an option" )
+      value = self.__dataDict[ entryName ]
+      if type( value ) != types.StringType:
+        lines.append( "%s%s\n%s{\n" % ( tabLevelString, entryName, tabLevelString ) )
+        value.__serializeLines( "%s%s" % ( tabLevelString, indentation ), lines )
+        lines.append( "%s}\n" % tabLevelString )
+      else:
+        valueList = [ field.strip() for field in value.split( "," ) if field.strip() ]
         if len( valueList ) == 0:
-          cfgString += "%s%s = \n" % ( tabLevelString, entryName )
+          lines.append( "%s%s = \n" % ( tabLevelString, entryName ) )
         else:
-          cfgString += "%s%s = %s\n" % ( tabLevelString, entryName, valueList[0] )
+          lines.append( "%s%s = %s\n" % ( tabLevelString, entryName, valueList[0] ) )
           for value in valueList[1:]:
-            cfgString += "%s%s += %s\n" % ( tabLevelString, entryName, value )
-      else:
-        raise ValueError( "Oops. There is an entry in the order which is not a section nor an option" )
-    return cfgString
+            lines.append( "%s%s += %s\n" % ( tabLevelString, entryName, value ) )
 
   @gCFGSynchro
   def clone( self ):
@@ -676,49 +688,79 @@ class CFG( object ):
 
     @return: CFG copy
     """
+    return self.__clone()
+
+  def __clone( self ):
+    #Names, comments and values are strings, so only the containers have to be copied
     clonedCFG = CFG()
-    clonedCFG.__orderedList = copy.deepcopy( self.__orderedList )
-    clonedCFG.__commentDict = copy.deepcopy( self.__commentDict )
-    for option in self.listOptions():
-      clonedCFG.__dataDict[ option ] = self[ option ]
-    for section in self.listSections():
-      clonedCFG.__dataDict[ section ] = self[ section ].clone()
+    clonedCFG.__orderedList = list( self.__orderedList )
+    clonedCFG.__commentDict = dict( self.__commentDict )
+    clonedData = clonedCFG.__dataDict
+    for key, value in self.__dataDict.iteritems():
+      if type( value ) == types.StringType:
+        clonedData[ key ] = value
+      else:
+        clonedData[ key ] = value.__clone()
     return clonedCFG
 
   @gCFGSynchro
-  def mergeWith( self, cfgToMergeWith ):
+  def mergeWith( self, cfgToMergeWith, shareSections = False ):
     """
     Generate a CFG by merging with the contents of another CFG.
 
     @type cfgToMergeWith: CFG
     @param cfgToMergeWith: CFG with the contents to merge with. This contents are more
                             preemtive than this CFG ones
+    @type shareSections: boolean
+    @param shareSections: Use the sections of this CFG that are not in cfgToMergeWith in the result
+                          instead of copies. Then neither CFG can be modified while the result is used.
+                          Sections only in cfgToMergeWith are always used without copying them
     @return: CFG with the result of the merge
     """
+    return self.__merge( cfgToMergeWith, shareSections )
+
+  def __setMergedEntry( self, key, value, comment ):
+    #As setOption and createNewSection do
+    if type( value ) == types.StringType:
+      if key not in self.__dataDict:
+        self.__orderedList.append( key )
+      self.__commentDict[ key ] = comment
+      self.__dataDict[ key ] = value
+    else:
+      if key not in self.__dataDict:
+        self.__orderedList.append( key )
+        self.__dataDict[ key ] = value
+      self.__commentDict[ key ] = comment
+      if self.__dataDict[ key ] is not value:
+        raise KeyError( "%s key already exists" % key )
+
+  def __merge( self, cfgToMergeWith, shareSections ):
     mergedCFG = CFG()
-    for option in self.listOptions():
-      mergedCFG.setOption( option,
-                           self[ option ],
-                           self.getComment( option ) )
-    for option in cfgToMergeWith.listOptions():
-      mergedCFG.setOption( option,
-                           cfgToMergeWith[ option ],
-                           cfgToMergeWith.getComment( option ) )
-    for section in self.listSections():
-      if section in cfgToMergeWith.listSections():
-        oSectionCFG = self[ section ].mergeWith( cfgToMergeWith[ section ] )
-        mergedCFG.createNewSection( section,
-                                    cfgToMergeWith.getComment( section ),
-                                    oSectionCFG )
+    selfData = self.__dataDict
+    otherData = cfgToMergeWith.__dataDict
+    for option in self.__orderedList:
+      if type( selfData[ option ] ) == types.StringType:
+        mergedCFG.__setMergedEntry( option, selfData[ option ], self.__commentDict[ option ] )
+    for option in cfgToMergeWith.__orderedList:
+      if type( otherData[ option ] ) == types.StringType:
+        mergedCFG.__setMergedEntry( option, otherData[ option ], cfgToMergeWith.__commentDict[ option ] )
+    for section in self.__orderedList:
+      sectionCFG = selfData[ section ]
+      if type( sectionCFG ) == types.StringType:
+        continue
+      if section in otherData and type( otherData[ section ] ) != types.StringType:
+        mergedCFG.__setMergedEntry( section, sectionCFG.__merge( otherData[ section ], shareSections ),
+                                    cfgToMergeWith.__commentDict[ section ] )
+      elif shareSections:
+        mergedCFG.__setMergedEntry( section, sectionCFG, self.__commentDict[ section ] )
       else:
-        mergedCFG.createNewSection( section,
-                                    self.getComment( section ),
-                                    self[ section ].clone() )
-    for section in cfgToMergeWith.listSections():
-      if section not in self.listSections():
-        mergedCFG.createNewSection( section,
-                                    cfgToMergeWith.getComment( section ),
-                                    cfgToMergeWith[ section ] )
+        mergedCFG.__setMergedEntry( section, sectionCFG.__clone(), self.__commentDict[ section ] )
+    for section in cfgToMergeWith.__orderedList:
+      sectionCFG = otherData[ section ]
+      if type( sectionCFG ) == types.StringType:
+        continue
+      if section not in selfData or type( selfData[ section ] ) == types.StringType:
+        mergedCFG.__setMergedEntry( section, sectionCFG, cfgToMergeWith.__commentDict[ section ] )
     return mergedCFG
 
   def getModifications( self, newerCfg, ignoreMask = None, parentPath = "" ):
@@ -907,34 +949,59 @@ class CFG( object ):
       if commentPos > -1:
         currentComment += "%s\n" % line[ commentPos: ].replace( "#", "" )
         line = line[ :commentPos ]
-      for index in range( len( line ) ):
-        if line[ index ] == "{":
+      #Jump from token to token instead of going through the line char by char
+      lastPos = 0
+      for match in gParserTokens.finditer( line ):
+        currentlyParsedString += line[ lastPos : match.start() ]
+        lastPos = match.end()
+        token = match.group()
+        if token == "{":
           currentlyParsedString = currentlyParsedString.strip()
-          currentLevel.createNewSection( currentlyParsedString, currentComment )
+          currentLevel.__addParsedSection( currentlyParsedString, currentComment )
           levelList.append( currentLevel )
           currentLevel = currentLevel[ currentlyParsedString ]
           currentlyParsedString = ""
           currentComment = ""
-        elif line[ index ] == "}":
+        elif token == "}":
           currentLevel = levelList.pop()
-        elif line[ index ] == "=":
-          lFields = line.split( "=" )
-          currentLevel.setOption( lFields[0].strip(),
-           "=".join( lFields[1:] ).strip(),
-           currentComment )
+        elif token == "=":
+          optionName, optionValue = line.split( "=", 1 )
+          currentLevel.__addParsedOption( optionName.strip(), optionValue.strip(), currentComment )
           currentlyParsedString = ""
           currentComment = ""
           break
-        elif line[ index: index + 2 ] == "+=":
-          valueList = line.split( "+=" )
-          currentLevel.appendToOption( valueList[0].strip(), ", %s" % "+=".join( valueList[1:] ).strip() )
+        else:
+          optionName, optionValue = line.split( "+=", 1 )
+          currentLevel.__appendParsedValue( optionName.strip(), ", %s" % optionValue.strip() )
           currentlyParsedString = ""
           currentComment = ""
           break
-        else:
-          currentlyParsedString += line[ index ]
+      else:
+        currentlyParsedString += line[ lastPos: ]
     return self
 
+  #The parser adds plain names directly, paths and errors go through the public methods
+
+  def __addParsedSection( self, sectionName, comment ):
+    if not sectionName or sectionName.find( "/" ) > -1 or sectionName in self.__dataDict:
+      return self.createNewSection( sectionName, comment )
+    self.__orderedList.append( sectionName )
+    self.__commentDict[ sectionName ] = comment
+    self.__dataDict[ sectionName ] = CFG()
+
+  def __addParsedOption( self, optionName, value, comment ):
+    if not optionName or optionName.find( "/" ) > -1:
+      return self.setOption( optionName, value, comment )
+    if optionName not in self.__dataDict:
+      self.__orderedList.append( optionName )
+    self.__commentDict[ optionName ] = comment
+    self.__dataDict[ optionName ] = value
+
+  def __appendParsedValue( self, optionName, value ):
+    if optionName.find( "/" ) > -1 or type( self.__dataDict.get( optionName ) ) != types.StringType:
+      return self.appendToOption( optionName, value )
+    self.__dataDict[ optionName ] += value
+
   @gCFGSynchro
   def loadFromDict( self, data ):
     for k in data:
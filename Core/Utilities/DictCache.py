@@ -1,19 +1,95 @@
 # $HeadURL$
+"""
+DictCache: thread safe cache of objects with an expiration time.
+
+  Entries expire after their valid seconds, measured with a monotonic clock, and
+  an expiration heap allows purging them without walking the whole cache. If a
+  maximum size is given, the least recently used entries are evicted to make room
+  for new ones. getOrLoad() fills missing entries with a loader function making
+  sure concurrent misses for the same key call the loader only once.
+"""
 __RCSID__ = "$Id$"
 
 import threading
-import datetime
+import heapq
+from DIRAC.Core.Utilities.Time import monotonic
+from DIRAC.Core.Utilities.ReturnValues import S_OK, S_ERROR
+
+#Positions in the entry and LRU link lists
+_PREV, _NEXT, _KEY, _VALUE, _EXPTIME = 0, 1, 2, 3, 4
 
 class DictCache:
 
-  def __init__( self, deleteFunction = False ):
+  def __init__( self, deleteFunction = False, maxSize = 0 ):
     """
     Initialize the dict cache.
       If a delete function is specified it will be invoked when deleting a cached object
+      If maxSize is greater than 0 the least recently used records will be evicted
+      to keep at most maxSize records
     """
-    self.__lock = threading.RLock()
+    self.__lock = threading.Lock()
     self.__cache = {}
     self.__deleteFunction = deleteFunction
+    self.__maxSize = max( 0, maxSize )
+    #Circular doubly linked list with the most recently used entries at the end
+    self.__lruRoot = []
+    self.__lruRoot[:] = [ self.__lruRoot, self.__lruRoot, None, None, None ]
+    #Heap of ( expirationTime, key ). Entries get stale when keys are renewed or deleted
+    self.__expHeap = []
+    self.__loading = {}
+    self.__stats = { 'hits' : 0, 'misses' : 0, 'loads' : 0, 'loadWaits' : 0,
+                     'evictions' : 0, 'expirations' : 0 }
+
+  #Internal helpers. Lock has to be held
+
+  def __unlink( self, entry ):
+    entry[ _PREV ][ _NEXT ] = entry[ _NEXT ]
+    entry[ _NEXT ][ _PREV ] = entry[ _PREV ]
+
+  def __linkLast( self, entry ):
+    last = self.__lruRoot[ _PREV ]
+    entry[ _PREV ] = last
+    entry[ _NEXT ] = self.__lruRoot
+    last[ _NEXT ] = entry
+    self.__lruRoot[ _PREV ] = entry
+
+  def __pop( self, cKey, deletedValues ):
+    entry = self.__cache.pop( cKey )
+    self.__unlink( entry )
+    deletedValues.append( entry[ _VALUE ] )
+
+  def __lookup( self, cKey, validSeconds ):
+    """
+    Return the entry for the key if valid for validSeconds more. Entries that are
+    not valid long enough are deleted
+    """
+    entry = self.__cache.get( cKey )
+    if entry is None:
+      return None, []
+    if entry[ _EXPTIME ] > monotonic() + validSeconds:
+      self.__unlink( entry )
+      self.__linkLast( entry )
+      return entry, []
+    deletedValues = []
+    self.__pop( cKey, deletedValues )
+    self.__stats[ 'expirations' ] += 1
+    return None, deletedValues
+
+  def __compactHeap( self ):
+    """
+    Drop stale heap items if they outnumber the live ones
+    """
+    if len( self.__expHeap ) > 2 * len( self.__cache ) + 64:
+      self.__expHeap = [ ( entry[ _EXPTIME ], cKey ) for cKey, entry in self.__cache.items() ]
+      heapq.heapify( self.__expHeap )
+
+  def __callDeleteFunction( self, deletedValues ):
+    """
+    Invoke the delete function out of the lock so it can use the cache
+    """
+    if self.__deleteFunction:
+      for value in deletedValues:
+        self.__deleteFunction( value )
 
   def exists( self, cKey, validSeconds = 0 ):
     """
@@ -24,18 +100,11 @@ class DictCache:
     """
     self.__lock.acquire()
     try:
-      #Is the key in the cache?
-      if cKey in self.__cache:
-        expTime = self.__cache[ cKey ][ 'expirationTime' ]
-        #If it's valid return True!
-        if expTime > datetime.datetime.now() + datetime.timedelta( seconds = validSeconds ):
-          return True
-        else:
-          #Delete expired
-          self.delete( cKey )
-      return False
+      entry, deletedValues = self.__lookup( cKey, validSeconds )
     finally:
       self.__lock.release()
+    self.__callDeleteFunction( deletedValues )
+    return entry is not None
 
   def delete( self, cKey ):
     """
@@ -43,15 +112,14 @@ class DictCache:
       Arguments:
         - cKey : identification key of the record
     """
+    deletedValues = []
     self.__lock.acquire()
     try:
-      if cKey not in self.__cache:
-        return
-      if self.__deleteFunction:
-        self.__deleteFunction( self.__cache[ cKey ][ 'value' ] )
-      del( self.__cache[ cKey ] )
+      if cKey in self.__cache:
+        self.__pop( cKey, deletedValues )
     finally:
       self.__lock.release()
+    self.__callDeleteFunction( deletedValues )
 
   def add( self, cKey, validSeconds, value = None ):
     """
@@ -63,13 +131,28 @@ class DictCache:
     """
     if max( 0, validSeconds ) == 0:
       return
+    deletedValues = []
     self.__lock.acquire()
     try:
-      vD = { 'expirationTime' : datetime.datetime.now() + datetime.timedelta( seconds = validSeconds ),
-             'value' : value }
-      self.__cache[ cKey ] = vD
+      expTime = monotonic() + validSeconds
+      if cKey in self.__cache:
+        entry = self.__cache[ cKey ]
+        entry[ _VALUE ] = value
+        entry[ _EXPTIME ] = expTime
+        self.__unlink( entry )
+      else:
+        entry = [ None, None, cKey, value, expTime ]
+        self.__cache[ cKey ] = entry
+      self.__linkLast( entry )
+      heapq.heappush( self.__expHeap, ( expTime, cKey ) )
+      if self.__maxSize:
+        while len( self.__cache ) > self.__maxSize:
+          self.__pop( self.__lruRoot[ _NEXT ][ _KEY ], deletedValues )
+          self.__stats[ 'evictions' ] += 1
+      self.__compactHeap()
     finally:
       self.__lock.release()
+    self.__callDeleteFunction( deletedValues )
 
   def get( self, cKey, validSeconds = 0 ):
     """
@@ -80,18 +163,86 @@ class DictCache:
     """
     self.__lock.acquire()
     try:
-      #Is the key in the cache?
-      if cKey in self.__cache:
-        expTime = self.__cache[ cKey ][ 'expirationTime' ]
-        #If it's valid return True!
-        if expTime > datetime.datetime.now() + datetime.timedelta( seconds = validSeconds ):
-          return self.__cache[ cKey ][ 'value' ]
-        else:
-          #Delete expired
-          self.delete( cKey )
+      entry, deletedValues = self.__lookup( cKey, validSeconds )
+      if entry is None:
+        self.__stats[ 'misses' ] += 1
+      else:
+        self.__stats[ 'hits' ] += 1
+    finally:
+      self.__lock.release()
+    self.__callDeleteFunction( deletedValues )
+    if entry is None:
       return False
+    return entry[ _VALUE ]
+
+  def getOrLoad( self, cKey, validSeconds, loadFunction, *args ):
+    """
+    Get a record from the cache. If it is not there call loadFunction( *args ), which
+    has to return S_OK( value )/S_ERROR, and cache the value for validSeconds.
+    If several threads miss the same key at the same time only one of them calls
+    loadFunction and the rest wait for its result
+      Arguments:
+        - cKey : identification key of the record
+        - validSeconds : valid seconds of the loaded record
+        - loadFunction : function to get the value if it's not cached
+    """
+    self.__lock.acquire()
+    try:
+      entry, deletedValues = self.__lookup( cKey, 0 )
+      if entry is not None:
+        self.__stats[ 'hits' ] += 1
+        return S_OK( entry[ _VALUE ] )
+      self.__stats[ 'misses' ] += 1
+      if cKey in self.__loading:
+        loadInfo = self.__loading[ cKey ]
+        loader = False
+        self.__stats[ 'loadWaits' ] += 1
+      else:
+        loadInfo = { 'event' : threading.Event(), 'result' : S_ERROR( "Loading %s failed" % str( cKey ) ) }
+        self.__loading[ cKey ] = loadInfo
+        loader = True
+        self.__stats[ 'loads' ] += 1
+    finally:
+      self.__lock.release()
+    self.__callDeleteFunction( deletedValues )
+
+    if not loader:
+      loadInfo[ 'event' ].wait()
+      return loadInfo[ 'result' ]
+    try:
+      try:
+        result = loadFunction( *args )
+      except Exception, e:
+        result = S_ERROR( "Exception while loading %s: %s" % ( str( cKey ), str( e ) ) )
+      if result[ 'OK' ]:
+        self.add( cKey, validSeconds, result[ 'Value' ] )
+      loadInfo[ 'result' ] = result
+      return result
+    finally:
+      self.__lock.acquire()
+      try:
+        del( self.__loading[ cKey ] )
+      finally:
+        self.__lock.release()
+      loadInfo[ 'event' ].set()
+
+  def getStats( self ):
+    """
+    Get usage statistics of the cache
+    """
+    self.__lock.acquire()
+    try:
+      stats = dict( self.__stats )
+      stats[ 'size' ] = len( self.__cache )
+      stats[ 'maxSize' ] = self.__maxSize
     finally:
       self.__lock.release()
+    lookups = stats[ 'hits' ] + stats[ 'misses' ]
+    if lookups:
+      stats[ 'hitRate' ] = float( stats[ 'hits' ] ) / lookups
+    else:
+      stats[ 'hitRate' ] = 0.0
+    return stats
 
   def showContentsInString( self ):
     """
@@ -100,11 +251,12 @@ class DictCache:
     self.__lock.acquire()
     try:
       data = []
+      now = monotonic()
       for cKey in self.__cache:
         data.append( "%s:" % str( cKey ) )
-        data.append( "\tExp: %s" % self.__cache[ cKey ][ 'expirationTime' ] )
-        if self.__cache[ cKey ][ 'value' ]:
-          data.append( "\tVal: %s" % self.__cache[ cKey ][ 'value' ] )
+        data.append( "\tExp: %.1f secs" % ( self.__cache[ cKey ][ _EXPTIME ] - now ) )
+        if self.__cache[ cKey ][ _VALUE ]:
+          data.append( "\tVal: %s" % self.__cache[ cKey ][ _VALUE ] )
       return "\n".join( data )
     finally:
       self.__lock.release()
@@ -115,12 +267,8 @@ class DictCache:
     """
     self.__lock.acquire()
     try:
-      keys = []
-      limitTime = datetime.datetime.now() + datetime.timedelta( seconds = validSeconds )
-      for cKey in self.__cache:
-        if self.__cache[ cKey ][ 'expirationTime' ] > limitTime:
-          keys.append( cKey )
-      return keys
+      limitTime = monotonic() + validSeconds
+      return [ cKey for cKey in self.__cache if self.__cache[ cKey ][ _EXPTIME ] > limitTime ]
     finally:
       self.__lock.release()
 
@@ -128,19 +276,22 @@ class DictCache:
     """
     Purge all entries that are expired or will be expired in <expiredInSeconds>
     """
+    deletedValues = []
     self.__lock.acquire()
     try:
-      keys = []
-      limitTime = datetime.datetime.now() + datetime.timedelta( seconds = expiredInSeconds )
-      for cKey in self.__cache:
-        if self.__cache[ cKey ][ 'expirationTime' ] < limitTime:
-          keys.append( cKey )
-      for cKey in keys:
-        if self.__deleteFunction:
-          self.__deleteFunction( self.__cache[ cKey ][ 'value' ] )
-        del( self.__cache[ cKey ] )
+      limitTime = monotonic() + expiredInSeconds
+      expHeap = self.__expHeap
+      while expHeap and expHeap[0][0] < limitTime:
+        expTime, cKey = heapq.heappop( expHeap )
+        entry = self.__cache.get( cKey )
+        #Skip heap items of renewed or deleted keys
+        if entry is None or entry[ _EXPTIME ] != expTime:
+          continue
+        self.__pop( cKey, deletedValues )
+        self.__stats[ 'expirations' ] += 1
     finally:
       self.__lock.release()
+    self.__callDeleteFunction( deletedValues )
 
   def purgeAll( self ):
     """
@@ -148,10 +299,10 @@ class DictCache:
     """
     self.__lock.acquire()
     try:
-      keys = self.__cache.keys()
-      for cKey in keys:
-        if self.__deleteFunction:
-          self.__deleteFunction( self.__cache[ cKey ][ 'value' ] )
-        del( self.__cache[ cKey ] )
+      deletedValues = [ entry[ _VALUE ] for entry in self.__cache.values() ]
+      self.__cache = {}
+      self.__lruRoot[:] = [ self.__lruRoot, self.__lruRoot, None, None, None ]
+      self.__expHeap = []
     finally:
       self.__lock.release()
+    self.__callDeleteFunction( deletedValues )
@@ -3,19 +3,22 @@
 ########################################################################
 """ DIRAC Basic MySQL Class
     It provides access to the basic MySQL methods in a multithread-safe mode
-    keeping used connections in a python Queue for further reuse.
+    keeping used connections in a ConnectionPool for further reuse.
 
     These are the coded methods:
 
 
     __init__( host, user, passwd, name, [maxConnsInQueue=10] )
 
-    Initializes the Queue and tries to connect to the DB server,
+    Initializes the ConnectionPool and tries to connect to the DB server,
     using the _connect method.
-    "maxConnsInQueue" defines the size of the Queue of open connections
-    that are kept for reuse. It also defined the maximum number of open
-    connections available from the object.
+    "maxConnsInQueue" defines the maximum number of connections the pool
+    hands out at the same time, further requests wait for a free one.
     maxConnsInQueue = 0 means unlimited and it is not supported.
+    "minPoolSize" connections are kept open even when idle. Idle connections
+    are pinged before reuse only if they have been idle for more than
+    "pingIdleTime" seconds, and requests wait at most "connectionWaitTime"
+    seconds for a free connection.
 
 
     _except( methodName, exception, errorMessage )
@@ -35,20 +38,20 @@
     _query( cmd, [conn] )
 
     Executes SQL command "cmd".
-    Gets a connection from the Queue (or open a new one if none is available),
-    the used connection is  back into the Queue.
+    Gets a connection from the pool (or open a new one if none is available),
+    the used connection is put back into the pool.
     If a connection to the the DB is passed as second argument this connection
-    is used and is not  in the Queue.
+    is used and is not put in the pool.
     Returns S_OK with fetchall() out in Value or S_ERROR upon failure.
 
 
     _update( cmd, [conn] )
 
     Executes SQL command "cmd" and issue a commit
-    Gets a connection from the Queue (or open a new one if none is available),
-    the used connection is  back into the Queue.
+    Gets a connection from the pool (or open a new one if none is available),
+    the used connection is put back into the pool.
     If a connection to the the DB is passed as second argument this connection
-    is used and is not  in the Queue
+    is used and is not put in the pool
     Returns S_OK with number of updated registers in Value or S_ERROR upon failure.
 
 
@@ -59,10 +62,10 @@
 
     _getConnection()
 
-    Gets a connection from the Queue (or open a new one if none is available)
+    Gets a connection from the pool (or open a new one if none is available)
     Returns S_OK with connection in Value or S_ERROR
-    the calling method is responsible for closing this connection once it is no
-    longer needed.
+    the connection does not count any more for the pool size and the calling
+    method is responsible for closing this connection once it is no longer needed.
 
 
 
@@ -93,6 +96,21 @@
       String type values will be appropriately escaped.
 
 
+    insertMany( self, tableName, inFields, valuesList, conn = None, ignore = False ):
+
+      Insert many rows in "tableName", each element of "valuesList" holding the
+      values of a row for "inFields". Rows are grouped in multi-row INSERT statements
+      split to fit in the server max_allowed_packet.
+
+
+    upsertMany( self, tableName, inFields, valuesList, updateFields = None, conn = None,
+                incrementFields = None ):
+
+      As insertMany, but rows with an existing unique key update "updateFields"
+      using INSERT ... ON DUPLICATE KEY UPDATE. "incrementFields" are added to
+      the stored values instead of replacing them.
+
+
     updateFields( self, tableName, updateFields = None, updateValues = None,
                   condDict = None,
                   limit = False, conn = None,
@@ -153,7 +171,7 @@
 __RCSID__ = "$Id$"
 
 
-from DIRAC                                  import gLogger
+from DIRAC                                  import gLogger, gMonitor
 from DIRAC                                  import S_OK, S_ERROR
 from DIRAC                                  import Time
 
@@ -163,13 +181,12 @@ MySQLdb.server_init( ['--defaults-file=/opt/dirac/etc/my.cnf', '--datadir=/opt/m
 gInstancesCount = 0
 gDebugFile = None
 
-import Queue
 import types
 import time
 import threading
 from types import StringTypes, DictType, ListType
 
-MAXCONNECTRETRY = 10
+MAXCONNECTRETRY = 3
 
 def _checkQueueSize( maxQueueSize ):
   """
@@ -219,13 +236,238 @@ def _quotedList( fieldList = None ):
 
 
 
+class ConnectionPool:
+  """
+  Pool of connections to a MySQL DB.
+    At most maxSize connections are handed out at the same time, requests beyond
+    that wait up to waitTime seconds for one to be returned. Idle connections are
+    reused most recently used first and only pinged if they have been idle for more
+    than pingIdleTime seconds. Connections idle for more than maxIdleTime are closed
+    as long as minSize connections are kept.
+    Checkout wait time, connections in use and creations are reported to gMonitor.
+  """
+
+  def __init__( self, connectArgs, name, minSize = 1, maxSize = 10, pingIdleTime = 60,
+                waitTime = 30, maxIdleTime = 600 ):
+    self.__connectArgs = connectArgs
+    self.__name = name
+    self.__minSize = max( 0, min( minSize, maxSize ) )
+    self.__maxSize = maxSize
+    self.__pingIdleTime = pingIdleTime
+    self.__waitTime = waitTime
+    self.__maxIdleTime = maxIdleTime
+    self.__log = gLogger.getSubLogger( 'ConnectionPool/%s' % name )
+    self.__lock = threading.Condition()
+    #List of ( connection, lastUseTime ), the most recently used at the end
+    self.__idle = []
+    self.__inUse = 0
+    self.__stats = { 'created' : 0, 'closed' : 0, 'checkouts' : 0, 'waits' : 0, 'waitTime' : 0.0, 'pings' : 0 }
+
+  def __markActivity( self, suffix, description, unit, operation, value ):
+    """
+    Send a mark to gMonitor registering the activity the first time
+    """
+    acName = "%s%s" % ( self.__name, suffix )
+    if acName not in gMonitor.activitiesDefinitions:
+      gMonitor.registerActivity( acName, description, "MySQL", unit, operation )
+    gMonitor.addMark( acName, value )
+
+  def __newConnection( self ):
+    """
+    Open a new connection to the DB. Retries a few times before giving up
+    """
+    for trial in range( MAXCONNECTRETRY ):
+      try:
+        connection = MySQLdb.connect( **self.__connectArgs )
+        break
+      except Exception, x:
+        self.__log.warn( 'Could not open a new connection', str( x ) )
+        if trial == MAXCONNECTRETRY - 1:
+          raise
+        time.sleep( trial + 1 )
+    self.__lock.acquire()
+    try:
+      self.__stats[ 'created' ] += 1
+    finally:
+      self.__lock.release()
+    self.__markActivity( "ConnCreated", "New connections to %s" % self.__name, "connections", gMonitor.OP_SUM, 1 )
+    return connection
+
+  def __close( self, connection ):
+    """
+    Close a connection. Lock must be held
+    """
+    try:
+      connection.close()
+    except Exception:
+      pass
+    self.__stats[ 'closed' ] += 1
+
+  def __release( self ):
+    """
+    One connection is not in use any more. Lock must not be held
+    """
+    self.__lock.acquire()
+    try:
+      self.__inUse -= 1
+      self.__lock.notify()
+    finally:
+      self.__lock.release()
+
+  def fill( self ):
+    """
+    Open connections up to the minimum size of the pool, at least one
+    """
+    self.__lock.acquire()
+    try:
+      missing = max( 1, self.__minSize ) - len( self.__idle ) - self.__inUse
+    finally:
+      self.__lock.release()
+    newConnections = []
+    try:
+      for i in range( missing ):
+        newConnections.append( self.__newConnection() )
+    finally:
+      self.__lock.acquire()
+      try:
+        now = time.time()
+        self.__idle.extend( [ ( connection, now ) for connection in newConnections ] )
+      finally:
+        self.__lock.release()
+
+  def get( self ):
+    """
+    Get a connection from the pool, opening a new one if there is room for it.
+    Waits for a connection to be returned if all of them are in use
+    """
+    startTime = time.time()
+    self.__lock.acquire()
+    try:
+      waited = False
+      while True:
+        if self.__idle:
+          connection, lastUse = self.__idle.pop()
+          break
+        if self.__inUse < self.__maxSize:
+          connection, lastUse = None, 0
+          break
+        remaining = self.__waitTime - ( time.time() - startTime )
+        if remaining <= 0:
+          return S_ERROR( 'Timeout while waiting for a free connection after %s seconds' % self.__waitTime )
+        waited = True
+        self.__lock.wait( remaining )
+      self.__inUse += 1
+      inUse = self.__inUse
+      now = time.time()
+      waitTime = now - startTime
+      self.__stats[ 'checkouts' ] += 1
+      self.__stats[ 'waitTime' ] += waitTime
+      if waited:
+        self.__stats[ 'waits' ] += 1
+      #Only connections idle for a while may have been dropped by the server
+      needPing = connection and now - lastUse > self.__pingIdleTime
+      if needPing:
+        self.__stats[ 'pings' ] += 1
+    finally:
+      self.__lock.release()
+
+    try:
+      if needPing:
+        try:
+          # This will try to reconnect if the connection has timeout
+          connection.ping( True )
+        except Exception, x:
+          self.__log.verbose( 'Discarding connection that failed to ping', str( x ) )
+          self.__lock.acquire()
+          try:
+            self.__close( connection )
+          finally:
+            self.__lock.release()
+          connection = None
+      if not connection:
+        connection = self.__newConnection()
+    except Exception, x:
+      self.__release()
+      return S_ERROR( 'Could not get a connection to %s: %s' % ( self.__name, str( x ) ) )
+
+    self.__markActivity( "ConnWaitTime", "Time waiting for a connection to %s" % self.__name, "ms",
+                         gMonitor.OP_MEAN, waitTime * 1000 )
+    self.__markActivity( "ConnInUse", "Connections to %s in use" % self.__name, "connections",
+                         gMonitor.OP_MEAN, inUse )
+    return S_OK( connection )
+
+  def put( self, connection ):
+    """
+    Return a connection to the pool
+    """
+    self.__lock.acquire()
+    try:
+      self.__inUse -= 1
+      now = time.time()
+      self.__idle.append( ( connection, now ) )
+      #Close the connections that are not needed any more
+      while len( self.__idle ) > self.__minSize and now - self.__idle[0][1] > self.__maxIdleTime:
+        self.__close( self.__idle.pop( 0 )[0] )
+      self.__lock.notify()
+    finally:
+      self.__lock.release()
+
+  def discard( self, connection ):
+    """
+    Close a connection taken from the pool instead of returning it
+    """
+    self.__lock.acquire()
+    try:
+      self.__close( connection )
+    finally:
+      self.__lock.release()
+    self.__release()
+
+  def detach( self, connection ):
+    """
+    The connection is kept by the caller and no longer counts for the pool
+    """
+    self.__release()
+
+  def close( self ):
+    """
+    Close all idle connections
+    """
+    self.__lock.acquire()
+    try:
+      while self.__idle:
+        self.__close( self.__idle.pop()[0] )
+    finally:
+      self.__lock.release()
+
+  def getStats( self ):
+    """
+    Get the pool counters
+    """
+    self.__lock.acquire()
+    try:
+      stats = dict( self.__stats )
+      stats[ 'inUse' ] = self.__inUse
+      stats[ 'idle' ] = len( self.__idle )
+      stats[ 'minSize' ] = self.__minSize
+      stats[ 'maxSize' ] = self.__maxSize
+    finally:
+      self.__lock.release()
+    if stats[ 'checkouts' ]:
+      stats[ 'meanWaitTime' ] = stats[ 'waitTime' ] / stats[ 'checkouts' ]
+    else:
+      stats[ 'meanWaitTime' ] = 0.0
+    return stats
+
+
 class MySQL:
   """
   Basic multithreaded DIRAC MySQL Client Class
   """
   __initialized = False
 
-  def __init__( self, hostName, userName, passwd, dbName, port = 3306, maxQueueSize = 3, debug = False ):
+  def __init__( self, hostName, userName, passwd, dbName, port = 3306, maxQueueSize = 3, debug = False,
+                minPoolSize = 1, pingIdleTime = 60, connectionWaitTime = 30 ):
     """
     set MySQL connection parameters and try to connect
     """
@@ -249,10 +491,19 @@ class MySQL:
     self.__passwd = str( passwd )
     self.__dbName = str( dbName )
     self.__port = port
-    # Create the connection Queue to reuse connections
-    self.__connectionQueue = Queue.Queue( maxQueueSize )
-    # Create the connection Semaphore to limit total number of open connection
-    self.__connectionSemaphore = threading.Semaphore( maxQueueSize )
+    # Create the connection pool to reuse connections and limit the number of open ones
+    self.__connectionPool = ConnectionPool( { 'host' : self.__hostName,
+                                              'port' : self.__port,
+                                              'user' : self.__userName,
+                                              'passwd' : self.__passwd,
+                                              'db' : self.__dbName },
+                                            self.__dbName,
+                                            minSize = minPoolSize,
+                                            maxSize = maxQueueSize,
+                                            pingIdleTime = pingIdleTime,
+                                            waitTime = connectionWaitTime )
+
+    self.__maxAllowedPacket = 0
 
     self.__initialized = True
     self._connect()
@@ -267,14 +518,8 @@ class MySQL:
   def __del__( self ):
     global gInstancesCount
     try:
-      while 1 and self.__initialized:
-        self.__connectionSemaphore.release()
-        try:
-          connection = self.__connectionQueue.get_nowait()
-          connection.close()
-        except Queue.Empty:
-          self.log.debug( 'No more connection in Queue' )
-          break
+      if self.__initialized:
+        self.__connectionPool.close()
       if gInstancesCount == 1:
         # only when the last instance of a MySQL object is deleted, the server
         # can be ended
@@ -380,6 +625,7 @@ class MySQL:
     inEscapeValues = []
 
     if not inValues:
+      self.__putConnection( connection )
       return S_OK( inEscapeValues )
 
     for value in inValues:
@@ -401,7 +647,7 @@ class MySQL:
 
   def _connect( self ):
     """
-    open connection to MySQL DB and put Connection into Queue
+    open connection to MySQL DB and put Connection into the pool
     set connected flag to True and return S_OK
     return S_ERROR upon failure
     """
@@ -418,7 +664,7 @@ class MySQL:
                        '[%s@%s] by user %s/%s.' %
                        ( self.__dbName, self.__hostName, self.__userName, self.__passwd ) )
     try:
-      self.__newConnection()
+      self.__connectionPool.fill()
       self.log.verbose( '_connect: Connected.' )
       self._connected = True
       return S_OK()
@@ -444,13 +690,10 @@ class MySQL:
     if gDebugFile:
       start = time.time()
 
-    if conn:
-      connection = conn
-    else:
-      retDict = self._getConnection()
-      if not retDict['OK']:
-        return retDict
-      connection = retDict[ 'Value' ]
+    retDict = self.__getConnection( conn = conn )
+    if not retDict['OK']:
+      return retDict
+    connection = retDict[ 'Value' ]
 
     try:
       cursor = connection.cursor()
@@ -474,14 +717,18 @@ class MySQL:
           self.logger.verbose( '_query: %s ...' % str( res[:10] ) )
 
       retDict = S_OK( res )
+      connectionError = False
     except Exception , x:
       self.log.warn( '_query:', cmd )
       retDict = self._except( '_query', x, 'Execution failed.' )
+      connectionError = isinstance( x, MySQLdb.OperationalError )
 
     try:
       cursor.close()
     except Exception:
       pass
+    if not conn:
+      self.__putConnection( connection, connectionError )
 
     if gDebugFile:
       print >> gDebugFile, time.time() - start, cmd.replace( '\n', '' )
@@ -490,10 +737,11 @@ class MySQL:
     return retDict
 
 
-  def _update( self, cmd, conn = None, debug = False ):
+  def _update( self, cmd, conn = None, debug = False, commit = True ):
     """ execute MySQL update command
         return S_OK with number of updated registers upon success
         return S_ERROR upon error
+        Pass commit = False to run it inside a transaction opened on conn
     """
     if debug:
       self.logger.debug( '_update:', cmd )
@@ -514,7 +762,8 @@ class MySQL:
     try:
       cursor = connection.cursor()
       res = cursor.execute( cmd )
-      connection.commit()
+      if commit:
+        connection.commit()
       if debug:
         self.log.debug( '_update:', res )
       else:
@@ -522,16 +771,18 @@ class MySQL:
       retDict = S_OK( res )
       if cursor.lastrowid:
         retDict[ 'lastRowId' ] = cursor.lastrowid
+      connectionError = False
     except Exception, x:
       self.log.warn( '_update:', cmd )
       retDict = self._except( '_update', x, 'Execution failed.' )
+      connectionError = isinstance( x, MySQLdb.OperationalError )
 
     try:
       cursor.close()
     except Exception:
       pass
     if not conn:
-      self.__putConnection( connection )
+      self.__putConnection( connection, connectionError )
 
     if gDebugFile:
       print >> gDebugFile, time.time() - start, cmd.replace( '\n', '' )
@@ -553,12 +804,10 @@ class MySQL:
       return S_ERROR( "_transaction: wrong type (%s) for cmdList" % type( cmdList ) )
 
     ## get connection 
-    connection = conn
-    if not connection:
-      retDict = self._getConnection()
-      if not retDict['OK']:
-        return retDict
-      connection = retDict[ 'Value' ]
+    retDict = self.__getConnection( conn = conn )
+    if not retDict['OK']:
+      return retDict
+    connection = retDict[ 'Value' ]
 
     ## list with cmds and their results   
     cmdRet = []
@@ -568,14 +817,20 @@ class MySQL:
         cmdRet.append( ( cmd, cursor.execute( cmd ) ) )
       connection.commit()
     except Exception, error:
-      self.logger.execption( error )
+      self.logger.exception( error )
       ## rollback, put back connection to the pool 
-      connection.rollback()
-      self.__putConnection( connection )
+      connectionError = isinstance( error, MySQLdb.OperationalError )
+      try:
+        connection.rollback()
+      except Exception:
+        connectionError = True
+      if not conn:
+        self.__putConnection( connection, connectionError )
       return S_ERROR( error )
     ## close cursor, put back connection to the pool
     cursor.close()
-    self.__putConnection( connection )
+    if not conn:
+      self.__putConnection( connection )
     return S_OK( cmdRet )
 
   def _createTables( self, tableDict, force = False ):
@@ -773,38 +1028,15 @@ class MySQL:
     return param[0].tostring()
 
 
-  def __newConnection( self ):
+  def __putConnection( self, connection, discard = False ):
     """
-    Create a New connection and put it in the Queue
-    """
-    self.log.debug( '__newConnection:' )
-
-    connection = MySQLdb.connect( host = self.__hostName,
-                                  port = self.__port,
-                                  user = self.__userName,
-                                  passwd = self.__passwd,
-                                  db = self.__dbName )
-    self.__putConnection( connection )
-
-
-  def __putConnection( self, connection ):
-    """
-    Put a connection in the Queue, if the queue is full, the connection is closed
+    Put a connection back in the pool, or close it if it is no longer usable
     """
     self.log.debug( '__putConnection:' )
-
-    # Release the semaphore first, in case something fails
-    self.__connectionSemaphore.release()
-    try:
-      self.__connectionQueue.put_nowait( connection )
-    except Queue.Full, x:
-      self.log.debug( '__putConnection: Full Queue' )
-      try:
-        connection.close()
-      except:
-        pass
-    except Exception, x:
-      self._except( '__putConnection', x, 'Failed to put Connection in Queue' )
+    if discard:
+      self.__connectionPool.discard( connection )
+    else:
+      self.__connectionPool.put( connection )
 
   def _getConnection( self ):
     """
@@ -818,54 +1050,30 @@ class MySQL:
 
     self.log.debug( '_getConnection:' )
 
-    retDict = self.__getConnection( trial = 0 )
-    self.__connectionSemaphore.release()
+    retDict = self.__getConnection()
+    if retDict[ 'OK' ]:
+      # The caller keeps the connection, it does not count for the pool any more
+      self.__connectionPool.detach( retDict[ 'Value' ] )
     return retDict
 
-  def __getConnection( self, conn = None, trial = 0 ):
+  def __getConnection( self, conn = None ):
     """
     Return a new connection to the DB,
     if conn is provided then just return it.
-    then try the Queue, if it is empty add a newConnection to the Queue and retry
-    it will retry MAXCONNECTRETRY to open a new connection and will return
-    an error if it fails.
+    otherwise get one from the pool, waiting for a free one if all are in use
     """
     self.log.debug( '__getConnection:' )
 
     if conn:
       return S_OK( conn )
 
-    try:
-      self.__connectionSemaphore.acquire()
-      connection = self.__connectionQueue.get_nowait()
-      self.log.debug( '__getConnection: Got a connection from Queue' )
-      if connection:
-        try:
-          # This will try to reconnect if the connection has timeout
-          connection.ping( True )
-        except:
-          # if the ping fails try with a new connection from the Queue
-          self.__connectionSemaphore.release()
-          return self.__getConnection()
-        return S_OK( connection )
-    except Queue.Empty, x:
-      self.__connectionSemaphore.release()
-      self.log.debug( '__getConnection: Empty Queue' )
-      try:
-        if trial == min( 10, MAXCONNECTRETRY ):
-          return S_ERROR( 'Could not get a connection after %s retries.' % MAXCONNECTRETRY )
-        try:
-          self.__newConnection()
-          return self.__getConnection()
-        except Exception, x:
-          self.log.debug( '__getConnection: Fails to get connection from Queue', x )
-          time.sleep( trial * 5.0 )
-          newtrial = trial + 1
-          return self.__getConnection( trial = newtrial )
-      except Exception, x:
-        return self._except( '__getConnection:', x, 'Failed to get connection from Queue' )
-    except Exception, x:
-      return self._except( '__getConnection:', x, 'Failed to get connection from Queue' )
+    return self.__connectionPool.get()
+
+  def getConnectionPoolStats( self ):
+    """
+    Get the counters of the connection pool
+    """
+    return S_OK( self.__connectionPool.getStats() )
 
 ########################################################################################
 #
@@ -1331,6 +1539,144 @@ class MySQL:
     return self._update( 'INSERT INTO %s %s VALUES %s' %
                          ( table, inFieldString, inValueString ), conn, debug = True )
 
+  def __getMaxAllowedPacket( self, connection ):
+    """
+    Get the maximum size of a statement accepted by the server
+    """
+    if not self.__maxAllowedPacket:
+      try:
+        cursor = connection.cursor()
+        cursor.execute( "SHOW VARIABLES LIKE 'max_allowed_packet'" )
+        self.__maxAllowedPacket = int( cursor.fetchall()[0][1] )
+        cursor.close()
+      except Exception, x:
+        self.log.warn( 'Could not get max_allowed_packet, using the MySQL default', str( x ) )
+        self.__maxAllowedPacket = 1048576
+    return self.__maxAllowedPacket
+
+  def __insertRows( self, command, tableName, inFields, valuesList, suffix, conn, commit ):
+    """
+    Insert rows using multi-row statements split to fit in max_allowed_packet
+    """
+    table = _quotedList( [tableName] )
+    if not table:
+      return S_ERROR( 'Invalid tableName argument' )
+    inFieldString = _quotedList( inFields )
+    if inFieldString == None:
+      return S_ERROR( 'Invalid inFields arguments' )
+    if not valuesList:
+      return S_OK( 0 )
+    if not commit and not conn:
+      # The transaction would be left open on a connection back in the pool
+      return S_ERROR( 'A connection is needed to insert without commit' )
+
+    retDict = self.__getConnection( conn = conn )
+    if not retDict['OK']:
+      return retDict
+    connection = retDict['Value']
+    connectionError = False
+    try:
+      # Leave some room for the protocol overhead
+      maxLength = int( self.__getMaxAllowedPacket( connection ) * 0.95 )
+      header = '%s INTO %s ( %s ) VALUES ' % ( command, table, inFieldString )
+      baseLength = len( header ) + len( suffix )
+      numFields = len( inFields )
+      statements = []
+      rows = []
+      length = baseLength
+      for values in valuesList:
+        if len( values ) != numFields:
+          return S_ERROR( 'Mismatch between inFields and inValues.' )
+        escapedValues = []
+        for value in values:
+          valueType = type( value )
+          if value is None:
+            escapedValues.append( 'NULL' )
+          elif valueType in ( types.IntType, types.LongType ):
+            escapedValues.append( str( value ) )
+          elif valueType == types.FloatType:
+            #repr keeps all the significant digits
+            escapedValues.append( repr( value ) )
+          else:
+            retDict = self.__escapeString( value, connection )
+            if not retDict['OK']:
+              return retDict
+            escapedValues.append( retDict['Value'] )
+        row = '(%s)' % ','.join( escapedValues )
+        if rows and length + len( row ) + 1 > maxLength:
+          statements.append( '%s%s%s' % ( header, ','.join( rows ), suffix ) )
+          rows = []
+          length = baseLength
+        rows.append( row )
+        length += len( row ) + 1
+      statements.append( '%s%s%s' % ( header, ','.join( rows ), suffix ) )
+
+      self.log.verbose( '%s:' % command, '%s rows into table %s in %s statements' % ( len( valuesList ), table,
+                                                                                   len( statements ) ) )
+      affectedRows = 0
+      cursor = connection.cursor()
+      try:
+        for cmd in statements:
+          self.log.debug( '%s:' % command, cmd[:min( len( cmd ) , 512 )] )
+          affectedRows += cursor.execute( cmd )
+          if commit:
+            connection.commit()
+      finally:
+        try:
+          cursor.close()
+        except Exception:
+          pass
+      return S_OK( affectedRows )
+    except Exception, x:
+      connectionError = isinstance( x, MySQLdb.OperationalError )
+      return self._except( '__insertRows', x, 'Execution failed.' )
+    finally:
+      if not conn:
+        self.__putConnection( connection, connectionError )
+
+  def insertMany( self, tableName, inFields, valuesList, conn = None, ignore = False, commit = True ):
+    """
+      Insert many rows in "tableName". Each element of "valuesList" is the list
+      of values of a row for the fields "inFields".
+      Rows are sent in multi-row INSERT statements as big as max_allowed_packet allows.
+      String type values will be appropriately escaped, None values are inserted as NULL.
+      If ignore is True rows with duplicated keys are skipped.
+      If commit is False the statements are left in the transaction opened on conn,
+      which is then mandatory.
+      return S_OK( number of inserted rows )
+    """
+    command = 'INSERT'
+    if ignore:
+      command = 'INSERT IGNORE'
+    return self.__insertRows( command, tableName, inFields, valuesList, '', conn, commit )
+
+  def upsertMany( self, tableName, inFields, valuesList, updateFields = None, conn = None,
+                  incrementFields = None, commit = True ):
+    """
+      Insert many rows in "tableName" as insertMany does. Rows clashing with an existing
+      unique key update that row instead, setting "updateFields" (all of "inFields" not in
+      "incrementFields" by default) to the new values and adding the new values to the
+      "incrementFields".
+      return S_OK( number of affected rows ) as reported by MySQL, updated rows count twice
+    """
+    if not incrementFields:
+      incrementFields = []
+    if updateFields == None:
+      updateFields = [ field for field in inFields if field not in incrementFields ]
+    quotedFields = []
+    for field in updateFields:
+      quotedField = _quotedList( [ field ] )
+      if not quotedField:
+        return S_ERROR( 'Invalid updateFields arguments' )
+      quotedFields.append( '%s=VALUES(%s)' % ( quotedField, quotedField ) )
+    for field in incrementFields:
+      quotedField = _quotedList( [ field ] )
+      if not quotedField:
+        return S_ERROR( 'Invalid incrementFields arguments' )
+      quotedFields.append( '%s=%s+VALUES(%s)' % ( quotedField, quotedField, quotedField ) )
+    suffix = ' ON DUPLICATE KEY UPDATE %s' % ', '.join( quotedFields )
+    return self.__insertRows( 'INSERT', tableName, inFields, valuesList, suffix, conn, commit )
+
 #####################################################################################
 #
 #   This is a test code for this class, it requires access to a MySQL DB
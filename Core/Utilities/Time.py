@@ -176,6 +176,40 @@ def fromString( myDate = None ):
 
   return None
 
+def _loadMonotonicClock():
+  """
+  Get a function returning seconds from the system monotonic clock.
+  Falls back to the wall clock if it is not available
+  """
+  try:
+    import ctypes
+    import ctypes.util
+    class _timespec( ctypes.Structure ):
+      _fields_ = [ ( 'tv_sec', ctypes.c_long ), ( 'tv_nsec', ctypes.c_long ) ]
+    libName = ctypes.util.find_library( 'rt' ) or ctypes.util.find_library( 'c' )
+    clockGetTime = ctypes.CDLL( libName ).clock_gettime
+    #CLOCK_MONOTONIC
+    clockId = 1
+    tSpec = _timespec()
+    if clockGetTime( clockId, ctypes.byref( tSpec ) ) != 0:
+      return nativetime.time
+    def monotonicClock( timespec = _timespec, byref = ctypes.byref ):
+      tSpec = timespec()
+      clockGetTime( clockId, byref( tSpec ) )
+      return tSpec.tv_sec + tSpec.tv_nsec * 1e-9
+    return monotonicClock
+  except Exception:
+    return nativetime.time
+
+_monotonicClock = _loadMonotonicClock()
+
+def monotonic():
+  """
+  Return seconds from a clock that never goes backwards. Only differences
+  between two calls are meaningful, use it to measure intervals and expirations
+  """
+  return _monotonicClock()
+
 class timeInterval:
   """
      Simple class to define a timeInterval object able to check if a given
@@ -0,0 +1,72 @@
+########################################################################
+# $HeadURL $
+# File: BinEncodeBenchmark.py
+########################################################################
+
+""".. module:: BinEncodeBenchmark
+
+Compare DEncode and BinEncode speed and size on payloads shaped like
+the responses of getReplicas, getJobPageSummaryWeb and job id lists.
+
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import sys
+import time
+import datetime
+from DIRAC.Core.Utilities import BinEncode, DEncode
+
+def replicasPayload( numFiles = 20000 ):
+  """ getReplicas like response """
+  successful = {}
+  for i in xrange( numFiles ):
+    lfn = "/lhcb/MC/2012/ALLSTREAMS.DST/00020000/0000/00020000_%08d_1.allstreams.dst" % i
+    successful[ lfn ] = { "CERN-DST" : "srm://srm-lhcb.cern.ch/castor/cern.ch/grid%s" % lfn,
+                          "GRIDKA-DST" : "srm://gridka-dcache.fzk.de/pnfs/gridka.de/lhcb%s" % lfn }
+  return { 'OK' : True, 'Value' : { 'Successful' : successful, 'Failed' : {} } }
+
+def jobSummaryPayload( numJobs = 20000 ):
+  """ getJobPageSummaryWeb like response """
+  paramNames = [ 'JobID', 'Status', 'MinorStatus', 'ApplicationStatus', 'Site', 'JobName',
+                 'LastUpdateTime', 'Owner', 'OwnerGroup', 'JobGroup' ]
+  now = datetime.datetime.utcnow()
+  records = []
+  for i in xrange( numJobs ):
+    records.append( [ str( 1000000 + i ), 'Done', 'Execution Complete', 'Job Finished Successfully',
+                      'LCG.CERN.ch', 'Job_%s' % i, str( now ), 'someuser', 'lhcb_user', '00012345' ] )
+  return { 'OK' : True, 'Value' : { 'ParameterNames' : paramNames, 'Records' : records,
+                                    'TotalRecords' : numJobs, 'Extras' : { 'Done' : numJobs } } }
+
+def jobIDsPayload( numJobs = 200000 ):
+  """ list of job ids """
+  return { 'OK' : True, 'Value' : range( 1000000, 1000000 + numJobs ) }
+
+def timeCodec( codec, payload, iterations = 3 ):
+  encodeTime = decodeTime = 0
+  for i in range( iterations ):
+    start = time.time()
+    data = codec.encode( payload )
+    encodeTime += time.time() - start
+    start = time.time()
+    decoded = codec.decode( data )[0]
+    decodeTime += time.time() - start
+  assert decoded == payload
+  return ( encodeTime / iterations, decodeTime / iterations, len( data ) )
+
+def runBenchmark():
+  for name, payloadFunc in ( ( "getReplicas", replicasPayload ),
+                             ( "getJobPageSummaryWeb", jobSummaryPayload ),
+                             ( "jobIDs", jobIDsPayload ) ):
+    payload = payloadFunc()
+    print "%s:" % name
+    for codec in ( DEncode, BinEncode ):
+      encodeTime, decodeTime, size = timeCodec( codec, payload )
+      print "  %-10s encode %.3f s  decode %.3f s  size %.1f MB" % ( codec.__name__.split( "." )[-1],
+                                                                  encodeTime, decodeTime,
+                                                                  size / 1048576.0 )
+    sys.stdout.flush()
+
+if __name__ == "__main__":
+  runBenchmark()
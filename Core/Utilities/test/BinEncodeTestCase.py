@@ -0,0 +1,84 @@
+########################################################################
+# $HeadURL $
+# File: BinEncodeTestCase.py
+########################################################################
+
+""".. module:: BinEncodeTestCase
+
+Test cases for DIRAC.Core.Utilities.BinEncode module.
+
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import datetime
+import unittest
+from DIRAC.Core.Utilities import BinEncode, DEncode
+
+########################################################################
+class BinEncodeTestCase( unittest.TestCase ):
+  """py:class BinEncodeTestCase
+  Test case for DIRAC.Core.Utilities.BinEncode module.
+  """
+
+  def roundTrip( self, uObject ):
+    data = BinEncode.encode( uObject )
+    self.assertEqual( BinEncode.isEncoded( data ), True )
+    decoded, end = BinEncode.decode( data )
+    self.assertEqual( end, len( data ) )
+    self.assertEqual( decoded, uObject )
+    self.assertEqual( type( decoded ), type( uObject ) )
+    return decoded
+
+  def testScalars( self ):
+    """ scalar types """
+    for uObject in ( 0, -1, 2 ** 62, 10 ** 30, -10 ** 30, 1.5, -2.0 * 10 ** -10, True, False,
+                     "", "a:b", "\x00e", u"\xf1and\xfa", None ):
+      self.roundTrip( uObject )
+
+  def testDateTime( self ):
+    """ datetime, date and time """
+    now = datetime.datetime.utcnow()
+    for uObject in ( now, now.date(), now.time() ):
+      self.roundTrip( uObject )
+
+  def testContainers( self ):
+    """ generic lists, tuples and dicts """
+    self.roundTrip( [] )
+    self.roundTrip( [ 1 ] )
+    self.roundTrip( ( 1, "a", None, ( 2.5, [] ) ) )
+    self.roundTrip( {} )
+    self.roundTrip( { 1 : "a", "b" : [ 1, 2L ], ( 1, 2 ) : { True : None } } )
+
+  def testFastPaths( self ):
+    """ homogeneous lists and string keyed dicts """
+    self.roundTrip( range( -5, 1000 ) )
+    self.roundTrip( [ "a", "", "\x00\x01", "long" * 100 ] )
+    self.roundTrip( dict( [ ( "k%s" % i, "v%s" % i ) for i in range( 100 ) ] ) )
+    replicas = dict( [ ( "/lfn/%s" % i, { "SE-A" : "pfn-a-%s" % i, "SE-B" : "pfn-b-%s" % i } ) for i in range( 100 ) ] )
+    self.roundTrip( { "Successful" : replicas, "Failed" : {} } )
+    #Mixed types must not take the fast paths
+    self.roundTrip( [ 1, 2L, True, 3 ] )
+    self.roundTrip( [ "a", u"b", "c" ] )
+    self.roundTrip( { "a" : "1", "b" : 2, "c" : u"3" } )
+    self.roundTrip( { "a" : "1", u"b" : "2" } )
+
+  def testSameAsDEncode( self ):
+    """ both codecs give back the same objects """
+    uObject = { 'OK' : True, 'Value' : { 'ParameterNames' : [ 'JobID', 'Status', 'Site' ],
+                                         'Records' : [ [ 1, 'Done', 'LCG.CERN.ch' ], [ 2L, 'Failed', None ] ],
+                                         'TotalRecords' : 2 } }
+    self.assertEqual( BinEncode.decode( BinEncode.encode( uObject ) )[0],
+                      DEncode.decode( DEncode.encode( uObject ) )[0] )
+
+  def testNotEncoded( self ):
+    """ DEncoded data is rejected """
+    self.assertEqual( BinEncode.isEncoded( DEncode.encode( [ 1, 2 ] ) ), False )
+    self.assertRaises( ValueError, BinEncode.decode, DEncode.encode( [ 1, 2 ] ) )
+
+## test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( BinEncodeTestCase )
+  unittest.TextTestRunner(verbosity=3).run( SUITE )
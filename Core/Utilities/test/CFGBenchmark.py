@@ -0,0 +1,80 @@
+########################################################################
+# $HeadURL $
+# File: CFGBenchmark.py
+########################################################################
+
+""".. module:: CFGBenchmark
+
+Time loading, serializing, cloning and merging a CFG shaped like
+a large production configuration.
+
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import sys
+import time
+from DIRAC.Core.Utilities.CFG import CFG
+
+def resourcesBuffer( numSites = 3000 ):
+  """ Resources/Sites like cfg """
+  lines = [ "Resources", "{", "  Sites", "  {", "    LCG", "    {" ]
+  for i in xrange( numSites ):
+    lines.extend( [ "      #Site %d" % i,
+                    "      LCG.Site%d.org" % i,
+                    "      {",
+                    "        Name = SITE%d" % i,
+                    "        CE = ce%d.site%d.org" % ( i, i ),
+                    "        CE += ce%d-2.site%d.org" % ( i, i ),
+                    "        SE = SITE%d-disk, SITE%d-tape" % ( i, i ),
+                    "        Coordinates = %d.5:%d.5" % ( i % 90, i % 180 ),
+                    "        CEs",
+                    "        {",
+                    "          ce%d.site%d.org" % ( i, i ),
+                    "          {",
+                    "            CEType = CREAM",
+                    "            Queues",
+                    "            {",
+                    "              long",
+                    "              {",
+                    "                maxCPUTime = 2880",
+                    "                SI00 = 2500",
+                    "              }",
+                    "            }",
+                    "          }",
+                    "        }",
+                    "      }" ] )
+  lines.extend( [ "    }", "  }", "}" ] )
+  return "\n".join( lines )
+
+def timeCFG( data, iterations = 3 ):
+  times = { 'load' : 0, 'serialize' : 0, 'clone' : 0, 'merge' : 0 }
+  for i in range( iterations ):
+    start = time.time()
+    cfg = CFG().loadFromBuffer( data )
+    times[ 'load' ] += time.time() - start
+    start = time.time()
+    serialized = cfg.serialize()
+    times[ 'serialize' ] += time.time() - start
+    start = time.time()
+    clone = cfg.clone()
+    times[ 'clone' ] += time.time() - start
+    start = time.time()
+    cfg.mergeWith( clone )
+    times[ 'merge' ] += time.time() - start
+  assert CFG().loadFromBuffer( serialized ).serialize() == serialized
+  for key in times:
+    times[ key ] /= iterations
+  return times
+
+def runBenchmark():
+  data = resourcesBuffer()
+  print "cfg of %.1f MB:" % ( len( data ) / 1048576.0 )
+  times = timeCFG( data )
+  for key in ( 'load', 'serialize', 'clone', 'merge' ):
+    print "  %-10s %.3f s" % ( key, times[ key ] )
+  sys.stdout.flush()
+
+if __name__ == "__main__":
+  runBenchmark()
@@ -0,0 +1,195 @@
+########################################################################
+# $HeadURL $
+# File: CFGSnapshotTestCase.py
+########################################################################
+
+""".. module:: CFGSnapshotTestCase
+
+Test cases for the snapshots the configuration is read from,
+DIRAC.ConfigurationSystem.private.ConfigurationData.CFGSnapshot, and for the
+snapshots cached by the Operations helper.
+
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import unittest
+from DIRAC.Core.Utilities.CFG import CFG
+from DIRAC.ConfigurationSystem.private.ConfigurationData import ConfigurationData
+from DIRAC.ConfigurationSystem.Client.ConfigurationData import gConfigurationData
+from DIRAC.ConfigurationSystem.Client.Helpers.Operations import Operations
+
+localBuffer = """
+#Local systems
+Systems
+{
+  Option1 = local1
+  Test
+  {
+    #Local option
+    Option2 = local2
+  }
+}
+LocalOnly
+{
+  Option3 = a, b
+}
+"""
+
+remoteBuffer = """
+Systems
+{
+  #Overridden by the local one
+  Option1 = remote1
+  Test
+  {
+    Option4 = remote4
+  }
+}
+#Remote resources
+Resources
+{
+  Sites
+  {
+    Site1
+    {
+      CE = ce1
+    }
+  }
+}
+"""
+
+operationsBuffer = """
+Operations
+{
+  Defaults
+  {
+    Option = default
+    Section
+    {
+      A = 1
+    }
+  }
+  Test
+  {
+    Option = test
+  }
+  vo
+  {
+    Defaults
+    {
+      VOOption = vo
+    }
+  }
+}
+"""
+
+########################################################################
+class CFGSnapshotTestCase( unittest.TestCase ):
+  """py:class CFGSnapshotTestCase
+  Test case for the snapshot of the merged configuration.
+  """
+
+  def setUp( self ):
+    self.cd = ConfigurationData( False )
+    self.cd.mergeWithLocal( CFG().loadFromBuffer( localBuffer ) )
+    self.cd.loadRemoteCFGFromMem( remoteBuffer )
+
+  def checkSection( self, snapshot, cfg, path ):
+    """ snapshot lookups under path match the contents of cfg """
+    self.assertEqual( snapshot.getSections( path ), cfg.listSections( True ) )
+    self.assertEqual( snapshot.getOptions( path ), cfg.listOptions( True ) )
+    self.assertEqual( snapshot.getOptionsDict( path ), dict( [ ( option, cfg[ option ] ) for option in cfg.listOptions() ] ) )
+    self.assert_( snapshot.getSectionCFG( path ) is cfg )
+    for key in cfg.listAll():
+      keyPath = "%s/%s" % ( path, key )
+      self.assertEqual( snapshot.getComment( keyPath ), cfg.getComment( key ) )
+      if key in cfg.listOptions():
+        self.assertEqual( snapshot.getOption( keyPath ), cfg[ key ] )
+        self.assertEqual( snapshot.getSections( keyPath ), None )
+      else:
+        self.assertEqual( snapshot.getOption( keyPath ), None )
+        self.checkSection( snapshot, cfg[ key ], keyPath )
+
+  def testLookups( self ):
+    """ options, sections and comments are the ones of the merged CFG """
+    snapshot = self.cd.getSnapshot()
+    self.assert_( snapshot.cfg is self.cd.mergedCFG )
+    self.checkSection( snapshot, self.cd.mergedCFG, "" )
+    self.assertEqual( self.cd.extractOptionFromCFG( "/Systems/Option1" ), "local1" )
+    self.assertEqual( self.cd.extractOptionFromCFG( " Systems//Test/Option4 " ), "remote4" )
+    self.assertEqual( self.cd.getOptionsFromCFG( "/Systems/Test" ), [ "Option4", "Option2" ] )
+    self.assertEqual( self.cd.getSectionsFromCFG( "/" ), [ "Systems", "Resources", "LocalOnly" ] )
+    self.assertEqual( self.cd.getCommentFromCFG( "/Systems/Test/Option2" ), "Local option\n" )
+    self.assertEqual( self.cd.extractOptionFromCFG( "/Systems/Missing" ), None )
+    self.assertEqual( self.cd.getSectionsFromCFG( "/Missing" ), None )
+    self.assertEqual( self.cd.getSnapshot().getSectionCFG( "/Missing" ), False )
+
+  def testSwappedOnSync( self ):
+    """ changes are seen in a new snapshot, the previous one is left as it was """
+    snapshot = self.cd.getSnapshot()
+    mergedData = str( snapshot.cfg )
+    self.cd.setOptionInCFG( "/Systems/Test/Option2", "changed" )
+    self.cd.setOptionInCFG( "/Resources/Sites/Site1/CE", "changed", self.cd.remoteCFG )
+    self.cd.deleteOptionInCFG( "/LocalOnly/Option3" )
+    newSnapshot = self.cd.getSnapshot()
+    self.failIf( newSnapshot is snapshot )
+    self.assertEqual( newSnapshot.sequence, snapshot.sequence + 3 )
+    self.assertEqual( self.cd.extractOptionFromCFG( "/Systems/Test/Option2" ), "changed" )
+    self.assertEqual( self.cd.extractOptionFromCFG( "/Resources/Sites/Site1/CE" ), "changed" )
+    self.assertEqual( self.cd.getOptionsFromCFG( "/LocalOnly" ), [] )
+    self.checkSection( newSnapshot, self.cd.mergedCFG, "" )
+    # The sections shared with the local and remote CFGs were not modified in place
+    self.assertEqual( str( snapshot.cfg ), mergedData )
+    self.assertEqual( snapshot.getOption( "/Systems/Test/Option2" ), "local2" )
+    self.assertEqual( snapshot.getSectionCFG( "/Resources/Sites/Site1" )[ "CE" ], "ce1" )
+    self.assertEqual( snapshot.getOptions( "/LocalOnly" ), [ "Option3" ] )
+
+class OperationsTestCase( unittest.TestCase ):
+  """py:class OperationsTestCase
+  Test case for the snapshots cached by the Operations helper.
+  """
+
+  def setUp( self ):
+    gConfigurationData.mergeWithLocal( CFG().loadFromBuffer( operationsBuffer ) )
+
+  def tearDown( self ):
+    gConfigurationData.deleteOptionInCFG( "/Operations" )
+    gConfigurationData.deleteOptionInCFG( "/Operations", gConfigurationData.remoteCFG )
+
+  def testLookups( self ):
+    ops = Operations( vo = "vo", setup = "Test" )
+    self.assertEqual( ops.getValue( "Option" ), "test" )
+    self.assertEqual( ops.getValue( "VOOption" ), "vo" )
+    self.assertEqual( ops.getValue( "Missing", "default" ), "default" )
+    self.assertEqual( ops.getOptionsDict( "Section" )[ 'Value' ], { 'A' : '1' } )
+    self.assertEqual( ops.getSections( "/" )[ 'Value' ], [ "Section" ] )
+    self.assertEqual( ops.getOptions( "Option" )[ 'Message' ], "Option in Operations is not a section" )
+    self.assertEqual( ops.getOptions( "Missing" )[ 'Message' ], "Missing in Operations does not exist" )
+    self.assertEqual( Operations( vo = "vo", setup = "Other" ).getValue( "Option" ), "default" )
+
+  def testNewVersion( self ):
+    """ the cached snapshots are dropped when the configuration changes """
+    ops = Operations( vo = "vo", setup = "Test" )
+    self.assertEqual( ops.getValue( "Option" ), "test" )
+    cacheSnapshot, cacheDict = Operations._Operations__cache
+    self.assert_( cacheSnapshot is gConfigurationData.getSnapshot() )
+    opsSnapshot = cacheDict[ ( "vo", "Test" ) ]
+    # Same snapshot while the configuration is not changed
+    ops.getValue( "VOOption" )
+    self.assert_( Operations._Operations__cache[1][ ( "vo", "Test" ) ] is opsSnapshot )
+    gConfigurationData.setOptionInCFG( "/Operations/Test/NewOption", "new", gConfigurationData.remoteCFG )
+    gConfigurationData.generateNewVersion()
+    self.assertEqual( ops.getValue( "NewOption" ), "new" )
+    cacheSnapshot, cacheDict = Operations._Operations__cache
+    self.assert_( cacheSnapshot is gConfigurationData.getSnapshot() )
+    self.failIf( cacheDict[ ( "vo", "Test" ) ] is opsSnapshot )
+    self.assertEqual( opsSnapshot.getOption( "NewOption" ), None )
+
+## test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( CFGSnapshotTestCase )
+  SUITE.addTest( TESTLOADER.loadTestsFromTestCase( OperationsTestCase ) )
+  unittest.TextTestRunner(verbosity=3).run( SUITE )
@@ -0,0 +1,93 @@
+########################################################################
+# $HeadURL $
+# File: CFGTestCase.py
+########################################################################
+
+""".. module:: CFGTestCase
+
+Test cases for DIRAC.Core.Utilities.CFG module.
+
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import unittest
+from DIRAC.Core.Utilities.CFG import CFG
+
+def generateCFG( numSections = 50, numOptions = 20, depth = 3, indentation = "" ):
+  """ cfg buffer with nested sections, lists and comments """
+  lines = []
+  for i in range( numOptions ):
+    if i % 5 == 0:
+      lines.append( "%s#Comment for option %d" % ( indentation, i ) )
+    lines.append( "%sOption%d = value%d" % ( indentation, i, i ) )
+    if i % 3 == 0:
+      lines.append( "%sOption%d += other%d" % ( indentation, i, i ) )
+  if depth:
+    for i in range( numSections ):
+      lines.append( "%s#Comment for section %d" % ( indentation, i ) )
+      lines.append( "%sSection%d\n%s{" % ( indentation, i, indentation ) )
+      lines.append( generateCFG( numSections / 5 + 1, numOptions, depth - 1, indentation + "  " ) )
+      lines.append( "%s}" % indentation )
+  return "\n".join( lines )
+
+########################################################################
+class CFGTestCase( unittest.TestCase ):
+  """py:class CFGTestCase
+  Test case for DIRAC.Core.Utilities.CFG module.
+  """
+
+  def setUp( self ):
+    self.buffer = generateCFG( numSections = 20 )
+
+  def testRoundTrip( self ):
+    """ load -> serialize -> load """
+    cfg = CFG().loadFromBuffer( self.buffer )
+    data = cfg.serialize()
+    self.assertEqual( CFG().loadFromBuffer( data ).serialize(), data )
+    self.assertEqual( cfg.getOption( "Section3/Section2/Option3" ), "value3, other3" )
+    self.assertEqual( cfg.getComment( "Section3" ), "Comment for section 3\n" )
+
+  def testParser( self ):
+    """ tokens, comments and values """
+    cfg = CFG().loadFromBuffer( "A { B = 1\n}\nC = x=y # trailing\nC += z\n#c1\n#c2\nS\n{\n  D = \n}\nA/E = 3\n" )
+    self.assertEqual( cfg.listSections(), [ "A", "S" ] )
+    self.assertEqual( cfg.listOptions(), [ "C" ] )
+    self.assertEqual( cfg[ "A" ].listOptions(), [ "A { B", "E" ] )
+    self.assertEqual( cfg[ "C" ], "x=y, z" )
+    self.assertEqual( cfg.getComment( "S" ), "c1\nc2\n" )
+    self.assertEqual( cfg[ "S" ][ "D" ], "" )
+    self.assertEqual( cfg.serialize(),
+                      "A\n{\n  A { B = 1\n  E = 3\n}\n#trailing\nC = x=y\nC += z\n#c1\n#c2\nS\n{\n  D = \n}\n" )
+    self.assertRaises( KeyError, CFG().loadFromBuffer, "S\n{\n}\nS\n{\n}\n" )
+    self.assertRaises( KeyError, CFG().loadFromBuffer, "A += 1\n" )
+
+  def testClone( self ):
+    """ clones do not share data """
+    cfg = CFG().loadFromBuffer( self.buffer )
+    clone = cfg.clone()
+    self.assertEqual( clone.serialize(), cfg.serialize() )
+    clone.setOption( "Section1/Section1/Option1", "changed" )
+    self.assertEqual( cfg.getOption( "Section1/Section1/Option1" ), "value1" )
+
+  def testMerge( self ):
+    """ shared and copied sections give the same result """
+    cfg = CFG().loadFromBuffer( self.buffer )
+    other = CFG().loadFromBuffer( "Option1 = new\nSection1\n{\n  Option2 = new\n}\nNewSection\n{\n  A = 1\n}\n" )
+    merged = cfg.mergeWith( other )
+    shared = cfg.mergeWith( other, shareSections = True )
+    self.assertEqual( shared.serialize(), merged.serialize() )
+    self.assertEqual( merged[ "Option1" ], "new" )
+    self.assertEqual( merged.getOption( "Section1/Option2" ), "new" )
+    self.assertEqual( merged.getOption( "Section1/Option3" ), "value3, other3" )
+    self.assertEqual( merged.listSections()[-1], "NewSection" )
+    self.assertEqual( shared[ "Section2" ] is cfg[ "Section2" ], True )
+    self.assertEqual( merged[ "Section2" ] is cfg[ "Section2" ], False )
+    self.assertRaises( KeyError, cfg.mergeWith, CFG().loadFromBuffer( "Section1 = 1\n" ) )
+
+## test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( CFGTestCase )
+  unittest.TextTestRunner(verbosity=3).run( SUITE )
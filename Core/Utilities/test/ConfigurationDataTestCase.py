@@ -0,0 +1,170 @@
+########################################################################
+# $HeadURL $
+# File: ConfigurationDataTestCase.py
+########################################################################
+
+""".. module:: ConfigurationDataTestCase
+
+Test cases for the refresh of the configuration with the modifications since the
+client version, DIRAC.ConfigurationSystem.private.ConfigurationData.
+
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import random
+import unittest
+from DIRAC import S_OK, S_ERROR
+from DIRAC.ConfigurationSystem.private.ConfigurationData import ConfigurationData
+import DIRAC.ConfigurationSystem.private.Refresher as RefresherModule
+
+def generateOptions( path, numOptions, seed = 0 ):
+  """ { path/OptionN : random value } """
+  generator = random.Random( seed )
+  return dict( [ ( "%s/Option%d" % ( path, i ), "%x" % generator.getrandbits( 128 ) ) for i in range( numOptions ) ] )
+
+def publish( server, version, options ):
+  """ set options { path : value } in the remote CFG of server and publish a new version """
+  for path, value in options.items():
+    server.setOptionInCFG( path, value, server.remoteCFG )
+  server.setVersion( version )
+
+class FakeConfigurationClient:
+  """ Calls the ConfigurationHandler methods on a server ConfigurationData """
+
+  def __init__( self, server, withModifications = True ):
+    self.server = server
+    self.withModifications = withModifications
+    self.serviceURL = "dips://fake:9135/Configuration/Server"
+    self.calls = []
+
+  def getModificationsIfNewer( self, clientVersion ):
+    self.calls.append( 'getModificationsIfNewer' )
+    if not self.withModifications:
+      return S_ERROR( "Unknown method getModificationsIfNewer" )
+    return S_OK( self.server.getDataIfNewer( clientVersion, withModifications = True ) )
+
+  def getCompressedDataIfNewer( self, clientVersion ):
+    self.calls.append( 'getCompressedDataIfNewer' )
+    return S_OK( self.server.getDataIfNewer( clientVersion ) )
+
+########################################################################
+class ModificationsTestCase( unittest.TestCase ):
+  """py:class ModificationsTestCase
+  Test case for the configuration modifications sent to the clients.
+  """
+
+  def setUp( self ):
+    self.server = ConfigurationData( False )
+    self.server.setAsService()
+    options = generateOptions( "/Resources/Sites/Site1", 50 )
+    options.update( { "/Systems/Option1" : "value1", "/Resources/Sites/Site1/CE" : "ce1" } )
+    publish( self.server, "1", options )
+    self.client = ConfigurationData( False )
+    self.client.loadRemoteCFGFromCompressedMem( self.server.getCompressedData() )
+
+  def testHistory( self ):
+    """ kept on the service only, trimmed to HistoryLength """
+    publish( self.client, "2", { "/Systems/Option1" : "value2" } )
+    self.assertEqual( self.client.getCompressedModifications( "1" ), False )
+    self.server.setOptionInCFG( "/DIRAC/Configuration/HistoryLength", "2" )
+    for version in ( "2", "3", "4" ):
+      publish( self.server, version, { "/Systems/Option1" : "value%s" % version } )
+    self.assertEqual( [ version for version, cfg in self.server._ConfigurationData__remoteHistory ], [ "3", "4" ] )
+    self.assertEqual( self.server.getCompressedModifications( "2" ), False )
+    self.assert_( self.server.getCompressedModifications( "3" ) )
+    # Changes are not in the history until the version is published
+    self.server.setOptionInCFG( "/Systems/Option1", "unpublished", self.server.remoteCFG )
+    self.assertEqual( self.server._ConfigurationData__remoteHistory[-1][1].getOption( "/Systems/Option1" ), "value4" )
+
+  def testUnknownVersion( self ):
+    """ whole configuration for versions out of the history """
+    publish( self.server, "2", { "/Systems/Option1" : "value2" } )
+    dataDict = self.server.getDataIfNewer( "0", withModifications = True )
+    self.assertEqual( dataDict[ 'newestVersion' ], "2" )
+    self.assertEqual( dataDict[ 'data' ], self.server.getCompressedData() )
+    self.failIf( 'modifications' in dataDict )
+    self.assert_( 'modifications' in self.server.getDataIfNewer( "1", withModifications = True ) )
+    self.failIf( 'modifications' in self.server.getDataIfNewer( "1" ) )
+    self.assertEqual( self.server.getDataIfNewer( "2", withModifications = True ), { 'newestVersion' : "2" } )
+
+  def testBiggerModifications( self ):
+    """ whole configuration when the modifications are bigger """
+    server = ConfigurationData( False )
+    server.setAsService()
+    publish( server, "1", {} )
+    publish( server, "2", generateOptions( "/Resources/Sites/Site1", 200 ) )
+    self.assert_( len( server.getCompressedModifications( "1" ) ) > len( server.getCompressedData() ) )
+    dataDict = server.getDataIfNewer( "1", withModifications = True )
+    self.assert_( 'data' in dataDict )
+    self.failIf( 'modifications' in dataDict )
+
+  def testApply( self ):
+    """ the client CFG is the same as the remote one, other versions are rejected """
+    publish( self.server, "2", { "/Systems/Option1" : "value2", "/Systems/Option2" : "new",
+                                 "/Resources/Sites/Site2/CE" : "ce2" } )
+    self.server.deleteOptionInCFG( "/Resources/Sites/Site1/CE", self.server.remoteCFG )
+    self.server.generateNewVersion()
+    newVersion = self.server.getVersion()
+    dataDict = self.server.getDataIfNewer( "1", withModifications = True )
+    result = self.client.applyRemoteModifications( dataDict[ 'modifications' ], newVersion )
+    self.assert_( result[ 'OK' ] )
+    self.assertEqual( str( self.client.remoteCFG ), str( self.server.remoteCFG ) )
+    self.assertEqual( self.client.extractOptionFromCFG( "/Systems/Option2" ), "new" )
+
+    # Modifications from another version
+    client = ConfigurationData( False )
+    client.loadRemoteCFGFromMem( str( self.server._ConfigurationData__remoteHistory[0][1] ) )
+    publish( client, "1", { "/Systems/Option1" : "local" } )
+    remoteCFG = str( client.remoteCFG )
+    self.failIf( client.applyRemoteModifications( dataDict[ 'modifications' ], "3" )[ 'OK' ] )
+    self.failIf( client.applyRemoteModifications( "not compressed", newVersion )[ 'OK' ] )
+    self.assertEqual( str( client.remoteCFG ), remoteCFG )
+
+class RefresherTestCase( unittest.TestCase ):
+  """py:class RefresherTestCase
+  Test case for the update of the configuration of the clients.
+  """
+
+  def setUp( self ):
+    self.server = ConfigurationData( False )
+    self.server.setAsService()
+    options = generateOptions( "/Resources/Sites/Site1", 50 )
+    options[ "/Systems/Option1" ] = "value1"
+    publish( self.server, "1", options )
+    self.client = ConfigurationData( False )
+    self.client.loadRemoteCFGFromCompressedMem( self.server.getCompressedData() )
+    publish( self.server, "2", { "/Systems/Option1" : "value2" } )
+    self.realConfigurationData = RefresherModule.gConfigurationData
+    RefresherModule.gConfigurationData = self.client
+
+  def tearDown( self ):
+    RefresherModule.gConfigurationData = self.realConfigurationData
+
+  def testModifications( self ):
+    serviceClient = FakeConfigurationClient( self.server )
+    self.assert_( RefresherModule._updateFromRemoteLocation( serviceClient )[ 'OK' ] )
+    self.assertEqual( serviceClient.calls, [ 'getModificationsIfNewer' ] )
+    self.assertEqual( str( self.client.remoteCFG ), str( self.server.remoteCFG ) )
+
+  def testOldServer( self ):
+    serviceClient = FakeConfigurationClient( self.server, withModifications = False )
+    self.assert_( RefresherModule._updateFromRemoteLocation( serviceClient )[ 'OK' ] )
+    self.assertEqual( serviceClient.calls, [ 'getModificationsIfNewer', 'getCompressedDataIfNewer' ] )
+    self.assertEqual( self.client.getVersion(), "2" )
+
+  def testFailedModifications( self ):
+    # The client CFG is not the one of its version
+    self.client.deleteOptionInCFG( "/Systems/Option1", self.client.remoteCFG )
+    serviceClient = FakeConfigurationClient( self.server )
+    self.assert_( RefresherModule._updateFromRemoteLocation( serviceClient )[ 'OK' ] )
+    self.assertEqual( serviceClient.calls, [ 'getModificationsIfNewer', 'getCompressedDataIfNewer' ] )
+    self.assertEqual( str( self.client.remoteCFG ), str( self.server.remoteCFG ) )
+
+## test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( ModificationsTestCase )
+  SUITE.addTest( TESTLOADER.loadTestsFromTestCase( RefresherTestCase ) )
+  unittest.TextTestRunner(verbosity=3).run( SUITE )
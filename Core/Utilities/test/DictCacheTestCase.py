@@ -0,0 +1,126 @@
+########################################################################
+# $HeadURL $
+# File: DictCacheTestCase.py
+########################################################################
+
+""".. module:: DictCacheTestCase
+
+Test cases for DIRAC.Core.Utilities.DictCache module.
+
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import time
+import threading
+import unittest
+from DIRAC import S_OK, S_ERROR
+from DIRAC.Core.Utilities.DictCache import DictCache
+
+########################################################################
+class DictCacheTestCase( unittest.TestCase ):
+  """py:class DictCacheTestCase
+  Test case for DIRAC.Core.Utilities.DictCache module.
+  """
+
+  def setUp( self ):
+    self.deleted = []
+
+  def testAddGet( self ):
+    """ add, get, exists and delete """
+    cache = DictCache( self.deleted.append )
+    cache.add( "a", 10, 1 )
+    cache.add( "b", 0, 2 )
+    self.assertEqual( cache.get( "a" ), 1 )
+    self.assertEqual( cache.get( "b" ), False )
+    self.assertEqual( cache.exists( "a" ), True )
+    self.assertEqual( cache.getKeys(), [ "a" ] )
+    #Not valid for long enough gets deleted
+    self.assertEqual( cache.get( "a", 20 ), False )
+    self.assertEqual( self.deleted, [ 1 ] )
+    cache.add( "a", 10, 3 )
+    cache.delete( "a" )
+    self.assertEqual( cache.exists( "a" ), False )
+    self.assertEqual( self.deleted, [ 1, 3 ] )
+
+  def testExpiration( self ):
+    """ purgeExpired only deletes expired records """
+    cache = DictCache( self.deleted.append )
+    cache.add( "short", 0.05, "short" )
+    cache.add( "long", 10, "long" )
+    cache.add( "renewed", 0.05, "renewed" )
+    cache.add( "renewed", 10, "renewed" )
+    time.sleep( 0.1 )
+    cache.purgeExpired()
+    self.assertEqual( self.deleted, [ "short" ] )
+    self.assertEqual( sorted( cache.getKeys() ), [ "long", "renewed" ] )
+    cache.purgeExpired( 20 )
+    self.assertEqual( sorted( self.deleted ), [ "long", "renewed", "short" ] )
+    self.assertEqual( cache.getKeys(), [] )
+
+  def testLRU( self ):
+    """ least recently used records are evicted """
+    cache = DictCache( self.deleted.append, maxSize = 3 )
+    for key in ( "a", "b", "c" ):
+      cache.add( key, 10, key )
+    cache.get( "a" )
+    cache.add( "d", 10, "d" )
+    self.assertEqual( self.deleted, [ "b" ] )
+    self.assertEqual( sorted( cache.getKeys() ), [ "a", "c", "d" ] )
+    cache.add( "c", 10, "c2" )
+    cache.add( "e", 10, "e" )
+    self.assertEqual( self.deleted, [ "b", "a" ] )
+    self.assertEqual( cache.getStats()[ 'evictions' ], 2 )
+    cache.purgeAll()
+    self.assertEqual( sorted( self.deleted ), [ "a", "b", "c2", "d", "e" ] )
+    self.assertEqual( cache.getStats()[ 'size' ], 0 )
+
+  def testSingleFlight( self ):
+    """ concurrent misses call the loader once """
+    cache = DictCache()
+    calls = []
+    def loader( value ):
+      calls.append( value )
+      time.sleep( 0.2 )
+      return S_OK( value )
+    results = []
+    def worker():
+      results.append( cache.getOrLoad( "key", 10, loader, 5 ) )
+    threads = [ threading.Thread( target = worker ) for i in range( 5 ) ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual( calls, [ 5 ] )
+    self.assertEqual( [ result[ 'Value' ] for result in results ], [ 5 ] * 5 )
+    self.assertEqual( cache.getOrLoad( "key", 10, loader, 6 )[ 'Value' ], 5 )
+    stats = cache.getStats()
+    self.assertEqual( stats[ 'loads' ], 1 )
+    self.assertEqual( stats[ 'hits' ] + stats[ 'misses' ], 6 )
+
+  def testLoadError( self ):
+    """ failed loads are not cached """
+    cache = DictCache()
+    result = cache.getOrLoad( "key", 10, lambda: S_ERROR( "No way" ) )
+    self.assertEqual( result[ 'OK' ], False )
+    self.assertEqual( cache.exists( "key" ), False )
+    result = cache.getOrLoad( "key", 10, lambda: 1 / 0 )
+    self.assertEqual( result[ 'OK' ], False )
+    self.assertEqual( cache.getOrLoad( "key", 10, lambda: S_OK( 1 ) )[ 'Value' ], 1 )
+
+  def testStats( self ):
+    """ hit rate """
+    cache = DictCache()
+    cache.add( "a", 10, 1 )
+    for key in ( "a", "a", "a", "b" ):
+      cache.get( key )
+    stats = cache.getStats()
+    self.assertEqual( ( stats[ 'hits' ], stats[ 'misses' ] ), ( 3, 1 ) )
+    self.assertEqual( stats[ 'hitRate' ], 0.75 )
+
+## test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( DictCacheTestCase )
+  unittest.TextTestRunner(verbosity=3).run( SUITE )
@@ -0,0 +1,217 @@
+########################################################################
+# $HeadURL $
+# File: MySQLTestCase.py
+########################################################################
+
+""".. module:: MySQLTestCase
+
+Test cases for the connection pool and the bulk inserts of DIRAC.Core.Utilities.MySQL.
+MySQLdb.connect is replaced, no DB is needed.
+
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import threading
+import time
+import unittest
+from DIRAC import S_OK
+import DIRAC.Core.Utilities.MySQL as MySQLModule
+from DIRAC.Core.Utilities.MySQL import ConnectionPool, MySQL
+
+class FakeCursor:
+
+  def __init__( self, connection ):
+    self.connection = connection
+
+  def execute( self, cmd ):
+    if self.connection.failWith:
+      raise self.connection.failWith
+    self.connection.executed.append( cmd )
+    # Affected rows
+    return cmd.count( '),(' ) + 1
+
+  def fetchall( self ):
+    return ( ( 'max_allowed_packet', self.connection.maxAllowedPacket ), )
+
+  def close( self ):
+    pass
+
+class FakeConnection:
+
+  def __init__( self, **kwargs ):
+    self.args = kwargs
+    self.closed = False
+    self.pings = 0
+    self.pingFails = False
+    self.maxAllowedPacket = 1048576
+    self.executed = []
+    self.commits = 0
+    self.failWith = None
+
+  def ping( self, reconnect = False ):
+    self.pings += 1
+    if self.pingFails:
+      raise MySQLModule.MySQLdb.OperationalError( "MySQL server has gone away" )
+
+  def close( self ):
+    self.closed = True
+
+  def commit( self ):
+    self.commits += 1
+
+  def cursor( self ):
+    return FakeCursor( self )
+
+  def escape_string( self, myString ):
+    return myString.replace( '"', '\\"' )
+
+class FakeMySQLdbTestCase( unittest.TestCase ):
+  """ Base class replacing MySQLdb.connect """
+
+  def setUp( self ):
+    self.connections = []
+    def connect( **kwargs ):
+      connection = FakeConnection( **kwargs )
+      self.connections.append( connection )
+      return connection
+    self.realConnect = MySQLModule.MySQLdb.connect
+    MySQLModule.MySQLdb.connect = connect
+
+  def tearDown( self ):
+    MySQLModule.MySQLdb.connect = self.realConnect
+
+class ConnectionPoolTestCase( FakeMySQLdbTestCase ):
+  """
+  .. class:: ConnectionPoolTestCase
+  """
+
+  def testReuse( self ):
+    """ most recently used first, pinged only after being idle """
+    pool = ConnectionPool( {}, "TestDB", maxSize = 2, pingIdleTime = 60 )
+    first = pool.get()[ 'Value' ]
+    second = pool.get()[ 'Value' ]
+    pool.put( first )
+    pool.put( second )
+    self.assert_( pool.get()[ 'Value' ] is second )
+    self.assertEqual( second.pings, 0 )
+    self.assertEqual( pool.getStats()[ 'created' ], 2 )
+
+  def testPingIdle( self ):
+    """ connections failing to ping are replaced """
+    pool = ConnectionPool( {}, "TestDB", maxSize = 2, pingIdleTime = 0 )
+    connection = pool.get()[ 'Value' ]
+    pool.put( connection )
+    time.sleep( 0.01 )
+    self.assert_( pool.get()[ 'Value' ] is connection )
+    self.assertEqual( connection.pings, 1 )
+    pool.put( connection )
+    time.sleep( 0.01 )
+    connection.pingFails = True
+    newConnection = pool.get()[ 'Value' ]
+    self.failIf( newConnection is connection )
+    self.assert_( connection.closed )
+    self.assertEqual( pool.getStats()[ 'inUse' ], 1 )
+
+  def testMaxSize( self ):
+    """ waits for a connection to be returned """
+    pool = ConnectionPool( {}, "TestDB", maxSize = 1, waitTime = 0.1 )
+    connection = pool.get()[ 'Value' ]
+    self.failIf( pool.get()[ 'OK' ] )
+    pool = ConnectionPool( {}, "TestDB", maxSize = 1, waitTime = 2 )
+    connection = pool.get()[ 'Value' ]
+    timer = threading.Timer( 0.05, pool.put, args = ( connection, ) )
+    timer.start()
+    self.assert_( pool.get()[ 'Value' ] is connection )
+    self.assertEqual( pool.getStats()[ 'waits' ], 1 )
+    self.assertEqual( len( self.connections ), 2 )
+
+  def testDiscardAndDetach( self ):
+    """ discarded and detached connections free their slot """
+    pool = ConnectionPool( {}, "TestDB", maxSize = 1, waitTime = 0.1 )
+    connection = pool.get()[ 'Value' ]
+    pool.discard( connection )
+    self.assert_( connection.closed )
+    connection = pool.get()[ 'Value' ]
+    pool.detach( connection )
+    self.assert_( pool.get()[ 'OK' ] )
+    self.assertEqual( pool.getStats()[ 'idle' ], 0 )
+
+  def testIdleClosed( self ):
+    """ connections idle for too long are closed down to the minimum size """
+    pool = ConnectionPool( {}, "TestDB", minSize = 1, maxSize = 3, maxIdleTime = 0 )
+    connections = [ pool.get()[ 'Value' ] for i in range( 3 ) ]
+    for connection in connections:
+      pool.put( connection )
+      time.sleep( 0.01 )
+    self.assertEqual( pool.getStats()[ 'idle' ], 1 )
+    self.assertEqual( [ connection.closed for connection in connections ], [ True, True, False ] )
+
+class InsertManyTestCase( FakeMySQLdbTestCase ):
+  """
+  .. class:: InsertManyTestCase
+  """
+
+  def setUp( self ):
+    FakeMySQLdbTestCase.setUp( self )
+    self.db = MySQL( "localhost", "user", "passwd", "TestDB", maxQueueSize = 2 )
+    self.connection = self.connections[0]
+    self.db.insertMany( "Test", [ "a" ], [ [ 1 ] ] )
+    del self.connection.executed[:]
+    self.connection.commits = 0
+
+  def getStatements( self ):
+    return [ cmd for cmd in self.connection.executed if not cmd.startswith( "SHOW VARIABLES" ) ]
+
+  def testInsertMany( self ):
+    """ one statement with all the rows """
+    result = self.db.insertMany( "Test", [ "a", "b", "c" ], [ [ 1, 'x"y', None ], [ 2L, 0.1, 'UTC_TIMESTAMP()' ] ] )
+    self.assertEqual( result[ 'Value' ], 2 )
+    self.assertEqual( self.getStatements(),
+                      [ 'INSERT INTO `Test` ( `a`, `b`, `c` ) VALUES (1,"x\\"y",NULL),(2,0.1,UTC_TIMESTAMP())' ] )
+    self.assertEqual( self.connection.commits, 1 )
+    self.failIf( self.db.insertMany( "Test", [ "a", "b" ], [ [ 1 ] ] )[ 'OK' ] )
+
+  def testSplit( self ):
+    """ statements fit in max_allowed_packet """
+    self.db._MySQL__maxAllowedPacket = 100
+    self.assertEqual( self.db.insertMany( "Test", [ "a" ], [ [ "x" * 20 ] for i in range( 6 ) ], ignore = True )[ 'Value' ], 6 )
+    self.assert_( len( self.getStatements() ) > 1 )
+    rows = 0
+    for cmd in self.getStatements():
+      self.assert_( len( cmd ) <= 95 )
+      self.assert_( cmd.startswith( 'INSERT IGNORE INTO `Test` ( `a` ) VALUES ' ) )
+      rows += cmd.count( "x" * 20 )
+    self.assertEqual( rows, 6 )
+
+  def testUpsertMany( self ):
+    """ updated and incremented fields """
+    self.db.upsertMany( "Test", [ "k", "v", "n" ], [ [ 1, 2, 3 ] ], incrementFields = [ "n" ],
+                        conn = self.connection, commit = False )
+    self.assertEqual( self.getStatements(), [ 'INSERT INTO `Test` ( `k`, `v`, `n` ) VALUES (1,2,3) ON DUPLICATE KEY UPDATE ' +
+                                              '`k`=VALUES(`k`), `v`=VALUES(`v`), `n`=`n`+VALUES(`n`)' ] )
+    self.assertEqual( self.connection.commits, 0 )
+
+  def testNoCommitNeedsConnection( self ):
+    """ the transaction is not left open on a pooled connection """
+    self.failIf( self.db.insertMany( "Test", [ "a" ], [ [ 1 ] ], commit = False )[ 'OK' ] )
+    self.assertEqual( self.getStatements(), [] )
+
+  def testFailedConnectionDiscarded( self ):
+    """ connections failing with an OperationalError are not put back in the pool """
+    self.connection.failWith = MySQLModule.MySQLdb.Error( 1062, "Duplicate entry" )
+    self.failIf( self.db.insertMany( "Test", [ "a" ], [ [ 1 ] ] )[ 'OK' ] )
+    self.failIf( self.connection.closed )
+    self.connection.failWith = MySQLModule.MySQLdb.OperationalError( 2006, "MySQL server has gone away" )
+    self.failIf( self.db.upsertMany( "Test", [ "a" ], [ [ 1 ] ] )[ 'OK' ] )
+    self.assert_( self.connection.closed )
+    self.assert_( self.db.insertMany( "Test", [ "a" ], [ [ 1 ] ] )[ 'OK' ] )
+    self.assertEqual( len( self.connections ), 2 )
+
+## test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( ConnectionPoolTestCase )
+  SUITE.addTest( TESTLOADER.loadTestsFromTestCase( InsertManyTestCase ) )
+  unittest.TextTestRunner(verbosity=3).run( SUITE )
@@ -143,13 +143,13 @@ class FileManager(FileManagerBase):
     connection = self._getConnection(connection)
     # Add the files
     failed = {}
-    insertTuples = []
     res = self._getStatusInt('AprioriGood',connection=connection)
     statusID = 0
     if res['OK']:
       statusID = res['Value']
       
     directorySESizeDict = {}  
+    insertRows = []
     for lfn in lfns.keys():
       dirID = lfns[lfn]['DirID']
       fileName = os.path.basename(lfn)
@@ -161,14 +161,14 @@ class FileManager(FileManagerBase):
         result = self.db.ugManager.getUserAndGroupID( ownerDict )
         if result['OK']:
           s_uid, s_gid = result['Value']
-      insertTuples.append("(%d,%d,%d,%d,%d,'%s')" % (dirID,size,s_uid,s_gid,statusID,fileName))
+      insertRows.append( ( dirID, size, s_uid, s_gid, statusID, fileName ) )
       directorySESizeDict.setdefault( dirID, {} )
       directorySESizeDict[dirID].setdefault( 0, {'Files':0,'Size':0} )
       directorySESizeDict[dirID][0]['Size'] += lfns[lfn]['Size']
       directorySESizeDict[dirID][0]['Files'] += 1
       
-    req = "INSERT INTO FC_Files (DirID,Size,UID,GID,Status,FileName) VALUES %s" % (','.join(insertTuples))
-    res = self.db._update(req,connection)
+    res = self.db.insertMany( 'FC_Files', ['DirID','Size','UID','GID','Status','FileName'], insertRows,
+                              conn = connection )
     if not res['OK']:
       return res
     # Get the fileIDs for the inserted files
@@ -183,7 +183,7 @@ class FileManager(FileManagerBase):
         lfns.pop(lfn)
       for lfn,fileDict in res['Value']['Successful'].items():
         lfns[lfn]['FileID'] = fileDict['FileID']
-    insertTuples = []
+    insertRows = []
     toDelete = []
     for lfn in lfns.keys():
       fileInfo = lfns[lfn]     
@@ -195,10 +195,11 @@ class FileManager(FileManagerBase):
       dirName = os.path.dirname(lfn)
       mode = fileInfo.get('Mode',self.db.umask)
       toDelete.append(fileID)
-      insertTuples.append("(%d,'%s','%s','%s',UTC_TIMESTAMP(),UTC_TIMESTAMP(),%d)" % (fileID,guid,checksum,checksumtype,mode))
-    if insertTuples:
-      req = "INSERT INTO FC_FileInfo (FileID,GUID,Checksum,CheckSumType,CreationDate,ModificationDate,Mode) VALUES %s" % ','.join(insertTuples)
-      res = self.db._update(req)
+      insertRows.append( ( fileID, guid, checksum, checksumtype, 'UTC_TIMESTAMP()', 'UTC_TIMESTAMP()', mode ) )
+    if insertRows:
+      res = self.db.insertMany( 'FC_FileInfo',
+                                ['FileID','GUID','Checksum','CheckSumType','CreationDate','ModificationDate','Mode'],
+                                insertRows, conn = connection )
       if not res['OK']:
         self._deleteFiles(toDelete,connection=connection)
         for lfn in lfns.keys():
@@ -309,8 +310,8 @@ class FileManager(FileManagerBase):
         for seID,repID in repDict.items():
           successful[fileIDLFNs[fileID]] = True
           insertTuples.remove((fileID,seID))
-    req = "INSERT INTO FC_Replicas (FileID,SEID,Status) VALUES %s" % (','.join(["(%d,%d,%d)" % (tuple[0],tuple[1],statusID) for tuple in insertTuples]))
-    res = self.db._update(req,connection)
+    res = self.db.insertMany( 'FC_Replicas', ['FileID','SEID','Status'],
+                              [ ( fileID, seID, statusID ) for fileID, seID in insertTuples ], conn = connection )
     if not res['OK']:
       return res
     res = self._getRepIDsForReplica(insertTuples, connection=connection)
@@ -166,6 +166,19 @@ class RequestClient( Client ):
       self.log.error("getRequest: unable to get '%s' request: %s" % getRequest["Message"] )
     return getRequest  
 
+  def getRequests( self, requestType, limit = 1 ):
+    """ get up to :limit: requests from RequestDB
+
+    :param self: self reference
+    :param str requestType: type of request
+    :param int limit: maximum number of requests
+    """
+    self.log.info( "getRequests: attempting to get %s '%s' requests." % ( limit, requestType ) )
+    getRequests = self.requestManager().getRequests( requestType, limit )
+    if not getRequests["OK"]:
+      self.log.error( "getRequests: unable to get '%s' requests: %s" % ( requestType, getRequests["Message"] ) )
+    return getRequests
+
   def serveRequest( self, requestType = "" ):
     """ Get the request of type :requestType: from RequestDB.   
 
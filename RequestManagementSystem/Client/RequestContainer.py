@@ -4,7 +4,7 @@
 The Data Management Request contains all the necessary information for
 a data management operation.
 """
-import os, xml.dom.minidom, copy, datetime, time
+import os, xml.dom.minidom, xml.parsers.expat, copy, datetime, time
 from types import DictType, ListType, NoneType, StringTypes
 
 from DIRAC.Core.Utilities.File import makeGuid
@@ -21,8 +21,16 @@ class RequestContainer:
   .. class:: RequestContainer
 
   Bag object holding all information about Request.
+
+  Requests are serialized to XML (toXML) or to a compact string (serialize): COMPACT_PREFIX,
+  the format version, ':' and the DEncoded [ header attributes, [ [ type, subrequest, tables ], ... ] ]
+  where tables holds the Files and Datasets of the subrequest as { key : [ field names, rows ] }.
+  parseRequest reads both.
   """
 
+  COMPACT_PREFIX = "DIRAC_REQUEST:"
+  COMPACT_VERSION = 1
+
 
   def __init__( self, request = None, init = True ):
 
@@ -272,13 +280,15 @@ class RequestContainer:
     self.setSubRequestAttributes( index, rType, attributeDict )
 
     if requestDict.has_key( 'Files' ):
-      files = []
+      # The file dictionaries are new, only their mutable values need a copy
+      files = self.subRequests[rType][index]['Files']
       for rFile in requestDict['Files']:
         fileDict = {'Status':'Waiting', 'FileID':makeGuid(), 'Attempt':1}
         for attr, value in rFile.items():
+          if type( value ) in ( DictType, ListType ):
+            value = copy.deepcopy( value )
           fileDict[attr] = value
         files.append( fileDict )
-      self.setSubRequestFiles( index, rType, files )
 
     if requestDict.has_key( 'Datasets' ):
       datasets = []
@@ -742,31 +752,101 @@ class RequestContainer:
     """ Output the request to XML
     """
 
-    out = '<?xml version="1.0" encoding="UTF-8" ?>\n\n'
-    out = '%s<DIRAC_REQUEST>\n\n' % out
-
-    xml_attributes = ''
+    out = [ '<?xml version="1.0" encoding="UTF-8" ?>\n\n<DIRAC_REQUEST>\n\n<Header \n' ]
     for attr, value in self.attributes.items():
-      xml_attributes += '             %s="%s"\n' % ( attr, str( value ) )
-    out = '%s<Header \n%s/>\n\n' % ( out, xml_attributes )
-
-    for requestType in self.getSubRequestTypes()['Value']:
-      # This allows us to supply a request type
-      useType = False
-      if not desiredType:
-        useType = True
-      elif desiredType == requestType:
-        if not self.getNumSubRequests( desiredType )['Value']:
-          # You have requested a request type and there are no sub requests of this type
-          return S_OK()
-        else:
-          useType = True
-      if useType:
-        numSubReqs = self.getNumSubRequests( requestType )['Value']
-        for subReqInd in range( numSubReqs ):
-          out = "%s%s" % ( out, self.createSubRequestXML( subReqInd, requestType )['Value'] )
-    out = '%s</DIRAC_REQUEST>\n' % out
-    return S_OK( str( out ) )
+      out.append( '             %s="%s"\n' % ( attr, str( value ) ) )
+    out.append( '/>\n\n' )
+
+    requestTypes = self.__getTypesToSerialize( desiredType )
+    if requestTypes is None:
+      # You have requested a request type and there are no sub requests of this type
+      return S_OK()
+    for requestType in requestTypes:
+      name = requestType.upper() + '_SUBREQUEST'
+      for subRequest in self.subRequests[requestType]:
+        out.append( self.__dictionaryToXML( name, subRequest ) )
+    out.append( '</DIRAC_REQUEST>\n' )
+    return S_OK( str( "".join( out ) ) )
+
+  def __getTypesToSerialize( self, desiredType ):
+    """ The subrequest types to serialize, None if there are no subrequests of the desired type
+    """
+    if not desiredType:
+      return self.subRequests.keys()
+    if desiredType in self.subRequests:
+      if not self.subRequests[desiredType]:
+        return None
+      return [ desiredType ]
+    return []
+
+  def serialize( self, desiredType = '' ):
+    """ Output the request to the compact format, only the subrequests of desiredType if given.
+        Attribute values are converted to strings as in the XML
+    """
+    requestTypes = self.__getTypesToSerialize( desiredType )
+    if requestTypes is None:
+      return S_OK()
+    header = dict( [ ( str( attr ), str( value ) ) for attr, value in self.attributes.items() ] )
+    subRequests = []
+    for requestType in requestTypes:
+      for subRequest in self.subRequests[requestType]:
+        subDict = self.__stringifyLeaves( subRequest )
+        tables = {}
+        for key in ( 'Files', 'Datasets' ):
+          table = self.__toTable( subDict.get( key ) )
+          if table:
+            tables[key] = table
+            del subDict[key]
+        subRequests.append( [ requestType, subDict, tables ] )
+    data = DEncode.encode( [ header, subRequests ] )
+    return S_OK( "%s%d:%s" % ( self.COMPACT_PREFIX, self.COMPACT_VERSION, data ) )
+
+  def __toTable( self, dictList ):
+    """ [ field names, rows ] from a list of dictionaries, each row is the list of values of the
+        fields or the dictionary itself if it does not have the same fields as the first one
+    """
+    if type( dictList ) is not ListType or not dictList:
+      return None
+    for aDict in dictList:
+      if type( aDict ) is not DictType:
+        return None
+    fields = dictList[0].keys()
+    numFields = len( fields )
+    rows = []
+    for aDict in dictList:
+      if len( aDict ) == numFields:
+        try:
+          rows.append( [ aDict[field] for field in fields ] )
+          continue
+        except KeyError:
+          pass
+      rows.append( aDict )
+    return [ fields, rows ]
+
+  def __fromTable( self, table ):
+    """ List of dictionaries from [ field names, rows ]
+    """
+    fields, rows = table
+    dictList = []
+    for row in rows:
+      if type( row ) is DictType:
+        dictList.append( row )
+      else:
+        dictList.append( dict( zip( fields, row ) ) )
+    return dictList
+
+  def __stringifyLeaves( self, aDict ):
+    """ Copy of a subrequest dictionary with the values that are not dictionaries or lists as strings
+    """
+    result = {}
+    for key, value in aDict.items():
+      if type( value ) is DictType:
+        result[ str( key ) ] = self.__stringifyLeaves( value )
+      elif type( value ) is ListType:
+        result[ str( key ) ] = value
+      else:
+        result[ str( key ) ] = str( value )
+    return result
 
   def createSubRequestXML( self, ind, rType ):
     """ A simple subrequest representation assuming the subrequest is just
@@ -779,7 +859,8 @@ class RequestContainer:
   def __dictionaryToXML( self, name, dictIn, indent = 0, attributes = {} ):
     """ Utility to convert a dictionary to XML
     """
-    xml_attributes = ''
+    leafIndent = ' ' * ( indent + 1 ) * 8
+    xml_attributes = []
     xml_elements = []
     for attr, value in dictIn.items():
       if type( value ) is DictType:
@@ -787,16 +868,16 @@ class RequestContainer:
       elif type( value ) is ListType:
         xml_elements.append( self.__listToXML( attr, value, indent + 1 ) )
       else:
-        xml_attributes += ' ' * ( indent + 1 ) * 8 + '<%s element_type="leaf"><![CDATA[%s]]></%s>\n' % ( attr, str( value ), attr )
+        xml_attributes.append( '%s<%s element_type="leaf"><![CDATA[%s]]></%s>' % ( leafIndent, attr, str( value ), attr ) )
 
     for attr, value in attributes.items():
-      xml_attributes += ' ' * ( indent + 1 ) * 8 + '<%s element_type="leaf"><![CDATA[%s]]></%s>\n' % ( attr, str( value ), attr )
+      xml_attributes.append( '%s<%s element_type="leaf"><![CDATA[%s]]></%s>' % ( leafIndent, attr, str( value ), attr ) )
 
-    out = ' ' * indent * 8 + '<%s element_type="dictionary">\n%s\n' % ( name, xml_attributes[:-1] )
+    out = [ ' ' * indent * 8 + '<%s element_type="dictionary">\n%s\n' % ( name, "\n".join( xml_attributes ) ) ]
     for el in xml_elements:
-      out += ' ' * indent * 8 + el
-    out += ' ' * indent * 8 + '</%s>\n' % name
-    return out
+      out.append( ' ' * indent * 8 + el )
+    out.append( ' ' * indent * 8 + '</%s>\n' % name )
+    return "".join( out )
 
   def __listToXML( self, name, aList, indent = 0, attributes = {} ):
     """ Utility to convert a list to XML
@@ -829,24 +910,39 @@ class RequestContainer:
     return out
 
   def parseRequest( self, request ):
-    """ Create request from the XML string or file
+    """ Create request from the XML or compact string or file
     """
-    if os.path.exists( request ):
-      dom = xml.dom.minidom.parse( request )
+    if not request.startswith( self.COMPACT_PREFIX ) and not request.lstrip().startswith( "<" ) \
+       and os.path.exists( request ):
+      requestFile = open( request, 'r' )
+      try:
+        request = requestFile.read()
+      finally:
+        requestFile.close()
+
+    if request.startswith( self.COMPACT_PREFIX ):
+      header, subRequests = self.__parseCompact( request )
     else:
-      dom = xml.dom.minidom.parseString( request )
+      header, subRequests = _RequestXMLParser().parse( request )
 
-    header = dom.getElementsByTagName( 'Header' )[0]
     for name in self.attributeNames:
-      self.attributes[name] = header.getAttribute( name )
+      self.attributes[name] = header.get( name, '' )
+    for requestType, subrequest in subRequests:
+      self.addSubRequest( subrequest, requestType )
 
-    request = dom.getElementsByTagName( 'DIRAC_REQUEST' )[0]
-    dom_subrequests = request.childNodes
-    for dom_subrequest in dom_subrequests:
-      if dom_subrequest.nodeName.find( '_SUBREQUEST' ) != -1:
-        subrequest = self.parseSubRequest( dom_subrequest )
-        requestType = dom_subrequest.nodeName.split( '_' )[0].lower()
-        self.addSubRequest( subrequest, requestType )
+  def __parseCompact( self, request ):
+    """ Get the header attributes and the [ ( type, subrequest ), ... ] from the compact format
+    """
+    version, data = request[ len( self.COMPACT_PREFIX ): ].split( ":", 1 )
+    if int( version ) != self.COMPACT_VERSION:
+      raise ValueError( "Unknown request format version %s" % version )
+    header, encodedSubRequests = DEncode.decode( data )[0]
+    subRequests = []
+    for requestType, subDict, tables in encodedSubRequests:
+      for key, table in tables.items():
+        subDict[key] = self.__fromTable( table )
+      subRequests.append( ( requestType, subDict ) )
+    return header, subRequests
 
   def parseSubRequest( self, dom ):
     """ A simple subrequest parser from the dom object. This is to be overloaded
@@ -932,3 +1028,74 @@ class RequestContainer:
 
     digest = '\n'.join( digestStrings )
     return S_OK( digest )
+
+class _RequestXMLParser:
+  """ Streaming parser of the request XML, giving the header attributes and the subrequests
+      as the DOM based parsing of RequestContainer did
+  """
+
+  def parse( self, data ):
+    """ :return: ( { header attribute : value }, [ ( type, subrequest dictionary ), ... ] )
+    """
+    self.header = None
+    self.subRequests = []
+    self.inRequest = False
+    # One frame per open element: [ kind, name, value ]
+    self.stack = []
+    parser = xml.parsers.expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = self.__startElement
+    parser.EndElementHandler = self.__endElement
+    parser.CharacterDataHandler = self.__characterData
+    parser.Parse( data, True )
+    if self.header is None:
+      raise IndexError( "No Header element in the request" )
+    if not self.inRequest and not self.subRequests:
+      raise IndexError( "No DIRAC_REQUEST element in the request" )
+    return self.header, self.subRequests
+
+  def __startElement( self, name, attrs ):
+    if name == 'Header' and self.header is None:
+      self.header = attrs
+    parent = self.stack and self.stack[-1] or None
+    if parent is None or parent[0] == 'other':
+      if name == 'DIRAC_REQUEST' and not self.inRequest:
+        self.inRequest = True
+        self.stack.append( [ 'request', name, None ] )
+      else:
+        self.stack.append( [ 'other', name, None ] )
+    elif parent[0] == 'request':
+      if name.find( '_SUBREQUEST' ) != -1:
+        self.stack.append( [ 'subrequest', name, {} ] )
+      else:
+        self.stack.append( [ 'skip', name, None ] )
+    elif parent[0] in ( 'subrequest', 'dictionary' ):
+      elementType = attrs.get( 'element_type' )
+      if elementType == 'dictionary':
+        self.stack.append( [ 'dictionary', name, {} ] )
+      elif elementType == 'list':
+        self.stack.append( [ 'list', name, [] ] )
+      elif elementType == 'leaf':
+        self.stack.append( [ 'leaf', name, [] ] )
+      else:
+        self.stack.append( [ 'skip', name, None ] )
+    elif parent[0] == 'list' and attrs.get( 'element_type' ) == 'leaf':
+      self.stack.append( [ 'encoded', name, [] ] )
+    else:
+      self.stack.append( [ 'skip', name, None ] )
+
+  def __endElement( self, name ):
+    kind, name, value = self.stack.pop()
+    if kind == 'subrequest':
+      self.subRequests.append( ( name.split( '_' )[0].lower(), value ) )
+    elif kind in ( 'dictionary', 'list' ):
+      self.stack[-1][2][name] = value
+    elif kind == 'leaf':
+      self.stack[-1][2][name] = str( "".join( value ).strip() )
+    elif kind == 'encoded':
+      # The list is the DEncoded leaf, if there are several the last one
+      self.stack[-1][2] = DEncode.decode( str( "".join( value ).strip() ) )[0]
+
+  def __characterData( self, data ):
+    if self.stack and self.stack[-1][0] in ( 'leaf', 'encoded' ):
+      self.stack[-1][2].append( data )
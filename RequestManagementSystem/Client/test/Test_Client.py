@@ -507,10 +507,62 @@ class AddOperationsTestCase( reqContainerTestCase ):
 #        for att in stageDic['Attributes'].keys():
 #          self.assertEqual( stageDic['Attributes'][att], stageReqDouble['Value']['Attributes'][att] )
 
+class SerializationTestCase( reqContainerTestCase ):
+
+  def setUp( self ):
+    reqContainerTestCase.setUp( self )
+    self.reqContainer.setRequestName( 'serialization' )
+    self.reqContainer.setJobID( 1234 )
+    files = [ { 'LFN' : '/lhcb/test/file_%d' % i, 'Size' : 1000 * i, 'GUID' : 'guid%d' % i } for i in range( 5 ) ]
+    # Files with other fields than the first one
+    files.append( { 'LFN' : '/lhcb/test/other', 'Size' : 1, 'PFN' : 'srm://se/lhcb/test/other' } )
+    files.append( { 'LFN' : '/lhcb/test/short' } )
+    self.reqContainer.addSubRequest( { 'Attributes' : { 'Operation' : 'replicateAndRegister', 'TargetSE' : 'CERN-USER',
+                                                        'ExecutionOrder' : 1 },
+                                       'Files' : files }, 'transfer' )
+    self.reqContainer.addSubRequest( { 'Attributes' : { 'Operation' : 'removeFile', 'ExecutionOrder' : 2 },
+                                       'Files' : files[:2] }, 'removal' )
+
+  def test_compactRoundTrip( self ):
+    compact = self.reqContainer.serialize()
+    self.assert_( compact['OK'] )
+    self.assert_( compact['Value'].startswith( RequestContainer.COMPACT_PREFIX ) )
+    fromCompact = RequestContainer( compact['Value'] )
+    fromXML = RequestContainer( self.reqContainer.toXML()['Value'] )
+    self.assertEqual( fromCompact.getRequestAttributes()['Value'], fromXML.getRequestAttributes()['Value'] )
+    self.assertEqual( fromCompact.subRequests, fromXML.subRequests )
+    self.assertEqual( fromCompact.getSubRequestFiles( 0, 'transfer' )['Value'],
+                      self.reqContainer.getSubRequestFiles( 0, 'transfer' )['Value'] )
+    self.assertEqual( fromCompact.getSubRequestAttributes( 0, 'transfer' )['Value']['ExecutionOrder'], '1' )
+
+  def test_serializeDesiredType( self ):
+    removal = RequestContainer( self.reqContainer.serialize( desiredType = 'removal' )['Value'] )
+    self.assertEqual( removal.getSubRequestTypes()['Value'], [ 'removal' ] )
+    self.assertEqual( removal.getSubRequestNumFiles( 0, 'removal' )['Value'], 2 )
+    self.reqContainer.initiateSubRequest( 'register' )
+    self.reqContainer.subRequests['register'] = []
+    self.assertEqual( self.reqContainer.serialize( desiredType = 'register' ), self.reqContainer.toXML( desiredType = 'register' ) )
+    self.failIf( self.reqContainer.serialize( desiredType = 'register' )['Value'] )
+
+  def test_fromFile( self ):
+    fname = 'testRequest.xml'
+    self.reqContainer.toFile( fname )
+    fromXMLFile = RequestContainer( fname )
+    reqFile = open( fname, 'w' )
+    reqFile.write( self.reqContainer.serialize()['Value'] )
+    reqFile.close()
+    fromCompactFile = RequestContainer( fname )
+    self.assertEqual( fromXMLFile.subRequests, fromCompactFile.subRequests )
+    self.assertEqual( fromCompactFile.getRequestName()['Value'], 'serialization' )
+
+  def test_unknownVersion( self ):
+    self.assertRaises( ValueError, RequestContainer, '%s99:%s' % ( RequestContainer.COMPACT_PREFIX, 'l e' ) )
+
 if __name__ == '__main__':
 
   suite = unittest.defaultTestLoader.loadTestsFromTestCase( GetSetTestCase )
   suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( AddOperationsTestCase ) )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( SerializationTestCase ) )
   testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
 
 
@@ -50,6 +50,7 @@ CREATE TABLE SubRequests (
    SubmissionTime DATETIME,
    LastUpdate DATETIME,
    INDEX(LastUpdate),
+   INDEX(Status,RequestID,ExecutionOrder),
    PRIMARY KEY (SubRequestID,Status,RequestType)
 )ENGINE=INNODB;
 
@@ -97,7 +97,7 @@ class RequestDBFile( object ):
     requestTypes = request.getSubRequestTypes()['Value']
     try:
       for requestType in requestTypes:
-        subRequestString = request.toXML( desiredType = requestType )['Value']
+        subRequestString = request.serialize( desiredType = requestType )['Value']
         if subRequestString:
           if desiredStatus:
             status = desiredStatus
@@ -212,6 +212,25 @@ class RequestDBFile( object ):
       self.log.exception( errStr, requestType, lException = x )
       return S_ERROR( errStr )
 
+  def getRequests( self, requestType, limit = 1 ):
+    """ Obtain up to :limit: requests from the database of a :requestType: type
+
+    :param self: self reference
+    :param str requestType: request type
+    :param int limit: maximum number of requests
+    """
+    requests = []
+    while len( requests ) < limit:
+      res = self.getRequest( requestType )
+      if not res['OK']:
+        if requests:
+          break
+        return res
+      if not res['Value']:
+        break
+      requests.append( res['Value'] )
+    return S_OK( requests )
+
   def setRequestStatus( self, requestName, requestStatus ):
     """ set the status for :requestName: to :requestStatus:  
     
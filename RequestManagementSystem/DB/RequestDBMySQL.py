@@ -21,6 +21,8 @@ class RequestDBMySQL( DB ):
 
   An interface to mysql RequestDB database. 
   """
+  # Seconds before loading again a ready queue found empty
+  EMPTY_QUEUE_LIFETIME = 5
 
   def __init__( self, systemInstance = 'Default', maxQueueSize = 10 ):
     """ c'tor
@@ -31,6 +33,19 @@ class RequestDBMySQL( DB ):
     """
     DB.__init__( self, 'RequestDB', 'RequestManagement/RequestDB', maxQueueSize )
     self.getIdLock = threading.Lock()
+    # "Queue" serves the requests from ready queues per request type (see getRequests),
+    # "Query" selects them among all the subrequests for each call
+    self.dispatchMode = gConfig.getValue( '%s/DispatchMode' % self.cs_path, 'Queue' )
+    self.dispatchQueueSize = gConfig.getValue( '%s/DispatchQueueSize' % self.cs_path, 1000 )
+    self.dispatchQueueLifeTime = gConfig.getValue( '%s/DispatchQueueLifeTime' % self.cs_path, 60 )
+    # { requestType : ( loadTime, [ ( requestID, executionOrder ), ... ] ) }
+    self.__readyQueues = {}
+    # { requestType : lock } held while claiming requests of the type, so the claims of a
+    # type don't wait for other types loading their queues. Created with __queueLock held
+    self.__typeLocks = {}
+    self.__queueLock = threading.Lock()
+    # { requestType : connection } used to assign the subrequests of the type
+    self.__assignConnections = {}
 
   def _setRequestStatus( self, requestType, requestName, status ):
     """ ste request Status to :status:
@@ -261,6 +276,10 @@ class RequestDBMySQL( DB ):
 
   def getRequest( self, requestType ):
     """ Get a request of a given type eligible for execution
+
+    :param self: self reference
+    :param str requestType: request type
+    :return: S_OK( { 'RequestName' : .., 'RequestString' : .., 'JobID' : .. } ) or S_OK() if there is none
     """
     # RG: What if requestType is not given?
     # the first query will return nothing.
@@ -270,14 +289,212 @@ class RequestDBMySQL( DB ):
     if not requestType or type( requestType ) not in types.StringTypes:
       return S_ERROR( "Request type not given." )
 
+    if self.dispatchMode != "Queue":
+      return self.__getRequestByQuery( requestType )
+
+    res = self.getRequests( requestType, 1 )
+    if not res['OK']:
+      return res
+    if not res['Value']:
+      return S_OK()
+    return S_OK( res['Value'][0] )
+
+  def getRequests( self, requestType, limit = 1 ):
+    """ Get up to :limit: requests of a given type eligible for execution
+
+    The subrequests of all the requests are assigned with a single update
+
+    :param self: self reference
+    :param str requestType: request type
+    :param int limit: maximum number of requests
+    :return: S_OK( [ { 'RequestName' : .., 'RequestString' : .., 'JobID' : .. }, ... ] )
+    """
+    if not requestType or type( requestType ) not in types.StringTypes:
+      return S_ERROR( "Request type not given." )
+
+    typeLock = self.__getTypeLock( requestType )
+    typeLock.acquire()
+    try:
+      res = self.__claimRequests( requestType, limit )
+    finally:
+      typeLock.release()
+    if not res['OK']:
+      return res
+    requestIDs, subRequests = res['Value']
+    if not requestIDs:
+      return S_OK( [] )
+    res = self.__buildRequests( requestType, requestIDs, subRequests )
+    if not res['OK']:
+      return res
+    requests, errors = res['Value']
+    if errors and not requests:
+      return S_ERROR( errors[0] )
+    return S_OK( requests )
+
+  def __getTypeLock( self, requestType ):
+    """ Get the lock of a request type, creating it the first time
+    """
+    self.__queueLock.acquire()
+    try:
+      if requestType not in self.__typeLocks:
+        self.__typeLocks[ requestType ] = threading.Lock()
+      return self.__typeLocks[ requestType ]
+    finally:
+      self.__queueLock.release()
+
+  def __getReadyQueue( self, requestType ):
+    """ Get the ready queue of a request type, loading it if it is too old
+
+    The queue has the ( RequestID, ExecutionOrder ) of the requests whose next subrequests
+    are Waiting subrequests of the type, the ones waiting for longer first.
+    Called with the lock of the type held
+
+    :param self: self reference
+    :param str requestType: request type
+    """
+    loadTime, queue = self.__readyQueues.get( requestType, ( 0, [] ) )
+    age = time.time() - loadTime
+    if queue and age < self.dispatchQueueLifeTime:
+      return S_OK( queue )
+    if not queue and age < self.EMPTY_QUEUE_LIFETIME:
+      return S_OK( queue )
+
+    res = self._escapeString( requestType )
+    if not res['OK']:
+      return res
+    myRequestType = res['Value']
+    # The head of a request is its first Waiting or Assigned subrequest sorted by ExecutionOrder, LastUpdate
+    # and SubRequestID. The request is ready for the type of its head if there are Waiting subrequests of
+    # that type with the same ExecutionOrder
+    headKey = "CONCAT( IFNULL( DATE_FORMAT( S.LastUpdate, '%Y%m%d%H%i%s' ), '00000000000000' ), LPAD( S.SubRequestID, 12, '0' ) )"
+    req = "SELECT S.RequestID, S.ExecutionOrder,"
+    req += " MIN( IF( S.RequestType = %s, %s, NULL ) ) AS TypeKey," % ( myRequestType, headKey )
+    req += " MIN( IF( S.RequestType = %s, NULL, %s ) ) AS OtherKey," % ( myRequestType, headKey )
+    req += " SUM( S.RequestType = %s AND S.Status = 'Waiting' ) AS NumWaiting" % myRequestType
+    req += " FROM SubRequests AS S, ( SELECT RequestID, MIN( ExecutionOrder ) AS ExecutionOrder FROM SubRequests"
+    req += " WHERE Status IN ( 'Waiting', 'Assigned' ) GROUP BY RequestID ) AS H"
+    req += " WHERE S.RequestID = H.RequestID AND S.ExecutionOrder = H.ExecutionOrder"
+    req += " AND S.Status IN ( 'Waiting', 'Assigned' ) GROUP BY S.RequestID, S.ExecutionOrder"
+    req += " HAVING NumWaiting > 0 AND ( OtherKey IS NULL OR TypeKey < OtherKey )"
+    req += " ORDER BY TypeKey LIMIT %d" % self.dispatchQueueSize
+    res = self._query( req )
+    if not res['OK']:
+      return S_ERROR( 'RequestDB.getRequests: Failed to load %s ready queue: %s' % ( requestType, res['Message'] ) )
+    queue = [ ( row[0], row[1] ) for row in res['Value'] ]
+    self.__readyQueues[ requestType ] = ( time.time(), queue )
+    gLogger.verbose( 'RequestDB.getRequests: %d %s requests ready' % ( len( queue ), requestType ) )
+    return S_OK( queue )
+
+  def __claimRequests( self, requestType, limit ):
+    """ Assign the Waiting subrequests of up to :limit: requests from the ready queue
+
+    Called with the lock of the type held
+
+    :return: S_OK( ( [ requestID, ... ], { requestID : [ subrequest row, ... ] } ) )
+    """
+    requestIDs = []
+    subRequests = {}
+    # A drained queue is loaded again, unless it has just been loaded
+    while len( requestIDs ) < limit:
+      res = self.__getReadyQueue( requestType )
+      if not res['OK']:
+        return res
+      queue = res['Value']
+      if not queue:
+        break
+      heads = queue[ :limit - len( requestIDs ) ]
+      del queue[ :len( heads ) ]
+      res = self.__assignSubRequests( requestType, heads )
+      if not res['OK']:
+        return res
+      for requestID, subRequestRows in res['Value']:
+        requestIDs.append( requestID )
+        subRequests[ requestID ] = subRequestRows
+    return S_OK( ( requestIDs, subRequests ) )
+
+  def __assignSubRequests( self, requestType, heads ):
+    """ Assign in one transaction the Waiting subrequests of requestType of the given request heads
+
+    The subrequests are locked with SELECT ... FOR UPDATE, so other RequestManagers can't assign them too
+
+    :param list heads: [ ( requestID, executionOrder ), ... ]
+    :return: S_OK( [ ( requestID, [ subrequest row, ... ] ), ... ] ) for the requests that could be assigned
+    """
+    res = self._escapeString( requestType )
+    if not res['OK']:
+      return res
+    myRequestType = res['Value']
+    executionOrders = dict( heads )
+    fields = ['RequestID', 'SubRequestID', 'Operation', 'Arguments',
+              'ExecutionOrder', 'SourceSE', 'TargetSE', 'Catalogue',
+              'CreationTime', 'SubmissionTime', 'LastUpdate']
+    req = "SELECT %s FROM SubRequests WHERE RequestID IN ( %s ) AND RequestType = %s AND Status = 'Waiting'" % \
+          ( ', '.join( fields ), intListToString( executionOrders.keys() ), myRequestType )
+    req += " ORDER BY SubRequestID FOR UPDATE"
+    # A connection kept just for this, the transaction goes from the select to the update.
+    # If it has gone away while idle it is replaced and the assignment tried again
+    for attempt in range( 2 ):
+      if requestType not in self.__assignConnections:
+        res = self._getConnection()
+        if not res['OK']:
+          return res
+        self.__assignConnections[ requestType ] = res['Value']
+      connection = self.__assignConnections[ requestType ]
+      res = self._query( req, conn = connection )
+      if res['OK']:
+        break
+      self.__dropAssignConnection( requestType )
+    if not res['OK']:
+      return S_ERROR( 'RequestDB.getRequests: Failed to retrieve SubRequests: %s' % res['Message'] )
+
+    rowsByRequest = {}
+    subIDList = []
+    for row in res['Value']:
+      requestID = row[0]
+      # Only the subrequests of the head, the others wait for the head to be done
+      if row[4] != executionOrders[ requestID ]:
+        continue
+      rowsByRequest.setdefault( requestID, [] ).append( row[1:] )
+      subIDList.append( row[1] )
+    if not subIDList:
+      # Nothing to assign, just end the transaction
+      try:
+        connection.rollback()
+      except Exception:
+        self.__dropAssignConnection( requestType )
+      return S_OK( [] )
+
+    req = "UPDATE SubRequests SET Status='Assigned' WHERE SubRequestID IN ( %s )" % intListToString( subIDList )
+    res = self._update( req, conn = connection )
+    if not res['OK']:
+      self.__dropAssignConnection( requestType )
+      return S_ERROR( 'Failed to assign subrequests: %s' % res['Message'] )
+    # In the order of the queue
+    return S_OK( [ ( requestID, rowsByRequest[ requestID ] ) for requestID, _order in heads
+                   if requestID in rowsByRequest ] )
+
+  def __dropAssignConnection( self, requestType ):
+    """ Close the connection used to assign the subrequests of a type after an error
+    """
+    connection = self.__assignConnections.pop( requestType, None )
+    if not connection:
+      return
+    try:
+      connection.rollback()
+      connection.close()
+    except Exception:
+      pass
+
+  def __getRequestByQuery( self, requestType ):
+    """ Get a request of a given type eligible for execution, selecting the candidates
+        among all the subrequests in the DB every time
+    """
     myRequestType = self._escapeString( requestType )
     if not myRequestType:
       return myRequestType
 
     myRequestType = myRequestType['Value']
 
-    start = time.time()
-    dmRequest = RequestContainer( init = False )
     requestID = 0
     subIDList = []
 
@@ -333,11 +550,81 @@ class RequestDBMySQL( DB ):
     if not requestID:
       return S_OK()
 
-    dmRequest.setRequestID( requestID )
+    res = self.__buildRequests( requestType, [ requestID ],
+                                { requestID : [ row for row in reqDict[requestID] if row[0] in subIDList ] } )
+    if not res['OK']:
+      return res
+    requests, errors = res['Value']
+    if errors:
+      return S_ERROR( errors[0] )
+    return S_OK( requests[0] )
+
+  def __buildRequests( self, requestType, requestIDs, subRequests ):
+    """ Build the requests of assigned subrequests, reading the files, datasets and request
+        attributes of all of them at once. The subrequests of the requests that can't be built are released
+
+    :param list requestIDs: request IDs
+    :param dict subRequests: { requestID : [ ( SubRequestID, Operation, Arguments, ExecutionOrder, SourceSE,
+                                              TargetSE, Catalogue, CreationTime, SubmissionTime, LastUpdate ), ... ] }
+    :return: S_OK( ( [ { 'RequestName' : .., 'RequestString' : .., 'JobID' : .. }, ... ], [ error, ... ] ) )
+    """
+    subIDList = []
+    for requestID in requestIDs:
+      subIDList.extend( [ row[0] for row in subRequests[requestID] ] )
 
+    files = {}
     fields = ['FileID', 'LFN', 'Size', 'PFN', 'GUID', 'Md5', 'Addler', 'Attempt', 'Status' ]
-    for subRequestID, operation, arguments, executionOrder, sourceSE, targetSE, catalogue, creationTime, submissionTime, lastUpdate in reqDict[requestID]:
-      if not subRequestID in subIDList: continue
+    req = "SELECT SubRequestID, %s FROM Files WHERE SubRequestID IN ( %s ) ORDER BY FileID;" % ( ', '.join( fields ),
+                                                                                               intListToString( subIDList ) )
+    res = self._query( req )
+    if not res['OK']:
+      self.__releaseRequests( requestIDs, subRequests )
+      return S_ERROR( 'RequestDB._getRequest: Failed to get File attributes\n%s' % res['Message'] )
+    for row in res['Value']:
+      files.setdefault( row[0], [] ).append( dict( zip( fields, row[1:] ) ) )
+
+    datasets = {}
+    req = "SELECT SubRequestID, Dataset FROM Datasets WHERE SubRequestID IN ( %s );" % intListToString( subIDList )
+    res = self._query( req )
+    if not res['OK']:
+      self.__releaseRequests( requestIDs, subRequests )
+      return S_ERROR( 'RequestDB._getRequest: Failed to get Datasets\n%s' % res['Message'] )
+    for subRequestID, dataset in res['Value']:
+      datasets.setdefault( subRequestID, [] ).append( dataset )
+
+    attributes = {}
+    fields = ['RequestID', 'RequestName', 'JobID', 'OwnerDN', 'OwnerGroup',
+              'DIRACSetup', 'SourceComponent', 'CreationTime',
+              'SubmissionTime', 'LastUpdate']
+    req = "SELECT %s from Requests WHERE RequestID IN ( %s );" % ( ', '.join( fields ), intListToString( requestIDs ) )
+    res = self._query( req )
+    if not res['OK']:
+      self.__releaseRequests( requestIDs, subRequests )
+      return S_ERROR( 'RequestDB._getRequest: Failed to retrieve Requests\n%s' % res['Message'] )
+    for row in res['Value']:
+      attributes[ row[0] ] = row[1:]
+
+    requests = []
+    errors = []
+    for requestID in requestIDs:
+      res = self.__buildRequest( requestType, requestID, subRequests[requestID], files, datasets,
+                                 attributes.get( requestID ) )
+      if not res['OK']:
+        gLogger.error( res['Message'] )
+        errors.append( res['Message'] )
+        self.__releaseSubRequests( requestID, [ row[0] for row in subRequests[requestID] ] )
+        continue
+      requests.append( res['Value'] )
+    return S_OK( ( requests, errors ) )
+
+  def __buildRequest( self, requestType, requestID, subRequestRows, files, datasets, attributes ):
+    """ Build the request container of one request and serialize it
+    """
+    if not attributes:
+      return S_ERROR( 'RequestDB._getRequest: Failed to retrieve Request %s' % requestID )
+    dmRequest = RequestContainer( init = False )
+    dmRequest.setRequestID( requestID )
+    for subRequestID, operation, arguments, executionOrder, sourceSE, targetSE, catalogue, creationTime, submissionTime, lastUpdate in subRequestRows:
       res = dmRequest.initiateSubRequest( requestType )
       ind = res['Value']
       subRequestDict = {
@@ -356,51 +643,17 @@ class RequestDBMySQL( DB ):
       res = dmRequest.setSubRequestAttributes( ind, requestType, subRequestDict )
       if not res['OK']:
         err = 'RequestDB._getRequest: Failed to set subRequest attributes for RequestID %s' % requestID
-        self.__releaseSubRequests( requestID, subIDList )
-        return S_ERROR( '%s\n%s' % ( err, res['Message'] ) )
-
-      req = "SELECT %s FROM Files WHERE SubRequestID = %s ORDER BY FileID;" % ( ', '.join( fields ), subRequestID )
-      res = self._query( req )
-      if not res['OK']:
-        err = 'RequestDB._getRequest: Failed to get File attributes for RequestID %s.%s' % ( requestID, subRequestID )
-        self.__releaseSubRequests( requestID, subIDList )
         return S_ERROR( '%s\n%s' % ( err, res['Message'] ) )
-      files = []
-      for fileID, lfn, size, pfn, guid, md5, addler, attempt, status in res['Value']:
-        fileDict = {'FileID':fileID, 'LFN':lfn, 'Size':size, 'PFN':pfn, 'GUID':guid, 'Md5':md5, 'Addler':addler, 'Attempt':attempt, 'Status':status}
-        files.append( fileDict )
-      res = dmRequest.setSubRequestFiles( ind, requestType, files )
+      res = dmRequest.setSubRequestFiles( ind, requestType, files.get( subRequestID, [] ) )
       if not res['OK']:
         err = 'RequestDB._getRequest: Failed to set files into Request for RequestID %s.%s' % ( requestID, subRequestID )
-        self.__releaseSubRequests( requestID, subIDList )
         return S_ERROR( '%s\n%s' % ( err, res['Message'] ) )
-
-      req = "SELECT Dataset,Status FROM Datasets WHERE SubRequestID = %s;" % subRequestID
-      res = self._query( req )
-      if not res['OK']:
-        err = 'RequestDB._getRequest: Failed to get Datasets for RequestID %s.%s' % ( requestID, subRequestID )
-        self.__releaseSubRequests( requestID, subIDList )
-        return S_ERROR( '%s\n%s' % ( err, res['Message'] ) )
-      datasets = []
-      for dataset, status in res['Value']:
-        datasets.append( dataset )
-      res = dmRequest.setSubRequestDatasets( ind, requestType, datasets )
+      res = dmRequest.setSubRequestDatasets( ind, requestType, datasets.get( subRequestID, [] ) )
       if not res['OK']:
         err = 'RequestDB._getRequest: Failed to set datasets into Request for RequestID %s.%s' % ( requestID, subRequestID )
-        self.__releaseSubRequests( requestID, subIDList )
         return S_ERROR( '%s\n%s' % ( err, res['Message'] ) )
 
-    fields = ['RequestName', 'JobID', 'OwnerDN', 'OwnerGroup',
-              'DIRACSetup', 'SourceComponent', 'CreationTime',
-              'SubmissionTime', 'LastUpdate']
-
-    req = "SELECT %s from Requests WHERE RequestID = %s;" % ( ', '.join( fields ), requestID )
-    res = self._query( req )
-    if not res['OK']:
-      err = 'RequestDB._getRequest: Failed to retrieve max RequestID'
-      self.__releaseSubRequests( requestID, subIDList )
-      return S_ERROR( '%s\n%s' % ( err, res['Message'] ) )
-    requestName, jobID, ownerDN, ownerGroup, diracSetup, sourceComponent, creationTime, submissionTime, lastUpdate = res['Value'][0]
+    requestName, jobID, ownerDN, ownerGroup, diracSetup, sourceComponent, creationTime, submissionTime, lastUpdate = attributes
     dmRequest.setRequestName( requestName )
     dmRequest.setJobID( jobID )
     dmRequest.setOwnerDN( ownerDN )
@@ -412,7 +665,6 @@ class RequestDBMySQL( DB ):
     res = dmRequest.toXML()
     if not res['OK']:
       err = 'RequestDB._getRequest: Failed to create XML for RequestID %s' % ( requestID )
-      self.__releaseSubRequests( requestID, subIDList )
       return S_ERROR( '%s\n%s' % ( err, res['Message'] ) )
     requestString = res['Value']
     #still have to manage the status of the dataset properly
@@ -422,9 +674,18 @@ class RequestDBMySQL( DB ):
     resultDict['JobID'] = jobID
     return S_OK( resultDict )
 
+  def __releaseRequests( self, requestIDs, subRequests ):
+    for requestID in requestIDs:
+      self.__releaseSubRequests( requestID, [ row[0] for row in subRequests[requestID] ] )
+
   def __releaseSubRequests( self, requestID, subRequestIDs ):
-    for subRequestID in subRequestIDs:
-      res = self._setSubRequestAttribute( requestID, subRequestID, 'Status', 'Waiting' )
+    if not subRequestIDs:
+      return
+    req = "UPDATE SubRequests SET Status='Waiting', LastUpdate=UTC_TIMESTAMP() WHERE RequestID=%s AND SubRequestID IN ( %s );" % \
+          ( requestID, intListToString( subRequestIDs ) )
+    res = self._update( req )
+    if not res['OK']:
+      gLogger.error( 'RequestDB: Failed to release subrequests of request %s' % requestID, res['Message'] )
 
   def setRequest( self, requestName, requestString ):
     request = RequestContainer( init = True, request = requestString )
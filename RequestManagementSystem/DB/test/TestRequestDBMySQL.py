@@ -0,0 +1,166 @@
+""" Unit tests of the ready queues of the RequestDBMySQL
+
+    The SubRequests table is kept in memory. One lock stands for the row locks taken
+    by SELECT ... FOR UPDATE, they are kept until the UPDATE commits or a rollback.
+"""
+import re
+import threading
+import unittest
+
+from DIRAC import S_OK, gLogger
+from DIRAC.RequestManagementSystem.DB.RequestDBMySQL import RequestDBMySQL
+
+class FakeSubRequests:
+  """ { subRequestID : [ requestID, requestType, status, executionOrder ] } """
+
+  def __init__( self ):
+    self.lock = threading.Lock()
+    self.rows = {}
+    #SubRequestIDs in the order they have been assigned
+    self.assigned = []
+    #Events to block the load of the queue of a type
+    self.loadStarted = {}
+    self.loadAllowed = {}
+
+  def addRequest( self, requestID, subRequests ):
+    """ subRequests: [ ( requestType, executionOrder ), ... ] """
+    for requestType, executionOrder in subRequests:
+      self.rows[ len( self.rows ) + 1 ] = [ requestID, requestType, 'Waiting', executionOrder ]
+
+class FakeConnection:
+
+  def __init__( self, subRequests ):
+    self.subRequests = subRequests
+    self.locked = False
+
+  def lock( self ):
+    if not self.locked:
+      self.subRequests.lock.acquire()
+      self.locked = True
+
+  def rollback( self ):
+    if self.locked:
+      self.locked = False
+      self.subRequests.lock.release()
+
+  def close( self ):
+    self.rollback()
+
+class FakeRequestDB( RequestDBMySQL ):
+  """ RequestDBMySQL serving the requests of FakeSubRequests """
+
+  def __init__( self, subRequests ):
+    self.log = gLogger.getSubLogger( "FakeRequestDB" )
+    self.subRequests = subRequests
+    self.dispatchMode = "Queue"
+    self.dispatchQueueSize = 1000
+    self.dispatchQueueLifeTime = 60
+    self._RequestDBMySQL__readyQueues = {}
+    self._RequestDBMySQL__typeLocks = {}
+    self._RequestDBMySQL__queueLock = threading.Lock()
+    self._RequestDBMySQL__assignConnections = {}
+
+  def _escapeString( self, myString, conn = None ):
+    return S_OK( "'%s'" % myString )
+
+  def _getConnection( self ):
+    return S_OK( FakeConnection( self.subRequests ) )
+
+  def _query( self, cmd, conn = None, debug = False ):
+    if cmd.find( "FOR UPDATE" ) > -1:
+      conn.lock()
+      requestIDs = [ int( requestID ) for requestID in re.search( "RequestID IN \( ([^)]*) \)", cmd ).group( 1 ).split( "," ) ]
+      requestType = re.search( "RequestType = '(\w+)'", cmd ).group( 1 )
+      rows = []
+      for subRequestID in sorted( self.subRequests.rows ):
+        requestID, subType, status, executionOrder = self.subRequests.rows[ subRequestID ]
+        if requestID in requestIDs and subType == requestType and status == 'Waiting':
+          rows.append( ( requestID, subRequestID, 'operation', '', executionOrder, '', '', '', None, None, None ) )
+      return S_OK( tuple( rows ) )
+    requestType = re.search( "S.RequestType = '(\w+)'", cmd ).group( 1 )
+    if requestType in self.subRequests.loadAllowed:
+      self.subRequests.loadStarted[ requestType ].set()
+      self.subRequests.loadAllowed[ requestType ].wait()
+    heads = {}
+    for requestID, subType, status, executionOrder in self.subRequests.rows.values():
+      if status in ( 'Waiting', 'Assigned' ):
+        heads[ requestID ] = min( heads.get( requestID, executionOrder ), executionOrder )
+    ready = {}
+    for requestID, subType, status, executionOrder in self.subRequests.rows.values():
+      if subType == requestType and status == 'Waiting' and heads[ requestID ] == executionOrder:
+        ready[ requestID ] = executionOrder
+    return S_OK( tuple( sorted( ready.items() ) ) )
+
+  def _update( self, cmd, conn = None, debug = False ):
+    subRequestIDs = [ int( subRequestID ) for subRequestID in re.search( "IN \( ([^)]*) \)", cmd ).group( 1 ).split( "," ) ]
+    for subRequestID in subRequestIDs:
+      self.subRequests.rows[ subRequestID ][2] = 'Assigned'
+      self.subRequests.assigned.append( subRequestID )
+    #The update commits
+    conn.rollback()
+    return S_OK( len( subRequestIDs ) )
+
+  def _RequestDBMySQL__buildRequests( self, requestType, requestIDs, subRequests ):
+    requests = [ { 'RequestName' : requestID, 'SubRequests' : [ row[0] for row in subRequests[ requestID ] ] }
+                 for requestID in requestIDs ]
+    return S_OK( ( requests, [] ) )
+
+class ReadyQueueTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.subRequests = FakeSubRequests()
+    for requestID in range( 1, 21 ):
+      self.subRequests.addRequest( requestID, [ ( 'transfer', 0 ), ( 'transfer', 0 ), ( 'register', 1 ) ] )
+    self.subRequests.addRequest( 21, [ ( 'removal', 0 ) ] )
+
+  def tearDown( self ):
+    for loadAllowed in self.subRequests.loadAllowed.values():
+      loadAllowed.set()
+
+  def test_claimOnce( self ):
+    #Two RequestManagers with their own ready queues, both holding all the requests
+    requestDBs = [ FakeRequestDB( self.subRequests ), FakeRequestDB( self.subRequests ) ]
+    for requestDB in requestDBs:
+      self.assertEqual( len( requestDB._RequestDBMySQL__getReadyQueue( 'transfer' )[ 'Value' ] ), 20 )
+    served = []
+    def getRequests( requestDB ):
+      while True:
+        requests = requestDB.getRequests( 'transfer', 3 )[ 'Value' ]
+        if not requests:
+          return
+        served.extend( requests )
+    threads = [ threading.Thread( target = getRequests, args = ( requestDBs[ i % 2 ], ) ) for i in range( 6 ) ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual( sorted( [ request[ 'RequestName' ] for request in served ] ), range( 1, 21 ) )
+    for request in served:
+      self.assertEqual( len( request[ 'SubRequests' ] ), 2 )
+    self.assertEqual( sorted( self.subRequests.assigned ), sorted( [ subRequestID for subRequestID, row in self.subRequests.rows.items()
+                                                                     if row[1] == 'transfer' ] ) )
+    #The register subrequests come after the transfers are done
+    self.assertEqual( requestDBs[0].getRequests( 'register', 5 )[ 'Value' ], [] )
+
+  def test_typesIndependent( self ):
+    requestDB = FakeRequestDB( self.subRequests )
+    self.subRequests.loadStarted[ 'removal' ] = threading.Event()
+    self.subRequests.loadAllowed[ 'removal' ] = threading.Event()
+    removals = []
+    removalThread = threading.Thread( target = lambda: removals.extend( requestDB.getRequests( 'removal', 5 )[ 'Value' ] ) )
+    removalThread.start()
+    self.subRequests.loadStarted[ 'removal' ].wait()
+    #The removal queue is being loaded, transfers are still served
+    transfers = []
+    transferThread = threading.Thread( target = lambda: transfers.extend( requestDB.getRequests( 'transfer', 2 )[ 'Value' ] ) )
+    transferThread.start()
+    transferThread.join( 2 )
+    self.assertEqual( [ request[ 'RequestName' ] for request in transfers ], [ 1, 2 ] )
+    self.subRequests.loadAllowed[ 'removal' ].set()
+    removalThread.join()
+    transferThread.join()
+    self.assertEqual( [ request[ 'RequestName' ] for request in removals ], [ 21 ] )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( ReadyQueueTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -119,6 +119,18 @@ class RequestManagerHandler(RequestHandler):
       gLogger.exception( errStr, requestType, lException=error )
       return S_ERROR(errStr)
 
+  types_getRequests = [ StringTypes, [ IntType, LongType ] ]
+  @staticmethod
+  def export_getRequests( requestType, limit ):
+    """ Get up to limit requests of given type from the database """
+    gLogger.info("RequestHandler.getRequests: Attempting to get %s requests of type" % limit, requestType)
+    try:
+      return gRequestDB.getRequests( requestType, limit )
+    except Exception, error:
+      errStr = "RequestManagerHandler.getRequests: Exception while getting requests."
+      gLogger.exception( errStr, requestType, lException=error )
+      return S_ERROR(errStr)
+
   types_serveRequest = []
   @staticmethod
   def export_serveRequest( requestType ):
@@ -0,0 +1,72 @@
+########################################################################
+# $HeadURL $
+# File: RequestContainerBenchmark.py
+########################################################################
+
+""".. module:: RequestContainerBenchmark
+
+Time writing and reading large multi-subrequest requests as XML
+and in the compact format.
+
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import sys
+import time
+from DIRAC.RequestManagementSystem.Client.RequestContainer import RequestContainer
+
+def largeRequest( numSubRequests = 10, numFiles = 5000 ):
+  """ request with numSubRequests subrequests of numFiles files """
+  request = RequestContainer()
+  request.setRequestName( "benchmark" )
+  request.setJobID( 1234 )
+  request.setOwnerDN( "/DC=ch/DC=cern/OU=Users/CN=benchmark" )
+  request.setOwnerGroup( "lhcb_user" )
+  for i in xrange( numSubRequests ):
+    requestType = ( "transfer", "removal", "register" )[ i % 3 ]
+    files = [ { "LFN" : "/lhcb/user/b/benchmark/%d/file_%d.dst" % ( i, j ),
+                "PFN" : "srm://srm.cern.ch/castor/cern.ch/grid/lhcb/user/b/benchmark/%d/file_%d.dst" % ( i, j ),
+                "Size" : 1000000 + j,
+                "GUID" : "7E9CED5A-295B-ED88-CE9A-%012d" % j,
+                "Addler" : "%08x" % j } for j in xrange( numFiles ) ]
+    request.addSubRequest( { "Attributes" : { "Operation" : "replicateAndRegister",
+                                              "TargetSE" : "CERN-USER",
+                                              "ExecutionOrder" : i },
+                             "Files" : files }, requestType )
+  return request
+
+def timeRequest( request, iterations = 3 ):
+  times = { "toXML" : 0, "parse XML" : 0, "serialize" : 0, "parse compact" : 0 }
+  for i in range( iterations ):
+    start = time.time()
+    xmlString = request.toXML()["Value"]
+    times[ "toXML" ] += time.time() - start
+    start = time.time()
+    fromXML = RequestContainer( xmlString )
+    times[ "parse XML" ] += time.time() - start
+    start = time.time()
+    compact = request.serialize()["Value"]
+    times[ "serialize" ] += time.time() - start
+    start = time.time()
+    fromCompact = RequestContainer( compact )
+    times[ "parse compact" ] += time.time() - start
+  assert fromXML.subRequests == fromCompact.subRequests
+  for key in times:
+    times[ key ] /= iterations
+  return times, len( xmlString ), len( compact )
+
+def runBenchmark():
+  for numSubRequests, numFiles in ( ( 3, 1000 ), ( 10, 5000 ) ):
+    request = largeRequest( numSubRequests, numFiles )
+    times, xmlSize, compactSize = timeRequest( request )
+    print "%d subrequests of %d files, XML %.1f MB, compact %.1f MB:" % ( numSubRequests, numFiles,
+                                                                           xmlSize / 1048576.0,
+                                                                           compactSize / 1048576.0 )
+    for key in ( "toXML", "parse XML", "serialize", "parse compact" ):
+      print "  %-15s %.3f s" % ( key, times[ key ] )
+    sys.stdout.flush()
+
+if __name__ == "__main__":
+  runBenchmark()
@@ -13,6 +13,7 @@ from DIRAC.Core.Utilities.ThreadPool                        import ThreadPool
 
 from DIRAC.ResourceStatusSystem.Client.ResourceStatusClient import ResourceStatusClient
 from DIRAC.ResourceStatusSystem.Command                     import knownAPIs
+from DIRAC.ResourceStatusSystem.Command.CommandResultCache  import CommandResultCache
 from DIRAC.ResourceStatusSystem.PolicySystem.PEP            import PEP
 from DIRAC.ResourceStatusSystem.Utilities.Utils             import where
 from DIRAC.ResourceStatusSystem.Utilities                   import CS
@@ -44,7 +45,8 @@ class RSInspectorAgent( AgentModule ):
       self.rsClient             = ResourceStatusClient()
       self.resourcesFreqs       = CS.getTypedDictRootedAtOperations( 'CheckingFreqs/ResourcesFreqs' )
       self.resourcesToBeChecked = Queue.Queue()
-      self.resourceNamesInCheck = []
+      self.resourceNamesInCheck = set()
+      self.commandCache         = CommandResultCache()
 
       self.maxNumberOfThreads = self.am_getOption( 'maxThreadsInPool', 1 )
       self.threadPool         = ThreadPool( self.maxNumberOfThreads,
@@ -67,6 +69,10 @@ class RSInspectorAgent( AgentModule ):
 
     try:
 
+      self.log.info( 'Commands of the last cycle: %d run, %d results reused' %
+                     ( self.commandCache.misses, self.commandCache.hits ) )
+      self.commandCache.clear()
+
       kwargs = { 'meta' : {} }
       kwargs['meta']['columns'] = [ 'ResourceName', 'StatusType', 'Status',
                                     'FormerStatus', 'SiteType', 'ResourceType', \
@@ -89,7 +95,7 @@ class RSInspectorAgent( AgentModule ):
 
         resourceL = [ 'Resource' ] + resourceTuple
 
-        self.resourceNamesInCheck.insert( 0, ( resourceTuple[ 0 ], resourceTuple[ 1 ] ) )
+        self.resourceNamesInCheck.add( ( resourceTuple[ 0 ], resourceTuple[ 1 ] ) )
         self.resourcesToBeChecked.put( resourceL )
 
       return S_OK()
@@ -124,7 +130,7 @@ class RSInspectorAgent( AgentModule ):
     __APIs__ = [ 'ResourceStatusClient', 'ResourceManagementClient' ]
     clients = knownAPIs.initAPIs( __APIs__, {} )
 
-    pep = PEP( clients = clients )
+    pep = PEP( clients = clients, commandCache = self.commandCache )
 
     while True:
 
@@ -152,15 +158,12 @@ class RSInspectorAgent( AgentModule ):
                           ( pepDict['name'], pepDict['statusType'], pepDict['status'], pepStatus ))
 
         # remove from InCheck list
-        self.resourceNamesInCheck.remove( ( pepDict[ 'name' ], pepDict[ 'statusType' ] ) )
+        self.resourceNamesInCheck.discard( ( pepDict[ 'name' ], pepDict[ 'statusType' ] ) )
 
       except Exception:
         self.log.exception( "RSInspector._executeCheck Checking Resource %s, with type/status: %s/%s" % \
                       ( pepDict['name'], pepDict['statusType'], pepDict['status'] ) )
-        try:
-          self.resourceNamesInCheck.remove( ( pepDict[ 'name' ], pepDict[ 'statusType' ] ) )
-        except IndexError:
-          pass
+        self.resourceNamesInCheck.discard( ( pepDict[ 'name' ], pepDict[ 'statusType' ] ) )
 
 ################################################################################
 #EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF
\ No newline at end of file
@@ -14,6 +14,7 @@ from DIRAC.Core.Utilities.ThreadPool                        import ThreadPool
 from DIRAC.ResourceStatusSystem.Utilities                   import CS
 from DIRAC.ResourceStatusSystem.Client.ResourceStatusClient import ResourceStatusClient
 from DIRAC.ResourceStatusSystem.Command                     import knownAPIs
+from DIRAC.ResourceStatusSystem.Command.CommandResultCache  import CommandResultCache
 from DIRAC.ResourceStatusSystem.PolicySystem.PEP            import PEP
 from DIRAC.ResourceStatusSystem.Utilities.Utils             import where
 
@@ -44,7 +45,8 @@ class SSInspectorAgent( AgentModule ):
       self.rsClient         = ResourceStatusClient()
       self.sitesFreqs       = CS.getTypedDictRootedAtOperations( 'CheckingFreqs/SitesFreqs' )
       self.sitesToBeChecked = Queue.Queue()
-      self.siteNamesInCheck = []
+      self.siteNamesInCheck = set()
+      self.commandCache     = CommandResultCache()
 
       self.maxNumberOfThreads = self.am_getOption( 'maxThreadsInPool', 1 )
       self.threadPool         = ThreadPool( self.maxNumberOfThreads,
@@ -67,6 +69,10 @@ class SSInspectorAgent( AgentModule ):
 
     try:
 
+      self.log.info( 'Commands of the last cycle: %d run, %d results reused' %
+                     ( self.commandCache.misses, self.commandCache.hits ) )
+      self.commandCache.clear()
+
       kwargs = { 'meta' : {} }
       kwargs['meta']['columns'] = [ 'SiteName', 'StatusType', 'Status',
                                     'FormerStatus', 'SiteType', 'TokenOwner']
@@ -88,7 +94,7 @@ class SSInspectorAgent( AgentModule ):
 
         resourceL = [ 'Site' ] + siteTuple
 
-        self.siteNamesInCheck.insert( 0, ( siteTuple[ 0 ], siteTuple[ 1 ] ) )
+        self.siteNamesInCheck.add( ( siteTuple[ 0 ], siteTuple[ 1 ] ) )
         self.sitesToBeChecked.put( resourceL )
 
       return S_OK()
@@ -123,7 +129,7 @@ class SSInspectorAgent( AgentModule ):
     __APIs__ = [ 'ResourceStatusClient', 'ResourceManagementClient', 'GGUSTicketsClient' ]
     clients = knownAPIs.initAPIs( __APIs__, {} )
 
-    pep = PEP( clients = clients )
+    pep = PEP( clients = clients, commandCache = self.commandCache )
 
     while True:
 
@@ -150,15 +156,12 @@ class SSInspectorAgent( AgentModule ):
                           ( pepDict['name'], pepDict['statusType'], pepDict['status'], pepStatus ))
 
         # remove from InCheck list
-        self.siteNamesInCheck.remove( ( pepDict[ 'name' ], pepDict[ 'statusType' ] ) )
+        self.siteNamesInCheck.discard( ( pepDict[ 'name' ], pepDict[ 'statusType' ] ) )
 
       except Exception:
         self.log.exception( "SSInspector._executeCheck Checking Site %s, with type/status: %s/%s" % \
                       ( pepDict['name'], pepDict['statusType'], pepDict['status'] ) )
-        try:
-          self.siteNamesInCheck.remove( ( pepDict[ 'name' ], pepDict[ 'statusType' ] ) )
-        except IndexError:
-          pass
+        self.siteNamesInCheck.discard( ( pepDict[ 'name' ], pepDict[ 'statusType' ] ) )
 
 ################################################################################
 #EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF
\ No newline at end of file
@@ -14,6 +14,7 @@ from DIRAC.Core.Utilities.ThreadPool                        import ThreadPool
 from DIRAC.ResourceStatusSystem.Utilities                   import CS
 from DIRAC.ResourceStatusSystem.Client.ResourceStatusClient import ResourceStatusClient
 from DIRAC.ResourceStatusSystem.Command                     import knownAPIs
+from DIRAC.ResourceStatusSystem.Command.CommandResultCache  import CommandResultCache
 from DIRAC.ResourceStatusSystem.PolicySystem.PEP            import PEP
 from DIRAC.ResourceStatusSystem.Utilities.Utils             import where
 
@@ -41,9 +42,11 @@ class SeSInspectorAgent( AgentModule ):
     # pylint: disable-msg=W0201
 
     try:
-      self.rsClient      = ResourceStatusClient()
-      self.servicesFreqs = CS.getTypedDictRootedAtOperations( 'CheckingFreqs/ServicesFreqs' )
-      self.queue         = Queue.Queue()
+      self.rsClient            = ResourceStatusClient()
+      self.servicesFreqs       = CS.getTypedDictRootedAtOperations( 'CheckingFreqs/ServicesFreqs' )
+      self.queue               = Queue.Queue()
+      self.serviceNamesInCheck = set()
+      self.commandCache        = CommandResultCache()
 
       self.maxNumberOfThreads = self.am_getOption( 'maxThreadsInPool', 1 )
       self.threadPool         = ThreadPool( self.maxNumberOfThreads,
@@ -65,7 +68,11 @@ class SeSInspectorAgent( AgentModule ):
   def execute( self ):
 
     try:
-      
+
+      self.log.info( 'Commands of the last cycle: %d run, %d results reused' %
+                     ( self.commandCache.misses, self.commandCache.hits ) )
+      self.commandCache.clear()
+
       kwargs = { 'meta' : {} }
       kwargs['meta']['columns'] = [ 'ServiceName', 'StatusType', 'Status',
                                     'FormerStatus', 'SiteType',
@@ -81,13 +88,15 @@ class SeSInspectorAgent( AgentModule ):
       self.log.info( 'Found %d candidates to be checked.' % len( resQuery ) )
 
       for service in resQuery:
+
+        if ( service[ 0 ], service[ 1 ] ) in self.serviceNamesInCheck:
+          self.log.info( '%s(%s) discarded, already on the queue' % ( service[ 0 ], service[ 1 ] ) )
+          continue
+
         resourceL = [ 'Service' ] + service
-        # Here we peek INSIDE the Queue to know if the item is already
-        # here. It's ok _here_ since (i.e. I know what I'm doing):
-        # - It is a read only operation.
-        # - We do not need exact accuracy, it's ok to have 2 times the same item in the queue sometimes.
-        if resourceL not in self.queue.queue:
-          self.queue.put( resourceL )
+
+        self.serviceNamesInCheck.add( ( service[ 0 ], service[ 1 ] ) )
+        self.queue.put( resourceL )
 
       return S_OK()
 
@@ -101,9 +110,11 @@ class SeSInspectorAgent( AgentModule ):
       Method executed at the end of the last cycle. It waits until the queue
       is empty.
     '''
-    if not self.queue.empty():
-      self.log.info( "Wait for queue to get empty before terminating the agent"  )
-      while not self.queue.empty():
+    if self.serviceNamesInCheck:
+      _msg = "Wait for queue to get empty before terminating the agent (%d tasks)"
+      _msg = _msg % len( self.serviceNamesInCheck )
+      self.log.info( _msg )
+      while self.serviceNamesInCheck:
         time.sleep( 2 )
       self.log.info( "Queue is empty, terminating the agent..." )
     return S_OK()
@@ -119,7 +130,7 @@ class SeSInspectorAgent( AgentModule ):
     __APIs__ = [ 'ResourceStatusClient', 'ResourceManagementClient' ]
     clients = knownAPIs.initAPIs( __APIs__, {} )
 
-    pep = PEP( clients = clients )
+    pep = PEP( clients = clients, commandCache = self.commandCache )
 
     while True:
       toBeChecked = self.queue.get()
@@ -147,9 +158,13 @@ class SeSInspectorAgent( AgentModule ):
                             pepDict['statusType'], pepDict['status'],
                             pepDict['statusType'], pepStatus ))
 
+        # remove from InCheck list
+        self.serviceNamesInCheck.discard( ( pepDict[ 'name' ], pepDict[ 'statusType' ] ) )
+
       except Exception:
         self.log.exception( "SeSInspector._executeCheck Checking Service %s, with type/status: %s/%s" %
                            ( pepDict['name'], pepDict['statusType'], pepDict['status'] ) )
+        self.serviceNamesInCheck.discard( ( pepDict[ 'name' ], pepDict[ 'statusType' ] ) )
 
 ################################################################################
 #EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF
@@ -14,6 +14,7 @@ from DIRAC.Core.Utilities.ThreadPool                        import ThreadPool
 from DIRAC.ResourceStatusSystem.Utilities                   import CS
 from DIRAC.ResourceStatusSystem.Client.ResourceStatusClient import ResourceStatusClient
 from DIRAC.ResourceStatusSystem.Command                     import knownAPIs
+from DIRAC.ResourceStatusSystem.Command.CommandResultCache  import CommandResultCache
 from DIRAC.ResourceStatusSystem.PolicySystem.PEP            import PEP
 from DIRAC.ResourceStatusSystem.Utilities.Utils             import where
 
@@ -44,7 +45,8 @@ class StElInspectorAgent( AgentModule ):
       self.rsClient                    = ResourceStatusClient()
       self.storageElementsFreqs        = CS.getTypedDictRootedAtOperations( 'CheckingFreqs/StorageElementsFreqs' )
       self.storageElementsToBeChecked  = Queue.Queue()
-      self.storageElementsNamesInCheck = []
+      self.storageElementsNamesInCheck = set()
+      self.commandCache                = CommandResultCache()
 
       self.maxNumberOfThreads = self.am_getOption( 'maxThreadsInPool', 1 )
       self.threadPool         = ThreadPool( self.maxNumberOfThreads,
@@ -67,6 +69,10 @@ class StElInspectorAgent( AgentModule ):
 
     try:
 
+      self.log.info( 'Commands of the last cycle: %d run, %d results reused' %
+                     ( self.commandCache.misses, self.commandCache.hits ) )
+      self.commandCache.clear()
+
       kwargs = { 'meta' : {} }
       kwargs['meta']['columns'] = [ 'StorageElementName', 'StatusType',
                                     'Status', 'FormerStatus', 'SiteType', \
@@ -90,7 +96,7 @@ class StElInspectorAgent( AgentModule ):
         resourceL = [ 'StorageElement' ] + seTuple
 
         # the tuple consists on ( SEName, SEStatusType )
-        self.storageElementsNamesInCheck.insert( 0, ( resourceL[ 1 ], resourceL[ 2 ] ) )
+        self.storageElementsNamesInCheck.add( ( resourceL[ 1 ], resourceL[ 2 ] ) )
         self.storageElementsToBeChecked.put( resourceL )
 
       return S_OK()
@@ -125,7 +131,7 @@ class StElInspectorAgent( AgentModule ):
     __APIs__ = [ 'ResourceStatusClient', 'ResourceManagementClient' ]
     clients = knownAPIs.initAPIs( __APIs__, {} )
 
-    pep = PEP( clients = clients )
+    pep = PEP( clients = clients, commandCache = self.commandCache )
 
     while True:
 
@@ -152,14 +158,11 @@ class StElInspectorAgent( AgentModule ):
                           ( pepDict['name'], pepDict['statusType'], pepDict['status'], pepStatus ))
 
         # remove from InCheck list
-        self.storageElementsNamesInCheck.remove( ( pepDict[ 'name' ], pepDict[ 'statusType' ] ) )
+        self.storageElementsNamesInCheck.discard( ( pepDict[ 'name' ], pepDict[ 'statusType' ] ) )
 
       except Exception:
         self.log.exception( 'StElInspector._executeCheck' )
-        try:
-          self.storageElementsNamesInCheck.remove( ( pepDict[ 'name' ], pepDict[ 'statusType' ] ) )
-        except IndexError:
-          pass
+        self.storageElementsNamesInCheck.discard( ( pepDict[ 'name' ], pepDict[ 'statusType' ] ) )
 
 ################################################################################
 #EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF
\ No newline at end of file
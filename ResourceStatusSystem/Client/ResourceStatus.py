@@ -3,13 +3,20 @@
 
   Module use to switch between the CS and the RSS.
 
+  The StorageElement statuses in the RSS are read from a process wide snapshot,
+  StorageElementStatusCache, refreshed in the background.
+
 '''
 
 import datetime
+import random
+import threading
+import time
 
 from DIRAC                                                  import gConfig, gLogger, S_OK, S_ERROR
 from DIRAC.ConfigurationSystem.Client.CSAPI                 import CSAPI
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations    import Operations
+from DIRAC.Core.Utilities.DIRACSingleton                    import DIRACSingleton
 from DIRAC.ResourceStatusSystem.Client.ResourceStatusClient import ResourceStatusClient
 
 __RCSID__ = '$Id: $'
@@ -94,20 +101,37 @@ class ResourceStatus( object ):
 
   def __getRSSStorageElementStatus( self, elementName, statusType, default ):
     '''
-    Gets from RSS the StorageElements status
+    Gets from RSS the StorageElements status, from the StorageElementStatusCache
+    if it could be loaded
     '''
 
-    meta = { 'columns' : [ 'StorageElementName', 'StatusType', 'Status' ] }
-    kwargs = {
-                    'elementName' : elementName,
-                    'statusType'  : statusType,
-                    'meta'        : meta
-                  }
-
-    #This returns S_OK( [['StatusType1','Status1'],['StatusType2','Status2']...]
-    res = self.rssClient.getElementStatus( 'StorageElement', **kwargs )
-    if res[ 'OK' ] and res['Value']:
-      return S_OK( getDictFromList( res['Value'] ) )
+    result = {}
+    missing = elementName
+    statuses = StorageElementStatusCache().getStatuses()
+    if statuses is not None:
+      result = getCachedStatus( statuses, elementName, statusType )
+      # Elements added since the last refresh are not in the snapshot yet
+      if isinstance( elementName, list ):
+        missing = [ element for element in elementName if not element in result ]
+      elif result:
+        missing = []
+
+    if missing:
+
+      meta = { 'columns' : [ 'StorageElementName', 'StatusType', 'Status' ] }
+      kwargs = {
+                      'elementName' : missing,
+                      'statusType'  : statusType,
+                      'meta'        : meta
+                    }
+
+      #This returns S_OK( [['StatusType1','Status1'],['StatusType2','Status2']...]
+      res = self.rssClient.getElementStatus( 'StorageElement', **kwargs )
+      if res[ 'OK' ] and res['Value']:
+        result.update( getDictFromList( res['Value'] ) )
+
+    if result:
+      return S_OK( result )
 
     if not isinstance( elementName, list ):
       elementName = [ elementName ]
@@ -201,6 +225,8 @@ class ResourceStatus( object ):
     if not res[ 'OK' ]:
       _msg = 'Error updating StorageElement (%s,%s,%s)' % ( elementName, statusType, str( kwargs ) )
       gLogger.warn( 'RSS: %s' % _msg )
+    else:
+      StorageElementStatusCache().setStatus( elementName, statusType, status )
 
     return res
 
@@ -240,6 +266,150 @@ class ResourceStatus( object ):
 
 ################################################################################
 
+class StorageElementStatusCache( object ):
+  '''
+  Process wide snapshot of the statuses of all the StorageElements in the RSS:
+  { elementName : { statusType : status } }
+
+  It is loaded with one query on first use, and refreshed by a background thread
+  every RefreshPeriod seconds, give or take Jitter * RefreshPeriod so that all the
+  processes do not query at the same time. While the RSS can not be reached the
+  last snapshot is kept. Options are in the RSSConfiguration/Cache/StorageElement
+  section of the Operations.
+  '''
+  __metaclass__ = DIRACSingleton
+
+  def __init__( self ):
+    '''
+    Constructor, the snapshot is loaded on first use.
+    '''
+    self.rssClient   = None
+    self.log         = gLogger.getSubLogger( 'StorageElementStatusCache' )
+    self.__opHelper  = Operations()
+    self.__statuses  = None
+    self.__lastUpdate  = 0
+    self.__lastAttempt = 0
+    self.__refreshLock   = threading.Lock()
+    self.__threadLock    = threading.Lock()
+    self.__refreshThread = None
+
+  def __getOption( self, option, default ):
+    '''
+    Option of the RSSConfiguration/Cache/StorageElement section
+    '''
+    return self.__opHelper.getValue( 'RSSConfiguration/Cache/StorageElement/%s' % option, default )
+
+  def getStatuses( self ):
+    '''
+    Gets the snapshot, loading it if it was never loaded. None if it could not be
+    loaded, a new attempt is made after RetryPeriod seconds.
+    '''
+    self.__startRefreshThread()
+    if self.__statuses is None and time.time() - self.__lastAttempt > self.__getOption( 'RetryPeriod', 60 ):
+      self.refresh()
+    return self.__statuses
+
+  def refresh( self ):
+    '''
+    Loads the statuses of all the StorageElements from the RSS. If it fails the
+    current snapshot is kept.
+    '''
+    self.__refreshLock.acquire()
+    try:
+      self.__lastAttempt = time.time()
+      if self.rssClient is None:
+        self.rssClient = ResourceStatusClient()
+      meta = { 'columns' : [ 'StorageElementName', 'StatusType', 'Status' ] }
+      res = self.rssClient.getElementStatus( 'StorageElement', meta = meta )
+      if not res[ 'OK' ]:
+        if self.__statuses is not None:
+          self.log.warn( 'Keeping StorageElement statuses of %d seconds ago' % ( time.time() - self.__lastUpdate ),
+                         res[ 'Message' ] )
+        else:
+          self.log.warn( 'Could not load StorageElement statuses', res[ 'Message' ] )
+        return res
+      self.__statuses   = getDictFromList( res[ 'Value' ] )
+      self.__lastUpdate = time.time()
+      return S_OK( self.__statuses )
+    finally:
+      self.__refreshLock.release()
+
+  def setStatus( self, elementName, statusType, status ):
+    '''
+    Sets in the snapshot a status set in the RSS, so that it is seen before the
+    next refresh.
+    '''
+    if self.__statuses is None:
+      return
+    if not isinstance( elementName, list ):
+      elementName = [ elementName ]
+    self.__refreshLock.acquire()
+    try:
+      # Readers keep the snapshot they got, the updated one is a copy
+      statuses = dict( self.__statuses )
+      for element in elementName:
+        statuses[ element ] = dict( statuses.get( element, {} ) )
+        statuses[ element ][ statusType ] = status
+      self.__statuses = statuses
+    finally:
+      self.__refreshLock.release()
+
+  def __startRefreshThread( self ):
+    '''
+    Starts the refresh thread if it is not running, threads are not kept after a fork
+    '''
+    if self.__refreshThread is not None and self.__refreshThread.isAlive():
+      return
+    self.__threadLock.acquire()
+    try:
+      if self.__refreshThread is None or not self.__refreshThread.isAlive():
+        self.__refreshThread = threading.Thread( target = self.__refreshLoop )
+        self.__refreshThread.setDaemon( True )
+        self.__refreshThread.start()
+    finally:
+      self.__threadLock.release()
+
+  def __refreshLoop( self ):
+    '''
+    Refreshes the snapshot every RefreshPeriod seconds, with jitter
+    '''
+    while True:
+      period = self.__getOption( 'RefreshPeriod', 300 )
+      jitter = self.__getOption( 'Jitter', 0.1 )
+      time.sleep( max( 1, period * ( 1 + random.uniform( -jitter, jitter ) ) ) )
+      try:
+        self.refresh()
+      except Exception, e:
+        self.log.exception( 'Error refreshing StorageElement statuses', lException = e )
+
+################################################################################
+
+def getCachedStatus( statuses, elementName, statusType ):
+  '''
+  Auxiliar method that picks from a { elementName : { statusType : status } } snapshot
+  the given elements and status types, as the RSS query would.
+  '''
+
+  if not isinstance( elementName, list ):
+    elementName = [ elementName ]
+  if statusType is not None and not isinstance( statusType, list ):
+    statusType = [ statusType ]
+
+  res = {}
+  for element in elementName:
+    if not element in statuses:
+      continue
+    if statusType is None:
+      res[ element ] = dict( statuses[ element ] )
+    else:
+      elementStatuses = dict( [ ( sType, statuses[ element ][ sType ] ) for sType in statusType
+                                if sType in statuses[ element ] ] )
+      if elementStatuses:
+        res[ element ] = elementStatuses
+  return res
+
+################################################################################
+
 def getDictFromList( l ):
   '''
   Auxiliar method that given a list returns a dictionary of dictionaries:
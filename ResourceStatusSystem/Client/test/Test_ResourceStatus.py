@@ -0,0 +1,113 @@
+''' Test_ResourceStatus
+
+  Unit tests of the StorageElement status snapshot of ResourceStatus.
+
+'''
+
+import unittest
+
+from DIRAC                                            import S_OK, S_ERROR
+from DIRAC.ResourceStatusSystem.Client.ResourceStatus import ResourceStatus, StorageElementStatusCache, getCachedStatus
+
+__RCSID__ = '$Id: $'
+
+class FakeResourceStatusClient( object ):
+  '''
+  Answers getElementStatus with the rows it is given, or an error if there are none
+  '''
+
+  def __init__( self, rows ):
+    self.rows     = rows
+    self.calls    = 0
+    self.elements = []
+
+  def getElementStatus( self, element, **kwargs ):
+    self.calls += 1
+    if self.rows is None:
+      return S_ERROR( 'RSS not reachable' )
+    elementName = kwargs.get( 'elementName' )
+    if elementName is None:
+      return S_OK( self.rows )
+    if not isinstance( elementName, list ):
+      elementName = [ elementName ]
+    self.elements.append( elementName )
+    return S_OK( [ row for row in self.rows if row[ 0 ] in elementName ] )
+
+################################################################################
+
+class StorageElementStatusCacheTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    StorageElementStatusCache.instance = None
+    self.rssClient = FakeResourceStatusClient( [ [ 'CERN-USER', 'Read', 'Active' ],
+                                                 [ 'CERN-USER', 'Write', 'Banned' ],
+                                                 [ 'PIC-USER', 'Read', 'Bad' ] ] )
+    self.cache = StorageElementStatusCache()
+    self.cache.rssClient = self.rssClient
+
+  def tearDown( self ):
+    StorageElementStatusCache.instance = None
+
+  def test_singleLoad( self ):
+    statuses = self.cache.getStatuses()
+    self.assertEqual( statuses[ 'CERN-USER' ], { 'Read' : 'Active', 'Write' : 'Banned' } )
+    self.assert_( StorageElementStatusCache().getStatuses() is statuses )
+    self.assertEqual( self.rssClient.calls, 1 )
+
+  def test_staleWhileUnreachable( self ):
+    statuses = self.cache.getStatuses()
+    self.rssClient.rows = None
+    self.failIf( self.cache.refresh()[ 'OK' ] )
+    self.assert_( self.cache.getStatuses() is statuses )
+    self.rssClient.rows = [ [ 'CERN-USER', 'Read', 'Banned' ] ]
+    self.assert_( self.cache.refresh()[ 'OK' ] )
+    self.assertEqual( self.cache.getStatuses(), { 'CERN-USER' : { 'Read' : 'Banned' } } )
+
+  def test_notLoaded( self ):
+    self.rssClient.rows = None
+    self.assertEqual( self.cache.getStatuses(), None )
+    # Not retried before RetryPeriod
+    self.rssClient.rows = []
+    self.assertEqual( self.cache.getStatuses(), None )
+    self.assertEqual( self.rssClient.calls, 1 )
+
+  def test_setStatus( self ):
+    statuses = self.cache.getStatuses()
+    self.cache.setStatus( 'PIC-USER', 'Write', 'Banned' )
+    self.assertEqual( self.cache.getStatuses()[ 'PIC-USER' ], { 'Read' : 'Bad', 'Write' : 'Banned' } )
+    self.assertEqual( statuses[ 'PIC-USER' ], { 'Read' : 'Bad' } )
+
+  def test_getCachedStatus( self ):
+    statuses = self.cache.getStatuses()
+    self.assertEqual( getCachedStatus( statuses, 'CERN-USER', 'Read' ), { 'CERN-USER' : { 'Read' : 'Active' } } )
+    self.assertEqual( getCachedStatus( statuses, [ 'CERN-USER', 'PIC-USER', 'RAL-USER' ], 'Read' ),
+                      { 'CERN-USER' : { 'Read' : 'Active' }, 'PIC-USER' : { 'Read' : 'Bad' } } )
+    self.assertEqual( getCachedStatus( statuses, 'PIC-USER', None ), { 'PIC-USER' : { 'Read' : 'Bad' } } )
+    self.assertEqual( getCachedStatus( statuses, 'PIC-USER', 'Write' ), {} )
+    self.assertEqual( getCachedStatus( statuses, 'RAL-USER', None ), {} )
+
+  def test_snapshotMiss( self ):
+    statuses = self.cache.getStatuses()
+    # RAL-USER has been added since the snapshot was taken
+    self.rssClient.rows = self.rssClient.rows + [ [ 'RAL-USER', 'Read', 'Active' ] ]
+    resourceStatus = ResourceStatus()
+    resourceStatus.rssClient = self.rssClient
+    getStatus = resourceStatus._ResourceStatus__getRSSStorageElementStatus
+    self.assertEqual( getStatus( 'CERN-USER', 'Read', None )[ 'Value' ], { 'CERN-USER' : { 'Read' : 'Active' } } )
+    self.assertEqual( self.rssClient.elements, [] )
+    self.assertEqual( getStatus( 'RAL-USER', 'Read', None )[ 'Value' ], { 'RAL-USER' : { 'Read' : 'Active' } } )
+    self.assertEqual( getStatus( [ 'PIC-USER', 'RAL-USER' ], 'Read', None )[ 'Value' ],
+                      { 'PIC-USER' : { 'Read' : 'Bad' }, 'RAL-USER' : { 'Read' : 'Active' } } )
+    self.assertEqual( self.rssClient.elements, [ [ 'RAL-USER' ], [ 'RAL-USER' ] ] )
+    self.failIf( getStatus( 'IN2P3-USER', 'Read', None )[ 'OK' ] )
+    self.assertEqual( getStatus( 'IN2P3-USER', 'Read', 'Unknown' )[ 'Value' ], { 'IN2P3-USER' : { 'Read' : 'Unknown' } } )
+    self.assert_( self.cache.getStatuses() is statuses )
+
+################################################################################
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( StorageElementStatusCacheTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
+
+################################################################################
+#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF
@@ -0,0 +1,127 @@
+# $HeadURL $
+''' CommandResultCache
+
+  Results of the commands run by the policies, shared by all the policies
+  evaluated by an agent during a cycle.
+
+'''
+
+import copy
+import threading
+
+__RCSID__ = '$Id: $'
+
+class CommandResultCache( object ):
+  '''
+    Memoizes the results of the commands by command name and arguments. A
+    command is run once: the threads asking for a result that is being computed
+    wait for it instead of running the command again. The agents clear it at
+    the beginning of each cycle.
+  '''
+
+  def __init__( self ):
+    '''
+      Constructor
+    '''
+    self.__lock    = threading.Lock()
+    # { key : [ threading.Event, result, computed ] }
+    self.__results = {}
+    self.hits      = 0
+    self.misses    = 0
+
+  def clear( self ):
+    '''
+      Forgets the results. Threads computing a result give it to the ones
+      waiting for it, but it is not kept.
+    '''
+    self.__lock.acquire()
+    try:
+      self.__results = {}
+      self.hits      = 0
+      self.misses    = 0
+    finally:
+      self.__lock.release()
+
+  def getResult( self, key, function ):
+    '''
+      Gets a copy of the result for key, calling function() to compute it if
+      nobody did. If the function raises, the exception is raised to the caller and the
+      threads waiting for the result compute it themselves.
+    '''
+    try:
+      hash( key )
+    except TypeError:
+      return function()
+
+    self.__lock.acquire()
+    try:
+      entry = self.__results.get( key )
+      if entry is None:
+        entry = [ threading.Event(), None, False ]
+        self.__results[ key ] = entry
+        self.misses += 1
+        owner = True
+      else:
+        self.hits += 1
+        owner = False
+    finally:
+      self.__lock.release()
+
+    if not owner:
+      entry[ 0 ].wait()
+      if entry[ 2 ]:
+        return copy.deepcopy( entry[ 1 ] )
+      return function()
+
+    try:
+      entry[ 1 ] = function()
+      entry[ 2 ] = True
+    finally:
+      if not entry[ 2 ]:
+        self.__lock.acquire()
+        try:
+          if self.__results.get( key ) is entry:
+            del self.__results[ key ]
+        finally:
+          self.__lock.release()
+      entry[ 0 ].set()
+    return copy.deepcopy( entry[ 1 ] )
+
+################################################################################
+
+class CachedCommand( object ):
+  '''
+    Command wrapper that takes the result of doCommand from a CommandResultCache.
+    The result is shared by the commands with the same name and arguments.
+  '''
+
+  def __init__( self, command, commandName, cache ):
+    '''
+      Constructor
+
+    :params:
+      :attr:`command`: command object
+      :attr:`commandName`: tuple ( module, class ) of the command
+      :attr:`cache`: CommandResultCache
+    '''
+    self.command     = command
+    self.commandName = tuple( commandName )
+    self.cache       = cache
+
+  def __getattr__( self, name ):
+    return getattr( self.command, name )
+
+  def setArgs( self, argsIn ):
+    self.command.setArgs( argsIn )
+
+  def setAPI( self, apiName, apiInstance ):
+    self.command.setAPI( apiName, apiInstance )
+
+  def doCommand( self ):
+    '''
+      Result of the command for its arguments, run only if it is not in the cache
+    '''
+    return self.cache.getResult( self.commandName + ( self.command.args, ), self.command.doCommand )
+
+################################################################################
+#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF
@@ -0,0 +1,85 @@
+""" UnitTest class for the CommandResultCache
+"""
+
+import threading
+import time
+import unittest
+
+from DIRAC import S_OK
+
+from DIRAC.ResourceStatusSystem.Command.Command            import Command
+from DIRAC.ResourceStatusSystem.Command.CommandResultCache import CommandResultCache, CachedCommand
+
+#############################################################################
+
+class SlowCommand( Command ):
+  """ Command counting how many times it is run
+  """
+  runs     = 0
+  runsLock = threading.Lock()
+
+  def doCommand( self ):
+    SlowCommand.runsLock.acquire()
+    SlowCommand.runs += 1
+    SlowCommand.runsLock.release()
+    time.sleep( 0.05 )
+    return { 'Result' : S_OK( { 'Name' : self.args[ 1 ] } ) }
+
+class FailingCommand( Command ):
+
+  def doCommand( self ):
+    raise RuntimeError( 'Service down' )
+
+#############################################################################
+
+class CommandResultCacheTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    SlowCommand.runs = 0
+    self.cache = CommandResultCache()
+
+  def _run( self, args ):
+    command = CachedCommand( SlowCommand(), ( 'Slow_Command', 'SlowCommand' ), self.cache )
+    command.setArgs( args )
+    return command.doCommand()
+
+  def test_sameArguments( self ):
+    res = self._run( ( 'Site', 'LCG.CERN.ch' ) )
+    self.assertEqual( res[ 'Result' ][ 'Value' ], { 'Name' : 'LCG.CERN.ch' } )
+    # Results are copies
+    res[ 'Result' ][ 'Value' ][ 'Name' ] = 'changed'
+    self.assertEqual( self._run( ( 'Site', 'LCG.CERN.ch' ) )[ 'Result' ][ 'Value' ][ 'Name' ], 'LCG.CERN.ch' )
+    self._run( ( 'Site', 'LCG.PIC.es' ) )
+    self.assertEqual( SlowCommand.runs, 2 )
+    self.assertEqual( ( self.cache.misses, self.cache.hits ), ( 2, 1 ) )
+
+  def test_concurrent( self ):
+    results = []
+    threads = [ threading.Thread( target = lambda: results.append( self._run( ( 'Site', 'LCG.CERN.ch' ) ) ) )
+                for _i in range( 10 ) ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual( SlowCommand.runs, 1 )
+    self.assertEqual( len( results ), 10 )
+
+  def test_clear( self ):
+    self._run( ( 'Site', 'LCG.CERN.ch' ) )
+    self.cache.clear()
+    self._run( ( 'Site', 'LCG.CERN.ch' ) )
+    self.assertEqual( SlowCommand.runs, 2 )
+
+  def test_failure( self ):
+    command = CachedCommand( FailingCommand(), ( 'Failing_Command', 'FailingCommand' ), self.cache )
+    command.setArgs( ( 'Site', 'LCG.CERN.ch' ) )
+    self.assertRaises( RuntimeError, command.doCommand )
+    # Failures are not kept
+    self.assertRaises( RuntimeError, command.doCommand )
+    self.assertEqual( self.cache.misses, 2 )
+
+#############################################################################
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( CommandResultCacheTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -22,14 +22,15 @@ class PDP:
     2. Invokes an evaluation of the policies, and returns the result (to a PEP)
   """
 
-  def __init__( self, **clients ):
+  def __init__( self, commandCache = None, **clients ):
     '''
-      Constructor. Defines members that will be used later on.
+      Constructor. Defines members that will be used later on. The results of
+      the commands are shared through commandCache, if given.
     '''
     
     cc                  = CommandCaller()
     self.clients        = clients
-    self.pCaller        = PolicyCaller( cc, **clients )
+    self.pCaller        = PolicyCaller( cc, commandCache = commandCache, **clients )
     self.iGetter        = InfoGetter()
 
     self.__granularity  = None
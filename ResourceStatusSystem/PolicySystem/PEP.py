@@ -40,7 +40,7 @@ class PEP:
       ]
   '''
 
-  def __init__( self, pdp = None, clients = None ):
+  def __init__( self, pdp = None, clients = None, commandCache = None ):
     '''
     Enforce policies, using a PDP  (Policy Decision Point), based on
 
@@ -57,8 +57,9 @@ class PEP:
      self.__futureGranularity (optional)
 
      :params:
-       :attr:`pdp`       : a custom PDP object (optional)
-       :attr:`clients`   : a dictionary containing modules corresponding to clients.
+       :attr:`pdp`          : a custom PDP object (optional)
+       :attr:`clients`      : a dictionary containing modules corresponding to clients.
+       :attr:`commandCache` : a CommandResultCache shared by the PEPs (optional)
     '''
     
     if clients is None:
@@ -75,7 +76,7 @@ class PEP:
 
     self.clients = clients
     if not pdp:
-      self.pdp = PDP( **clients )
+      self.pdp = PDP( commandCache = commandCache, **clients )
 
   def enforce( self, granularity = None, name = None, statusType = None,
                status = None, formerStatus = None, reason = None, 
@@ -9,6 +9,7 @@
 from DIRAC                                            import gLogger
 from DIRAC.ResourceStatusSystem.Utilities             import Utils
 from DIRAC.ResourceStatusSystem.Command.CommandCaller import CommandCaller
+from DIRAC.ResourceStatusSystem.Command.CommandResultCache import CachedCommand
 
 __RCSID__  = '$Id: $'
 
@@ -17,16 +18,20 @@ class PolicyCaller:
     PolicyCaller loads policies, sets commands and runs them.
   '''
   
-  def __init__( self, commandCallerIn = None, **clients ):
+  def __init__( self, commandCallerIn = None, commandCache = None, **clients ):
     '''
       Constructor
+
+    :params:
+      :attr:`commandCache`: CommandResultCache shared with other callers (optional)
     '''
  
     if commandCallerIn is None:
       commandCallerIn = CommandCaller()  
     
-    self.cCaller = commandCallerIn 
-    self.clients = clients
+    self.cCaller      = commandCallerIn 
+    self.commandCache = commandCache
+    self.clients      = clients
 
 ################################################################################
 
@@ -46,7 +51,7 @@ class PolicyCaller:
 
     3. If commandIn is specified (normally it is), use
     :meth:`DIRAC.ResourceStatusSystem.Command.CommandCaller.CommandCaller.setCommandObject`
-    to get a command object
+    to get a command object, whose results are taken from the commandCache if there is one
     '''
 
     if not policy:
@@ -77,11 +82,15 @@ class PolicyCaller:
       args = args + tuple( extraArgs )
 
     if commandIn:
-      commandIn = self.cCaller.setCommandObject( commandIn )
+      commandName = commandIn
+      commandIn   = self.cCaller.setCommandObject( commandIn )
       for clientName, clientInstance in self.clients.items():
         
         self.cCaller.setAPI( commandIn, clientName, clientInstance )
 
+      if self.commandCache is not None:
+        commandIn = CachedCommand( commandIn, commandName, self.commandCache )
+
     res = self._innerEval( policy, args, commandIn = commandIn )
     # Just adding the PolicyName to the result of the evaluation of the policy
     res[ 'PolicyName' ] = pName
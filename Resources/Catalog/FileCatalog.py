@@ -4,12 +4,21 @@
 __RCSID__ = "$Id$"
 """ File catalog class. This is a simple dispatcher for the file catalog plug-ins.
     It ensures that all operations are performed on the desired catalogs.
+
+    The catalog plug-ins are instantiated once per thread, set of catalogs and CS version.
+    Write operations are done on the master catalogs first and then concurrently on the
+    other catalogs. Depending on the ReadMode option of /Resources/FileCatalogs, reads
+    query the catalogs one after the other ( Sequential, the default ) or all at the same time,
+    using the results in the catalog order as soon as all the files are resolved ( FirstSuccess )
+    or merging the results of all the catalogs ( Merge ).
 """
 
 from DIRAC  import gLogger, gConfig, S_OK, S_ERROR, rootPath
+from DIRAC.ConfigurationSystem.Client.ConfigurationData import gConfigurationData
+from DIRAC.Core.DISET.ThreadConfig import ThreadConfig
 from DIRAC.Core.Utilities.List import uniqueElements
 from DIRAC.Resources.Catalog.FileCatalogFactory import FileCatalogFactory
-import types, re, os
+import types, re, os, threading, time, Queue
 
 class FileCatalog:
 
@@ -22,21 +31,35 @@ class FileCatalog:
                    'removeFile', 'setReplicaStatus', 'setReplicaHost', 'createDirectory', 'setDirectoryStatus',
                    'removeDirectory', 'removeDataset', 'removeFileFromDataset', 'createDataset']
 
-  def __init__( self, catalogs = [] ):
+  readModes = ['Sequential', 'FirstSuccess', 'Merge']
+
+  # Plug-ins keep per call and per thread state ( self.call, LFC sessions ), so each thread
+  # has its own: cache = { ( class, catalog names ) : ( CS version, readCatalogs, writeCatalogs, locks ) }
+  __threadCatalogs = threading.local()
+  # { catalogName : { method : [ calls, total time, max time ] } }
+  __latencies = {}
+  __latenciesLock = threading.Lock()
+
+  def __init__( self, catalogs = [], readMode = None ):
     """ Default constructor
     """
     self.valid = True
     self.timeout = 180
     self.readCatalogs = []
     self.writeCatalogs = []
+    # { id( plug-in ) : lock }, held while the plug-in is called
+    self.__catalogLocks = {}
     self.rootConfigPath = '/Resources/FileCatalogs'
+    if readMode is None:
+      readMode = gConfig.getValue( '%s/ReadMode' % self.rootConfigPath, 'Sequential' )
+    if readMode not in FileCatalog.readModes:
+      gLogger.warn( "FileCatalog: Unknown read mode, reading sequentially.", readMode )
+      readMode = 'Sequential'
+    self.readMode = readMode
 
     if type( catalogs ) in types.StringTypes:
       catalogs = [catalogs]
-    if catalogs:
-      res = self._getSelectedCatalogs( catalogs )
-    else:
-      res = self._getCatalogs()
+    res = self.__loadCatalogs( catalogs )
     if not res['OK']:
       self.valid = False
     elif ( len( self.readCatalogs ) == 0 ) and ( len( self.writeCatalogs ) == 0 ):
@@ -53,13 +76,29 @@ class FileCatalog:
 
   def __getattr__( self, name ):
     self.call = name
+    # The executors get the method name, self.call may be changed by other threads
     if name in FileCatalog.write_methods:
-      return self.w_execute
+      return lambda *parms, **kws: self.__writeExecute( name, parms, kws )
     elif name in FileCatalog.ro_methods:
-      return self.r_execute
+      return lambda *parms, **kws: self.__readExecute( name, parms, kws )
     else:
       raise AttributeError
 
+  def getCatalogLatencies( self ):
+    """ Get the number of calls, total and maximum time of the calls by catalog and method
+        made by all the FileCatalog instances of the process
+    """
+    latencies = {}
+    FileCatalog.__latenciesLock.acquire()
+    try:
+      for catalogName, methods in FileCatalog.__latencies.items():
+        latencies[catalogName] = {}
+        for method, ( calls, totalTime, maxTime ) in methods.items():
+          latencies[catalogName][method] = {'Calls':calls, 'TotalTime':totalTime, 'MaxTime':maxTime}
+    finally:
+      FileCatalog.__latenciesLock.release()
+    return S_OK( latencies )
+
   def __checkArgumentFormat( self, path ):
     if type( path ) in types.StringTypes:
       urls = {path:False}
@@ -76,6 +115,11 @@ class FileCatalog:
   def w_execute( self, *parms, **kws ):
     """ Write method executor.
     """
+    return self.__writeExecute( self.call, parms, kws )
+
+  def __writeExecute( self, call, parms, kws ):
+    """ Execute the write method call on the master catalogs and then concurrently on the others
+    """
     successful = {}
     failed = {}
     failedCatalogs = []
@@ -85,65 +129,149 @@ class FileCatalog:
       return res
     fileInfo = res['Value']
     allLfns = fileInfo.keys()
-    for catalogName, oCatalog, master in self.writeCatalogs:
-      method = getattr( oCatalog, self.call )
-      res = method( fileInfo, **kws )
+    masterCatalogs = [catalog for catalog in self.writeCatalogs if catalog[2]]
+    otherCatalogs = [catalog for catalog in self.writeCatalogs if not catalog[2]]
+    for catalogName, oCatalog, master in masterCatalogs:
+      res = self.__callCatalog( catalogName, oCatalog, call, ( fileInfo, ), kws )
       if not res['OK']:
-        if master:
-          # If this is the master catalog and it fails we dont want to continue with the other catalogs
-          gLogger.error( "FileCatalog.w_execute: Failed to execute %s on master catalog %s." % ( self.call, catalogName ), res['Message'] )
-          return res
-        else:
-          # Otherwise we keep the failed catalogs so we can update their state later
-          failedCatalogs.append( ( catalogName, res['Message'] ) )
-      else:
-        for lfn, message in res['Value']['Failed'].items():
-          # Save the error message for the failed operations
-          if not failed.has_key( lfn ):
-            failed[lfn] = {}
-          failed[lfn][catalogName] = message
-          if master:
-            # If this is the master catalog then we should not attempt the operation on other catalogs
-            fileInfo.pop( lfn )
-        for lfn, result in res['Value']['Successful'].items():
-          # Save the result return for each file for the successful operations
-          if not successful.has_key( lfn ):
-            successful[lfn] = {}
-          successful[lfn][catalogName] = result
+        # If this is the master catalog and it fails we dont want to continue with the other catalogs
+        gLogger.error( "FileCatalog.w_execute: Failed to execute %s on master catalog %s." % ( call, catalogName ), res['Message'] )
+        return res
+      for lfn, message in res['Value']['Failed'].items():
+        # Save the error message for the failed operations
+        failed.setdefault( lfn, {} )[catalogName] = message
+        # If this is the master catalog then we should not attempt the operation on other catalogs
+        fileInfo.pop( lfn, None )
+      for lfn, result in res['Value']['Successful'].items():
+        # Save the result return for each file for the successful operations
+        successful.setdefault( lfn, {} )[catalogName] = result
+    if len( otherCatalogs ) > 1:
+      # Each catalog gets its own copy of the files
+      results = self.__orderedResults( self.__startCalls( call, otherCatalogs, None, kws, fileInfo = fileInfo ),
+                                       len( otherCatalogs ) )
+    else:
+      results = [self.__callCatalog( catalogName, oCatalog, call, ( fileInfo, ), kws )
+                 for catalogName, oCatalog, _master in otherCatalogs]
+    for ( catalogName, oCatalog, master ), res in zip( otherCatalogs, results ):
+      if not res['OK']:
+        # Otherwise we keep the failed catalogs so we can update their state later
+        failedCatalogs.append( ( catalogName, res['Message'] ) )
+        continue
+      for lfn, message in res['Value']['Failed'].items():
+        failed.setdefault( lfn, {} )[catalogName] = message
+      for lfn, result in res['Value']['Successful'].items():
+        successful.setdefault( lfn, {} )[catalogName] = result
     # This recovers the states of the files that completely failed i.e. when S_ERROR is returned by a catalog
     for catalogName, errorMessage in failedCatalogs:
-      for file in allLfns:
-        if not failed.has_key( file ):
-          failed[file] = {}
-        failed[file][catalogName] = errorMessage
+      for lfn in allLfns:
+        failed.setdefault( lfn, {} )[catalogName] = errorMessage
     resDict = {'Failed':failed, 'Successful':successful}
     return S_OK( resDict )
 
   def r_execute( self, *parms, **kws ):
     """ Read method executor.
     """
+    return self.__readExecute( self.call, parms, kws )
+
+  def __readExecute( self, call, parms, kws ):
+    """ Execute the read method call on the read catalogs, in the order of the catalogs
+        until all the files are resolved, or merging the results of all of them
+    """
+    if self.readMode != 'Sequential' and len( self.readCatalogs ) > 1:
+      results = self.__orderedResults( self.__startCalls( call, self.readCatalogs, parms, kws ),
+                                       len( self.readCatalogs ) )
+    else:
+      results = ( self.__callCatalog( catalogName, oCatalog, call, parms, kws )
+                  for catalogName, oCatalog, _master in self.readCatalogs )
     successful = {}
     failed = {}
-    for catalogName, oCatalog, master in self.readCatalogs:
-      method = getattr( oCatalog, self.call )
-      res = method( *parms, **kws )
+    for res in results:
       if res['OK']:
         for key, item in res['Value']['Successful'].items():
           if not successful.has_key( key ):
             successful[key] = item
             if failed.has_key( key ):
               failed.pop( key )
+          elif self.readMode == 'Merge' and type( item ) == types.DictType \
+               and type( successful[key] ) == types.DictType:
+            # The values of the first catalogs take precedence
+            merged = dict( item )
+            merged.update( successful[key] )
+            successful[key] = merged
         for key, item in res['Value']['Failed'].items():
           if not successful.has_key( key ):
             failed[key] = item
-        if len( failed ) == 0:
+        if len( failed ) == 0 and self.readMode != 'Merge':
           resDict = {'Failed':failed, 'Successful':successful}
           return S_OK( resDict )
     if ( len( successful ) == 0 ) and ( len( failed ) == 0 ):
-      return S_ERROR( 'Failed to perform %s from any catalog' % self.call )
+      return S_ERROR( 'Failed to perform %s from any catalog' % call )
     resDict = {'Failed':failed, 'Successful':successful}
     return S_OK( resDict )
 
+  def __callCatalog( self, catalogName, oCatalog, call, parms, kws ):
+    """ Call the method of a catalog, recording its latency
+    """
+    # Threads of a FirstSuccess read left running when the files were resolved
+    # may still be using it
+    lock = self.__catalogLocks.setdefault( id( oCatalog ), threading.RLock() )
+    lock.acquire()
+    startTime = time.time()
+    try:
+      method = getattr( oCatalog, call )
+      return method( *parms, **kws )
+    finally:
+      lock.release()
+      elapsed = time.time() - startTime
+      gLogger.debug( "FileCatalog: %s on %s took %.3f s" % ( call, catalogName, elapsed ) )
+      FileCatalog.__latenciesLock.acquire()
+      try:
+        stats = FileCatalog.__latencies.setdefault( catalogName, {} ).setdefault( call, [0, 0., 0.] )
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] = max( stats[2], elapsed )
+      finally:
+        FileCatalog.__latenciesLock.release()
+
+  def __startCalls( self, call, catalogs, parms, kws, fileInfo = None ):
+    """ Call the catalogs, each in a thread with the credentials of the caller.
+        If fileInfo is given each catalog is called with a copy of it.
+        Returns the queue where the ( index of the catalog, result ) are put
+    """
+    resultQueue = Queue.Queue()
+    threadID = ThreadConfig().dump()
+    for index in range( len( catalogs ) ):
+      catalogName, oCatalog, _master = catalogs[index]
+      if fileInfo is not None:
+        parms = ( dict( fileInfo ), )
+      thread = threading.Thread( target = self.__threadCall,
+                                 args = ( resultQueue, index, threadID, catalogName, oCatalog, call, parms, kws ) )
+      thread.setDaemon( True )
+      thread.start()
+    return resultQueue
+
+  def __threadCall( self, resultQueue, index, threadID, catalogName, oCatalog, call, parms, kws ):
+    """ Thread calling a catalog
+    """
+    ThreadConfig().load( threadID )
+    try:
+      res = self.__callCatalog( catalogName, oCatalog, call, parms, kws )
+    except Exception, x:
+      errStr = "FileCatalog: Exception executing %s on catalog %s" % ( call, catalogName )
+      gLogger.exception( errStr, lException = x )
+      res = S_ERROR( errStr )
+    resultQueue.put( ( index, res ) )
+
+  def __orderedResults( self, resultQueue, numResults ):
+    """ Generator of the results of the catalog calls in the order of the catalogs
+    """
+    arrived = {}
+    for index in range( numResults ):
+      while not arrived.has_key( index ):
+        resIndex, res = resultQueue.get()
+        arrived[resIndex] = res
+      yield arrived.pop( index )
+
   ###########################################################################################
   #
   # Below is the method for obtaining the objects instantiated for a provided catalogue configuration
@@ -190,6 +318,32 @@ class FileCatalog:
     else:
       return S_OK( 'Catalog does not exist' )
 
+  def __loadCatalogs( self, catalogs ):
+    """ Get the catalog objects of the catalogs, or of the configured ones if none is given,
+        from the cache of the thread if they were created for the current CS version
+    """
+    cacheKey = ( self.__class__, tuple( catalogs ) )
+    version = gConfigurationData.getVersion()
+    try:
+      catalogCache = FileCatalog.__threadCatalogs.cache
+    except AttributeError:
+      catalogCache = FileCatalog.__threadCatalogs.cache = {}
+    if catalogCache.has_key( cacheKey ):
+      cachedVersion, readCatalogs, writeCatalogs, catalogLocks = catalogCache[cacheKey]
+      if cachedVersion == version:
+        self.readCatalogs = list( readCatalogs )
+        self.writeCatalogs = list( writeCatalogs )
+        self.__catalogLocks = catalogLocks
+        return S_OK()
+
+    if catalogs:
+      res = self._getSelectedCatalogs( catalogs )
+    else:
+      res = self._getCatalogs()
+    if res['OK'] and ( self.readCatalogs or self.writeCatalogs ):
+      catalogCache[cacheKey] = ( version, list( self.readCatalogs ), list( self.writeCatalogs ), self.__catalogLocks )
+    return res
+
   def _getSelectedCatalogs( self, desiredCatalogs ):
     for catalogName in desiredCatalogs:
       res = self._generateCatalogObject( catalogName )
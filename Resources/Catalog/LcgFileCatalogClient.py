@@ -10,7 +10,7 @@ from DIRAC.Core.Utilities.List                                import sortList, b
 from DIRAC.Core.Security.ProxyInfo                            import getProxyInfo, formatProxyInfoAsString
 from DIRAC.ConfigurationSystem.Client.Helpers.Registry        import getDNForUsername, getVOMSAttributeForGroup
 from stat import *
-import os, re, types, time
+import os, re, types, time, threading
 
 lfc = None
 importedLFC = None
@@ -69,8 +69,8 @@ class LcgFileCatalogClient( FileCatalogueBase ):
       os.environ['LFC_CONRETRY'] = '5'
 
     self.prefix = '/grid'
-    self.session = False
-    self.transaction = False
+    # The lfcthr sessions and transactions belong to the thread that opened them
+    self.__threadState = threading.local()
 
   ####################################################################
   #
@@ -88,9 +88,15 @@ class LcgFileCatalogClient( FileCatalogueBase ):
   # These are the methods for session/transaction manipulation
   #
 
+  def __inSession( self ):
+    return getattr( self.__threadState, 'session', False )
+
+  def __inTransaction( self ):
+    return getattr( self.__threadState, 'transaction', False )
+
   def __openSession( self ):
     """Open the LFC client/server session"""
-    if self.session:
+    if self.__inSession():
       return False
     else:
       sessionName = 'DIRAC_%s.%s at %s at time %s' % ( DIRAC.majorVersion,
@@ -98,36 +104,36 @@ class LcgFileCatalogClient( FileCatalogueBase ):
                                                        DIRAC.siteName(),
                                                        time.time() )
       lfc.lfc_startsess( self.host, sessionName )
-      self.session = True
+      self.__threadState.session = True
       return True
 
   def __closeSession( self ):
     """Close the LFC client/server session"""
-    if self.session:
+    if self.__inSession():
       lfc.lfc_endsess()
-      self.session = False
+      self.__threadState.session = False
 
   def __startTransaction( self ):
     """ Begin transaction for one time commit """
-    if not self.transaction:
+    if not self.__inTransaction():
       transactionName = 'Transaction: DIRAC_%s.%s at %s at time %s' % ( DIRAC.majorVersion,
                                                                         DIRAC.minorVersion,
                                                                         DIRAC.siteName(),
                                                                         time.time() )
       lfc.lfc_starttrans( self.host, transactionName )
-      self.transaction = True
+      self.__threadState.transaction = True
 
   def __abortTransaction( self ):
     """ Abort transaction """
-    if self.transaction:
+    if self.__inTransaction():
       lfc.lfc_aborttrans()
-      self.transaction = False
+      self.__threadState.transaction = False
 
   def __endTransaction( self ):
     """ End transaction gracefully """
-    if self.transaction:
+    if self.__inTransaction():
       lfc.lfc_endtrans()
-      self.transaction = False
+      self.__threadState.transaction = False
 
   def setAuthorizationId( self, dn ):
     """ Set authorization id for the proxy-less LFC communication """
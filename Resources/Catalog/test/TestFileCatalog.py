@@ -0,0 +1,126 @@
+#! /usr/bin/env python
+""" Unit tests of the FileCatalog dispatcher with fake catalog plug-ins
+"""
+from DIRAC                                              import S_OK, S_ERROR
+from DIRAC.Resources.Catalog.FileCatalog                import FileCatalog
+import unittest,time,threading
+
+class FakeCatalog:
+  """ Catalog plug-in knowing the replicas of some files """
+
+  def __init__(self,name,replicas,delay=0.,fail=False):
+    self.name = name
+    self.replicas = replicas
+    self.delay = delay
+    self.fail = fail
+    self.added = []
+    self.running = 0
+    self.maxRunning = 0
+
+  def getReplicas(self,lfns):
+    self.running += 1
+    self.maxRunning = max(self.maxRunning,self.running)
+    time.sleep(self.delay)
+    self.running -= 1
+    if self.fail:
+      return S_ERROR('%s is down' % self.name)
+    successful = {}
+    failed = {}
+    for lfn in lfns:
+      if self.replicas.has_key(lfn):
+        successful[lfn] = dict(self.replicas[lfn])
+      else:
+        failed[lfn] = 'No such file or directory'
+    return S_OK({'Successful':successful,'Failed':failed})
+
+  def addFile(self,fileDict):
+    time.sleep(self.delay)
+    if self.fail:
+      return S_ERROR('%s is down' % self.name)
+    self.added.append(threading.currentThread())
+    return S_OK({'Successful':dict.fromkeys(fileDict.keys(),True),'Failed':{}})
+
+class FakeFileCatalog(FileCatalog):
+  """ FileCatalog with the fake catalogs instead of the configured ones """
+
+  catalogs = []
+  instantiations = 0
+
+  def _getCatalogs(self):
+    FakeFileCatalog.instantiations += 1
+    for catalogName,oCatalog,master in FakeFileCatalog.catalogs:
+      self.readCatalogs.append((catalogName,oCatalog,master))
+      self.writeCatalogs.append((catalogName,oCatalog,master))
+    return S_OK()
+
+class FileCatalogTestCase(unittest.TestCase):
+
+  def setUp(self):
+    self.master = FakeCatalog('Master',{'/lhcb/a':{'CERN-USER':'pfnA'}})
+    self.second = FakeCatalog('Second',{'/lhcb/a':{'PIC-USER':'pfnA2'},'/lhcb/b':{'RAL-USER':'pfnB'}},delay=0.2)
+    self.third = FakeCatalog('Third',{},delay=0.2)
+    FakeFileCatalog.catalogs = [('Master',self.master,True),('Second',self.second,False),('Third',self.third,False)]
+    FakeFileCatalog._FileCatalog__threadCatalogs.cache = {}
+    FakeFileCatalog.instantiations = 0
+
+  def test_cachedCatalogs(self):
+    catalog = FakeFileCatalog()
+    self.assert_(catalog.isOK())
+    FakeFileCatalog()
+    self.assertEqual(FakeFileCatalog.instantiations,1)
+    # Instances do not share their catalog lists
+    catalog.removeCatalog('Third')
+    self.assertEqual(len(FakeFileCatalog().getReadCatalogs()),3)
+    # Other threads get their own plug-ins
+    thread = threading.Thread(target=FakeFileCatalog)
+    thread.start()
+    thread.join()
+    self.assertEqual(FakeFileCatalog.instantiations,2)
+
+  def test_concurrentWrites(self):
+    start = time.time()
+    res = FakeFileCatalog().addFile({'/lhcb/c':{'PFN':'pfnC'}})
+    self.assert_(time.time()-start < 0.35)
+    self.assert_(res['OK'])
+    self.assertEqual(res['Value']['Successful']['/lhcb/c'],{'Master':True,'Second':True,'Third':True})
+    self.assertEqual(self.master.added,[threading.currentThread()])
+
+  def test_failedWrites(self):
+    self.third.fail = True
+    res = FakeFileCatalog().addFile({'/lhcb/c':{'PFN':'pfnC'}})
+    self.assertEqual(res['Value']['Failed']['/lhcb/c'],{'Third':'Third is down'})
+    self.master.fail = True
+    res = FakeFileCatalog().addFile({'/lhcb/c':{'PFN':'pfnC'}})
+    self.failIf(res['OK'])
+    self.assertEqual(len(self.second.added),1)
+
+  def test_readModes(self):
+    lfns = ['/lhcb/a','/lhcb/b']
+    sequential = FakeFileCatalog(readMode='Sequential').getReplicas(lfns)
+    start = time.time()
+    firstSuccess = FakeFileCatalog(readMode='FirstSuccess').getReplicas(lfns)
+    self.assert_(time.time()-start < 0.35)
+    self.assertEqual(sequential,firstSuccess)
+    self.assertEqual(firstSuccess['Value']['Successful']['/lhcb/a'],{'CERN-USER':'pfnA'})
+    merged = FakeFileCatalog(readMode='Merge').getReplicas(lfns+['/lhcb/x'])
+    self.assertEqual(merged['Value']['Successful']['/lhcb/a'],{'CERN-USER':'pfnA','PIC-USER':'pfnA2'})
+    self.assertEqual(merged['Value']['Failed'].keys(),['/lhcb/x'])
+
+  def test_pluginsNotShared(self):
+    catalog = FakeFileCatalog(readMode='FirstSuccess')
+    for i in range(3):
+      # Resolved by the master, the calls to the others are still running
+      res = catalog.getReplicas(['/lhcb/a'])
+      self.assertEqual(res['Value']['Successful']['/lhcb/a'],{'CERN-USER':'pfnA'})
+    time.sleep(0.3)
+    self.assertEqual(self.second.maxRunning,1)
+
+  def test_latencies(self):
+    FakeFileCatalog().getReplicas(['/lhcb/b'])
+    latencies = FakeFileCatalog().getCatalogLatencies()['Value']
+    self.assert_(latencies['Second']['getReplicas']['Calls'] >= 1)
+    self.assert_(latencies['Second']['getReplicas']['MaxTime'] >= 0.2)
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase(FileCatalogTestCase)
+  testResult = unittest.TextTestRunner(verbosity=2).run(suite)
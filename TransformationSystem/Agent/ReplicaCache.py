@@ -0,0 +1,252 @@
+""" ReplicaCache keeps the replicas of the input files of the transformations between agent cycles
+
+    The replicas are indexed by transformation and LFN, each LFN with the time its replicas were obtained.
+    The cache is shared by the threads of the agent and kept on disk in a journal: each change is
+    appended to the file as a pickled record, and the file is rewritten with the live entries only
+    when the journal has become much bigger than the cache, or when it could not be read or appended
+    to completely.
+"""
+
+__RCSID__ = "$Id$"
+
+import os, time, threading, cPickle
+
+from DIRAC import gLogger
+
+# The journal is rewritten when it holds more than JOURNAL_GROWTH times the cached LFNs plus
+# JOURNAL_MIN_SIZE LFN records. The margin keeps small caches from being rewritten at every flush.
+JOURNAL_GROWTH = 2
+JOURNAL_MIN_SIZE = 10000
+
+class ReplicaCache( object ):
+  """ Replicas of transformation files with per LFN expiry
+  """
+
+  def __init__( self, cacheFile, validity = 172800 ):
+    """ c'tor
+
+    :param str cacheFile: journal file of the cache
+    :param int validity: seconds the replicas of an LFN are kept
+    """
+    self.cacheFile = cacheFile
+    self.validity = validity
+    self.log = gLogger.getSubLogger( "ReplicaCache" )
+    # { transID : { lfn : ( updateTime, { se : pfn } ) } }
+    self.__cache = {}
+    # Records not written to the journal yet
+    self.__pending = []
+    # LFNs in the records of the journal file
+    self.__journalSize = 0
+    self.__lastPurge = time.time()
+    self.__lock = threading.Lock()
+    # Keeps the records in the journal in the same order they are done
+    self.__fileLock = threading.Lock()
+    self.__load()
+
+  def __load( self ):
+    """ Replay the journal
+    """
+    if not os.path.isfile( self.cacheFile ):
+      return
+    truncated = False
+    fd = open( self.cacheFile, "rb" )
+    fileSize = os.path.getsize( self.cacheFile )
+    try:
+      while True:
+        offset = fd.tell()
+        try:
+          record = cPickle.load( fd )
+        except EOFError:
+          if offset < fileSize:
+            # Last record was cut before its end
+            self.log.warn( "Replica cache file %s is truncated" % self.cacheFile )
+            truncated = True
+          break
+        except Exception, e:
+          # Last record was not written completely, what was read is fine
+          self.log.warn( "Replica cache file %s is truncated" % self.cacheFile, str( e ) )
+          truncated = True
+          break
+        self.__applyRecord( record )
+        self.__journalSize += self.__recordSize( record )
+    finally:
+      fd.close()
+    self.log.verbose( "Loaded %d cached replicas from %s" % ( self.__countLFNs(), self.cacheFile ) )
+    if truncated:
+      self.__compact()
+
+  def __applyRecord( self, record ):
+    """ Apply an add or remove record to the cache
+    """
+    action, transID, data = record
+    if action == 'add':
+      self.__cache.setdefault( transID, {} ).update( data )
+    elif action == 'remove':
+      if data is None:
+        self.__cache.pop( transID, None )
+      elif transID in self.__cache:
+        transCache = self.__cache[ transID ]
+        for lfn in data:
+          transCache.pop( lfn, None )
+        if not transCache:
+          self.__cache.pop( transID )
+
+  def __record( self, action, transID, data ):
+    """ Apply a record and queue it for the journal. Called with the lock held
+    """
+    self.__applyRecord( ( action, transID, data ) )
+    self.__pending.append( ( action, transID, data ) )
+
+  @staticmethod
+  def __recordSize( record ):
+    if record[2] is None:
+      return 1
+    return len( record[2] )
+
+  def __countLFNs( self ):
+    return sum( [ len( transCache ) for transCache in self.__cache.values() ] )
+
+  def getReplicas( self, transID, lfns, dropOthers = True ):
+    """ Get the cached replicas of the LFNs of a transformation
+
+    :param transID: transformation ID
+    :param list lfns: LFNs
+    :param bool dropOthers: drop the cached LFNs of the transformation not in lfns
+    :return: ( { lfn : replicas } of the cached LFNs, [ LFNs not cached ] )
+    """
+    cachedReplicas = {}
+    missingLFNs = []
+    notValidBefore = time.time() - self.validity
+    self.__lock.acquire()
+    try:
+      transCache = self.__cache.get( transID, {} )
+      expiredLFNs = []
+      for lfn in lfns:
+        if lfn in transCache:
+          updateTime, replicas = transCache[ lfn ]
+          if updateTime >= notValidBefore:
+            cachedReplicas[ lfn ] = replicas
+            continue
+          expiredLFNs.append( lfn )
+        missingLFNs.append( lfn )
+      if dropOthers and len( transCache ) > len( cachedReplicas ) + len( expiredLFNs ):
+        requestedLFNs = set( lfns )
+        expiredLFNs.extend( [ lfn for lfn in transCache if lfn not in requestedLFNs ] )
+      if expiredLFNs:
+        self.__record( 'remove', transID, expiredLFNs )
+    finally:
+      self.__lock.release()
+    return cachedReplicas, missingLFNs
+
+  def addReplicas( self, transID, replicas ):
+    """ Add the replicas of LFNs of a transformation
+
+    :param transID: transformation ID
+    :param dict replicas: { lfn : { se : pfn } }
+    """
+    if not replicas:
+      return
+    now = time.time()
+    data = dict( [ ( lfn, ( now, replicas[ lfn ] ) ) for lfn in replicas ] )
+    self.__lock.acquire()
+    try:
+      self.__record( 'add', transID, data )
+    finally:
+      self.__lock.release()
+
+  def invalidate( self, transID ):
+    """ Drop all the cached replicas of a transformation
+
+    :return: True if there was something cached for the transformation
+    """
+    self.__lock.acquire()
+    try:
+      if transID not in self.__cache:
+        return False
+      self.__record( 'remove', transID, None )
+      return True
+    finally:
+      self.__lock.release()
+
+  def purgeExpired( self, minInterval = 0 ):
+    """ Drop the expired replicas of all the transformations
+
+    :param int minInterval: do nothing if the last purge was less than minInterval seconds ago
+    """
+    now = time.time()
+    self.__lock.acquire()
+    try:
+      if now - self.__lastPurge < minInterval:
+        return 0
+      self.__lastPurge = now
+      notValidBefore = now - self.validity
+      purged = 0
+      for transID in self.__cache.keys():
+        expiredLFNs = [ lfn for lfn, ( updateTime, _replicas ) in self.__cache[ transID ].iteritems()
+                        if updateTime < notValidBefore ]
+        if expiredLFNs:
+          self.log.verbose( "Clear %d cached replicas for transformation %s" % ( len( expiredLFNs ), transID ) )
+          self.__record( 'remove', transID, expiredLFNs )
+          purged += len( expiredLFNs )
+      return purged
+    finally:
+      self.__lock.release()
+
+  def flush( self ):
+    """ Append the changes to the journal, rewrite it if it is too big
+    """
+    self.__fileLock.acquire()
+    try:
+      self.__lock.acquire()
+      try:
+        pending = self.__pending
+        self.__pending = []
+        numLFNs = self.__countLFNs()
+      finally:
+        self.__lock.release()
+      if not pending:
+        return
+      pendingSize = sum( [ self.__recordSize( record ) for record in pending ] )
+      if self.__journalSize + pendingSize > JOURNAL_GROWTH * numLFNs + JOURNAL_MIN_SIZE:
+        self.__compact( lock = True )
+        return
+      try:
+        fd = open( self.cacheFile, "ab" )
+        try:
+          for record in pending:
+            cPickle.dump( record, fd, cPickle.HIGHEST_PROTOCOL )
+        finally:
+          fd.close()
+        self.__journalSize += pendingSize
+      except Exception, e:
+        # The records may be partly written, rewrite the journal from the cache
+        self.log.error( "Could not write replica cache file %s" % self.cacheFile, str( e ) )
+        self.__compact( lock = True )
+    finally:
+      self.__fileLock.release()
+
+  def __compact( self, lock = False ):
+    """ Rewrite the journal with one record per transformation
+    """
+    if lock:
+      self.__lock.acquire()
+    try:
+      # Changes pending now are in the snapshot of the cache
+      self.__pending = []
+      records = [ ( 'add', transID, dict( transCache ) ) for transID, transCache in self.__cache.items() ]
+    finally:
+      if lock:
+        self.__lock.release()
+    tmpFile = "%s.tmp" % self.cacheFile
+    try:
+      fd = open( tmpFile, "wb" )
+      try:
+        for record in records:
+          cPickle.dump( record, fd, cPickle.HIGHEST_PROTOCOL )
+      finally:
+        fd.close()
+      os.rename( tmpFile, self.cacheFile )
+      self.__journalSize = sum( [ self.__recordSize( record ) for record in records ] )
+      self.log.verbose( "Rewrote replica cache file %s" % self.cacheFile )
+    except Exception, e:
+      self.log.error( "Could not write replica cache file %s" % self.cacheFile, str( e ) )
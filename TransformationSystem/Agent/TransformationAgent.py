@@ -3,12 +3,13 @@
 
 __RCSID__ = "$Id$"
 
-import time, re, random, Queue, threading, os, datetime, pickle
+import time, re, random, Queue, threading, os
 from DIRAC                                                          import  S_OK, S_ERROR
 from DIRAC.Core.Base.AgentModule                                    import AgentModule
 from DIRAC.Core.Utilities.ThreadPool                                import ThreadPool
 from DIRAC.TransformationSystem.Client.TransformationClient         import TransformationClient
 from DIRAC.TransformationSystem.Agent.TransformationAgentsUtilities import TransformationAgentsUtilities
+from DIRAC.TransformationSystem.Agent.ReplicaCache                  import ReplicaCache
 from DIRAC.DataManagementSystem.Client.ReplicaManager               import ReplicaManager
 
 AGENT_NAME = 'Transformation/TransformationAgent'
@@ -44,13 +45,13 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
     self.transInQueue = []
     self.lock = threading.Lock()
 
-    #for caching using a pickle file
+    #for caching using a journal file, shared by all the threads
     self.workDirectory = self.am_getWorkDirectory()
-    self.cacheFile = os.path.join( self.workDirectory, 'ReplicaCache.pkl' )
+    self.cacheFile = os.path.join( self.workDirectory, 'ReplicaCache.journal' )
 
     # Validity of the cache in days
-    self.replicaCacheValidity = 2
-    self.__readCache()
+    self.replicaCacheValidity = self.am_getOption( 'ReplicaCacheValidity', 2 )
+    self.replicaCache = ReplicaCache( self.cacheFile, validity = self.replicaCacheValidity * 86400 )
 
     self.unusedFiles = {}
 
@@ -244,17 +245,9 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
     """ Standard plugin callback
     """
     if invalidateCache:
-      self.lock.acquire()
-      try:
-        self.__readCache( lock = False )
-        if transID in self.replicaCache:
-          self._logInfo( "Removed cached replicas for transformation" , method = 'pluginCallBack', transID = transID )
-          self.replicaCache.pop( transID )
-          self.__writeCache( lock = False )
-      except:
-        pass
-      finally:
-        self.lock.release()
+      if self.replicaCache.invalidate( transID ):
+        self._logInfo( "Removed cached replicas for transformation" , method = 'pluginCallBack', transID = transID )
+        self.replicaCache.flush()
 
   def _getTransformationFiles( self, transDict, clients ):
     """ get the data replicas for a certain transID
@@ -314,50 +307,37 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
       plugin_o = getattr( plugModule, 'TransformationPlugin' )( '%s' % plugin,
                                                                 transClient = clients['TransformationClient'],
                                                                 replicaManager = clients['ReplicaManager'] )
-      return S_OK( plugin_o )
     except AttributeError, e:
       self._logException( "Failed to create %s(): %s." % ( plugin, e ), method = "__generatePluginObject" )
       return S_ERROR()
-    plugin_o.setDirectory( self.workDirectory )
-    plugin_o.setCallback( self.pluginCallback )
+    # Plugins that keep data or invalidate the replica cache
+    if hasattr( plugin_o, 'setDirectory' ):
+      plugin_o.setDirectory( self.workDirectory )
+    if hasattr( plugin_o, 'setCallback' ):
+      plugin_o.setCallback( self.pluginCallback )
+    return S_OK( plugin_o )
 
   def __getDataReplicas( self, transID, lfns, clients, active = True ):
     """ Get the replicas for the LFNs and check their statuses. It first looks within the cache.
     """
     self._logVerbose( "Getting replicas for %d files" % len( lfns ), method = '__getDataReplicas', transID = transID )
-    self.lock.acquire()
-    try:
-      cachedReplicaSets = self.replicaCache.get( transID, {} )
-      dataReplicas = {}
-      newLFNs = []
-      for crs in cachedReplicaSets:
-        cachedReplicas = cachedReplicaSets[crs]
-        for lfn in [lfn for lfn in lfns if lfn in cachedReplicas]:
-          dataReplicas[lfn] = cachedReplicas[lfn]
-        # Remove files from the cache that are not in the required list
-        for lfn in [lfn for lfn in cachedReplicas if lfn not in lfns]:
-          self.replicaCache[transID][crs].pop( lfn )
-    except:
-      pass
-    finally:
-      self.lock.release()
+    # Files from the cache that are not in the required list are removed, unless only a part of them is required
+    dataReplicas, newLFNs = self.replicaCache.getReplicas( transID, lfns, dropOthers = active )
     if dataReplicas:
       self._logVerbose( "ReplicaCache hit for %d out of %d LFNs" % ( len( dataReplicas ), len( lfns ) ),
                          method = '__getDataReplicas', transID = transID )
-    newLFNs += [lfn for lfn in lfns if lfn not in dataReplicas]
     if newLFNs:
       self._logVerbose( "Getting replicas for %d files from catalog" % len( newLFNs ),
                          method = '__getDataReplicas', transID = transID )
       res = self.__getDataReplicasRM( transID, newLFNs, clients, active )
       if res['OK']:
         newReplicas = res['Value']
-        self.lock.acquire()
-        self.replicaCache.setdefault( transID, {} )[datetime.datetime.utcnow()] = newReplicas
-        self.lock.release()
+        self.replicaCache.addReplicas( transID, newReplicas )
         dataReplicas.update( newReplicas )
       else:
         self._logWarn( "Failed to get replicas for %d files" % len( newLFNs ), res['Message'] )
-    self.__cleanCache()
+    self.replicaCache.purgeExpired( minInterval = 3600 )
+    self.replicaCache.flush()
     return S_OK( dataReplicas )
 
 
@@ -398,58 +378,3 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
     if not dataReplicas:
       return S_ERROR( "No replicas obtained" )
     return S_OK( dataReplicas )
-
-  def __cleanCache( self ):
-    """ Cleans the cache
-    """
-    self.lock.acquire()
-    try:
-      timeLimit = datetime.datetime.utcnow() - datetime.timedelta( days = self.replicaCacheValidity )
-      for transID in [transID for transID in self.replicaCache]:
-        for updateTime in self.replicaCache[transID].copy():
-          if updateTime < timeLimit or not self.replicaCache[transID][updateTime]:
-            self._logVerbose( "Clear %d cached replicas for transformation %s" % ( len( self.replicaCache[transID][updateTime] ),
-                                                                                    str( transID ) ),
-                              method = '__cleanCache' )
-            self.replicaCache[transID].pop( updateTime )
-        # Remove empty transformations
-        if not self.replicaCache[transID]:
-          self.replicaCache.pop( transID )
-      self.__writeCache( lock = False )
-    except:
-      pass
-    finally:
-      self.lock.release()
-
-  def __readCache( self, lock = True ):
-    """ Reads from the cache
-    """
-    if lock:
-      self.lock.acquire()
-    try:
-      cacheFile = open( self.cacheFile, 'r' )
-      self.replicaCache = pickle.load( cacheFile )
-      cacheFile.close()
-      self._logVerbose( "Successfully loaded replica cache from file %s" % self.cacheFile )
-    except:
-      self._logVerbose( "Failed to load replica cache from file %s" % self.cacheFile )
-      self.replicaCache = {}
-    finally:
-      if lock:
-        self.lock.release()
-
-  def __writeCache( self, lock = True ):
-    """ Writes the cache
-    """
-    if lock:
-      self.lock.acquire()
-    try:
-      f = open( self.cacheFile, 'w' )
-      pickle.dump( self.replicaCache, f )
-      f.close()
-      self._logVerbose( "Successfully wrote replica cache file %s" % self.cacheFile )
-    except:
-      self._logError( "Could not write replica cache file %s" % self.cacheFile )
-    finally:
-      if lock:
-        self.lock.release()
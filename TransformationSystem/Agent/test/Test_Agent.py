@@ -1,4 +1,4 @@
-import unittest, datetime, sys
+import unittest, datetime, sys, os, tempfile
 
 from mock import Mock
 
@@ -62,6 +62,54 @@ class TransformationAgentSuccess( AgentsTestCase ):
 
 
 
+class ReplicaCacheSuccess( unittest.TestCase ):
+
+  def setUp( self ):
+    self.cacheFile = tempfile.mktemp()
+
+  def tearDown( self ):
+    if os.path.exists( self.cacheFile ):
+      os.unlink( self.cacheFile )
+
+  def test_journal( self ):
+    from DIRAC.TransformationSystem.Agent.ReplicaCache import ReplicaCache
+    cache = ReplicaCache( self.cacheFile )
+    cache.addReplicas( 1, {'/a':{'SE1':'pfn1'}, '/b':{'SE2':'pfn2'}} )
+    cache.addReplicas( 2, {'/c':{'SE1':'pfn3'}} )
+    self.assertEqual( cache.getReplicas( 1, ['/a', '/d'] ), ( {'/a':{'SE1':'pfn1'}}, ['/d'] ) )
+    cache.flush()
+    self.assertTrue( cache.invalidate( 2 ) )
+    self.assertFalse( cache.invalidate( 3 ) )
+    cache.flush()
+
+    # '/b' was dropped as it was not required any longer
+    cache = ReplicaCache( self.cacheFile )
+    self.assertEqual( cache.getReplicas( 1, ['/a', '/b'] ), ( {'/a':{'SE1':'pfn1'}}, ['/b'] ) )
+    self.assertEqual( cache.getReplicas( 2, ['/c'] ), ( {}, ['/c'] ) )
+
+    cache.validity = -1
+    self.assertEqual( cache.purgeExpired(), 1 )
+    self.assertEqual( cache.getReplicas( 1, ['/a'] ), ( {}, ['/a'] ) )
+
+  def test_truncated( self ):
+    from DIRAC.TransformationSystem.Agent.ReplicaCache import ReplicaCache
+    cache = ReplicaCache( self.cacheFile )
+    cache.addReplicas( 1, {'/a':{'SE1':'pfn1'}} )
+    cache.flush()
+    cache.addReplicas( 1, {'/b':{'SE2':'pfn2'}} )
+    cache.flush()
+    fd = open( self.cacheFile, "r+b" )
+    fd.truncate( os.path.getsize( self.cacheFile ) - 20 )
+    fd.close()
+
+    # The cut record is lost, the journal is rewritten so records appended later are read
+    cache = ReplicaCache( self.cacheFile )
+    self.assertEqual( cache.getReplicas( 1, ['/a', '/b'], False ), ( {'/a':{'SE1':'pfn1'}}, ['/b'] ) )
+    cache.addReplicas( 1, {'/c':{'SE1':'pfn3'}} )
+    cache.flush()
+    cache = ReplicaCache( self.cacheFile )
+    self.assertEqual( cache.getReplicas( 1, ['/a', '/c'] ), ( {'/a':{'SE1':'pfn1'}, '/c':{'SE1':'pfn3'}}, [] ) )
+
 #############################################################################
 # Test Suite run
 #############################################################################
@@ -69,6 +117,7 @@ class TransformationAgentSuccess( AgentsTestCase ):
 if __name__ == '__main__':
   suite = unittest.defaultTestLoader.loadTestsFromTestCase( AgentsTestCase )
   suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( TransformationAgentSuccess ) )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( ReplicaCacheSuccess ) )
   testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
 
 #EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#
@@ -211,6 +211,35 @@ class JobDB( DB ):
       return S_ERROR( 'JobDB.getAttributesForJobList: Failed\n%s' % str( x ) )
 
 
+#############################################################################
+  def setAttributesForJobList( self, jobIDList, attrNames, attrValues, update = False ):
+    """ Set the same attribute values for all the jobs in the jobIDList with a single
+        update. The LastUpdate time stamp is refreshed if explicitely requested
+    """
+    if not jobIDList:
+      return S_OK( 0 )
+    if len( attrNames ) != len( attrValues ):
+      return S_ERROR( 'JobDB.setAttributesForJobList: incompatible Argument length' )
+
+    attr = []
+    for i in range( len( attrNames ) ):
+      ret = self._escapeString( attrValues[i] )
+      if not ret['OK']:
+        return ret
+      attr.append( "%s=%s" % ( attrNames[i], ret['Value'] ) )
+    if update:
+      attr.append( "LastUpdateTime=UTC_TIMESTAMP()" )
+    if len( attr ) == 0:
+      return S_ERROR( 'JobDB.setAttributesForJobList: Nothing to do' )
+
+    jobList = ','.join( [ str( int( jobID ) ) for jobID in jobIDList ] )
+    cmd = 'UPDATE Jobs SET %s WHERE JobID in ( %s )' % ( ', '.join( attr ), jobList )
+    res = self._update( cmd )
+    if res['OK']:
+      return res
+    else:
+      return S_ERROR( 'JobDB.setAttributesForJobList: failed to set attributes' )
+
 #############################################################################
   def getDistinctJobAttributes( self, attribute, condDict = None, older = None,
                                 newer = None, timeStamp = 'LastUpdateTime' ):
@@ -499,6 +528,34 @@ class JobDB( DB ):
     else:
       return S_ERROR( 'JobDB.getJobOptParameters: failed to retrieve parameters' )
 
+#############################################################################
+  def getOptParametersForJobList( self, jobIDList, paramList = None ):
+    """ Get optimizer parameters for the jobs in the jobIDList.
+        Returns an S_OK structure with a dictionary of dictionaries as its Value:
+        ValueDict[jobID][parameter_name] = parameter_value
+    """
+    if not jobIDList:
+      return S_OK( {} )
+    jobList = ','.join( [ str( int( jobID ) ) for jobID in jobIDList ] )
+    cmd = "SELECT JobID, Name, Value from OptimizerParameters WHERE JobID in ( %s )" % jobList
+    if paramList:
+      ret = self._escapeValues( paramList )
+      if not ret['OK']:
+        return ret
+      cmd += " and Name in ( %s )" % ','.join( ret['Value'] )
+
+    result = self._query( cmd )
+    if not result['OK']:
+      return S_ERROR( 'JobDB.getOptParametersForJobList: failed to retrieve parameters' )
+    resultDict = dict( [ ( int( jobID ), {} ) for jobID in jobIDList ] )
+    for jobID, name, value in result['Value']:
+      try:
+        value = value.tostring()
+      except Exception:
+        pass
+      resultDict[ int( jobID ) ][ name ] = value
+    return S_OK( resultDict )
+
 #############################################################################
   def getTimings( self, site, period = 3600 ):
     """ Get CPU and wall clock times for the jobs finished in the last hour
@@ -891,20 +948,9 @@ class JobDB( DB ):
     if not parameters:
       return S_OK()
 
-    insertValueList = []
-    for name, value in parameters:
-      ret = self._escapeString( name )
-      if not ret['OK']:
-        return ret
-      e_name = ret['Value']
-      ret = self._escapeString( value )
-      if not ret['OK']:
-        return ret
-      e_value = ret['Value']
-      insertValueList.append( '(%s,%s,%s)' % ( jobID, e_name, e_value ) )
-
-    cmd = 'REPLACE JobParameters (JobID,Name,Value) VALUES %s' % ', '.join( insertValueList )
-    result = self._update( cmd )
+    result = self.upsertMany( 'JobParameters', [ 'JobID', 'Name', 'Value' ],
+                              [ ( jobID, name, value ) for name, value in parameters ],
+                              updateFields = [ 'Value' ] )
     if not result['OK']:
       return S_ERROR( 'JobDB.setJobParameters: operation failed.' )
 
@@ -1109,6 +1155,25 @@ class JobDB( DB ):
     else:
       return result
 
+#############################################################################
+  def getJDLsForJobList( self, jobIDList, original = False ):
+    """ Get the JDLs for the jobs in the jobIDList. By default the current job JDLs
+        are returned. If 'original' argument is True, original JDLs are returned
+        Returns S_OK( { jobID : JDL } )
+    """
+    if not jobIDList:
+      return S_OK( {} )
+    jobList = ','.join( [ str( int( jobID ) ) for jobID in jobIDList ] )
+    if original:
+      cmd = "SELECT JobID, OriginalJDL FROM JobJDLs WHERE JobID in ( %s )" % jobList
+    else:
+      cmd = "SELECT JobID, JDL FROM JobJDLs WHERE JobID in ( %s )" % jobList
+
+    result = self._query( cmd )
+    if not result['OK']:
+      return result
+    return S_OK( dict( [ ( int( jobID ), jdl ) for jobID, jdl in result['Value'] ] ) )
+
 #############################################################################
   def insertNewJobIntoDB( self, jdl, owner, ownerDN, ownerGroup, diracSetup ):
     """ Insert the initial JDL into the Job database,
@@ -53,7 +53,40 @@ class JobLoggingDB(DB):
   
     event = 'status/minor/app=%s/%s/%s' % (status,minor,application)
     self.gLogger.info("Adding record for job "+str(jobID)+": '"+event+"' from "+source)
-  
+
+    _date,time_order = self.__getTimeStamp(date)
+
+    cmd = "INSERT INTO LoggingInfo (JobId, Status, MinorStatus, ApplicationStatus, " + \
+          "StatusTime, StatusTimeOrder, StatusSource) VALUES (%d,'%s','%s','%s','%s',%f,'%s')" % \
+           (int(jobID),status,minor,application,str(_date),time_order,source)
+            
+    return self._update( cmd )
+
+#############################################################################
+  def addLoggingRecords(self,
+                        jobIDList,
+                        status='idem',
+                        minor='idem',
+                        application='idem',
+                        date='',
+                        source='Unknown'):
+    """ Add the same logging record for all the jobs in the jobIDList with a single
+        insert. Arguments are the same as for addLoggingRecord
+    """
+    if not jobIDList:
+      return S_OK(0)
+    event = 'status/minor/app=%s/%s/%s' % (status,minor,application)
+    self.gLogger.info("Adding record for %s jobs: '%s' from %s" % (len(jobIDList),event,source))
+
+    _date,time_order = self.__getTimeStamp(date)
+    values = [ (int(jobID),status,minor,application,str(_date),time_order,source) for jobID in jobIDList ]
+    return self.insertMany( 'LoggingInfo', ['JobId','Status','MinorStatus','ApplicationStatus',
+                                            'StatusTime','StatusTimeOrder','StatusSource'], values )
+
+#############################################################################
+  def __getTimeStamp(self,date):
+    """ Get the UTC datetime and the time order of a logging record
+    """
     if not date:
       # Make the UTC datetime string and float
       _date = Time.dateTime()
@@ -81,11 +114,7 @@ class JobLoggingDB(DB):
         epoc = time.mktime(_date.timetuple()) - MAGIC_EPOC_NUMBER
         time_order = round(epoc,3)     
 
-    cmd = "INSERT INTO LoggingInfo (JobId, Status, MinorStatus, ApplicationStatus, " + \
-          "StatusTime, StatusTimeOrder, StatusSource) VALUES (%d,'%s','%s','%s','%s',%f,'%s')" % \
-           (int(jobID),status,minor,application,str(_date),time_order,source)
-            
-    return self._update( cmd )
+    return _date,time_order
     
 #############################################################################
   def getJobLoggingInfo(self, jobID):
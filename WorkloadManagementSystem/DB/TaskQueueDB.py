@@ -9,9 +9,12 @@ __RCSID__ = "ebed3a8 (2012-07-06 20:33:11 +0200) Adri Casajs <adria@ecm.ub.es>"
 import types
 import random
 import time
+import threading
 from DIRAC  import gConfig, gLogger, S_OK, S_ERROR
 from DIRAC.WorkloadManagementSystem.private.SharesCorrector import SharesCorrector
 from DIRAC.WorkloadManagementSystem.private.Queues import maxCPUSegments
+from DIRAC.WorkloadManagementSystem.private.TaskQueueIndex import TaskQueueIndex
+from DIRAC.WorkloadManagementSystem.private.WeightedSampler import WeightedSampler, weightedSample
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations import Operations
 from DIRAC.Core.Utilities import List, DictCache
 from DIRAC.Core.Base.DB import DB
@@ -38,9 +41,20 @@ class TaskQueueDB( DB ):
     self.__jobPriorityBoundaries = ( 0.001, 10 )
     self.__groupShares = {}
     self.__deleteTQWithDelay = DictCache( self.__deleteTQIfEmpty )
+    self.__deleteTQPurgeLock = threading.Lock()
+    self.__deleteTQPurgePeriod = 60
+    self.__deleteTQLastPurge = time.time()
     self.__opsHelper = Operations()
     self.__ensureInsertionIsSingle = False
     self.__sharesCorrector = SharesCorrector( self.__opsHelper )
+    self.__tqIndex = False
+    self.__tqIndexLock = threading.Lock()
+    self.__tqIndexCursor = 0
+    self.__tqIndexUpdatePeriod = 10
+    self.__tqIndexLastUpdate = 0
+    #tqId -> ( generation, sampler of the job priorities weighted by the job RealPriority )
+    self.__jobPrioSamplers = {}
+    self.__samplersGeneration = 0
     result = self.__initializeDB()
     if not result[ 'OK' ]:
       raise Exception( "Can't create tables: %s" % result[ 'Message' ] )
@@ -70,6 +84,121 @@ class TaskQueueDB( DB ):
   def __getCSOption( self, optionName, defValue ):
     return self.__opsHelper.getValue( "Matching/%s" % optionName, defValue )
 
+  def __isJobSharingGroup( self, group ):
+    return Properties.JOB_SHARING in CS.getPropertiesForGroup( group )
+
+  def enableTaskQueueIndex( self, updatePeriod = 10 ):
+    """
+    Keep an in memory index of the task queues to find the ones matching a resource
+    without querying the DB. Task queues created by other processes are added to the
+    index when matching if it hasn't been updated in the last updatePeriod seconds
+    """
+    if not self.__tqIndex:
+      self.__tqIndex = TaskQueueIndex( self.__multiValueMatchFields, self.__bannedJobMatchFields,
+                                       self.__strictRequireMatchFields, self.__isJobSharingGroup )
+    self.__tqIndexUpdatePeriod = updatePeriod
+    return self.refreshTaskQueueIndex()
+
+  def refreshTaskQueueIndex( self, onlyNewTQs = False ):
+    """
+    Load the task queues into the index. If onlyNewTQs is True only the task queues
+    created since the last refresh are added, otherwise the whole index is rebuilt
+    """
+    if not self.__tqIndex:
+      return S_ERROR( "Task queue index is not enabled" )
+    self.__tqIndexLock.acquire()
+    try:
+      return self.__refreshTaskQueueIndex( onlyNewTQs )
+    finally:
+      self.__tqIndexLock.release()
+
+  def __refreshTaskQueueIndex( self, onlyNewTQs ):
+    """
+    Refresh the task queue index. The index lock has to be held
+    """
+    self.__tqIndexLastUpdate = time.time()
+    if onlyNewTQs:
+      result = self.__loadTaskQueuesForIndex( "TQId > %d" % self.__tqIndexCursor )
+    else:
+      result = self.__loadTaskQueuesForIndex()
+    if not result[ 'OK' ]:
+      self.log.error( "Can't refresh the task queue index", result[ 'Message' ] )
+      return result
+    tqDefs, cursor = result[ 'Value' ]
+    if onlyNewTQs:
+      for tqId in tqDefs:
+        self.__tqIndex.addTaskQueue( tqId, tqDefs[ tqId ] )
+    else:
+      self.__tqIndex.load( tqDefs )
+    self.__tqIndexCursor = cursor
+    return S_OK( len( tqDefs ) )
+
+  def __loadTaskQueuesForIndex( self, sqlCond = "" ):
+    """
+    Get the definitions of the task queues for the index
+      Returns S_OK( ( { tqId : tqDef }, cursor ) ). Task queues are only loaded once they are
+      enabled, since then all their requirements are in the DB. The cursor is the TQId
+      below which all the task queues have been loaded
+    """
+    if sqlCond:
+      sqlCond = " WHERE %s" % sqlCond
+    sqlFields = [ "TQId", "Priority", "Enabled" ] + list( self.__singleValueDefFields )
+    result = self._query( "SELECT %s FROM `tq_TaskQueues`%s" % ( ", ".join( sqlFields ), sqlCond ) )
+    if not result[ 'OK' ]:
+      return result
+    indexedTQs = set( self.__tqIndex.getTaskQueueIds() )
+    tqDefs = {}
+    cursor = 0
+    if sqlCond:
+      cursor = self.__tqIndexCursor
+    firstSkipped = False
+    for record in result[ 'Value' ]:
+      tqId = record[0]
+      cursor = max( cursor, tqId )
+      if record[2] < 1 and tqId not in indexedTQs:
+        if not firstSkipped or tqId < firstSkipped:
+          firstSkipped = tqId
+        continue
+      tqDef = dict( zip( self.__singleValueDefFields, record[3:] ) )
+      tqDef[ 'Priority' ] = record[1]
+      tqDefs[ tqId ] = tqDef
+    if firstSkipped:
+      cursor = firstSkipped - 1
+    if tqDefs:
+      for field in self.__multiValueDefFields:
+        result = self._query( "SELECT TQId, Value FROM `tq_TQTo%s`%s" % ( field, sqlCond ) )
+        if not result[ 'OK' ]:
+          return result
+        for tqId, value in result[ 'Value' ]:
+          if tqId in tqDefs:
+            tqDefs[ tqId ].setdefault( field, [] ).append( value )
+    return S_OK( ( tqDefs, cursor ) )
+
+  def __checkTaskQueueIndex( self ):
+    """
+    Add the task queues created by other processes if the index is old enough
+    """
+    if time.time() - self.__tqIndexLastUpdate < self.__tqIndexUpdatePeriod:
+      return
+    #Only one thread updates, the rest keep matching with the current contents
+    if not self.__tqIndexLock.acquire( False ):
+      return
+    try:
+      if time.time() - self.__tqIndexLastUpdate >= self.__tqIndexUpdatePeriod:
+        self.__refreshTaskQueueIndex( True )
+    finally:
+      self.__tqIndexLock.release()
+
+  def __matchInTaskQueueIndex( self, rawMatchDict, numQueuesToGet, negativeCond ):
+    """
+    Match using the task queue index. rawMatchDict has to be checked but not escaped
+    """
+    self.__checkTaskQueueIndex()
+    if 'LHCbPlatform' in rawMatchDict and not "Platform" in rawMatchDict:
+      rawMatchDict = dict( rawMatchDict )
+      rawMatchDict[ 'Platform' ] = rawMatchDict[ 'LHCbPlatform' ]
+    return self.__tqIndex.match( rawMatchDict, numQueuesToGet = numQueuesToGet, negativeCond = negativeCond )
+
   def getPrivatePilots( self ):
     return self.__getCSOption( "PrivatePilotTypes", [ 'private' ] )
 
@@ -398,6 +527,10 @@ class TaskQueueDB( DB ):
         self.recalculateTQSharesForEntity( tqDefDict[ 'OwnerDN' ], tqDefDict[ 'OwnerGroup' ], connObj = connObj )
     finally:
       self.setTaskQueueState( tqId, True )
+    if newTQ and self.__tqIndex:
+      result = self.__loadTaskQueuesForIndex( "TQId = %d" % tqId )
+      if result[ 'OK' ] and tqId in result[ 'Value' ][0]:
+        self.__tqIndex.addTaskQueue( tqId, result[ 'Value' ][0][ tqId ] )
     return S_OK()
 
   def __insertJobInTaskQueue( self, jobId, tqId, jobPriority, checkTQExists = True, connObj = False ):
@@ -497,6 +630,7 @@ class TaskQueueDB( DB ):
     """
     #Make a copy to avoid modification of original if escaping needs to be done
     tqMatchDict = dict( tqMatchDict )
+    rawMatchDict = dict( tqMatchDict )
     self.log.info( "Starting match for requirements", self.__strDict( tqMatchDict ) )
     retVal = self._checkMatchDefinition( tqMatchDict )
     if not retVal[ 'OK' ]:
@@ -512,14 +646,13 @@ class TaskQueueDB( DB ):
     for matchTry in range( self.__maxMatchRetry ):
       if 'JobID' in tqMatchDict:
         # A certain JobID is required by the resource, so all TQ are to be considered
-        retVal = self.matchAndGetTaskQueue( tqMatchDict, numQueuesToGet = 0, skipMatchDictDef = True, connObj = connObj )
+        numQueuesToGet = 0
+        tqNegativeCond = {}
         preJobSQL = "%s AND `tq_Jobs`.JobId = %s " % ( preJobSQL, tqMatchDict['JobID'] )
       else:
-        retVal = self.matchAndGetTaskQueue( tqMatchDict,
-                                            numQueuesToGet = numQueuesPerTry,
-                                            skipMatchDictDef = True,
-                                            negativeCond = negativeCond,
-                                            connObj = connObj )
+        numQueuesToGet = numQueuesPerTry
+        tqNegativeCond = negativeCond
+      retVal = self.__getMatchingTaskQueues( tqMatchDict, rawMatchDict, numQueuesToGet, tqNegativeCond, connObj )
       if not retVal[ 'OK' ]:
         return retVal
       tqList = retVal[ 'Value' ]
@@ -528,23 +661,33 @@ class TaskQueueDB( DB ):
         return S_OK( { 'matchFound' : False, 'tqMatch' : tqMatchDict } )
       for tqId, tqOwnerDN, tqOwnerGroup in tqList:
         self.log.info( "Trying to extract jobs from TQ %s" % tqId )
-        retVal = self._query( prioSQL % tqId, conn = connObj )
-        if not retVal[ 'OK' ]:
-          return S_ERROR( "Can't retrieve winning priority for matching job: %s" % retVal[ 'Message' ] )
-        if len( retVal[ 'Value' ] ) == 0:
-          continue
-        prio = retVal[ 'Value' ][0][0]
-        retVal = self._query( "%s %s" % ( preJobSQL % ( tqId, prio ), postJobSQL ), conn = connObj )
-        if not retVal[ 'OK' ]:
-          return S_ERROR( "Can't begin transaction for matching job: %s" % retVal[ 'Message' ] )
-        jobTQList = [ ( row[0], row[1] ) for row in retVal[ 'Value' ] ]
+        jobTQList = []
+        #Draw the priority from the precomputed table. The DB is only asked to draw it if
+        #the table is missing or out of date
+        prio = self.__sampleJobPriority( tqId )
+        if prio is not None:
+          retVal = self._query( "%s %s" % ( preJobSQL % ( tqId, prio ), postJobSQL ), conn = connObj )
+          if not retVal[ 'OK' ]:
+            return S_ERROR( "Can't begin transaction for matching job: %s" % retVal[ 'Message' ] )
+          jobTQList = [ ( row[0], row[1] ) for row in retVal[ 'Value' ] ]
+        if len( jobTQList ) == 0:
+          retVal = self._query( prioSQL % tqId, conn = connObj )
+          if not retVal[ 'OK' ]:
+            return S_ERROR( "Can't retrieve winning priority for matching job: %s" % retVal[ 'Message' ] )
+          if len( retVal[ 'Value' ] ) == 0:
+            continue
+          prio = retVal[ 'Value' ][0][0]
+          retVal = self._query( "%s %s" % ( preJobSQL % ( tqId, prio ), postJobSQL ), conn = connObj )
+          if not retVal[ 'OK' ]:
+            return S_ERROR( "Can't begin transaction for matching job: %s" % retVal[ 'Message' ] )
+          jobTQList = [ ( row[0], row[1] ) for row in retVal[ 'Value' ] ]
         if len( jobTQList ) == 0:
           gLogger.info( "Task queue %s seems to be empty, triggering a cleaning" % tqId )
           self.__deleteTQWithDelay.add( tqId, 300, ( tqId, tqOwnerDN, tqOwnerGroup ) )
         while len( jobTQList ) > 0:
           jobId, tqId = jobTQList.pop( random.randint( 0, len( jobTQList ) - 1 ) )
           self.log.info( "Trying to extract job %s from TQ %s" % ( jobId, tqId ) )
-          retVal = self.deleteJob( jobId, connObj = connObj )
+          retVal = self.__deleteJob( jobId, connObj )
           if not retVal[ 'OK' ]:
             msgFix = "Could not take job"
             msgVar = " %s out from the TQ %s: %s" % ( jobId, tqId, retVal[ 'Message' ] )
@@ -557,6 +700,136 @@ class TaskQueueDB( DB ):
     self.log.info( "Could not find a match after %s match retries" % self.__maxMatchRetry )
     return S_ERROR( "Could not find a match after %s match retries" % self.__maxMatchRetry )
 
+  def matchAndGetJobs( self, tqMatchDict, maxJobs = 1, numQueuesPerTry = 10, negativeCond = {} ):
+    """
+    Match up to maxJobs jobs in one pass over the matching task queues and take them
+    out of the task queues. Jobs are reserved atomically, concurrent matches never get
+    the same job
+      Returns S_OK( { 'matchFound' : True/False, 'jobs' : [ ( jobId, tqId ), ... ], 'tqMatch' : tqMatchDict } )
+    """
+    if 'JobID' in tqMatchDict:
+      #Only the requested job can be matched
+      retVal = self.matchAndGetJob( tqMatchDict, negativeCond = negativeCond )
+      if not retVal[ 'OK' ]:
+        return retVal
+      matchData = retVal[ 'Value' ]
+      matchData[ 'jobs' ] = []
+      if matchData[ 'matchFound' ]:
+        matchData[ 'jobs' ].append( ( matchData[ 'jobId' ], matchData[ 'taskQueueId' ] ) )
+      return S_OK( matchData )
+    #Make a copy to avoid modification of original if escaping needs to be done
+    tqMatchDict = dict( tqMatchDict )
+    rawMatchDict = dict( tqMatchDict )
+    self.log.info( "Starting match of %s jobs for requirements" % maxJobs, self.__strDict( tqMatchDict ) )
+    retVal = self._checkMatchDefinition( tqMatchDict )
+    if not retVal[ 'OK' ]:
+      self.log.error( "TQ match request check failed", retVal[ 'Message' ] )
+      return retVal
+    retVal = self._getConnection()
+    if not retVal[ 'OK' ]:
+      return S_ERROR( "Can't connect to DB: %s" % retVal[ 'Message' ] )
+    connObj = retVal[ 'Value' ]
+    jobTQList = []
+    for matchTry in range( self.__maxMatchRetry ):
+      retVal = self.__getMatchingTaskQueues( tqMatchDict, rawMatchDict, numQueuesPerTry, negativeCond, connObj )
+      if not retVal[ 'OK' ]:
+        return retVal
+      tqList = retVal[ 'Value' ]
+      if len( tqList ) == 0:
+        self.log.info( "No TQ matches requirements" )
+        break
+      for tqId, tqOwnerDN, tqOwnerGroup in tqList:
+        retVal = self.__getJobsToMatch( tqId, maxJobs - len( jobTQList ), connObj )
+        if not retVal[ 'OK' ]:
+          return S_ERROR( "Can't retrieve jobs for matching: %s" % retVal[ 'Message' ] )
+        jobIds = retVal[ 'Value' ]
+        if jobIds:
+          retVal = self.__reserveJobs( jobIds, connObj )
+          if not retVal[ 'OK' ]:
+            self.log.error( "Could not take jobs out from the TQ %s" % tqId, retVal[ 'Message' ] )
+            return retVal
+          jobIds = retVal[ 'Value' ]
+          self.log.info( "Extracted %s jobs from TQ %s" % ( len( jobIds ), tqId ) )
+          jobTQList.extend( [ ( jobId, tqId ) for jobId in jobIds ] )
+        #The TQ will be deleted if it stays empty
+        self.__deleteTQWithDelay.add( tqId, 300, ( tqId, tqOwnerDN, tqOwnerGroup ) )
+        if len( jobTQList ) >= maxJobs:
+          break
+      #Only retry if other matches took all the jobs
+      if jobTQList:
+        break
+    return S_OK( { 'matchFound' : len( jobTQList ) > 0, 'jobs' : jobTQList, 'tqMatch' : tqMatchDict } )
+
+  def __sampleJobPriority( self, tqId ):
+    """
+    Draw a job priority of a TQ with a probability proportional to the sum of the
+    RealPriority of its jobs. Returns None if the TQ priorities are not known
+    """
+    samplerData = self.__jobPrioSamplers.get( tqId )
+    if not samplerData:
+      return None
+    return samplerData[1].sample()
+
+  def __getJobsToMatch( self, tqId, numJobs, connObj ):
+    """
+    Get up to numJobs jobs of a TQ. Each job is drawn with a probability proportional to
+    its RealPriority, and jobs with the same priority are taken in order
+    """
+    jobSQL = "SELECT `tq_Jobs`.JobId FROM `tq_Jobs` WHERE `tq_Jobs`.TQId = %s AND `tq_Jobs`.Priority = %s ORDER BY `tq_Jobs`.JobId ASC LIMIT %s"
+    jobIds = []
+    if tqId in self.__jobPrioSamplers:
+      numJobsPerPrio = {}
+      for iJob in range( numJobs ):
+        prio = self.__sampleJobPriority( tqId )
+        numJobsPerPrio[ prio ] = numJobsPerPrio.get( prio, 0 ) + 1
+      for prio in numJobsPerPrio:
+        retVal = self._query( jobSQL % ( tqId, prio, numJobsPerPrio[ prio ] ), conn = connObj )
+        if not retVal[ 'OK' ]:
+          return retVal
+        jobIds.extend( [ row[0] for row in retVal[ 'Value' ] ] )
+    if not jobIds:
+      #Unknown or out of date priorities. Let the DB draw them
+      retVal = self._query( "SELECT `tq_Jobs`.JobId FROM `tq_Jobs` WHERE `tq_Jobs`.TQId = %s ORDER BY RAND() / `tq_Jobs`.RealPriority ASC LIMIT %s" % ( tqId, numJobs ),
+                            conn = connObj )
+      if not retVal[ 'OK' ]:
+        return retVal
+      jobIds = [ row[0] for row in retVal[ 'Value' ] ]
+    return S_OK( jobIds )
+
+  def __reserveJobs( self, jobIds, connObj ):
+    """
+    Take jobs out of the task queues. The rows are locked before deleting them so only
+    the jobs deleted by this call are returned
+      Returns S_OK( [ jobIds reserved ] )
+    """
+    jobList = ", ".join( [ str( jobId ) for jobId in jobIds ] )
+    retVal = self._query( "SELECT JobId FROM `tq_Jobs` WHERE JobId IN ( %s ) FOR UPDATE" % jobList, conn = connObj )
+    if not retVal[ 'OK' ]:
+      return retVal
+    lockedIds = [ row[0] for row in retVal[ 'Value' ] ]
+    if not lockedIds:
+      #Nothing to take, just end the transaction
+      try:
+        connObj.rollback()
+      except Exception, excp:
+        return S_ERROR( "Can't end the transaction: %s" % excp )
+      return S_OK( [] )
+    #The update commits and releases the locks
+    jobList = ", ".join( [ str( jobId ) for jobId in lockedIds ] )
+    retVal = self._update( "DELETE FROM `tq_Jobs` WHERE JobId IN ( %s )" % jobList, conn = connObj )
+    if not retVal[ 'OK' ]:
+      return retVal
+    return S_OK( lockedIds )
+
+  def __getMatchingTaskQueues( self, tqMatchDict, rawMatchDict, numQueuesToGet, negativeCond, connObj ):
+    """
+    Get the task queues matching the checked tqMatchDict, from the index if it's enabled
+    """
+    if self.__tqIndex:
+      return S_OK( self.__matchInTaskQueueIndex( rawMatchDict, numQueuesToGet, negativeCond ) )
+    return self.matchAndGetTaskQueue( tqMatchDict, numQueuesToGet = numQueuesToGet, skipMatchDictDef = True,
+                                      negativeCond = negativeCond, connObj = connObj )
+
   def matchAndGetTaskQueue( self, tqMatchDict, numQueuesToGet = 1, skipMatchDictDef = False,
                                   negativeCond = {}, connObj = False ):
     """
@@ -565,17 +838,23 @@ class TaskQueueDB( DB ):
     #Make a copy to avoid modification of original if escaping needs to be done
     tqMatchDict = dict( tqMatchDict )
     if not skipMatchDictDef:
+      rawMatchDict = dict( tqMatchDict )
       retVal = self._checkMatchDefinition( tqMatchDict )
       if not retVal[ 'OK' ]:
         return retVal
-    retVal = self.__generateTQMatchSQL( tqMatchDict, numQueuesToGet = numQueuesToGet, negativeCond = negativeCond )
+      if self.__tqIndex:
+        return S_OK( self.__matchInTaskQueueIndex( rawMatchDict, numQueuesToGet, negativeCond ) )
+    retVal = self.__generateTQMatchSQL( tqMatchDict, negativeCond = negativeCond )
     if not retVal[ 'OK' ]:
       return retVal
     matchSQL = retVal[ 'Value' ]
     retVal = self._query( matchSQL, conn = connObj )
     if not retVal[ 'OK' ]:
       return retVal
-    return S_OK( [ ( row[0], row[1], row[2] ) for row in retVal[ 'Value' ] ] )
+    #Apply priorities
+    tqDict = dict( [ ( row[0], ( row[0], row[1], row[2] ) ) for row in retVal[ 'Value' ] ] )
+    tqIds = weightedSample( [ ( row[0], row[3] ) for row in retVal[ 'Value' ] ], numQueuesToGet )
+    return S_OK( [ tqDict[ tqId ] for tqId in tqIds ] )
 
   def __generateSQLSubCond( self, sqlString, value, boolOp = 'OR' ):
     if type( value ) not in ( types.ListType, types.TupleType ):
@@ -632,7 +911,7 @@ class TaskQueueDB( DB ):
       return tableN, "`%s`" % fullTableName,
     return  sqlTables[ fullTableName ], "`%s`" % fullTableName
 
-  def __generateTQMatchSQL( self, tqMatchDict, numQueuesToGet = 1, negativeCond = {} ):
+  def __generateTQMatchSQL( self, tqMatchDict, negativeCond = {} ):
     """
     Generate the SQL needed to match a task queue
     """
@@ -710,12 +989,8 @@ class TaskQueueDB( DB ):
     if negativeCond:
       sqlCondList.append( self.__generateNotSQL( sqlTables, negativeCond ) )
     #Generate the final query string
-    tqSqlCmd = "SELECT tq.TQId, tq.OwnerDN, tq.OwnerGroup FROM `tq_TaskQueues` tq WHERE %s" % ( " AND ".join( sqlCondList ) )
-    #Apply priorities
-    tqSqlCmd = "%s ORDER BY RAND() / tq.Priority ASC" % tqSqlCmd
-    #Do we want a limit?
-    if numQueuesToGet:
-      tqSqlCmd = "%s LIMIT %s" % ( tqSqlCmd, numQueuesToGet )
+    #Priorities are applied after the query, the DB doesn't have to sort the TQs
+    tqSqlCmd = "SELECT tq.TQId, tq.OwnerDN, tq.OwnerGroup, tq.Priority FROM `tq_TaskQueues` tq WHERE %s" % ( " AND ".join( sqlCondList ) )
     return S_OK( tqSqlCmd )
 
   def deleteJob( self, jobId, connObj = False ):
@@ -723,6 +998,15 @@ class TaskQueueDB( DB ):
     Delete a job from the task queues
     Return S_OK( True/False ) / S_ERROR
     """
+    result = self.__deleteJob( jobId, connObj )
+    #Processes without a periodic purge delete the empty TQs from here
+    self.__checkEmptyTaskQueues()
+    return result
+
+  def __deleteJob( self, jobId, connObj ):
+    """
+    Delete a job from the task queues. Its TQ is deleted later on if it stays empty
+    """
     if not connObj:
       retVal = self._getConnection()
       if not retVal[ 'OK' ]:
@@ -748,6 +1032,28 @@ class TaskQueueDB( DB ):
     self.__deleteTQWithDelay.add( tqId, 300, ( tqId, tqOwnerDN, tqOwnerGroup ) )
     return S_OK( True )
 
+  def purgeEmptyTaskQueues( self ):
+    """
+    Delete the TQs that have been empty for long enough. Meant to be run periodically,
+    matching only registers the TQs that may have to be deleted
+    """
+    #Only one thread purges, the rest will be done in the next pass
+    if not self.__deleteTQPurgeLock.acquire( False ):
+      return S_OK()
+    try:
+      self.__deleteTQLastPurge = time.time()
+      self.__deleteTQWithDelay.purgeExpired()
+    finally:
+      self.__deleteTQPurgeLock.release()
+    return S_OK()
+
+  def __checkEmptyTaskQueues( self ):
+    """
+    Purge the empty TQs if it has not been done for a while
+    """
+    if time.time() - self.__deleteTQLastPurge >= self.__deleteTQPurgePeriod:
+      self.purgeEmptyTaskQueues()
+
   def getTaskQueueForJob( self, jobId, connObj = False ):
     """
     Return TaskQueue for a given Job
@@ -804,15 +1110,12 @@ class TaskQueueDB( DB ):
     return S_OK( retVal[ 'Value' ][0] )
 
   def __deleteTQIfEmpty( self, args ):
-    print "[ADRILETE] PRE"
     ( tqId, tqOwnerDN, tqOwnerGroup ) = args
-    print "[ADRILETE] POST"
     retries = 3
     while retries:
       retries -= 1
       result = self.deleteTaskQueueIfEmpty( tqId, tqOwnerDN, tqOwnerGroup )
       if result[ 'OK' ]:
-        print "[ADRILETE] OK"        
         return
     gLogger.error( "Could not delete TQ %s: %s" % ( tqId, result[ 'Message' ] ) )
 
@@ -845,6 +1148,9 @@ class TaskQueueDB( DB ):
         retVal = self._update( "DELETE FROM `tq_TQTo%s` WHERE TQId = %s" % ( mvField, tqId ), conn = connObj )
         if not retVal[ 'OK' ]:
           return retVal
+      if self.__tqIndex:
+        self.__tqIndex.removeTaskQueue( tqId )
+      self.__jobPrioSamplers.pop( tqId, None )
       self.recalculateTQSharesForEntity( tqOwnerDN, tqOwnerGroup, connObj = connObj )
       self.log.info( "Deleted empty and enabled TQ %s" % tqId )
       return S_OK( True )
@@ -878,10 +1184,13 @@ class TaskQueueDB( DB ):
     if not retVal[ 'OK' ]:
       return S_ERROR( "Could not delete task queue %s: %s" % ( tqId, retVal[ 'Message' ] ) )
     for mvField in self.__multiValueDefFields:
-      retVal = self._update( "DELETE FROM `tq_TQTo%s` WHERE TQId = %s" % tqId, conn = connObj )
+      retVal = self._update( "DELETE FROM `tq_TQTo%s` WHERE TQId = %s" % ( mvField, tqId ), conn = connObj )
       if not retVal[ 'OK' ]:
         return retVal
     if delTQ > 0:
+      if self.__tqIndex:
+        self.__tqIndex.removeTaskQueue( tqId )
+      self.__jobPrioSamplers.pop( tqId, None )
       self.recalculateTQSharesForEntity( tqOwnerDN, tqOwnerGroup, connObj = connObj )
       return S_OK( True )
     return S_OK( False )
@@ -1001,8 +1310,13 @@ class TaskQueueDB( DB ):
     result = self._query( "SELECT DISTINCT( OwnerGroup ) FROM `tq_TaskQueues`" )
     if not result[ 'OK' ]:
       return result
+    self.__samplersGeneration += 1
     for group in [ r[0] for r in result[ 'Value' ] ]:
       self.recalculateTQSharesForEntity( "all", group )
+    #Forget the job priorities of the TQs that are gone
+    for tqId, samplerData in self.__jobPrioSamplers.items():
+      if samplerData[0] < self.__samplersGeneration:
+        self.__jobPrioSamplers.pop( tqId, None )
     return S_OK()
 
   def recalculateTQSharesForEntity( self, userDN, userGroup, connObj = False ):
@@ -1055,19 +1369,29 @@ class TaskQueueDB( DB ):
     if Properties.JOB_SHARING not in CS.getPropertiesForGroup( userGroup ):
       tqCond.append( "t.OwnerDN='%s'" % userDN )
     tqCond.append( "t.TQId = j.TQId" )
-    if consolidationFunc == 'AVG':
-      selectSQL = "SELECT j.TQId, SUM( j.RealPriority )/COUNT(j.RealPriority) FROM `tq_TaskQueues` t, `tq_Jobs` j WHERE "
-    elif consolidationFunc == 'SUM':
-      selectSQL = "SELECT j.TQId, SUM( j.RealPriority ) FROM `tq_TaskQueues` t, `tq_Jobs` j WHERE "
-    else:
+    if consolidationFunc not in ( 'AVG', 'SUM' ):
       return S_ERROR( "Unknown consolidation func %s for setting priorities" % consolidationFunc )
+    selectSQL = "SELECT j.TQId, j.Priority, COUNT( j.RealPriority ), SUM( j.RealPriority ) FROM `tq_TaskQueues` t, `tq_Jobs` j WHERE "
     selectSQL += " AND ".join( tqCond )
-    selectSQL += " GROUP BY t.TQId"
+    selectSQL += " GROUP BY t.TQId, j.Priority"
     result = self._query( selectSQL, conn = connObj )
     if not result[ 'OK' ]:
       return result
 
-    tqDict = dict( result[ 'Value' ] )
+    #Consolidate the job priorities per TQ and keep the weight of each job priority
+    #to draw the jobs to match without sorting them in the DB
+    tqDict = {}
+    tqNumJobs = {}
+    tqJobPrios = {}
+    for tqId, jobPrio, numJobs, sumPrio in result[ 'Value' ]:
+      tqDict[ tqId ] = tqDict.get( tqId, 0 ) + sumPrio
+      tqNumJobs[ tqId ] = tqNumJobs.get( tqId, 0 ) + numJobs
+      tqJobPrios.setdefault( tqId, {} )[ jobPrio ] = sumPrio
+    if consolidationFunc == 'AVG':
+      for tqId in tqDict:
+        tqDict[ tqId ] = tqDict[ tqId ] / tqNumJobs[ tqId ]
+    for tqId in tqJobPrios:
+      self.__jobPrioSamplers[ tqId ] = ( self.__samplersGeneration, WeightedSampler( tqJobPrios[ tqId ] ) )
     if len( tqDict ) == 0:
       return S_OK()
     #Calculate Sum of priorities
@@ -1090,7 +1414,9 @@ class TaskQueueDB( DB ):
     for prio in prioDict:
       tqList = ", ".join( [ str( tqId ) for tqId in prioDict[ prio ] ] )
       updateSQL = "UPDATE `tq_TaskQueues` SET Priority=%.4f WHERE TQId in ( %s )" % ( prio, tqList )
-      self._update( updateSQL, conn = connObj )
+      result = self._update( updateSQL, conn = connObj )
+      if result[ 'OK' ] and self.__tqIndex:
+        self.__tqIndex.setPriorities( dict( [ ( tqId, prio ) for tqId in prioDict[ prio ] ] ) )
     return S_OK()
 
   def getGroupShares( self ):
@@ -0,0 +1,169 @@
+""" Unit tests of the matching of several jobs and of the delayed deletion of the
+    empty task queues of the TaskQueueDB
+"""
+import re
+import threading
+import time
+import unittest
+
+from DIRAC import S_OK, gLogger
+from DIRAC.Core.Utilities import DictCache
+from DIRAC.WorkloadManagementSystem.DB.TaskQueueDB import TaskQueueDB
+
+class FakeTaskQueueDB( TaskQueueDB ):
+  """ TaskQueueDB where each job is in the TQ with the same number """
+
+  def __init__( self ):
+    self.log = gLogger.getSubLogger( "FakeTaskQueueDB" )
+    self._TaskQueueDB__deleteTQWithDelay = DictCache( self._TaskQueueDB__deleteTQIfEmpty )
+    self._TaskQueueDB__deleteTQPurgeLock = threading.Lock()
+    self._TaskQueueDB__deleteTQPurgePeriod = 60
+    self._TaskQueueDB__deleteTQLastPurge = time.time()
+    self.deletedTQs = []
+
+  def delayDeletion( self, tqId, validSeconds ):
+    self._TaskQueueDB__deleteTQWithDelay.add( tqId, validSeconds, ( tqId, "/DN", "group" ) )
+
+  def _getConnection( self ):
+    return S_OK( None )
+
+  def _query( self, cmd, conn = None, debug = False ):
+    jobId = int( cmd.split( "j.JobId = " )[1].split()[0] )
+    return S_OK( ( ( jobId, "/DN", "group" ), ) )
+
+  def _update( self, cmd, conn = None, debug = False ):
+    return S_OK( 1 )
+
+  def deleteTaskQueueIfEmpty( self, tqId, tqOwnerDN = False, tqOwnerGroup = False, connObj = False ):
+    self.deletedTQs.append( tqId )
+    return S_OK( True )
+
+class FakeTaskQueues:
+  """ Jobs of each TQ. One lock stands for the row locks taken with FOR UPDATE """
+
+  def __init__( self, jobsPerTQ ):
+    self.lock = threading.Lock()
+    self.jobs = dict( [ ( tqId, range( tqId * 100, tqId * 100 + jobsPerTQ[ tqId ] ) ) for tqId in jobsPerTQ ] )
+
+  def getJobs( self ):
+    jobIds = []
+    for tqId in self.jobs:
+      jobIds.extend( self.jobs[ tqId ] )
+    return jobIds
+
+class FakeConnection:
+  """ Holds the lock of FakeTaskQueues from SELECT ... FOR UPDATE until the end of the transaction """
+
+  def __init__( self, taskQueues ):
+    self.taskQueues = taskQueues
+    self.locked = False
+
+  def lock( self ):
+    if not self.locked:
+      self.taskQueues.lock.acquire()
+      self.locked = True
+
+  def rollback( self ):
+    if self.locked:
+      self.locked = False
+      self.taskQueues.lock.release()
+
+class MatchingTaskQueueDB( FakeTaskQueueDB ):
+  """ TaskQueueDB matching any TQ with jobs left in FakeTaskQueues """
+
+  def __init__( self, taskQueues ):
+    FakeTaskQueueDB.__init__( self )
+    self.taskQueues = taskQueues
+    self._TaskQueueDB__maxMatchRetry = 3
+    self._TaskQueueDB__jobPrioSamplers = {}
+
+  def _getConnection( self ):
+    return S_OK( FakeConnection( self.taskQueues ) )
+
+  def _checkMatchDefinition( self, tqMatchDict ):
+    return S_OK()
+
+  def _TaskQueueDB__getMatchingTaskQueues( self, tqMatchDict, rawMatchDict, numQueuesToGet, negativeCond, connObj ):
+    return S_OK( [ ( tqId, "/DN", "group" ) for tqId in sorted( self.taskQueues.jobs ) if self.taskQueues.jobs[ tqId ] ] )
+
+  def _query( self, cmd, conn = None, debug = False ):
+    match = re.search( "TQId = (\d+) ORDER BY RAND\(\) / `tq_Jobs`.RealPriority ASC LIMIT (\d+)", cmd )
+    if match:
+      jobIds = list( self.taskQueues.jobs[ int( match.group( 1 ) ) ] )
+      #Let concurrent matches draw the same jobs
+      time.sleep( 0.001 )
+      return S_OK( tuple( [ ( jobId, ) for jobId in jobIds[ :int( match.group( 2 ) ) ] ] ) )
+    conn.lock()
+    jobIds = [ int( jobId ) for jobId in re.search( "IN \( (.*) \)", cmd ).group( 1 ).split( ", " ) ]
+    return S_OK( tuple( [ ( jobId, ) for jobId in jobIds if jobId in self.taskQueues.getJobs() ] ) )
+
+  def _update( self, cmd, conn = None, debug = False ):
+    jobIds = [ int( jobId ) for jobId in re.search( "IN \( (.*) \)", cmd ).group( 1 ).split( ", " ) ]
+    for tqId in self.taskQueues.jobs:
+      self.taskQueues.jobs[ tqId ] = [ jobId for jobId in self.taskQueues.jobs[ tqId ] if jobId not in jobIds ]
+    #The update commits
+    conn.rollback()
+    return S_OK( len( jobIds ) )
+
+class MatchJobsTestCase( unittest.TestCase ):
+
+  def test_severalTQs( self ):
+    taskQueues = FakeTaskQueues( { 1 : 2, 2 : 3 } )
+    tqDB = MatchingTaskQueueDB( taskQueues )
+    result = tqDB.matchAndGetJobs( { 'Setup' : 'Test' }, maxJobs = 4 )[ 'Value' ]
+    self.assert_( result[ 'matchFound' ] )
+    self.assertEqual( [ tqId for jobId, tqId in result[ 'jobs' ] ], [ 1, 1, 2, 2 ] )
+    self.assertEqual( sorted( [ jobId for jobId, tqId in result[ 'jobs' ] ] ), [ 100, 101, 200, 201 ] )
+    self.assertEqual( taskQueues.jobs, { 1 : [], 2 : [ 202 ] } )
+    result = tqDB.matchAndGetJobs( { 'Setup' : 'Test' }, maxJobs = 4 )[ 'Value' ]
+    self.assertEqual( result[ 'jobs' ], [ ( 202, 2 ) ] )
+    self.failIf( tqDB.matchAndGetJobs( { 'Setup' : 'Test' }, maxJobs = 4 )[ 'Value' ][ 'matchFound' ] )
+
+  def test_concurrentMatches( self ):
+    taskQueues = FakeTaskQueues( { 1 : 20, 2 : 20 } )
+    #Two Matchers on the same TQs
+    tqDBs = [ MatchingTaskQueueDB( taskQueues ), MatchingTaskQueueDB( taskQueues ) ]
+    matched = []
+    def match( tqDB ):
+      while True:
+        result = tqDB.matchAndGetJobs( { 'Setup' : 'Test' }, maxJobs = 3 )
+        if not result[ 'Value' ][ 'matchFound' ]:
+          return
+        matched.extend( [ jobId for jobId, tqId in result[ 'Value' ][ 'jobs' ] ] )
+    threads = [ threading.Thread( target = match, args = ( tqDBs[ i % 2 ], ) ) for i in range( 6 ) ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual( sorted( matched ), range( 100, 120 ) + range( 200, 220 ) )
+
+class DelayedDeletionTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.tqDB = FakeTaskQueueDB()
+    self.tqDB.delayDeletion( 1, 0.01 )
+    time.sleep( 0.05 )
+
+  def test_deleteJobRateLimited( self ):
+    self.assert_( self.tqDB.deleteJob( 2 )[ 'Value' ] )
+    #The last purge is too recent
+    self.assertEqual( self.tqDB.deletedTQs, [] )
+    self.tqDB._TaskQueueDB__deleteTQLastPurge = time.time() - 61
+    self.assert_( self.tqDB.deleteJob( 3 )[ 'Value' ] )
+    self.assertEqual( self.tqDB.deletedTQs, [ 1 ] )
+    #TQs 2 and 3 have just been emptied
+    self.tqDB.delayDeletion( 4, 0.01 )
+    time.sleep( 0.05 )
+    self.tqDB.deleteJob( 5 )
+    self.assertEqual( self.tqDB.deletedTQs, [ 1 ] )
+
+  def test_purgeEmptyTaskQueues( self ):
+    self.tqDB.deleteJob( 2 )
+    self.assert_( self.tqDB.purgeEmptyTaskQueues()[ 'OK' ] )
+    self.assertEqual( self.tqDB.deletedTQs, [ 1 ] )
+    self.assert_( time.time() - self.tqDB._TaskQueueDB__deleteTQLastPurge < 1 )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( MatchJobsTestCase )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( DelayedDeletionTestCase ) )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -10,7 +10,7 @@ It also provides an XMLRPC interface to the Matcher
 __RCSID__ = "$Id$"
 
 import time
-from   types import StringType, DictType, StringTypes
+from   types import StringType, DictType, StringTypes, IntType, LongType
 import threading
 
 from DIRAC.ConfigurationSystem.Client.Helpers          import Registry, Operations
@@ -58,9 +58,20 @@ def initializeMatcherHandler( serviceInfo ):
   gMonitor.registerActivity( 'numTQs', "Number of Task Queues",
                              'Matching', "tqsk queues" , gMonitor.OP_MEAN, 300 )
 
+  #Keep the task queues in memory so matching does not need to query the TaskQueueDB
+  serviceCS = serviceInfo[ 'serviceSectionPath' ]
+  if gConfig.getValue( "%s/UseTaskQueueIndex" % serviceCS, True ):
+    result = gTaskQueueDB.enableTaskQueueIndex( gConfig.getValue( "%s/TaskQueueIndexUpdatePeriod" % serviceCS, 10 ) )
+    if not result[ 'OK' ]:
+      return result
+    gThreadScheduler.addPeriodicTask( gConfig.getValue( "%s/TaskQueueIndexRefreshPeriod" % serviceCS, 300 ),
+                                      gTaskQueueDB.refreshTaskQueueIndex )
+
   gTaskQueueDB.recalculateTQSharesForAll()
   gThreadScheduler.addPeriodicTask( 120, gTaskQueueDB.recalculateTQSharesForAll )
   gThreadScheduler.addPeriodicTask( 60, sendNumTaskQueues )
+  #Empty task queues are deleted here instead of while matching
+  gThreadScheduler.addPeriodicTask( 60, gTaskQueueDB.purgeEmptyTaskQueues )
 
   sendNumTaskQueues()
 
@@ -76,8 +87,8 @@ def sendNumTaskQueues():
 
 class Limiter:
 
-  __csDictCache = DictCache()
-  __condCache = DictCache()
+  __csDictCache = DictCache( maxSize = 1000 )
+  __condCache = DictCache( maxSize = 10000 )
   __delayMem = {}
 
   def __init__( self, opsHelper ):
@@ -174,10 +185,9 @@ class Limiter:
     """ Extract limiting information from the CS in the form:
         { 'JobType' : { 'Merge' : 20, 'MCGen' : 1000 } }
     """
-    stuffDict = Limiter.__csDictCache.get( section )
-    if stuffDict:
-      return S_OK( stuffDict )
+    return Limiter.__csDictCache.getOrLoad( section, 300, self.__loadCSData, section )
 
+  def __loadCSData( self, section ):
     result = self.__opsHelper.getSections( section )
     if not result['OK']:
       return result
@@ -195,8 +205,6 @@ class Limiter:
         gLogger.error( errMsg )
         return S_ERROR( errMsg )
       stuffDict[ attName ] = attLimits
-
-    Limiter.__csDictCache.add( section, 300, stuffDict )
     return S_OK( stuffDict )
 
   def __getRunningCondition( self, siteName ):
@@ -217,14 +225,11 @@ class Limiter:
         gLogger.error( "Attribute %s does not exist. Check the job limits" % attName )
         continue
       cK = "Running:%s:%s" % ( siteName, attName )
-      data = self.__condCache.get( cK )
-      if not data:
-        result = gJobDB.getCounters( 'Jobs', [ attName ], { 'Site' : siteName, 'Status' : [ 'Running', 'Matched', 'Stalled' ] } )
-        if not result[ 'OK' ]:
-          return result
-        data = result[ 'Value' ]
-        data = dict( [ ( k[0][ attName ], k[1] )  for k in data ] )
-        self.__condCache.add( cK, 10, data )
+      #Concurrent matches for the same site count the running jobs only once
+      result = self.__condCache.getOrLoad( cK, 10, self.__loadRunningCounters, siteName, attName )
+      if not result[ 'OK' ]:
+        return result
+      data = result[ 'Value' ]
       for attValue in limitsDict[ attName ]:
         limit = limitsDict[ attName ][ attValue ]
         running = data.get( attValue, 0 )
@@ -237,6 +242,12 @@ class Limiter:
     #negCond is something like : {'JobType': ['Merge']}
     return S_OK( negCond )
 
+  def __loadRunningCounters( self, siteName, attName ):
+    result = gJobDB.getCounters( 'Jobs', [ attName ], { 'Site' : siteName, 'Status' : [ 'Running', 'Matched', 'Stalled' ] } )
+    if not result[ 'OK' ]:
+      return result
+    return S_OK( dict( [ ( k[0][ attName ], k[1] )  for k in result[ 'Value' ] ] ) )
+
   def updateDelayCounters( self, siteName, jid ):
     #Get the info from the CS
     siteSection = "%s/%s" % ( self.__matchingDelaySection, siteName )
@@ -360,12 +371,11 @@ class MatcherHandler( RequestHandler ):
 
     return resourceDict
 
-  def selectJob( self, resourceDescription ):
-    """ Main job selection function to find the highest priority job
-        matching the resource capacity
+  def __prepareMatch( self, resourceDescription ):
+    """ Build the resource dictionary to match with the TaskQueueDB. Checks the pilot
+        credentials and version, reports the pilot info and applies the site mask
+        Returns S_OK( ( resourceDict, siteName, pilotInfoReported ) )
     """
-
-    startTime = time.time()
     resourceDict = self.__processResourceDescription( resourceDescription )
 
     credDict = self.getRemoteCredentials()
@@ -460,6 +470,20 @@ class MatcherHandler( RequestHandler ):
     for key in resourceDict:
      gLogger.verbose( "%s : %s" % ( key.rjust( 20 ), resourceDict[ key ] ) )
 
+    return S_OK( ( resourceDict, siteName, pilotInfoReported ) )
+
+  def selectJob( self, resourceDescription ):
+    """ Main job selection function to find the highest priority job
+        matching the resource capacity
+    """
+
+    startTime = time.time()
+    result = self.__prepareMatch( resourceDescription )
+    if not result[ 'OK' ]:
+      return result
+    resourceDict, siteName, pilotInfoReported = result[ 'Value' ]
+    pilotReference = resourceDict.get( 'PilotReference', '' )
+
     negativeCond = self.__limiter.getNegativeCondForSite( siteName )
     result = gTaskQueueDB.matchAndGetJob( resourceDict, negativeCond = negativeCond )
 
@@ -530,6 +554,91 @@ class MatcherHandler( RequestHandler ):
     resultDict['PilotInfoReportedFlag'] = pilotInfoReported
     return S_OK( resultDict )
 
+  def selectJobs( self, resourceDescription, maxJobs ):
+    """ Find up to maxJobs jobs matching the resource capacity in a single match
+        and update them in bulk
+    """
+
+    startTime = time.time()
+    result = self.__prepareMatch( resourceDescription )
+    if not result[ 'OK' ]:
+      return result
+    resourceDict, siteName, pilotInfoReported = result[ 'Value' ]
+    pilotReference = resourceDict.get( 'PilotReference', '' )
+
+    negativeCond = self.__limiter.getNegativeCondForSite( siteName )
+    result = gTaskQueueDB.matchAndGetJobs( resourceDict, maxJobs = maxJobs, negativeCond = negativeCond )
+    if not result['OK']:
+      return result
+    if not result['Value']['matchFound']:
+      return S_ERROR( 'No match found' )
+    jobIDs = [ jobID for jobID, tqID in result['Value']['jobs'] ]
+
+    result = gJobDB.getAttributesForJobList( jobIDs, ['OwnerDN', 'OwnerGroup', 'Status'] )
+    if not result['OK']:
+      return S_ERROR( 'Could not retrieve job attributes' )
+    jobAttrs = result['Value']
+    matchedIDs = []
+    for jobID in jobIDs:
+      if jobID not in jobAttrs:
+        gLogger.error( 'No attributes returned for job %s' % jobID )
+      elif jobAttrs[ jobID ]['Status'] != 'Waiting':
+        gLogger.error( 'Job %s matched by the TQ is not in Waiting state' % jobID )
+      else:
+        matchedIDs.append( jobID )
+    if not matchedIDs:
+      return S_ERROR( "Jobs %s are not in Waiting state" % ", ".join( [ str( jobID ) for jobID in jobIDs ] ) )
+
+    attNames = ['Status','MinorStatus','ApplicationStatus','Site']
+    attValues = ['Matched','Assigned','Unknown',siteName]
+    result = gJobDB.setAttributesForJobList( matchedIDs, attNames, attValues )
+    if not result['OK']:
+      gLogger.error( "Could not set the matched jobs attributes", result['Message'] )
+    result = gJobLoggingDB.addLoggingRecords( matchedIDs,
+                                              status = 'Matched',
+                                              minor = 'Assigned',
+                                              source = 'Matcher' )
+    if not result['OK']:
+      gLogger.error( "Could not add the matched jobs logging records", result['Message'] )
+
+    result = gJobDB.getJDLsForJobList( matchedIDs )
+    if not result['OK']:
+      return S_ERROR( 'Failed to get the job JDLs' )
+    jdlDict = result['Value']
+    result = gJobDB.getOptParametersForJobList( matchedIDs )
+    if result['OK']:
+      optDict = result['Value']
+    else:
+      optDict = {}
+
+    jobList = []
+    for jobID in matchedIDs:
+      if jobID not in jdlDict:
+        gLogger.error( 'Failed to get the JDL for job %s' % jobID )
+        continue
+      jobDict = dict( optDict.get( jobID, {} ) )
+      jobDict['JDL'] = jdlDict[ jobID ]
+      jobDict['JobID'] = jobID
+      jobDict['DN'] = jobAttrs[ jobID ]['OwnerDN']
+      jobDict['Group'] = jobAttrs[ jobID ]['OwnerGroup']
+      jobList.append( jobDict )
+
+    if self.__opsHelper.getValue( "JobScheduling/CheckMatchingDelay", True ):
+      for jobID in matchedIDs:
+        self.__limiter.updateDelayCounters( siteName, jobID )
+
+    # Report pilot-job association
+    if pilotReference:
+      result = gPilotAgentsDB.setCurrentJobID( pilotReference, matchedIDs[0] )
+      for jobID in matchedIDs:
+        result = gPilotAgentsDB.setJobForPilot( jobID, pilotReference, updateStatus=False )
+
+    matchTime = time.time() - startTime
+    gLogger.info( "Match time for %s jobs: [%s]" % ( len( jobList ), str( matchTime ) ) )
+    gMonitor.addMark( "matchTime", matchTime )
+
+    return S_OK( { 'Jobs' : jobList, 'PilotInfoReportedFlag' : pilotInfoReported } )
+
 ##############################################################################
   types_requestJob = [ [StringType, DictType] ]
   def export_requestJob( self, resourceDescription ):
@@ -543,6 +652,22 @@ class MatcherHandler( RequestHandler ):
       gMonitor.addMark( "matchesOK" )
     return result
 
+##############################################################################
+  types_requestJobs = [ [StringType, DictType], [IntType, LongType] ]
+  def export_requestJobs( self, resourceDescription, maxJobs ):
+    """ Serve up to maxJobs jobs to the request of an agent in one call. Returns
+        S_OK( { 'Jobs' : [ jobDict ], 'PilotInfoReportedFlag' : bool } ) where each jobDict
+        has the same keys as the result of requestJob
+    """
+    maxJobs = min( maxJobs, self.__opsHelper.getValue( "JobScheduling/MaxJobsPerRequest", 20 ) )
+    if maxJobs < 1:
+      return S_ERROR( "The number of jobs to request has to be greater than 0" )
+    result = self.selectJobs( resourceDescription, maxJobs )
+    gMonitor.addMark( "matchesDone" )
+    if result[ 'OK' ]:
+      gMonitor.addMark( "matchesOK", len( result[ 'Value' ][ 'Jobs' ] ) )
+    return result
+
 ##############################################################################
   types_getActiveTaskQueues = []
   def export_getActiveTaskQueues( self ):
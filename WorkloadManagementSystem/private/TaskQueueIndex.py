@@ -0,0 +1,318 @@
+########################################################################
+# $HeadURL$
+########################################################################
+""" In memory index of the task queues used by the Matcher to select the task
+    queues matching a resource without querying the TaskQueueDB.
+
+    It keeps the definition and priority of each task queue plus inverted indexes
+    from each multi value definition field value ( site, platform... ) to the task
+    queues having it. The matching rules are the same as the ones implemented
+    in SQL by TaskQueueDB. Matching task queues are drawn from a cumulative
+    priority table of all the task queues, so picking a few of them does not
+    require sorting the candidates.
+"""
+
+__RCSID__ = "$Id$"
+
+import threading
+import types
+from DIRAC.WorkloadManagementSystem.private.WeightedSampler import WeightedSampler, weightedSample
+
+class TaskQueueIndex:
+
+  def __init__( self, multiValueMatchFields, bannedJobMatchFields, strictRequireMatchFields,
+                isJobSharingGroup = False ):
+    """
+    Arguments:
+      - multiValueMatchFields : match fields. The definition field is the plural ( Site -> Sites )
+      - bannedJobMatchFields : match fields that can be banned by the jobs ( Site -> BannedSites )
+      - strictRequireMatchFields : fields that can only be matched if the resource defines them
+      - isJobSharingGroup : function returning True if the group has the JobSharing property
+    """
+    self.__lock = threading.Lock()
+    self.__multiValueMatchFields = multiValueMatchFields
+    self.__bannedJobMatchFields = bannedJobMatchFields
+    self.__strictRequireMatchFields = strictRequireMatchFields
+    self.__defFields = [ "%ss" % field for field in multiValueMatchFields ]
+    self.__defFields.extend( [ "Banned%ss" % field for field in bannedJobMatchFields ] )
+    if isJobSharingGroup:
+      self.__isJobSharingGroup = isJobSharingGroup
+    else:
+      self.__isJobSharingGroup = lambda group: False
+    self.__reset()
+
+  def __reset( self ):
+    #tqId -> definition dict. Multi value fields are stored as frozensets
+    self.__tqs = {}
+    #field -> value -> set( tqIds )
+    self.__valueIndex = dict( [ ( field, {} ) for field in self.__defFields ] )
+    #field -> set( tqIds ) of task queues not defining the field
+    self.__undefinedIndex = dict( [ ( field, set() ) for field in self.__defFields ] )
+    self.__setupIndex = {}
+    self.__groupIndex = {}
+    self.__ownerIndex = {}
+    #Cumulative priority table. Rebuilt when needed after priorities or task queues change
+    self.__sampler = False
+
+  #Internal helpers. Lock has to be held
+
+  def __addToIndex( self, index, key, tqId ):
+    if key not in index:
+      index[ key ] = set()
+    index[ key ].add( tqId )
+
+  def __removeFromIndex( self, index, key, tqId ):
+    tqIds = index.get( key )
+    if tqIds is None:
+      return
+    tqIds.discard( tqId )
+    if not tqIds:
+      del( index[ key ] )
+
+  def __add( self, tqId, tqDef ):
+    if tqId in self.__tqs:
+      self.__remove( tqId )
+    tqData = { 'OwnerDN' : tqDef[ 'OwnerDN' ],
+               'OwnerGroup' : tqDef[ 'OwnerGroup' ],
+               'Setup' : tqDef[ 'Setup' ],
+               'CPUTime' : tqDef[ 'CPUTime' ],
+               'Priority' : float( tqDef.get( 'Priority', 1 ) ) }
+    for field in self.__defFields:
+      values = frozenset( [ str( value ).strip() for value in tqDef.get( field, [] ) if str( value ).strip() ] )
+      tqData[ field ] = values
+      if not values:
+        self.__undefinedIndex[ field ].add( tqId )
+      for value in values:
+        self.__addToIndex( self.__valueIndex[ field ], value, tqId )
+    self.__addToIndex( self.__setupIndex, tqData[ 'Setup' ], tqId )
+    self.__addToIndex( self.__groupIndex, tqData[ 'OwnerGroup' ], tqId )
+    self.__addToIndex( self.__ownerIndex, ( tqData[ 'OwnerDN' ], tqData[ 'OwnerGroup' ] ), tqId )
+    self.__tqs[ tqId ] = tqData
+    self.__sampler = False
+
+  def __remove( self, tqId ):
+    tqData = self.__tqs.pop( tqId, None )
+    if tqData is None:
+      return False
+    self.__sampler = False
+    for field in self.__defFields:
+      self.__undefinedIndex[ field ].discard( tqId )
+      for value in tqData[ field ]:
+        self.__removeFromIndex( self.__valueIndex[ field ], value, tqId )
+    self.__removeFromIndex( self.__setupIndex, tqData[ 'Setup' ], tqId )
+    self.__removeFromIndex( self.__groupIndex, tqData[ 'OwnerGroup' ], tqId )
+    self.__removeFromIndex( self.__ownerIndex, ( tqData[ 'OwnerDN' ], tqData[ 'OwnerGroup' ] ), tqId )
+    return True
+
+  def __union( self, index, values ):
+    tqIds = set()
+    for value in values:
+      if value in index:
+        tqIds.update( index[ value ] )
+    return tqIds
+
+  #Index maintenance
+
+  def load( self, tqDefDict ):
+    """
+    Replace the contents of the index
+      Arguments:
+        - tqDefDict : { tqId : tqDefinition } where the definition has the single value
+                      fields, the Priority and the multi value definition fields
+    """
+    self.__lock.acquire()
+    try:
+      self.__reset()
+      for tqId in tqDefDict:
+        self.__add( tqId, tqDefDict[ tqId ] )
+    finally:
+      self.__lock.release()
+
+  def addTaskQueue( self, tqId, tqDef ):
+    """
+    Add or replace a task queue
+    """
+    self.__lock.acquire()
+    try:
+      self.__add( tqId, tqDef )
+    finally:
+      self.__lock.release()
+
+  def removeTaskQueue( self, tqId ):
+    """
+    Remove a task queue. Returns True if the task queue was indexed
+    """
+    self.__lock.acquire()
+    try:
+      return self.__remove( tqId )
+    finally:
+      self.__lock.release()
+
+  def setPriorities( self, tqPrioDict ):
+    """
+    Update the priorities of some task queues
+      Arguments:
+        - tqPrioDict : { tqId : priority }
+    """
+    self.__lock.acquire()
+    try:
+      for tqId in tqPrioDict:
+        if tqId in self.__tqs:
+          self.__tqs[ tqId ][ 'Priority' ] = float( tqPrioDict[ tqId ] )
+          self.__sampler = False
+    finally:
+      self.__lock.release()
+
+  def getTaskQueueIds( self ):
+    """
+    Get the ids of all the indexed task queues
+    """
+    self.__lock.acquire()
+    try:
+      return self.__tqs.keys()
+    finally:
+      self.__lock.release()
+
+  def getNumTaskQueues( self ):
+    return len( self.__tqs )
+
+  #Matching
+
+  def __toList( self, value ):
+    if type( value ) not in ( types.ListType, types.TupleType ):
+      value = [ value ]
+    return [ str( v ).strip() for v in value ]
+
+  def __passesNegativeCond( self, tqData, negativeCond ):
+    """ Negative conditions are a dict or a list of dicts. Task queues pass a dict if
+        they do not have any of its values and pass a list if they pass any of its dicts
+    """
+    if type( negativeCond ) in ( types.ListType, types.TupleType ):
+      for condDict in negativeCond:
+        if self.__passesNegativeCond( tqData, condDict ):
+          return True
+      return False
+    for field in negativeCond:
+      values = self.__toList( negativeCond[ field ] )
+      if field in self.__multiValueMatchFields:
+        tqValues = tqData[ "%ss" % field ]
+        for value in values:
+          if value in tqValues:
+            return False
+      elif field in ( 'OwnerDN', 'OwnerGroup', 'Setup' ):
+        if tqData[ field ] in values:
+          return False
+      elif field == 'CPUTime':
+        if str( tqData[ field ] ) in values:
+          return False
+    return True
+
+  def __matchOwner( self, tqMatchDict ):
+    """
+    Get the task queues the resource can run because of the owners. None means any
+    """
+    if 'OwnerDN' in tqMatchDict and 'OwnerGroup' in tqMatchDict:
+      dns = self.__toList( tqMatchDict[ 'OwnerDN' ] )
+      tqIds = set()
+      for group in self.__toList( tqMatchDict[ 'OwnerGroup' ] ):
+        if self.__isJobSharingGroup( group ):
+          tqIds.update( self.__groupIndex.get( group, () ) )
+        else:
+          tqIds.update( self.__union( self.__ownerIndex, [ ( dn, group ) for dn in dns ] ) )
+      return tqIds
+    tqIds = None
+    if 'OwnerGroup' in tqMatchDict:
+      tqIds = self.__union( self.__groupIndex, self.__toList( tqMatchDict[ 'OwnerGroup' ] ) )
+    if 'OwnerDN' in tqMatchDict:
+      dns = self.__toList( tqMatchDict[ 'OwnerDN' ] )
+      if tqIds is None:
+        tqIds = self.__tqs
+      tqIds = set( [ tqId for tqId in tqIds if self.__tqs[ tqId ][ 'OwnerDN' ] in dns ] )
+    return tqIds
+
+  def __findMatchingTQs( self, tqMatchDict, negativeCond ):
+    """
+    Apply the match conditions. Lock has to be held
+    """
+    candidates = self.__matchOwner( tqMatchDict )
+    if 'Setup' in tqMatchDict:
+      setupTQIds = self.__union( self.__setupIndex, self.__toList( tqMatchDict[ 'Setup' ] ) )
+      if candidates is None:
+        candidates = setupTQIds
+      else:
+        candidates &= setupTQIds
+    if candidates is None:
+      candidates = set( self.__tqs )
+
+    for field in self.__multiValueMatchFields:
+      defField = "%ss" % field
+      if field in tqMatchDict and tqMatchDict[ field ]:
+        values = self.__toList( tqMatchDict[ field ] )
+        allowed = self.__union( self.__valueIndex[ defField ], values )
+        # Jobs for masked sites can be matched if they specified a GridCE. Site is removed
+        # from the resource if it is masked, and then the GridCE has to match explicitly
+        if field != 'GridCE' or 'Site' in tqMatchDict:
+          allowed.update( self.__undefinedIndex[ defField ] )
+        candidates &= allowed
+        if field in self.__bannedJobMatchFields:
+          candidates -= self.__union( self.__valueIndex[ "Banned%s" % defField ], values )
+      #Resource banning
+      bannedField = "Banned%s" % field
+      if bannedField in tqMatchDict and tqMatchDict[ bannedField ]:
+        candidates -= self.__union( self.__valueIndex[ defField ], self.__toList( tqMatchDict[ bannedField ] ) )
+      if not candidates:
+        return candidates
+
+    #For strict fields the task queue can only require them if the resource defines them
+    for field in self.__strictRequireMatchFields:
+      if field not in tqMatchDict:
+        candidates &= self.__undefinedIndex[ "%ss" % field ]
+
+    if 'CPUTime' in tqMatchDict:
+      maxCPUTime = max( [ long( cpuTime ) for cpuTime in self.__toList( tqMatchDict[ 'CPUTime' ] ) ] )
+      candidates = set( [ tqId for tqId in candidates if self.__tqs[ tqId ][ 'CPUTime' ] <= maxCPUTime ] )
+
+    if negativeCond:
+      candidates = set( [ tqId for tqId in candidates
+                          if self.__passesNegativeCond( self.__tqs[ tqId ], negativeCond ) ] )
+    return candidates
+
+  def __getSampler( self ):
+    if not self.__sampler:
+      self.__sampler = WeightedSampler( dict( [ ( tqId, self.__tqs[ tqId ][ 'Priority' ] ) for tqId in self.__tqs ] ) )
+    return self.__sampler
+
+  def __drawTQs( self, candidates, numQueuesToGet ):
+    """
+    Draw task queues from the candidates with a probability proportional to their priority.
+    Lock has to be held
+    """
+    tqIds = []
+    if numQueuesToGet and numQueuesToGet < len( candidates ):
+      #Draw from the table of all the TQs skipping the non matching ones. It pays off
+      #unless the candidates are a small fraction of the TQs
+      tqIds = self.__getSampler().sampleDistinct( numQueuesToGet, candidates.__contains__ )
+    if not numQueuesToGet or len( tqIds ) < numQueuesToGet:
+      drawn = set( tqIds )
+      weightList = [ ( tqId, self.__tqs[ tqId ][ 'Priority' ] ) for tqId in candidates if tqId not in drawn ]
+      tqIds.extend( weightedSample( weightList, max( 0, numQueuesToGet - len( tqIds ) ) ) )
+    return tqIds
+
+  def match( self, tqMatchDict, numQueuesToGet = 1, negativeCond = {} ):
+    """
+    Get the task queues matching a resource in random order weighted by their priority
+      Arguments:
+        - tqMatchDict : resource description with unescaped values
+        - numQueuesToGet : maximum number of task queues to return. 0 means all
+        - negativeCond : conditions the task queues must not fulfill
+      Returns a list of ( tqId, ownerDN, ownerGroup )
+    """
+    self.__lock.acquire()
+    try:
+      candidates = self.__findMatchingTQs( tqMatchDict, negativeCond )
+      if not candidates:
+        return []
+      tqIds = self.__drawTQs( candidates, numQueuesToGet )
+      return [ ( tqId, self.__tqs[ tqId ][ 'OwnerDN' ], self.__tqs[ tqId ][ 'OwnerGroup' ] ) for tqId in tqIds ]
+    finally:
+      self.__lock.release()
@@ -0,0 +1,97 @@
+########################################################################
+# $HeadURL$
+########################################################################
+""" Weighted random selection used to pick task queues and job priorities
+    with a probability proportional to their priority.
+
+    WeightedSampler keeps a cumulative weight table so each draw is a binary
+    search. weightedSample picks several distinct items from any list of
+    weights without building a table.
+"""
+
+__RCSID__ = "$Id$"
+
+import math
+import random
+import bisect
+import heapq
+
+class WeightedSampler:
+
+  def __init__( self, weightDict ):
+    """
+    Arguments:
+      - weightDict : { key : weight }. Keys without a positive weight are never drawn
+    """
+    self.__keys = []
+    self.__cumWeights = []
+    total = 0.0
+    for key in weightDict:
+      weight = weightDict[ key ]
+      if weight <= 0:
+        continue
+      total += weight
+      self.__keys.append( key )
+      self.__cumWeights.append( total )
+    self.__totalWeight = total
+
+  def __len__( self ):
+    return len( self.__keys )
+
+  def getTotalWeight( self ):
+    return self.__totalWeight
+
+  def sample( self ):
+    """
+    Draw a key. Returns None if there are no keys
+    """
+    if not self.__keys:
+      return None
+    pos = bisect.bisect_right( self.__cumWeights, random.random() * self.__totalWeight )
+    return self.__keys[ min( pos, len( self.__keys ) - 1 ) ]
+
+  def sampleDistinct( self, num, acceptFunction = False, maxDraws = 0 ):
+    """
+    Draw up to num distinct keys in order. Keys not accepted by acceptFunction are
+    skipped. Each key is drawn with a probability proportional to its weight among
+    the accepted keys not drawn yet
+      Arguments:
+        - num : number of keys to draw
+        - acceptFunction : function returning True for the keys that can be drawn
+        - maxDraws : give up after this number of draws. 0 means 4 * num + 16
+    """
+    if not maxDraws:
+      maxDraws = 4 * num + 16
+    drawn = []
+    drawnSet = set()
+    for iDraw in xrange( maxDraws ):
+      if len( drawn ) >= num:
+        break
+      key = self.sample()
+      if key is None:
+        break
+      if key in drawnSet or ( acceptFunction and not acceptFunction( key ) ):
+        continue
+      drawn.append( key )
+      drawnSet.add( key )
+    return drawn
+
+def weightedSample( weightList, num = 0 ):
+  """
+  Draw num distinct keys from a list of ( key, weight ) in order. Each key is drawn with
+  a probability proportional to its weight among the keys not drawn yet. If num is 0
+  all the keys are returned in weighted random order
+  """
+  #Efraimidis-Spirakis: taking the largest random() ** ( 1 / weight ) is equivalent
+  #to drawing one by one without replacement. Logs avoid underflows for small weights
+  keyed = []
+  for key, weight in weightList:
+    if weight > 0:
+      keyed.append( ( math.log( 1.0 - random.random() ) / weight, key ) )
+    else:
+      keyed.append( ( float( "-inf" ), key ) )
+  if num:
+    keyed = heapq.nlargest( num, keyed )
+  else:
+    keyed.sort( reverse = True )
+  return [ item[1] for item in keyed ]
@@ -0,0 +1,89 @@
+########################################################################
+# $HeadURL $
+# File: TaskQueueIndexTestCase.py
+########################################################################
+
+""".. module:: TaskQueueIndexTestCase
+
+Test cases for DIRAC.WorkloadManagementSystem.private.TaskQueueIndex module.
+
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import unittest
+from DIRAC.WorkloadManagementSystem.private.TaskQueueIndex import TaskQueueIndex
+
+MULTI_VALUE_MATCH_FIELDS = ( 'GridCE', 'Site', 'GridMiddleware', 'Platform',
+                             'PilotType', 'SubmitPool', 'JobType' )
+
+def tqDef( **kwargs ):
+  tqDict = { 'OwnerDN' : '/DN/user', 'OwnerGroup' : 'user', 'Setup' : 'Production',
+             'CPUTime' : 86400, 'Priority' : 1.0 }
+  tqDict.update( kwargs )
+  return tqDict
+
+########################################################################
+class TaskQueueIndexTestCase( unittest.TestCase ):
+  """py:class TaskQueueIndexTestCase
+  Test case for DIRAC.WorkloadManagementSystem.private.TaskQueueIndex module.
+  """
+
+  def setUp( self ):
+    self.index = TaskQueueIndex( MULTI_VALUE_MATCH_FIELDS, ( 'Site', ), ( 'SubmitPool', 'Platform', 'PilotType' ),
+                                 lambda group: group == 'prod' )
+    self.index.load( { 1 : tqDef(),
+                       2 : tqDef( Sites = [ 'LCG.CERN.ch' ] ),
+                       3 : tqDef( Sites = [ 'LCG.PIC.es', 'LCG.CERN.ch' ], Platforms = [ 'slc5' ] ),
+                       4 : tqDef( BannedSites = [ 'LCG.CERN.ch' ] ),
+                       5 : tqDef( OwnerDN = '/DN/other', OwnerGroup = 'prod', CPUTime = 100000 ),
+                       6 : tqDef( GridCEs = [ 'ce.cern.ch' ] ),
+                       7 : tqDef( Setup = 'Certification' ) } )
+
+  def match( self, tqMatchDict, negativeCond = {} ):
+    matchDict = { 'Setup' : 'Production', 'CPUTime' : 86400 }
+    matchDict.update( tqMatchDict )
+    return sorted( [ tqTuple[0] for tqTuple in self.index.match( matchDict, 0, negativeCond ) ] )
+
+  def testMultiValue( self ):
+    """ sites, banned sites and strict fields """
+    self.assertEqual( self.match( { 'Site' : 'LCG.CERN.ch' } ), [ 1, 2, 6 ] )
+    self.assertEqual( self.match( { 'Site' : 'LCG.PIC.es' } ), [ 1, 4, 6 ] )
+    self.assertEqual( self.match( { 'Site' : 'LCG.PIC.es', 'Platform' : 'slc5' } ), [ 1, 3, 4, 6 ] )
+    self.assertEqual( self.match( { 'Site' : 'LCG.PIC.es', 'BannedSite' : [ 'LCG.PIC.es' ] } ), [ 1, 4, 6 ] )
+    self.assertEqual( self.match( { 'Site' : 'LCG.CERN.ch', 'GridCE' : 'ce.pic.es' } ), [ 1, 2 ] )
+    #Masked sites only match TQs with the GridCE explicitly
+    self.assertEqual( self.match( { 'GridCE' : 'ce.cern.ch' } ), [ 6 ] )
+
+  def testOwners( self ):
+    """ owner, job sharing groups and CPU time """
+    self.assertEqual( self.match( { 'OwnerDN' : '/DN/user', 'OwnerGroup' : 'user' } ), [ 1, 2, 4, 6 ] )
+    self.assertEqual( self.match( { 'OwnerDN' : '/DN/user', 'OwnerGroup' : 'prod' } ), [] )
+    self.assertEqual( self.match( { 'OwnerDN' : '/DN/user', 'OwnerGroup' : 'prod', 'CPUTime' : 100000 } ), [ 5 ] )
+    self.assertEqual( self.match( { 'OwnerGroup' : [ 'user', 'prod' ], 'CPUTime' : 100000, 'Site' : 'LCG.CERN.ch' } ),
+                      [ 1, 2, 5, 6 ] )
+    self.assertEqual( self.match( { 'OwnerDN' : '/DN/other' , 'CPUTime' : 100000 } ), [ 5 ] )
+
+  def testNegativeCond( self ):
+    """ limiter conditions """
+    self.assertEqual( self.match( { 'Site' : 'LCG.CERN.ch' }, { 'Site' : [ 'LCG.CERN.ch' ] } ), [ 1, 6 ] )
+    self.assertEqual( self.match( { 'Site' : 'LCG.CERN.ch' }, [ { 'Site' : [ 'LCG.CERN.ch' ] },
+                                                                { 'GridCE' : [ 'ce.cern.ch' ] } ] ), [ 1, 2, 6 ] )
+
+  def testUpdates( self ):
+    """ incremental updates and priorities """
+    self.index.removeTaskQueue( 1 )
+    self.index.addTaskQueue( 8, tqDef( Sites = [ 'LCG.PIC.es' ] ) )
+    self.assertEqual( self.match( { 'Site' : 'LCG.PIC.es' } ), [ 4, 6, 8 ] )
+    self.index.addTaskQueue( 8, tqDef( Sites = [ 'LCG.CERN.ch' ] ) )
+    self.assertEqual( self.match( { 'Site' : 'LCG.PIC.es' } ), [ 4, 6 ] )
+    self.index.setPriorities( dict( [ ( tqId, 1e-6 ) for tqId in ( 2, 6 ) ] ) )
+    for i in range( 20 ):
+      self.assertEqual( self.index.match( { 'Setup' : 'Production', 'CPUTime' : 86400, 'Site' : 'LCG.CERN.ch' }, 1 )[0][0], 8 )
+
+## test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( TaskQueueIndexTestCase )
+  unittest.TextTestRunner(verbosity=3).run( SUITE )
@@ -0,0 +1,115 @@
+########################################################################
+# $HeadURL $
+# File: WeightedSamplerTestCase.py
+########################################################################
+
+""".. module:: WeightedSamplerTestCase
+
+Test cases for DIRAC.WorkloadManagementSystem.private.WeightedSampler module.
+
+Draw frequencies are checked with a chi-square test against the expected
+shares. The random generator is seeded and the thresholds are the 0.001
+critical values, so a correct sampler does not fail by chance.
+
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import random
+import unittest
+from DIRAC.WorkloadManagementSystem.private.WeightedSampler import WeightedSampler, weightedSample
+from DIRAC.WorkloadManagementSystem.private.TaskQueueIndex import TaskQueueIndex
+
+#Chi-square critical values for p = 0.001 by degrees of freedom
+CHI2_CRITICAL = { 1 : 10.83, 2 : 13.82, 3 : 16.27, 4 : 18.47 }
+NUM_DRAWS = 20000
+
+def chiSquare( counts, weights ):
+  """ chi-square statistic of the counts against the expected weights """
+  totalWeight = float( sum( weights.values() ) )
+  numDraws = sum( counts.values() )
+  chi2 = 0.0
+  for key in weights:
+    expected = numDraws * weights[ key ] / totalWeight
+    chi2 += ( counts.get( key, 0 ) - expected ) ** 2 / expected
+  return chi2
+
+def countDraws( drawFunction, numDraws = NUM_DRAWS ):
+  counts = {}
+  for i in xrange( numDraws ):
+    key = drawFunction()
+    counts[ key ] = counts.get( key, 0 ) + 1
+  return counts
+
+########################################################################
+class WeightedSamplerTestCase( unittest.TestCase ):
+  """py:class WeightedSamplerTestCase
+  Test case for DIRAC.WorkloadManagementSystem.private.WeightedSampler module.
+  """
+
+  def setUp( self ):
+    random.seed( 1234 )
+    self.weights = { 'a' : 1.0, 'b' : 2.0, 'c' : 7.0 }
+
+  def assertFair( self, counts, weights ):
+    self.assertEqual( set( counts ) - set( weights ), set() )
+    self.assert_( chiSquare( counts, weights ) < CHI2_CRITICAL[ len( weights ) - 1 ] )
+
+  def testSample( self ):
+    """ draws are proportional to the weights """
+    sampler = WeightedSampler( dict( self.weights, e = 0 ) )
+    self.assertEqual( len( sampler ), 3 )
+    self.assertFair( countDraws( sampler.sample ), self.weights )
+    self.assertEqual( WeightedSampler( {} ).sample(), None )
+
+  def testSampleDistinct( self ):
+    """ rejected keys do not change the shares of the accepted ones """
+    sampler = WeightedSampler( self.weights )
+    accept = lambda key: key != 'c'
+    draw = lambda: sampler.sampleDistinct( 1, accept, maxDraws = 1000 )[0]
+    self.assertFair( countDraws( draw ), { 'a' : 1.0, 'b' : 2.0 } )
+    self.assertEqual( sorted( sampler.sampleDistinct( 3, maxDraws = 100000 ) ), [ 'a', 'b', 'c' ] )
+    self.assertEqual( sampler.sampleDistinct( 5, lambda key: False ), [] )
+
+  def testWeightedSample( self ):
+    """ first and second draws without replacement """
+    weightList = self.weights.items()
+    self.assertFair( countDraws( lambda: weightedSample( weightList, 1 )[0] ), self.weights )
+    #Second draw: P( j ) = sum_i P( i first ) * w_j / ( W - w_i )
+    total = sum( self.weights.values() )
+    expected = {}
+    for key in self.weights:
+      expected[ key ] = sum( [ self.weights[ i ] / total * self.weights[ key ] / ( total - self.weights[ i ] )
+                               for i in self.weights if i != key ] )
+    self.assertFair( countDraws( lambda: weightedSample( weightList, 2 )[1] ), expected )
+    #Tiny weights like the minimum TQ share are still drawn in order
+    tinyList = [ ( 'a', 1e-5 ), ( 'b', 1e-3 ), ( 'c', 0 ) ]
+    self.assertFair( countDraws( lambda: weightedSample( tinyList, 1 )[0] ), { 'a' : 1e-5, 'b' : 1e-3 } )
+    self.assertEqual( weightedSample( tinyList )[-1], 'c' )
+
+  def testTaskQueueShares( self ):
+    """ TQ selection respects the group shares, also with non matching TQs """
+    index = TaskQueueIndex( ( 'Site', ), ( 'Site', ), () )
+    tqDefs = {}
+    #Group shares 1000 and 3000, the first one split between two TQs
+    for tqId, group, prio, sites in ( ( 1, 'g1', 500, [] ), ( 2, 'g1', 500, [ 'S1' ] ),
+                                      ( 3, 'g2', 3000, [] ),
+                                      ( 4, 'g3', 100000, [ 'S2' ] ), ( 5, 'g3', 10, [ 'S2' ] ) ):
+      tqDefs[ tqId ] = { 'OwnerDN' : 'dn', 'OwnerGroup' : group, 'Setup' : 'Production',
+                         'CPUTime' : 1, 'Priority' : prio, 'Sites' : sites }
+    index.load( tqDefs )
+    matchDict = { 'Setup' : 'Production', 'Site' : 'S1' }
+    countGroup = lambda: tqDefs[ index.match( matchDict, 1 )[0][0] ][ 'OwnerGroup' ]
+    self.assertFair( countDraws( countGroup ), { 'g1' : 1000.0, 'g2' : 3000.0 } )
+    #Two TQs out of three always come from the cumulative table
+    countTQ = lambda: index.match( matchDict, 2 )[0][0]
+    self.assertFair( countDraws( countTQ ), { 1 : 500.0, 2 : 500.0, 3 : 3000.0 } )
+    index.setPriorities( { 3 : 1000 } )
+    self.assertFair( countDraws( countGroup ), { 'g1' : 1000.0, 'g2' : 1000.0 } )
+
+## test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( WeightedSamplerTestCase )
+  unittest.TextTestRunner(verbosity=3).run( SUITE )